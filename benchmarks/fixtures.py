@@ -0,0 +1,140 @@
+import glob
+import json
+import os
+import random
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image
+
+# 所有夹具都用固定种子生成，保证不同提交之间测的是完全相同的输入
+SEED = 20240601
+SCREEN_WIDTH = 1080
+SCREEN_HEIGHT = 2400
+
+
+def noise_image(width: int, height: int, seed: int = SEED) -> Image.Image:
+    """随机噪声图：逐像素比较时没有捷径，相当于真实截图的最坏情况"""
+    rng = random.Random(seed)
+    return Image.frombytes("RGB", (width, height), rng.randbytes(width * height * 3))
+
+
+def screenshot_pair(overlap: int, width: int = SCREEN_WIDTH, height: int = SCREEN_HEIGHT,
+                    seed: int = SEED) -> Tuple[Image.Image, Image.Image]:
+    """相邻两屏截图：第二屏顶部 overlap 像素与第一屏底部相同（overlap=0 表示没有重叠）"""
+    first = noise_image(width, height, seed)
+    second = noise_image(width, height, seed + 1)
+    if overlap > 0:
+        second.paste(first.crop((0, height - overlap, width, height)), (0, 0))
+    return first, second
+
+
+def scroll_frames(count: int = 6, overlap: int = 60, width: int = SCREEN_WIDTH,
+                  height: int = SCREEN_HEIGHT, seed: int = SEED) -> List[Image.Image]:
+    """一次长截图的各屏截图，最后一屏与上一屏有重叠"""
+    frames = [noise_image(width, height, seed + i) for i in range(count - 1)]
+    last = noise_image(width, height, seed + count)
+    last.paste(frames[-1].crop((0, height - overlap, width, height)), (0, 0))
+    return frames + [last]
+
+
+def save_long_screenshot(path: str, frames: List[Image.Image]) -> str:
+    """把各屏纵向拼接后保存为 PNG，供图片编码基准使用"""
+    width = frames[0].width
+    long_img = Image.new("RGB", (width, sum(f.height for f in frames)))
+    y = 0
+    for frame in frames:
+        long_img.paste(frame, (0, y))
+        y += frame.height
+    long_img.save(path)
+    return path
+
+
+def large_hierarchy(node_count: int = 3000, width: int = SCREEN_WIDTH, height: int = SCREEN_HEIGHT,
+                    seed: int = SEED) -> str:
+    """生成大规模界面层级 XML：多层嵌套，约三分之一节点可点击"""
+    rng = random.Random(seed)
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>', '<hierarchy rotation="0">']
+    depth = 0
+    for i in range(node_count):
+        x1 = rng.randrange(0, width - 20)
+        y1 = rng.randrange(0, height - 20)
+        x2 = min(width, x1 + rng.randrange(20, 400))
+        y2 = min(height, y1 + rng.randrange(20, 200))
+        attrs = (f'index="{i}" text="item {i}" resource-id="com.demo:id/view_{i % 97}" '
+                 f'class="android.widget.{rng.choice(["TextView", "ImageView", "LinearLayout", "Switch"])}" '
+                 f'package="com.demo" content-desc="desc {i % 13}" '
+                 f'clickable="{"true" if rng.random() < 0.33 else "false"}" bounds="[{x1},{y1}][{x2},{y2}]"')
+        if depth < 12 and rng.random() < 0.4:
+            lines.append(f"<node {attrs}>")
+            depth += 1
+        else:
+            lines.append(f"<node {attrs}/>")
+            while depth > 0 and rng.random() < 0.3:
+                lines.append("</node>")
+                depth -= 1
+    lines.extend(["</node>"] * depth)
+    lines.append("</hierarchy>")
+    return "\n".join(lines)
+
+
+def crawl_paths(path_count: int = 2000, depth: int = 6, seed: int = SEED) -> Tuple[List, List, List]:
+    """模拟探索过程累积的三类路径列表（隐私开关 / 个性化开关 / 个性化布局）"""
+    rng = random.Random(seed)
+
+    def path(i: int, with_switch: bool) -> List[Dict]:
+        nodes = [{"text": f"设置{i % 7}", "bounds": "[0.740,0.920][0.920,0.980]"}]
+        nodes += [{"text": f"菜单{i}-{d}"} for d in range(rng.randrange(1, depth))]
+        if with_switch:
+            nodes.append({"text": f"开关{i}", "current_state": "on", "recommended_state": "off",
+                          "analysis": "该开关会收集个人信息用于个性化推荐" * 3})
+        return nodes
+
+    return ([path(i, True) for i in range(path_count)],
+            [path(i, True) for i in range(path_count // 4)],
+            [path(i, False) for i in range(path_count // 4)])
+
+
+def crawl_log(item_count: int = 20000, seed: int = SEED) -> Dict:
+    """all_paths_results 风格的输出文件，包含大量重复条目"""
+    rng = random.Random(seed)
+
+    def item(i: int) -> Dict:
+        entry = {"text": f"项目{rng.randrange(item_count // 3)}"}
+        if rng.random() < 0.3:
+            entry["bounds"] = f"[0.{rng.randrange(100, 999)},0.920][0.920,0.980]"
+        return entry
+
+    return {
+        "privacy_switches": [item(i) for i in range(item_count)],
+        "personality": {
+            "personality_switches": [item(i) for i in range(item_count // 4)],
+            "personality_layouts": [item(i) for i in range(item_count // 4)],
+        },
+    }
+
+
+def write_json(path: str, data: Dict) -> str:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    return path
+
+
+def recorded_hierarchy(recording_dir: str) -> Optional[str]:
+    """从 crawl_recording 的录制目录中取最大的一份界面层级，作为真实数据夹具"""
+    files = glob.glob(os.path.join(recording_dir, "hierarchy", "*.xml"))
+    if not files:
+        return None
+    with open(max(files, key=os.path.getsize), "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def recorded_frames(recording_dir: str, count: int = 6) -> Optional[List[Image.Image]]:
+    """从录制目录中按顺序取若干张截图"""
+    files = sorted(glob.glob(os.path.join(recording_dir, "frames", "*.png")))[:count]
+    if len(files) < 2:
+        return None
+    frames = []
+    for file in files:
+        with Image.open(file) as img:
+            frames.append(img.convert("RGB"))
+    return frames
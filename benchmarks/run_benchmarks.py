@@ -0,0 +1,265 @@
+"""
+CPU 侧热点路径的基准测试
+
+    python benchmarks/run_benchmarks.py                 # 运行全部基准，结果按提交保存到 benchmarks/results/
+    python benchmarks/run_benchmarks.py -k overlap      # 只运行名字包含 overlap 的基准
+    python benchmarks/run_benchmarks.py --compare       # 与历史中上一个不同提交的结果对比
+    python benchmarks/run_benchmarks.py --compare abc1234 --fail-on-regression
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+from typing import Callable, Dict, List, Optional
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+HISTORY_PATH = os.path.join(RESULTS_DIR, "history.jsonl")
+
+sys.path.append(os.path.join(ROOT_DIR, "src"))
+sys.path.append(os.path.join(ROOT_DIR, "src", "Stage1"))
+sys.path.append(os.path.join(ROOT_DIR, "utils"))
+
+import fixtures  # noqa: E402
+
+# 名称 -> setup 函数；setup(workdir, recording) 返回被计时的无参函数
+BENCHMARKS: Dict[str, Callable] = {}
+
+
+def benchmark(name: str):
+    def decorator(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return decorator
+
+
+# ---------------------------------------------------------------------------
+# 基准定义
+# ---------------------------------------------------------------------------
+
+@benchmark("find_overlap.hit")
+def bench_find_overlap_hit(workdir: str, recording: Optional[str]):
+    from screenshot_inspector import find_overlap
+    first, second = fixtures.screenshot_pair(overlap=60)
+    return lambda: find_overlap(first, second)
+
+
+@benchmark("find_overlap.miss")
+def bench_find_overlap_miss(workdir: str, recording: Optional[str]):
+    from screenshot_inspector import find_overlap
+    first, second = fixtures.screenshot_pair(overlap=0)
+    return lambda: find_overlap(first, second)
+
+
+@benchmark("stitch_screenshots")
+def bench_stitch(workdir: str, recording: Optional[str]):
+    from screenshot_inspector import stitch_screenshots
+    frames = (recording and fixtures.recorded_frames(recording)) or fixtures.scroll_frames()
+    return lambda: stitch_screenshots(frames, frames[0].width)
+
+
+@benchmark("encode_compressed_image")
+def bench_encode(workdir: str, recording: Optional[str]):
+    from privacy_analyzer import encode_compressed_image
+    frames = (recording and fixtures.recorded_frames(recording)) or fixtures.scroll_frames(count=4)
+    path = fixtures.save_long_screenshot(os.path.join(workdir, "long.png"), frames)
+    return lambda: encode_compressed_image(path)
+
+
+class _HierarchyDevice:
+    """只提供 extract_clickable_elements 用到的两个方法"""
+
+    def __init__(self, xml: str):
+        self.xml = xml
+
+    def dump_hierarchy(self) -> str:
+        return self.xml
+
+    def window_size(self):
+        return fixtures.SCREEN_WIDTH, fixtures.SCREEN_HEIGHT
+
+
+@benchmark("extract_clickable_elements")
+def bench_extract_clickable(workdir: str, recording: Optional[str]):
+    from concise_position_personal_icon import FinePersonalIconDetector
+    xml = (recording and fixtures.recorded_hierarchy(recording)) or fixtures.large_hierarchy()
+    detector = FinePersonalIconDetector("benchmark")
+    device = _HierarchyDevice(xml)
+    return lambda: detector.extract_clickable_elements(device, "bottom_right")
+
+
+@benchmark("is_in_region")
+def bench_is_in_region(workdir: str, recording: Optional[str]):
+    from concise_position_personal_icon import FinePersonalIconDetector
+    detector = FinePersonalIconDetector("benchmark")
+    elements = [{"center": [(i % 100) / 100, (i // 100 % 100) / 100]} for i in range(10000)]
+    regions = ["top_left", "top_right", "bottom_left", "bottom_right", "bottom_center"]
+
+    def run():
+        for region in regions:
+            for elem in elements:
+                detector._is_in_region(elem, region, fixtures.SCREEN_WIDTH, fixtures.SCREEN_HEIGHT)
+    return run
+
+
+@benchmark("hierarchy_extract")
+def bench_hierarchy_extract(workdir: str, recording: Optional[str]):
+    from hierarchy_extractor import HierarchyExtractor
+    xml = (recording and fixtures.recorded_hierarchy(recording)) or fixtures.large_hierarchy()
+    extractor = HierarchyExtractor()
+    return lambda: extractor.extract([xml, xml])
+
+
+@benchmark("build_final_output")
+def bench_build_final_output(workdir: str, recording: Optional[str]):
+    from privacy_detection_main import build_final_output
+    privacy, personality, layouts = fixtures.crawl_paths()
+    return lambda: build_final_output(privacy, personality, layouts)
+
+
+@benchmark("path_trie.write")
+def bench_path_trie(workdir: str, recording: Optional[str]):
+    import io
+    from path_trie import PathTrie
+    privacy, _, _ = fixtures.crawl_paths()
+
+    def run():
+        trie = PathTrie()
+        for path in privacy:
+            trie.add(trie.add_path(path[:-1]), "privacy_switches", path[-1])
+        trie.write(io.StringIO())
+    return run
+
+
+@benchmark("convert_log_to_config")
+def bench_convert_log(workdir: str, recording: Optional[str]):
+    from FormatConversion import convert_log_to_config
+    input_path = fixtures.write_json(os.path.join(workdir, "log.json"), fixtures.crawl_log())
+    output_path = os.path.join(workdir, "config.json")
+    return lambda: convert_log_to_config(input_path, output_path)
+
+
+# ---------------------------------------------------------------------------
+# 计时、保存与对比
+# ---------------------------------------------------------------------------
+
+def time_callable(func: Callable, repeat: int) -> Dict:
+    """先用 autorange 确定每轮次数（每轮至少 0.2s），再重复 repeat 轮，取每次调用的最小值与中位数"""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    runs = [t / number for t in timer.repeat(repeat=repeat, number=number)]
+    return {
+        "min": min(runs),
+        "median": statistics.median(runs),
+        "number": number,
+        "repeat": repeat,
+    }
+
+
+def current_commit() -> Dict:
+    def git(*args) -> str:
+        try:
+            return subprocess.run(["git", *args], cwd=ROOT_DIR, capture_output=True,
+                                  text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return ""
+
+    return {
+        "commit": git("rev-parse", "--short", "HEAD") or "unknown",
+        "subject": git("log", "-1", "--format=%s"),
+        "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+    }
+
+
+def load_history() -> List[Dict]:
+    if not os.path.exists(HISTORY_PATH):
+        return []
+    with open(HISTORY_PATH, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def save_run(run: Dict):
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    with open(os.path.join(RESULTS_DIR, f"{run['commit']}.json"), "w", encoding="utf-8") as f:
+        json.dump(run, f, ensure_ascii=False, indent=2)
+    with open(HISTORY_PATH, "a", encoding="utf-8") as f:
+        f.write(json.dumps(run, ensure_ascii=False) + "\n")
+
+
+def find_baseline(history: List[Dict], run: Dict, ref: Optional[str]) -> Optional[Dict]:
+    """ref 为空时取历史中最近一次来自其他提交的结果"""
+    for previous in reversed(history):
+        if ref and previous["commit"].startswith(ref):
+            return previous
+        if not ref and previous["commit"] != run["commit"]:
+            return previous
+    return None
+
+
+def compare(run: Dict, baseline: Dict, threshold: float) -> List[str]:
+    print(f"\n对比基准提交 {baseline['commit']} ({baseline.get('subject', '')})")
+    print(f"{'benchmark':<30}{'baseline':>12}{'current':>12}{'ratio':>8}")
+    regressions = []
+    for name, result in run["results"].items():
+        base = baseline["results"].get(name)
+        if not base:
+            print(f"{name:<30}{'-':>12}{result['median'] * 1e3:>10.3f}ms{'':>8}")
+            continue
+        ratio = result["median"] / base["median"] if base["median"] else float("inf")
+        flag = "  <-- 退化" if ratio > threshold else ""
+        print(f"{name:<30}{base['median'] * 1e3:>10.3f}ms{result['median'] * 1e3:>10.3f}ms{ratio:>8.2f}{flag}")
+        if ratio > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU 侧热点路径基准测试（结果按提交保存）")
+    parser.add_argument("-k", dest="keyword", help="只运行名字包含该关键字的基准")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--recording", help="使用 crawl_recording 的录制目录中的真实截图/层级作为夹具")
+    parser.add_argument("--compare", nargs="?", const="", default=None,
+                        help="与某个提交（默认上一个不同提交）的结果对比")
+    parser.add_argument("--threshold", type=float, default=1.2, help="中位数变慢超过该倍数视为退化")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    parser.add_argument("--no-save", action="store_true", help="只打印，不写入结果历史")
+    args = parser.parse_args()
+
+    # screenshot_inspector 等模块导入时会在当前目录建目录，基准在临时目录中运行
+    workdir = tempfile.mkdtemp(prefix="prisee_bench_")
+    os.chdir(workdir)
+
+    run = dict(current_commit(), timestamp=time.strftime("%Y-%m-%d %H:%M:%S"),
+               python=platform.python_version(), machine=platform.machine(), results={})
+    print(f"{'benchmark':<30}{'median':>12}{'min':>12}{'calls':>8}")
+    for name, setup in BENCHMARKS.items():
+        if args.keyword and args.keyword not in name:
+            continue
+        func = setup(workdir, args.recording)
+        result = time_callable(func, args.repeat)
+        run["results"][name] = result
+        print(f"{name:<30}{result['median'] * 1e3:>10.3f}ms{result['min'] * 1e3:>10.3f}ms{result['number']:>8}")
+
+    history = load_history()
+    if not args.no_save:
+        save_run(run)
+
+    if args.compare is not None:
+        baseline = find_baseline(history, run, args.compare or None)
+        if baseline is None:
+            print("\n没有可对比的历史结果")
+            return
+        regressions = compare(run, baseline, args.threshold)
+        if regressions and args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
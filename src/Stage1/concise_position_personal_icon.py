@@ -8,6 +8,11 @@ import logging
 import re
 from typing import List, Dict, Optional
 
+from element_ranking import (
+    rank_clickable_elements, encode_elements_table, encode_elements_json, estimate_tokens
+)
+
+import sys
 from dotenv import load_dotenv
 import os
 
@@ -17,15 +22,31 @@ load_dotenv()
 # 配置参数
 GEMINI_API_BASE = os.getenv("GEMINI_API_BASE")
 
+# Stage1 与 src 共用模型级联模块
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from llm_request import Endpoint, check_response, gemini_executor
+from metering import report_payload
+from model_cascade import get_cascade, cascade_tiers, validate_confidence
+from structured_output import ElementSelection, gemini_reask, parse_dict
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class FinePersonalIconDetector:
     """精定位：结合XML组件数据精确识别个人中心图标"""
 
-    def __init__(self, api_key: str):
+    # 本地预排序使用的关键词、排除词与资源ID模式
+    KEYWORDS = ["我", "我的", "个人", "账号", "用户", "个人中心", "mine", "profile"]
+    NEGATIVE_KEYWORDS = ["首页", "发现", "消息", "设置", "搜索", "返回"]
+    ID_PATTERNS = [r"mine", r"personal", r"profile", r"user", r"account", r"(^|_)me($|_)", r"my"]
+
+    def __init__(self, api_key: str, top_k: int = 8):
         self.api_key = api_key
         self.model = "gemini-2.5-pro"
+        self.top_k = top_k
+        self.cascade = get_cascade(
+            "personal_fine", cascade_tiers("GEMINI_CASCADE_MODELS", ["gemini-2.5-flash", self.model])
+        )
 
     def extract_clickable_elements(self, d: u2.Device, region: str) -> List[Dict]:
         """
@@ -104,21 +125,24 @@ class FinePersonalIconDetector:
         return True  # 如果没有指定区域，返回所有元素
 
     def fine_detection(self, image_bytes: bytes, clickable_elements: List[Dict], coarse_region: Dict) -> Optional[Dict]:
+        """级联精定位：先用flash模型，未选出组件或置信度不足时升级到pro模型"""
+        return self.cascade.run(
+            lambda model: self._request_fine_detection(image_bytes, clickable_elements, coarse_region, model),
+            lambda result: validate_confidence(result, key="final_confidence")
+        )
+
+    def _request_fine_detection(self, image_bytes: bytes, clickable_elements: List[Dict],
+                                coarse_region: Dict, model: str) -> Optional[Dict]:
         """
         精定位：结合截图和XML数据精确识别个人中心图标
         """
-        # 构建更详细的组件信息用于提示词
-        elements_info = []
-        for i, elem in enumerate(clickable_elements):
-            elements_info.append({
-                "index": i,
-                "text": elem.get('text', ''),
-                "description": elem.get('description', ''),
-                "resource_id": elem.get('resource_id', ''),
-                "bounds": elem.get('bounds', []),
-                "normalized_bounds": [f"{x:.3f}" for x in elem.get('normalized_bounds', [])],
-                "center": [f"{x:.3f}" for x in elem.get('center', [])]
-            })
+        # 本地预排序：只保留得分最高的 top_k 个候选，并以紧凑表格编码
+        legacy_tokens = estimate_tokens(encode_elements_json(clickable_elements))
+        clickable_elements = rank_clickable_elements(
+            clickable_elements, coarse_region.get('region', ''),
+            self.KEYWORDS, self.NEGATIVE_KEYWORDS, self.ID_PATTERNS, self.top_k
+        )
+        elements_table = encode_elements_table(clickable_elements)
 
         prompt = f"""【精确定位任务】
 你需要在给定的UI组件列表中精确识别出"个人中心"或"我的"图标/按钮。
@@ -137,9 +161,9 @@ class FinePersonalIconDetector:
 请基于这些精确的组件数据进行分析：
 
 【可用组件数据】
-以下是该区域内的所有可点击UI组件信息：
+以下是该区域内经本地预排序保留的候选可点击UI组件（每行一个组件，字段以|分隔；bounds为像素坐标x1,y1,x2,y2，size为归一化宽,高（占屏幕宽高的比例），center为归一化中心点）：
 
-{json.dumps(elements_info, indent=2, ensure_ascii=False)}
+{elements_table}
 
 【分析任务】
 1. 结合截图视觉信息和组件属性，分析每个组件：
@@ -177,13 +201,19 @@ class FinePersonalIconDetector:
 
 请直接输出JSON，不要解释。"""
 
+        prompt_tokens = estimate_tokens(prompt)
+        legacy_prompt_tokens = prompt_tokens - estimate_tokens(elements_table) + legacy_tokens
+        logger.info(f"精定位提示词token估算: {legacy_prompt_tokens} -> {prompt_tokens} "
+                    f"(组件数据 {legacy_tokens} -> {estimate_tokens(elements_table)}, "
+                    f"保留 {len(clickable_elements)} 个候选)")
+
         try:
             # 压缩图片
             compressed_image_bytes = self._compress_image(image_bytes)
             image_base64 = base64.b64encode(compressed_image_bytes).decode('utf-8')
 
             payload = {
-                "model": self.model,
+                "model": model,
                 "stream": False,
                 "messages": [
                     {
@@ -200,29 +230,28 @@ class FinePersonalIconDetector:
                 "max_tokens": 3000
             }
 
-            headers = {
-                'Content-Type': 'application/json',
-                'Authorization': f'Bearer {self.api_key}'
-            }
+            def send(endpoint: Endpoint, timeout: float) -> Dict:
+                body = json.dumps(dict(payload, model=endpoint.model))
+                report_payload(len(body))
+                response = requests.post(
+                    endpoint.chat_url,
+                    headers=endpoint.headers(),
+                    data=body,
+                    timeout=timeout,
+                    proxies={"http": None, "https": None}  # 禁用代理
+                )
+                logger.info(f"精定位API响应状态码: {response.status_code}")
+                check_response(response)
+                return response.json()
 
             logger.info("发送个人中心精定位API请求...")
-            response = requests.post(
-                f"{GEMINI_API_BASE}/v1/chat/completions",
-                headers=headers,
-                json=payload,
-                timeout=60,
-                proxies={"http": None, "https": None}  # 禁用代理
+            response_data = gemini_executor(self.api_key, model, GEMINI_API_BASE, attempt_timeout=60).execute(
+                send, lambda data: bool(data.get('choices'))
             )
-
-            logger.info(f"精定位API响应状态码: {response.status_code}")
-
-            if response.status_code != 200:
-                logger.error(f"精定位API请求失败: {response.status_code}")
-                logger.error(f"响应内容: {response.text}")
+            if response_data is None:
+                logger.error("精定位API请求失败（已达重试上限或截止时间）")
                 return None
 
-            response_data = response.json()
-
             if 'choices' not in response_data or not response_data['choices']:
                 logger.error("精定位响应中没有choices字段")
                 return None
@@ -234,17 +263,11 @@ class FinePersonalIconDetector:
 
             logger.info(f"精定位原始响应内容: {content}")
 
-            # 清理响应内容
-            cleaned_content = content.strip()
-            if cleaned_content.startswith('```json'):
-                cleaned_content = cleaned_content[7:]
-            if cleaned_content.endswith('```'):
-                cleaned_content = cleaned_content[:-3]
-            cleaned_content = cleaned_content.strip()
-
-            logger.info(f"精定位清理后的内容: {cleaned_content}")
-
-            result = json.loads(cleaned_content)
+            # 回答不合法时先本地修复，仍失败再交给便宜的文字模型整理，不重新发送截图
+            result = parse_dict(content, ElementSelection, reask=gemini_reask(self.api_key, GEMINI_API_BASE))
+            if result is None:
+                logger.error("精定位响应解析失败")
+                return None
             selected = result.get("selected_element")
 
             if selected and selected.get("index") is not None:
@@ -260,10 +283,6 @@ class FinePersonalIconDetector:
             logger.info("精定位未找到合适的个人中心图标")
             return None
 
-        except json.JSONDecodeError as e:
-            logger.error(f"精定位JSON解析失败: {str(e)}")
-            logger.error(f"解析的内容: {content if 'content' in locals() else 'N/A'}")
-            return None
         except Exception as e:
             logger.error(f"精定位失败: {str(e)}")
             import traceback
@@ -0,0 +1,134 @@
+# element_ranking.py
+import json
+import re
+from typing import Dict, List, Sequence
+
+# 各区域的"锚点"（归一化坐标），目标图标通常贴近该区域的外侧角落
+REGION_ANCHORS = {
+    "top_left": (0.0, 0.0),
+    "top_right": (1.0, 0.0),
+    "bottom_left": (0.0, 1.0),
+    "bottom_right": (1.0, 1.0),
+    "top_center": (0.5, 0.0),
+    "bottom_center": (0.5, 1.0),
+}
+
+# 图标按钮的合理面积范围（占屏幕面积比例）
+MIN_ICON_AREA = 0.0005
+MAX_ICON_AREA = 0.04
+
+_CJK_PATTERN = re.compile(r'[㐀-鿿＀-￯　-〿]')
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算文本token数：中文字符约1 token/字，其余约4字符/token"""
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _keyword_score(elem: Dict, keywords: Sequence[str], negative_keywords: Sequence[str]) -> float:
+    content = f"{elem.get('text', '')} {elem.get('description', '')}".lower()
+    score = 0.0
+    if any(k.lower() in content for k in keywords):
+        score += 3.0
+    if any(k.lower() in content for k in negative_keywords):
+        score -= 2.0
+    return score
+
+
+def _resource_id_score(elem: Dict, id_patterns: Sequence[str]) -> float:
+    resource_id = elem.get('resource_id', '').lower()
+    if not resource_id:
+        return 0.0
+    # 只看 ":id/" 之后的部分，避免包名中的词误命中
+    resource_id = resource_id.split(':id/')[-1]
+    return 2.0 if any(re.search(p, resource_id) for p in id_patterns) else 0.0
+
+
+def _size_score(elem: Dict) -> float:
+    x1, y1, x2, y2 = elem.get('normalized_bounds', [0, 0, 0, 0])
+    area = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+    if area <= 0:
+        return -1.0
+    if MIN_ICON_AREA <= area <= MAX_ICON_AREA:
+        return 1.0
+    # 过大（整行/整块容器）或过小的组件按偏离程度衰减
+    ratio = area / MAX_ICON_AREA if area > MAX_ICON_AREA else MIN_ICON_AREA / area
+    return max(-1.0, 1.0 - ratio / 4)
+
+
+def _position_score(elem: Dict, region: str) -> float:
+    anchor = REGION_ANCHORS.get(region)
+    if not anchor:
+        return 0.0
+    center_x, center_y = elem.get('center', [0.5, 0.5])
+    distance = ((center_x - anchor[0]) ** 2 + (center_y - anchor[1]) ** 2) ** 0.5
+    return 1.0 - distance / (2 ** 0.5)
+
+
+def score_element(elem: Dict, region: str, keywords: Sequence[str],
+                  negative_keywords: Sequence[str], id_patterns: Sequence[str]) -> float:
+    """本地打分：关键词命中 + 资源ID模式 + 尺寸 + 位置先验"""
+    return (_keyword_score(elem, keywords, negative_keywords)
+            + _resource_id_score(elem, id_patterns)
+            + _size_score(elem)
+            + _position_score(elem, region))
+
+
+def rank_clickable_elements(elements: List[Dict], region: str, keywords: Sequence[str],
+                            negative_keywords: Sequence[str], id_patterns: Sequence[str],
+                            top_k: int) -> List[Dict]:
+    """
+    对可点击组件打分并保留得分最高的 top_k 个，按得分降序返回
+    返回的是附带 prerank_score 字段（便于日志排查）的副本，传入的组件不会被修改
+    """
+    scored = [dict(elem, prerank_score=round(
+        score_element(elem, region, keywords, negative_keywords, id_patterns), 3)) for elem in elements]
+    ranked = sorted(scored, key=lambda e: e["prerank_score"], reverse=True)
+    return ranked[:top_k] if top_k > 0 else ranked
+
+
+def _cell(value: str) -> str:
+    return str(value).replace('|', '/').replace('\n', ' ').strip()
+
+
+def encode_elements_table(elements: List[Dict]) -> str:
+    """
+    将组件列表编码为紧凑的表格文本（替代缩进JSON）
+    bounds 为像素坐标 x1,y1,x2,y2；size 为归一化宽,高（占屏幕宽高的比例）；center 为归一化中心点
+    """
+    lines = ["index|text|description|resource_id|bounds|size|center"]
+    for i, elem in enumerate(elements):
+        resource_id = elem.get('resource_id', '').split(':id/')[-1]
+        bounds = ",".join(str(v) for v in elem.get('bounds', []))
+        x1, y1, x2, y2 = elem.get('normalized_bounds', [0, 0, 0, 0])
+        size = f"{max(0.0, x2 - x1):.3f},{max(0.0, y2 - y1):.3f}"
+        center = ",".join(f"{v:.3f}" for v in elem.get('center', []))
+        lines.append("|".join([
+            str(i),
+            _cell(elem.get('text', '')),
+            _cell(elem.get('description', '')),
+            _cell(resource_id),
+            bounds,
+            size,
+            center,
+        ]))
+    return "\n".join(lines)
+
+
+def encode_elements_json(elements: List[Dict]) -> str:
+    """旧版的缩进JSON编码，仅用于统计压缩前的token数"""
+    elements_info = []
+    for i, elem in enumerate(elements):
+        elements_info.append({
+            "index": i,
+            "text": elem.get('text', ''),
+            "description": elem.get('description', ''),
+            "resource_id": elem.get('resource_id', ''),
+            "bounds": elem.get('bounds', []),
+            "normalized_bounds": [f"{x:.3f}" for x in elem.get('normalized_bounds', [])],
+            "center": [f"{x:.3f}" for x in elem.get('center', [])]
+        })
+    return json.dumps(elements_info, indent=2, ensure_ascii=False)
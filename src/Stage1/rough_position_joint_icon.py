@@ -0,0 +1,189 @@
+# rough_position_joint_icon.py
+from PIL import Image
+import io
+import json
+import base64
+import requests
+import logging
+from typing import Dict, Optional
+
+import sys
+from dotenv import load_dotenv
+import os
+
+# 加载环境变量
+load_dotenv()
+
+# 配置参数
+GEMINI_API_BASE = os.getenv("GEMINI_API_BASE")
+
+# Stage1 与 src 共用模型级联模块
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from llm_request import Endpoint, check_response, gemini_executor
+from metering import report_payload
+from model_cascade import get_cascade, cascade_tiers, validate_confidence
+from structured_output import JointRegions, gemini_reask, parse_response
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class CoarseJointIconDetector:
+    """粗定位：一次请求同时识别个人中心图标与设置图标的区域，并判断设置入口是否已可见"""
+
+    def __init__(self, api_key: str):
+        self.api_key = api_key
+        self.model = "gemini-2.5-pro"
+        self.cascade = get_cascade(
+            "joint_coarse", cascade_tiers("GEMINI_CASCADE_MODELS", ["gemini-2.5-flash", self.model])
+        )
+
+    def detect_joint_regions(self, image_bytes: bytes) -> Optional[Dict]:
+        """级联联合粗定位：决定下一步动作的那个区域置信度不足时升级到pro模型"""
+        def validate(result):
+            if not result:
+                return False
+            target = result["setting"] if result["setting_visible"] else result["personal"]
+            return validate_confidence(target)
+
+        return self.cascade.run(
+            lambda model: self._request_joint_regions(image_bytes, model),
+            validate
+        )
+
+    def _request_joint_regions(self, image_bytes: bytes, model: str) -> Optional[Dict]:
+        """
+        联合粗定位
+        返回：{personal: {region, confidence, reason} 或 None,
+              setting: {region, confidence, reason} 或 None,
+              setting_visible: bool}
+        """
+        prompt = """【任务说明】
+你是一个专业的UI界面分析助手，需要在同一张手机应用截图中同时识别：
+（1）"个人中心"或"我的"图标的大致方位区域；
+（2）"设置"图标的大致方位区域，并判断设置入口此刻是否已经可以直接点击。
+
+【分析要求】
+1. 个人中心图标：
+   - 人形图标、用户头像，或包含"我"、"我的"、"个人中心"、"账号"等文字的按钮
+   - 最可能出现在右下角（底部导航栏），其次是左上角、右上角、底部中央
+2. 设置图标：
+   - 齿轮形状图标 (⚙️)、六边形图标，或包含"设置"、"Setting"、"Settings"文字的按钮
+   - 最可能出现在右上角，其次是左上角、右下角、顶部中央
+   - 三个点菜单、三条横线菜单等不算设置入口
+3. 只有当界面上确实存在可以直接点击的设置入口时，setting_visible 才为 true。
+
+【输出格式】
+请严格按照以下JSON格式输出，不要包含任何其他文字：
+
+{
+  "personal": {
+    "region": "bottom_right",  // 区域标识：top_left, top_right, bottom_left, bottom_right, bottom_center
+    "confidence": 0.85,
+    "reason": "底部导航栏右侧显示'我的'文字和人形图标"
+  },
+  "setting": {
+    "region": "top_right",     // 区域标识：top_left, top_right, bottom_left, bottom_right, top_center
+    "confidence": 0.6,
+    "reason": "右上角有齿轮图标"
+  },
+  "setting_visible": true
+}
+
+某一类图标未检测到时，对应字段输出 null。
+
+请直接输出JSON，不要解释。"""
+
+        try:
+            # 压缩图片以减少API负载
+            compressed_image_bytes = self._compress_image(image_bytes)
+            image_base64 = base64.b64encode(compressed_image_bytes).decode('utf-8')
+
+            payload = {
+                "model": model,
+                "stream": False,
+                "messages": [
+                    {
+                        "role": "user",
+                        "content": [
+                            {"type": "text", "text": prompt},
+                            {"type": "image_url", "image_url": {
+                                "url": f"data:image/png;base64,{image_base64}"}
+                             }
+                        ]
+                    }
+                ],
+                "temperature": 0.1,
+                "max_tokens": 2000
+            }
+
+            def send(endpoint: Endpoint, timeout: float) -> Dict:
+                body = json.dumps(dict(payload, model=endpoint.model))
+                report_payload(len(body))
+                response = requests.post(
+                    endpoint.chat_url,
+                    headers=endpoint.headers(),
+                    data=body,
+                    timeout=timeout,
+                )
+                logger.info(f"API响应状态码: {response.status_code}")
+                check_response(response)
+                return response.json()
+
+            logger.info("发送联合粗定位API请求...")
+            response_data = gemini_executor(self.api_key, model, GEMINI_API_BASE, attempt_timeout=60).execute(
+                send, lambda data: bool(data.get('choices'))
+            )
+            if response_data is None:
+                logger.error("API请求失败（已达重试上限或截止时间）")
+                return None
+
+            if 'choices' not in response_data or not response_data['choices']:
+                logger.error("响应中没有choices字段")
+                return None
+
+            content = response_data['choices'][0]['message']['content']
+            if not content:
+                logger.error("响应内容为空")
+                return None
+
+            logger.info(f"原始响应内容: {content}")
+
+            # 回答不合法时先本地修复，仍失败再交给便宜的文字模型整理，不重新发送截图
+            result = parse_response(content, JointRegions, reask=gemini_reask(self.api_key, GEMINI_API_BASE))
+            if result is None:
+                logger.error("响应解析失败")
+                return None
+            joint_result = {
+                "personal": result.personal.model_dump() if result.personal else None,
+                "setting": result.setting.model_dump() if result.setting else None,
+                "setting_visible": result.setting_visible
+            }
+            logger.info(f"联合粗定位结果: {joint_result}")
+            return joint_result
+
+        except Exception as e:
+            logger.error(f"联合粗定位失败: {str(e)}")
+            import traceback
+            logger.error(traceback.format_exc())
+            return None
+
+    def _compress_image(self, image_bytes: bytes, quality: int = 50) -> bytes:
+        """压缩图片以减少API负载"""
+        try:
+            image = Image.open(io.BytesIO(image_bytes))
+            # 调整图片大小，最大边长为800像素
+            max_size = 800
+            if max(image.size) > max_size:
+                ratio = max_size / max(image.size)
+                new_size = (int(image.size[0] * ratio), int(image.size[1] * ratio))
+                image = image.resize(new_size, Image.Resampling.LANCZOS)
+
+            # 保存为压缩的JPEG
+            output_buffer = io.BytesIO()
+            image = image.convert('RGB')  # 转换为RGB以支持JPEG
+            image.save(output_buffer, format='JPEG', quality=quality, optimize=True)
+            return output_buffer.getvalue()
+        except Exception as e:
+            logger.warning(f"图片压缩失败，使用原图: {str(e)}")
+            return image_bytes
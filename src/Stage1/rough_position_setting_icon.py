@@ -8,12 +8,20 @@ import requests
 import logging
 from typing import Dict, Optional
 
+import sys
 from dotenv import load_dotenv
 import os
 
 load_dotenv()
 GEMINI_API_BASE = os.getenv("GEMINI_API_BASE")
 
+# Stage1 与 src 共用模型级联模块
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from llm_request import Endpoint, check_response, gemini_executor
+from metering import report_payload
+from model_cascade import get_cascade, cascade_tiers, validate_confidence
+from structured_output import CoarseRegions, gemini_reask, parse_dict
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -21,11 +29,23 @@ logger = logging.getLogger(__name__)
 class CoarseSettingIconDetector:
     """粗定位：视觉初步识别设置图标区域"""
 
+    REGIONS = ("top_left", "top_right", "bottom_left", "bottom_right", "top_center")
+
     def __init__(self, api_key: str):
         self.api_key = api_key
         self.model = "gemini-2.5-pro"
+        self.cascade = get_cascade(
+            "setting_coarse", cascade_tiers("GEMINI_CASCADE_MODELS", ["gemini-2.5-flash", self.model])
+        )
 
     def detect_setting_region(self, image_bytes: bytes) -> Optional[Dict]:
+        """级联粗定位：先用flash模型，区域非法或置信度不足时升级到pro模型"""
+        return self.cascade.run(
+            lambda model: self._request_setting_region(image_bytes, model),
+            lambda result: validate_confidence(result) and result.get("region") in self.REGIONS
+        )
+
+    def _request_setting_region(self, image_bytes: bytes, model: str) -> Optional[Dict]:
         """
         粗定位：识别设置图标的大致方位区域
         返回区域信息：{region: "top_right", confidence: 0.9, hint_bbox: [x1,y1,x2,y2]}
@@ -79,7 +99,7 @@ class CoarseSettingIconDetector:
             image_base64 = base64.b64encode(compressed_image_bytes).decode('utf-8')
 
             payload = {
-                "model": self.model,
+                "model": model,
                 "stream": False,
                 "messages": [
                     {
@@ -96,27 +116,26 @@ class CoarseSettingIconDetector:
                 "max_tokens": 2000
             }
 
-            headers = {
-                'Content-Type': 'application/json',
-                'Authorization': f'Bearer {self.api_key}'
-            }
+            def send(endpoint: Endpoint, timeout: float) -> Dict:
+                body = json.dumps(dict(payload, model=endpoint.model))
+                report_payload(len(body))
+                response = requests.post(
+                    endpoint.chat_url,
+                    headers=endpoint.headers(),
+                    data=body,
+                    timeout=timeout,
+                )
+                logger.info(f"API响应状态码: {response.status_code}")
+                check_response(response)
+                return response.json()
 
             logger.info("发送粗定位API请求...")
-            response = requests.post(
-                f"{GEMINI_API_BASE}/v1/chat/completions",
-                headers=headers,
-                json=payload,  # 使用json参数自动序列化
-                timeout=60
+            response_data = gemini_executor(self.api_key, model, GEMINI_API_BASE, attempt_timeout=60).execute(
+                send, lambda data: bool(data.get('choices'))
             )
-
-            logger.info(f"API响应状态码: {response.status_code}")
-
-            if response.status_code != 200:
-                logger.error(f"API请求失败: {response.status_code}")
-                logger.error(f"响应内容: {response.text}")
+            if response_data is None:
+                logger.error("API请求失败（已达重试上限或截止时间）")
                 return None
-
-            response_data = response.json()
             logger.info("成功获取API响应")
 
             # 调试：打印完整的响应结构
@@ -133,17 +152,11 @@ class CoarseSettingIconDetector:
 
             logger.info(f"原始响应内容: {content}")
 
-            # 尝试清理响应内容，移除可能的markdown标记
-            cleaned_content = content.strip()
-            if cleaned_content.startswith('```json'):
-                cleaned_content = cleaned_content[7:]
-            if cleaned_content.endswith('```'):
-                cleaned_content = cleaned_content[:-3]
-            cleaned_content = cleaned_content.strip()
-
-            logger.info(f"清理后的内容: {cleaned_content}")
-
-            result = json.loads(cleaned_content)
+            # 回答不合法时先本地修复，仍失败再交给便宜的文字模型整理，不重新发送截图
+            result = parse_dict(content, CoarseRegions, reask=gemini_reask(self.api_key, GEMINI_API_BASE))
+            if result is None:
+                logger.error("响应解析失败")
+                return None
             regions = result.get("detected_regions", [])
 
             if regions:
@@ -156,10 +169,6 @@ class CoarseSettingIconDetector:
                 logger.info("未检测到设置图标区域")
                 return None
 
-        except json.JSONDecodeError as e:
-            logger.error(f"JSON解析失败: {str(e)}")
-            logger.error(f"解析的内容: {content if 'content' in locals() else 'N/A'}")
-            return None
         except Exception as e:
             logger.error(f"粗定位失败: {str(e)}")
             import traceback
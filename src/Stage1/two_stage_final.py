@@ -4,10 +4,13 @@ import time
 import os
 import json
 import logging
+import sys
+from typing import Dict, Optional
 from rough_position_setting_icon import CoarseSettingIconDetector
 from concise_position_setting_icon import FineSettingIconDetector
 from rough_position_personal_icon import CoarsePersonalIconDetector
 from concise_position_personal_icon import FinePersonalIconDetector
+from rough_position_joint_icon import CoarseJointIconDetector
 
 from dotenv import load_dotenv
 import os
@@ -20,6 +23,11 @@ GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 DEVICE_SERIAL = os.getenv("DEVICE_SERIAL")
 APP_PACKAGE = os.getenv("APP_PACKAGE")
 
+# Stage1 与 src 共用模型级联模块
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from model_cascade import cascade_stats, export_cascade_stats
+from metering import meter, metering_scope, metering_summary
+
 # 设置更详细的日志
 logging.basicConfig(
     level=logging.WARNING,
@@ -42,10 +50,12 @@ class CombinedDetectionPipeline:
         self.setting_fine_detector = FineSettingIconDetector(api_key)
         self.personal_coarse_detector = CoarsePersonalIconDetector(api_key)
         self.personal_fine_detector = FinePersonalIconDetector(api_key)
+        self.joint_coarse_detector = CoarseJointIconDetector(api_key)
 
         # 存储检测结果和token统计
         self.detection_results = []
         self.token_usage = {
+            "joint_coarse": 0,
             "personal_coarse": 0,
             "personal_fine": 0,
             "setting_coarse": 0,
@@ -60,8 +70,43 @@ class CombinedDetectionPipeline:
             self.token_usage["total"] += tokens
             logger.info(f"📊 {phase} 阶段使用了 {tokens} tokens")
 
-    def _detect_and_click_personal_icon(self) -> bool:
-        """检测并点击个人中心图标"""
+    def _metered(self, phase: str, detect, *args):
+        """在计量作用域内调用检测器，并把这次调用消耗的token计入对应阶段"""
+        before = meter.total_tokens(phase=phase)
+        with metering_scope(phase=phase):
+            result = detect(*args)
+        self._update_token_usage(phase, meter.total_tokens(phase=phase) - before)
+        return result
+
+    def _detect_joint_regions(self) -> Optional[Dict]:
+        """联合粗定位：一次请求同时获取个人中心与设置图标区域"""
+        screenshot_path = "temp_screenshot_joint.png"
+
+        try:
+            logger.info(" 截取联合检测屏幕...")
+            self.device.screenshot(screenshot_path)
+
+            if not os.path.exists(screenshot_path):
+                logger.error("  截图文件未生成")
+                return None
+
+            with open(screenshot_path, "rb") as f:
+                screenshot_bytes = f.read()
+
+            joint_result = self._metered("joint_coarse", self.joint_coarse_detector.detect_joint_regions,
+                                        screenshot_bytes)
+
+            return joint_result
+
+        except Exception as e:
+            logger.error(f"  联合粗定位流程失败: {str(e)}")
+            return None
+        finally:
+            if os.path.exists(screenshot_path):
+                os.remove(screenshot_path)
+
+    def _detect_and_click_personal_icon(self, coarse_result: Optional[Dict] = None) -> bool:
+        """检测并点击个人中心图标；coarse_result 不为空时跳过粗定位请求"""
         screenshot_path = "temp_screenshot_personal.png"
 
         try:
@@ -76,14 +121,11 @@ class CombinedDetectionPipeline:
             with open(screenshot_path, "rb") as f:
                 screenshot_bytes = f.read()
 
-            # 步骤1: 粗定位个人中心图标
-            logger.info(" 阶段1: 粗定位个人中心图标...")
-            coarse_result = self.personal_coarse_detector.detect_personal_region(screenshot_bytes)
-
-            # 尝试获取token使用量（如果检测器支持）
-            if hasattr(self.personal_coarse_detector, 'last_token_usage'):
-                tokens = self.personal_coarse_detector.last_token_usage
-                self._update_token_usage("personal_coarse", tokens)
+            # 步骤1: 粗定位个人中心图标（已有联合粗定位结果时直接复用）
+            if coarse_result is None:
+                logger.info(" 阶段1: 粗定位个人中心图标...")
+                coarse_result = self._metered("personal_coarse", self.personal_coarse_detector.detect_personal_region,
+                                             screenshot_bytes)
 
             if not coarse_result:
                 logger.warning("  粗定位未找到个人中心图标区域")
@@ -110,15 +152,11 @@ class CombinedDetectionPipeline:
 
             # 步骤3: 精定位个人中心图标
             logger.info(" 阶段3: 精定位个人中心图标...")
-            fine_result = self.personal_fine_detector.fine_detection(
+            fine_result = self._metered(
+                "personal_fine", self.personal_fine_detector.fine_detection,
                 screenshot_bytes, clickable_elements, coarse_result
             )
 
-            # 尝试获取token使用量（如果检测器支持）
-            if hasattr(self.personal_fine_detector, 'last_token_usage'):
-                tokens = self.personal_fine_detector.last_token_usage
-                self._update_token_usage("personal_fine", tokens)
-
             if not fine_result:
                 logger.warning("  精定位未找到个人中心图标")
                 return False
@@ -154,8 +192,8 @@ class CombinedDetectionPipeline:
                 os.remove(screenshot_path)
                 logger.info("🧹 清理个人中心临时截图文件")
 
-    def _detect_and_click_setting_icon(self) -> bool:
-        """检测并点击设置图标"""
+    def _detect_and_click_setting_icon(self, coarse_result: Optional[Dict] = None) -> bool:
+        """检测并点击设置图标；coarse_result 不为空时跳过粗定位请求"""
         screenshot_path = "temp_screenshot_setting.png"
 
         try:
@@ -170,14 +208,11 @@ class CombinedDetectionPipeline:
             with open(screenshot_path, "rb") as f:
                 screenshot_bytes = f.read()
 
-            # 步骤1: 粗定位设置图标
-            logger.info(" 阶段1: 粗定位设置图标...")
-            coarse_result = self.setting_coarse_detector.detect_setting_region(screenshot_bytes)
-
-            # 尝试获取token使用量（如果检测器支持）
-            if hasattr(self.setting_coarse_detector, 'last_token_usage'):
-                tokens = self.setting_coarse_detector.last_token_usage
-                self._update_token_usage("setting_coarse", tokens)
+            # 步骤1: 粗定位设置图标（已有联合粗定位结果时直接复用）
+            if coarse_result is None:
+                logger.info(" 阶段1: 粗定位设置图标...")
+                coarse_result = self._metered("setting_coarse", self.setting_coarse_detector.detect_setting_region,
+                                             screenshot_bytes)
 
             if not coarse_result:
                 logger.warning("  粗定位未找到设置图标区域")
@@ -204,15 +239,11 @@ class CombinedDetectionPipeline:
 
             # 步骤3: 精定位设置图标
             logger.info(" 阶段3: 精定位设置图标...")
-            fine_result = self.setting_fine_detector.fine_detection(
+            fine_result = self._metered(
+                "setting_fine", self.setting_fine_detector.fine_detection,
                 screenshot_bytes, clickable_elements, coarse_result
             )
 
-            # 尝试获取token使用量（如果检测器支持）
-            if hasattr(self.setting_fine_detector, 'last_token_usage'):
-                tokens = self.setting_fine_detector.last_token_usage
-                self._update_token_usage("setting_fine", tokens)
-
             if not fine_result:
                 logger.warning("  精定位未找到设置图标")
                 return False
@@ -255,6 +286,8 @@ class CombinedDetectionPipeline:
             results_with_tokens = {
                 "detection_results": self.detection_results,
                 "token_usage": self.token_usage,
+                "cascade_stats": cascade_stats(),
+                "metering": metering_summary(),
                 "summary": {
                     "total_tokens": self.token_usage["total"],
                     "detection_steps": len(self.detection_results)
@@ -264,6 +297,7 @@ class CombinedDetectionPipeline:
             with open(output_path, 'w', encoding='utf-8') as f:
                 json.dump(results_with_tokens, f, ensure_ascii=False, indent=2)
             logger.info(f"检测结果已保存到: {output_path}")
+            export_cascade_stats()
 
             # 在控制台输出token使用摘要
             self._print_token_summary()
@@ -274,6 +308,7 @@ class CombinedDetectionPipeline:
     def _print_token_summary(self):
         """打印token使用摘要"""
         logger.info("===== TOKEN使用统计 =====")
+        logger.info(f"联合粗定位: {self.token_usage['joint_coarse']} tokens")
         logger.info(f"个人中心粗定位: {self.token_usage['personal_coarse']} tokens")
         logger.info(f"个人中心精定位: {self.token_usage['personal_fine']} tokens")
         logger.info(f"设置粗定位: {self.token_usage['setting_coarse']} tokens")
@@ -284,6 +319,8 @@ class CombinedDetectionPipeline:
     def run_combined_detection(self, app_package: str) -> bool:
         """完整的组合检测流程"""
         try:
+            meter.set_scope(app=app_package, page="navigation")
+
             # 启动应用
             logger.info(" 启动应用...")
             self.device.app_start(app_package)
@@ -296,23 +333,34 @@ class CombinedDetectionPipeline:
             if current_app['package'] != app_package:
                 logger.warning(f"应用可能未成功启动，当前包名: {current_app['package']}")
 
-            # 第一步：检测并点击个人中心图标
-            logger.info("=" * 50)
-            logger.info("开始个人中心图标检测流程")
-            logger.info("=" * 50)
-
-            personal_success = self._detect_and_click_personal_icon()
-
-            if not personal_success:
-                logger.error("  个人中心图标检测失败，终止流程")
-                return False
-
-            # 第二步：检测并点击设置图标（在个人中心页面内）
-            logger.info("=" * 50)
-            logger.info("开始设置图标检测流程")
-            logger.info("=" * 50)
-
-            setting_success = self._detect_and_click_setting_icon()
+            # 第零步：联合粗定位，判断首页是否已可见设置入口
+            joint_result = self._detect_joint_regions()
+
+            if joint_result and joint_result["setting_visible"]:
+                # 设置入口已可见：跳过个人中心这一跳，直接复用联合粗定位的设置区域
+                logger.info("设置图标已在当前页面可见，跳过个人中心检测")
+                personal_success = True
+                setting_success = self._detect_and_click_setting_icon(joint_result["setting"])
+            else:
+                # 第一步：检测并点击个人中心图标
+                logger.info("=" * 50)
+                logger.info("开始个人中心图标检测流程")
+                logger.info("=" * 50)
+
+                personal_success = self._detect_and_click_personal_icon(
+                    joint_result["personal"] if joint_result else None
+                )
+
+                if not personal_success:
+                    logger.error("  个人中心图标检测失败，终止流程")
+                    return False
+
+                # 第二步：检测并点击设置图标（在个人中心页面内）
+                logger.info("=" * 50)
+                logger.info("开始设置图标检测流程")
+                logger.info("=" * 50)
+
+                setting_success = self._detect_and_click_setting_icon()
 
             if not setting_success:
                 logger.error("  设置图标检测失败")
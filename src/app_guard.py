@@ -0,0 +1,184 @@
+import logging
+import os
+import re
+import threading
+import time
+import xml.etree.ElementTree as ET
+from typing import Dict, List, Optional
+
+import uiautomator2 as u2
+from dotenv import load_dotenv
+
+from tracing import tracer, traced_sleep
+
+# 加载环境变量
+load_dotenv()
+
+# 每次点击进入页面后确认仍在目标应用中：跳到浏览器、应用商店等其他应用或弹出系统对话框时立即返回，
+# 不再截取长图、调用模型
+APP_GUARD = os.getenv("APP_GUARD", "true").lower() == "true"
+# 回到目标应用最多按返回键的次数，以及每次等待回到目标应用的最长时间（秒）
+APP_GUARD_MAX_BACKS = int(os.getenv("APP_GUARD_MAX_BACKS", 3))
+APP_GUARD_TIMEOUT = float(os.getenv("APP_GUARD_TIMEOUT", 1.5))
+APP_GUARD_POLL_INTERVAL = 0.3
+# 额外视为系统对话框的包名（逗号分隔），例如各厂商的权限管理
+APP_GUARD_SYSTEM_PACKAGES = [p.strip() for p in os.getenv("APP_GUARD_SYSTEM_PACKAGES", "").split(",") if p.strip()]
+
+logger = logging.getLogger(__name__)
+
+# 权限申请、打开方式选择、安装确认等系统对话框所在的包
+SYSTEM_DIALOG_PACKAGES = (
+    "android",
+    "com.android.systemui",
+    "com.android.permissioncontroller",
+    "com.google.android.permissioncontroller",
+    "com.android.packageinstaller",
+    "com.google.android.packageinstaller",
+    "com.lbe.security.miui",
+    "com.miui.securitycenter",
+    "com.huawei.systemmanager",
+    "com.hihonor.systemmanager",
+    "com.coloros.securitypermission",
+    "com.oplus.securitypermission",
+    "com.vivo.permissionmanager",
+) + tuple(APP_GUARD_SYSTEM_PACKAGES)
+# 关闭系统对话框时点击的按钮：一律拒绝授权，不替用户开启任何权限
+_DENY_LABELS = ("拒绝", "禁止", "不允许", "始终拒绝", "拒绝且不再询问", "取消", "deny", "don't allow", "cancel")
+
+_BOUNDS_PATTERN = re.compile(r'\[(-?\d+),(-?\d+)\]\[(-?\d+),(-?\d+)\]')
+
+
+def _bounds(elem) -> Optional[List[int]]:
+    match = _BOUNDS_PATTERN.match(elem.get("bounds") or "")
+    return list(map(int, match.groups())) if match else None
+
+
+def _overlay_package(hierarchy_xml: Optional[str]) -> Optional[str]:
+    """层级中覆盖在应用之上的系统对话框窗口（顶层节点属于系统对话框的包）"""
+    if not hierarchy_xml:
+        return None
+    try:
+        root = ET.fromstring(hierarchy_xml)
+    except ET.ParseError:
+        return None
+    for elem in root:
+        if elem.get("package") in SYSTEM_DIALOG_PACKAGES and elem.get("package") != "com.android.systemui":
+            return elem.get("package")
+    return None
+
+
+def _deny_button(hierarchy_xml: str, package: str) -> Optional[List[int]]:
+    """系统对话框中拒绝 / 取消按钮的中心点"""
+    try:
+        root = ET.fromstring(hierarchy_xml)
+    except ET.ParseError:
+        return None
+    for label in _DENY_LABELS:
+        for elem in root.iter("node"):
+            text = (elem.get("text") or elem.get("content-desc") or "").strip().lower()
+            box = _bounds(elem)
+            if text == label and box is not None and (elem.get("package") or package) == package:
+                return [(box[0] + box[2]) // 2, (box[1] + box[3]) // 2]
+    return None
+
+
+class AppGuard:
+    """
+    点击后的应用守卫：用 app_current() 判断前台应用是否仍为目标应用，并在点击后已取得的层级中查找
+    覆盖在应用之上的系统对话框；离开时系统对话框先点拒绝 / 取消，其他应用按返回键，
+    每一步轮询前台应用直到回到目标应用，最多 APP_GUARD_MAX_BACKS 次
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.enabled = APP_GUARD
+        self.checks = 0
+        self.incidents = {"system_dialog": 0, "foreign_app": 0}
+        self.packages: Dict[str, int] = {}
+        self.recoveries = {"deny_button": 0, "back": 0, "failed": 0}
+        self.recovery_seconds = 0.0
+
+    def reset(self):
+        with self._lock:
+            self.checks = 0
+            self.incidents = {"system_dialog": 0, "foreign_app": 0}
+            self.packages = {}
+            self.recoveries = {"deny_button": 0, "back": 0, "failed": 0}
+            self.recovery_seconds = 0.0
+
+    def _inspect(self, device: u2.Device, package: str, hierarchy_xml: Optional[str] = None) -> Optional[Dict]:
+        with tracer.span("app_current", "device"):
+            current = device.app_current()
+        current_package = current.get("package") or ""
+        if current_package and current_package != package:
+            kind = "system_dialog" if current_package in SYSTEM_DIALOG_PACKAGES else "foreign_app"
+            return {"kind": kind, "package": current_package, "activity": current.get("activity", "")}
+        overlay = _overlay_package(hierarchy_xml)
+        if overlay is not None:
+            return {"kind": "system_dialog", "package": overlay, "activity": current.get("activity", "")}
+        return None
+
+    def check(self, device: u2.Device, package: str, hierarchy_xml: Optional[str] = None) -> Optional[Dict]:
+        """
+        前台仍为目标应用且没有系统对话框时返回 None，
+        否则返回 {"kind": system_dialog / foreign_app, "package", "activity"}
+        """
+        incident = self._inspect(device, package, hierarchy_xml)
+        with self._lock:
+            self.checks += 1
+            if incident is not None:
+                self.incidents[incident["kind"]] += 1
+                self.packages[incident["package"]] = self.packages.get(incident["package"], 0) + 1
+        return incident
+
+    def _back_in_app(self, device: u2.Device, package: str, dialog: bool) -> bool:
+        """轮询直到前台回到目标应用（对话框覆盖在应用之上时还要等层级中的对话框消失）"""
+        waited = 0.0
+        while waited < APP_GUARD_TIMEOUT:
+            traced_sleep(APP_GUARD_POLL_INTERVAL, "guard_poll")
+            waited += APP_GUARD_POLL_INTERVAL
+            hierarchy_xml = device.dump_hierarchy() if dialog else None
+            if self._inspect(device, package, hierarchy_xml) is None:
+                return True
+        return False
+
+    def recover(self, device: u2.Device, package: str, incident: Dict) -> bool:
+        """回到目标应用：系统对话框先点拒绝 / 取消，之后（以及其他应用）按返回键；失败返回 False"""
+        started = time.time()
+        dialog = incident["kind"] == "system_dialog"
+        button = _deny_button(device.dump_hierarchy(), incident["package"]) if dialog else None
+        steps = (["deny_button"] if button is not None else []) + ["back"] * APP_GUARD_MAX_BACKS
+        recovered = None
+        for method in steps:
+            if method == "deny_button":
+                device.click(*button)
+            else:
+                with tracer.span("back", "device"):
+                    device.press("back")
+            if self._back_in_app(device, package, dialog):
+                recovered = method
+                break
+        with self._lock:
+            self.recoveries[recovered or "failed"] += 1
+            self.recovery_seconds += time.time() - started
+        if recovered is None:
+            logger.error(f"无法从 {incident['package']} 回到 {package}")
+        return recovered is not None
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "checks": self.checks,
+                "incidents": dict(self.incidents),
+                "packages": dict(sorted(self.packages.items(), key=lambda kv: -kv[1])),
+                "recoveries": dict(self.recoveries),
+                "recovery_seconds": round(self.recovery_seconds, 3),
+            }
+
+
+guard = AppGuard()
+
+
+def guard_stats() -> Dict:
+    return guard.stats()
@@ -0,0 +1,558 @@
+import argparse
+import json
+import logging
+import os
+import random
+import time
+import tracemalloc
+from typing import Dict, List, Optional
+from xml.sax.saxutils import quoteattr
+
+from PIL import Image, ImageDraw
+
+import privacy_analyzer
+import screenshot_inspector
+from app_guard import guard
+from explorer import Explorer
+from frontier import make_frontier
+from llm_request import set_base_rewriter
+from metering import meter
+from popup_detector import detector as popup_detector
+from scroll_controller import scroller
+from stub_llm_server import StubLLMServer
+from switch_knowledge import STRUCTURE_ONLY_NOTE
+from tracing import tracer, set_sleep_scale
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 模拟界面的布局参数（像素）
+HEADER_HEIGHT = 200
+ROW_HEIGHT = 160
+POPUP_MAX_RATIO = 0.6
+
+# topic_skew > 0 时列表项使用带主题的名称：隐私类主题下开关更密集，其他主题更稀疏
+PRIVACY_TOPICS = ["隐私设置", "个性化推荐", "广告管理", "找到我的方式", "隐私可见范围", "个人信息"]
+# 离开应用的列表项：打开浏览器 / 应用商店，或只弹出系统权限对话框
+EXTERNAL_TARGETS = [("用户协议", "com.android.browser", "用户协议 - 浏览器"),
+                    ("去应用商店评分", "com.android.vending", "应用详情"),
+                    ("开启定位服务", "com.android.permissioncontroller", "允许“模拟应用”获取此设备的位置信息？")]
+NEUTRAL_TOPICS = ["账号与安全", "通用设置", "消息通知", "存储空间", "关于我们", "帮助与反馈", "字体大小", "深色模式"]
+NEUTRAL_SWITCH_LABELS = ["新消息通知", "自动播放视频", "深色模式", "声音提醒", "省流量模式", "弹幕显示"]
+SWITCH_LABELS = ["个性化广告推荐", "程序化广告", "允许通过手机号找到我", "把我推荐给可能认识的人", "允许查看我的关注列表",
+                 "显示我的在线状态", "隐藏我的位置", "共享使用数据以改进体验", "个性化内容推荐", "私密账号"]
+
+
+def generate_settings_tree(depth: int = 3, branching: int = 3, switch_density: float = 0.5,
+                           shared_ratio: float = 0.0, popup_ratio: float = 0.0,
+                           long_page_ratio: float = 0.0, max_switches: int = 6,
+                           long_page_factor: int = 6, topic_skew: float = 0.0,
+                           external_ratio: float = 0.0, seed: int = 0) -> Dict[str, Dict]:
+    """
+    生成参数化的设置页面图（有向无环，从 root 出发）
+    每个页面：title、items（switch 或指向子页面的 layout）、popup（是否以底部弹窗形式出现）
+    shared_ratio 为子页面复用同层已有页面的概率（多条路径共享同一子页面）
+    topic_skew 为隐私类与其他主题页面的开关密度差异（0 表示不区分主题，列表项名称为 Entry <id>）
+    区分主题时，其他主题（账号与安全、通用设置等）的页面只包含与隐私无关的开关和同类子页面
+    external_ratio 为非弹窗页面带一个离开应用的列表项（打开其他应用或系统权限对话框）的概率
+    """
+    rng = random.Random(seed)
+    pages: Dict[str, Dict] = {}
+    levels: List[List[str]] = [["root"]]
+    counter = 0
+
+    def pick_topic(parent: Dict) -> Optional[str]:
+        if not topic_skew:
+            return None
+        if parent.get("neutral"):
+            return rng.choice(NEUTRAL_TOPICS)
+        privacy_chance = 0.6 if parent.get("privacy") else 0.4
+        if rng.random() < privacy_chance:
+            return rng.choice(PRIVACY_TOPICS)
+        return rng.choice(NEUTRAL_TOPICS)
+
+    def new_page(page_id: str, level: int, topic: Optional[str] = None) -> Dict:
+        popup = level > 0 and rng.random() < popup_ratio
+        # 弹窗不能滚动，不会是长页面
+        long_page = not popup and rng.random() < long_page_ratio
+        privacy = topic in PRIVACY_TOPICS
+        neutral = topic in NEUTRAL_TOPICS
+        labels = NEUTRAL_SWITCH_LABELS if neutral else SWITCH_LABELS
+        density = switch_density
+        if topic is not None:
+            density = min(1.0, density * (1 + topic_skew)) if privacy else density * (1 - topic_skew)
+        n_switches = sum(rng.random() < density for _ in range(max_switches))
+        if long_page:
+            n_switches *= long_page_factor
+        return {
+            "title": f"{topic} {page_id}" if topic else f"Page {page_id}",
+            "level": level,
+            "privacy": privacy,
+            "neutral": neutral,
+            "popup": popup,
+            "items": [
+                {"type": "switch", "text": f"{rng.choice(labels)} {page_id}-{k}" if topic else f"Switch {page_id}-{k}",
+                 "checked": rng.random() < 0.5, "privacy": not neutral}
+                for k in range(n_switches)
+            ],
+        }
+
+    pages["root"] = new_page("root", 0, "设置" if topic_skew else None)
+    for level in range(1, depth + 1):
+        levels.append([])
+        for parent_id in levels[level - 1]:
+            parent = pages[parent_id]
+            # 弹窗页面不再向下展开，避免弹窗套弹窗
+            if parent["popup"]:
+                continue
+            for _ in range(branching):
+                if levels[level] and rng.random() < shared_ratio:
+                    child_id = rng.choice(levels[level])
+                else:
+                    counter += 1
+                    child_id = f"p{counter}"
+                    pages[child_id] = new_page(child_id, level, pick_topic(parent))
+                    levels[level].append(child_id)
+                parent["items"].append({"type": "layout", "text": pages[child_id]["title"].replace("Page", "Entry"),
+                                        "target": child_id})
+        for page_id in levels[level - 1]:
+            page = pages[page_id]
+            if external_ratio and not page["popup"] and rng.random() < external_ratio:
+                label, package, title = rng.choice(EXTERNAL_TARGETS)
+                external_id = f"ext_{page_id}"
+                dialog = package.endswith("permissioncontroller")
+                pages[external_id] = {
+                    "title": title, "level": level, "privacy": False, "neutral": True, "popup": dialog,
+                    "package": package,
+                    "items": [{"type": "dismiss", "text": "拒绝"}, {"type": "dismiss", "text": "仅在使用中允许"}]
+                    if dialog else [],
+                }
+                page["items"].append({"type": "layout", "text": f"{label} {page_id}", "target": external_id})
+            rng.shuffle(page["items"])
+    return pages
+
+
+def tree_stats(pages: Dict[str, Dict]) -> Dict:
+    return {
+        "pages": len(pages),
+        "switches": sum(1 for p in pages.values() for item in p["items"]
+                        if item["type"] == "switch" and item.get("privacy", True)),
+        "edges": sum(1 for p in pages.values() for item in p["items"] if item["type"] == "layout"),
+        "popups": sum(1 for p in pages.values() if p["popup"] and "package" not in p),
+        "external": sum(1 for p in pages.values() if "package" in p),
+    }
+
+
+class SimulatedSelector:
+    def __init__(self, device: "SimulatedDevice", kwargs: Dict):
+        self._device = device
+        self._kwargs = kwargs
+
+    def _row(self) -> Optional[Dict]:
+        text = self._kwargs.get("text") or self._kwargs.get("description")
+        for row in self._device.visible_rows():
+            if row["item"]["text"] == text:
+                return row
+        return None
+
+    @property
+    def exists(self) -> bool:
+        return self._row() is not None
+
+    @property
+    def info(self) -> Dict:
+        row = self._row()
+        if row is None:
+            return {}
+        left, top, right, bottom = row["bounds"]
+        return {"bounds": {"left": left, "top": top, "right": right, "bottom": bottom},
+                "text": row["item"]["text"]}
+
+
+class SimulatedDevice:
+    """
+    用生成的设置页面图模拟 u2.Device：支持 Explorer / take_long_screenshot 用到的截图、层级、
+    点击、滑动、返回与 device(text=...) 选择器，并统计各类设备调用次数
+    """
+
+    def __init__(self, pages: Dict[str, Dict], width: int = 1080, height: int = 2400,
+                 package: str = "com.simulated.app", back_glitch: float = 0.0, seed: int = 0):
+        self.pages = pages
+        self.width = width
+        self.height = height
+        self.package = package
+        self.settings: Dict = {}
+        self.stack: List[Dict] = [{"page": "root", "offset": 0}]
+        self.visited = set()
+        self.calls: Dict[str, int] = {}
+        self.visited.add("root")
+        # 按返回键时以该概率一次退回两级（模拟返回行为不规范的应用）
+        self.back_glitch = back_glitch
+        self.rng = random.Random(seed)
+
+    def _count(self, op: str):
+        self.calls[op] = self.calls.get(op, 0) + 1
+
+    @property
+    def current_page(self) -> str:
+        return self.stack[-1]["page"]
+
+    def _page(self) -> Dict:
+        return self.pages[self.current_page]
+
+    def _content_top(self) -> int:
+        page = self._page()
+        if not page["popup"]:
+            return 0
+        popup_height = min(HEADER_HEIGHT + len(page["items"]) * ROW_HEIGHT, int(self.height * POPUP_MAX_RATIO))
+        return self.height - popup_height
+
+    def _max_offset(self) -> int:
+        page = self._page()
+        if page["popup"]:
+            return 0
+        return max(0, HEADER_HEIGHT + len(page["items"]) * ROW_HEIGHT - self.height)
+
+    def visible_rows(self) -> List[Dict]:
+        top = self._content_top()
+        offset = self.stack[-1]["offset"]
+        rows = []
+        for i, item in enumerate(self._page()["items"]):
+            y1 = top + HEADER_HEIGHT + i * ROW_HEIGHT - offset
+            y2 = y1 + ROW_HEIGHT
+            if y1 >= top and y2 <= self.height:
+                rows.append({"item": item, "bounds": [0, y1, self.width, y2]})
+        return rows
+
+    # ---- 观察 ----
+
+    def screenshot(self, filename: Optional[str] = None, format: str = "pillow"):
+        self._count("screenshot")
+        page = self._page()
+        top = self._content_top()
+        image = Image.new("RGB", (self.width, self.height), (40, 40, 40) if page["popup"] else (255, 255, 255))
+        draw = ImageDraw.Draw(image)
+        if page["popup"]:
+            draw.rectangle([0, top, self.width, self.height], fill=(255, 255, 255))
+        header_y = top - self.stack[-1]["offset"]
+        if header_y + HEADER_HEIGHT > top:
+            draw.text((40, header_y + 80), page["title"], fill=(0, 0, 0))
+        for row in self.visible_rows():
+            x1, y1, x2, y2 = row["bounds"]
+            item = row["item"]
+            draw.line([40, y2 - 1, x2 - 40, y2 - 1], fill=(220, 220, 220))
+            draw.text((40, y1 + 60), item["text"], fill=(0, 0, 0))
+            if item["type"] == "switch":
+                color = (0, 150, 136) if item["checked"] else (180, 180, 180)
+                draw.rounded_rectangle([x2 - 200, y1 + 50, x2 - 60, y1 + 110], radius=30, fill=color)
+            else:
+                draw.text((x2 - 80, y1 + 60), ">", fill=(120, 120, 120))
+        if filename:
+            image.save(filename)
+            return filename
+        return image
+
+    def dump_hierarchy(self, *args, **kwargs) -> str:
+        self._count("dump_hierarchy")
+        nodes = []
+        for row in self.visible_rows():
+            x1, y1, x2, y2 = row["bounds"]
+            item = row["item"]
+            children = f'<node class="android.widget.TextView" text={quoteattr(item["text"])} ' \
+                       f'bounds="[40,{y1}][{x2 - 240},{y2}]" clickable="false"/>'
+            if item["type"] == "switch":
+                children += f'<node class="android.widget.Switch" text="" checkable="true" ' \
+                            f'checked="{str(item["checked"]).lower()}" clickable="true" ' \
+                            f'bounds="[{x2 - 200},{y1 + 50}][{x2 - 60},{y1 + 110}]"/>'
+            else:
+                children += f'<node class="android.widget.ImageView" text="" clickable="false" ' \
+                            f'bounds="[{x2 - 100},{y1 + 50}][{x2 - 60},{y1 + 110}]"/>'
+            nodes.append(f'<node class="android.widget.LinearLayout" text="" '
+                         f'clickable="{str(item["type"] == "layout").lower()}" '
+                         f'bounds="[{x1},{y1}][{x2},{y2}]">{children}</node>')
+        title = quoteattr(self._page()["title"])
+        package = self._page().get("package", self.package)
+        # 普通页面的列表放在可滚动容器中（弹窗内容不滚动）
+        content = "".join(nodes)
+        if not self._page()["popup"]:
+            content = (f'<node class="androidx.recyclerview.widget.RecyclerView" text="" scrollable="true" '
+                       f'bounds="[0,{self._content_top()}][{self.width},{self.height}]">{content}</node>')
+        return (f'<?xml version="1.0" encoding="UTF-8"?><hierarchy rotation="0">'
+                f'<node class="android.widget.FrameLayout" package="{package}" text={title} '
+                f'bounds="[0,0][{self.width},{self.height}]">{content}</node></hierarchy>')
+
+    def window_size(self):
+        return self.width, self.height
+
+    def app_current(self) -> Dict:
+        return {"package": self._page().get("package", self.package), "activity": f".{self.current_page}"}
+
+    @property
+    def info(self) -> Dict:
+        return {"currentPackageName": self.package}
+
+    def __call__(self, **kwargs):
+        return SimulatedSelector(self, kwargs)
+
+    # ---- 动作 ----
+
+    def swipe(self, x1, y1, x2, y2, duration: float = 0.1):
+        self._count("swipe")
+        state = self.stack[-1]
+        state["offset"] = min(self._max_offset(), max(0, state["offset"] + int(y1 - y2)))
+
+    def click(self, x, y):
+        self._count("click")
+        page = self._page()
+        if page["popup"] and y < self._content_top():
+            # 点击弹窗外的暗色区域关闭弹窗
+            self.stack.pop()
+            return
+        for row in self.visible_rows():
+            x1, y1, x2, y2 = row["bounds"]
+            if x1 <= x <= x2 and y1 <= y <= y2:
+                item = row["item"]
+                if item["type"] == "switch":
+                    item["checked"] = not item["checked"]
+                elif item["type"] == "dismiss":
+                    self.stack.pop()
+                else:
+                    self.stack.append({"page": item["target"], "offset": 0})
+                    self.visited.add(item["target"])
+                return
+
+    def press(self, key: str):
+        self._count(f"press_{key}")
+        if key == "back" and len(self.stack) > 1:
+            self.stack.pop()
+            if len(self.stack) > 1 and self.rng.random() < self.back_glitch:
+                self.stack.pop()
+
+    def app_start(self, package: str, stop: bool = False):
+        self._count("app_start")
+        self.stack = [{"page": "root", "offset": 0}]
+
+
+def simulated_recommendation(text: str) -> Dict:
+    return {"recommended_state": "off", "analysis": f"关闭“{text}”可减少个人信息被收集和使用，有助于保护用户隐私。"}
+
+
+def analysis_for_page(page: Dict, structure_only: bool = False) -> Dict:
+    """与 prompt.txt 约定格式一致的分析结果：整页的开关与可进入的列表项；structure_only 时开关只有文字与当前状态"""
+    return {
+        "isPopup": page["popup"],
+        "switches": [
+            {"text": item["text"], "current_state": "on" if item["checked"] else "off",
+             **({} if structure_only else simulated_recommendation(item["text"]))}
+            for item in page["items"] if item["type"] == "switch" and item.get("privacy", True)
+        ],
+        "layouts": [{"text": item["text"]} for item in page["items"] if item["type"] == "layout"],
+        "personalization": {"switches": [], "layouts": []},
+    }
+
+
+class SimulatedAnalyzerServer(StubLLMServer):
+    """按模拟设备当前所在页面给出分析结果的替身模型服务，走完整的执行层/级联/解析流程"""
+
+    def __init__(self, device: SimulatedDevice, latency: float = 0.0, **kwargs):
+        super().__init__(latency=latency, **kwargs)
+        self.device = device
+
+    def respond(self, request: Dict) -> str:
+        text = "".join(part.get("text", "") for message in request.get("messages", [])
+                       for part in (message["content"] if isinstance(message["content"], list)
+                                    else [{"text": message["content"]}]))
+        if text.startswith(privacy_analyzer.RECOMMEND_PROMPT):
+            labels = json.loads(text.rsplit("\n", 1)[-1])
+            return json.dumps({label: simulated_recommendation(label) for label in labels}, ensure_ascii=False)
+        return json.dumps(analysis_for_page(self.device.pages[self.device.current_page],
+                                            structure_only=STRUCTURE_ONLY_NOTE in text), ensure_ascii=False)
+
+
+def run_simulation(depth: int = 3, branching: int = 3, switch_density: float = 0.5,
+                   shared_ratio: float = 0.0, popup_ratio: float = 0.0, long_page_ratio: float = 0.0,
+                   seed: int = 0, analyzer: str = "direct", model_latency: float = 0.0,
+                   sleep_scale: float = 0.0, width: int = 1080, height: int = 2400,
+                   trace: bool = False, max_depth: int = 0, max_pages: int = 0,
+                   topic_skew: float = 0.0, frontier: str = "priority",
+                   hierarchy_extraction: bool = True, analysis_mode: str = "image",
+                   switch_kb: bool = True, progressive: bool = False, scroll_control: bool = True,
+                   back_glitch: float = 0.0, external_ratio: float = 0.0, app_guard: bool = True) -> Dict:
+    """
+    在模拟应用上跑一次 Explorer 探索，返回耗时、内存峰值、调用次数与覆盖率
+    analyzer="direct" 直接返回分析结果；"stub" 经本地替身服务走完整的模型请求链路
+    hierarchy_extraction 为 False 时所有页面都交给（模拟的）模型；analysis_mode 为 text 时先发送层级摘要
+    switch_kb 为 True 且知识库已有 SWITCH_KB_MIN_ENTRIES 条以上时模型只输出页面结构，推荐状态与理由由开关知识库补全
+    progressive 为 True 时先分析缩图，未通过层级校验再用原图
+    scroll_control 为 False 时沿用固定比例的滑动与固定次数的回到顶部
+    back_glitch 为按返回键时一次退回两级的概率，用于检验返回确认与恢复
+    external_ratio 为页面带离开应用的列表项的概率；app_guard 为 False 时点击后不检查前台应用
+    """
+    pages = generate_settings_tree(depth, branching, switch_density, shared_ratio,
+                                   popup_ratio, long_page_ratio, topic_skew=topic_skew,
+                                   external_ratio=external_ratio, seed=seed)
+    device = SimulatedDevice(pages, width, height, back_glitch=back_glitch, seed=seed)
+    explorer = Explorer(device, max_depth=max_depth, max_pages=max_pages, max_seconds=0, max_tokens=0,
+                        frontier=make_frontier(frontier), app_package=device.package)
+
+    analyzer_calls = {"count": 0}
+    original_analyze = privacy_analyzer.analyze_privacy_switches
+    original_analyze_digest = privacy_analyzer.analyze_privacy_digest
+    original_recommend = privacy_analyzer.recommend_switch_states
+    server = None
+    if analyzer == "stub":
+        server = SimulatedAnalyzerServer(device, latency=model_latency).start()
+        set_base_rewriter(lambda provider, base_url: server.url)
+        os.environ.setdefault("QWEN_API_KEY", "simulated")
+    else:
+        def analyze(**kwargs):
+            analyzer_calls["count"] += 1
+            if model_latency:
+                time.sleep(model_latency)
+            return analysis_for_page(pages[device.current_page], structure_only=kwargs.get("structure_only", False))
+
+        def recommend(labels, *args, **kwargs):
+            analyzer_calls["count"] += 1
+            return {label: simulated_recommendation(label) for label in labels}
+        privacy_analyzer.analyze_privacy_switches = analyze
+        privacy_analyzer.analyze_privacy_digest = analyze
+        privacy_analyzer.recommend_switch_states = recommend
+
+    previous_trace = tracer.enabled
+    previous_extraction = screenshot_inspector.HIERARCHY_EXTRACTION
+    previous_mode = screenshot_inspector.ANALYSIS_MODE
+    previous_kb = screenshot_inspector.SWITCH_KB
+    previous_progressive = screenshot_inspector.PROGRESSIVE_ANALYSIS
+    screenshot_inspector.SWITCH_KB = switch_kb
+    screenshot_inspector.PROGRESSIVE_ANALYSIS = progressive
+    screenshot_inspector.HIERARCHY_EXTRACTION = hierarchy_extraction
+    screenshot_inspector.ANALYSIS_MODE = analysis_mode
+    screenshot_inspector.reset_analysis_mode_stats()
+    popup_detector.reset()
+    scroller.reset()
+    previous_scroll = scroller.enabled
+    scroller.enabled = scroll_control
+    guard.reset()
+    previous_guard = guard.enabled
+    guard.enabled = app_guard
+    meter.reset()
+    tracer.enabled = trace
+    set_sleep_scale(sleep_scale)
+    tracemalloc.start()
+    started = time.time()
+    try:
+        success = explorer.run()
+    finally:
+        elapsed = time.time() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        mode_stats = screenshot_inspector.analysis_mode_stats()
+        progressive_stats = screenshot_inspector.progressive_stats()
+        scroll_stats = scroller.stats()
+        app_guard_stats = guard.stats()
+        completion_tokens = meter.summary()["totals"]["completion_tokens"]
+        set_sleep_scale(1.0)
+        tracer.enabled = previous_trace
+        scroller.enabled = previous_scroll
+        guard.enabled = previous_guard
+        screenshot_inspector.HIERARCHY_EXTRACTION = previous_extraction
+        screenshot_inspector.ANALYSIS_MODE = previous_mode
+        screenshot_inspector.SWITCH_KB = previous_kb
+        screenshot_inspector.PROGRESSIVE_ANALYSIS = previous_progressive
+        privacy_analyzer.recommend_switch_states = original_recommend
+        privacy_analyzer.analyze_privacy_switches = original_analyze
+        privacy_analyzer.analyze_privacy_digest = original_analyze_digest
+        if server is not None:
+            set_base_rewriter(None)
+            server.stop()
+
+    found = {path[-1]["text"] for path in explorer.privacy_switches + explorer.personality_switches}
+    stats = tree_stats(pages)
+    return {
+        "params": {"depth": depth, "branching": branching, "switch_density": switch_density,
+                   "shared_ratio": shared_ratio, "popup_ratio": popup_ratio,
+                   "long_page_ratio": long_page_ratio, "topic_skew": topic_skew, "seed": seed,
+                   "analyzer": analyzer, "frontier": frontier, "hierarchy_extraction": hierarchy_extraction,
+                   "analysis_mode": analysis_mode, "switch_kb": switch_kb, "progressive": progressive,
+                   "scroll_control": scroll_control, "back_glitch": back_glitch,
+                   "external_ratio": external_ratio, "app_guard": app_guard},
+        "tree": stats,
+        "success": success,
+        "wall_time": round(elapsed, 3),
+        "peak_memory_mb": round(peak / 1024 / 1024, 2),
+        "analyzer_calls": server.request_count if server else analyzer_calls["count"],
+        "device_calls": dict(device.calls),
+        "pages_visited": len(device.visited),
+        "switch_paths": len(explorer.privacy_switches),
+        "distinct_switches_found": len(found),
+        "switch_coverage": round(len(found) / stats["switches"], 3) if stats["switches"] else 1.0,
+        "exploration": explorer.report(),
+        "analysis_mode": mode_stats,
+        "progressive": progressive_stats,
+        "popup": popup_detector.stats(),
+        "scroll": scroll_stats,
+        "app_guard": app_guard_stats,
+        "completion_tokens": completion_tokens,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="在合成的设置页面树上运行探索，测量随树规模增长的耗时/内存/调用次数")
+    parser.add_argument("--depth", type=int, nargs="+", default=[2, 3, 4])
+    parser.add_argument("--branching", type=int, nargs="+", default=[3])
+    parser.add_argument("--switch-density", type=float, default=0.5)
+    parser.add_argument("--shared", type=float, default=0.0, help="子页面被多条路径共享的概率")
+    parser.add_argument("--popups", type=float, default=0.0, help="页面以弹窗形式出现的概率")
+    parser.add_argument("--long-pages", type=float, default=0.0, help="需要多屏滚动的长页面比例")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--analyzer", choices=["direct", "stub"], default="direct")
+    parser.add_argument("--model-latency", type=float, default=0.0)
+    parser.add_argument("--sleep-scale", type=float, default=0.0, help="爬虫固定等待的倍率，0 表示不等待")
+    parser.add_argument("--topic-skew", type=float, default=0.0, help="隐私类主题页面与其他页面的开关密度差异")
+    parser.add_argument("--frontier", choices=["priority", "stack"], nargs="+", default=["priority"])
+    parser.add_argument("--no-hierarchy-extraction", action="store_true", help="不在本地由层级提取，所有页面都调用模型")
+    parser.add_argument("--analysis-mode", choices=["image", "text"], default="image",
+                        help="text 时先把界面层级摘要发给文字模型")
+    parser.add_argument("--no-switch-kb", action="store_true", help="模型完整输出推荐状态与理由，不用开关知识库补全")
+    parser.add_argument("--progressive", action="store_true", help="先分析缩小的截图，未通过层级校验再用原图")
+    parser.add_argument("--no-scroll-control", action="store_true", help="沿用固定比例滑动与固定次数回到顶部")
+    parser.add_argument("--back-glitch", type=float, default=0.0, help="按返回键时一次退回两级的概率")
+    parser.add_argument("--external", type=float, default=0.0, help="页面带离开应用的列表项（浏览器、应用商店、权限对话框）的概率")
+    parser.add_argument("--no-app-guard", action="store_true", help="点击后不检查前台应用")
+    parser.add_argument("--max-depth", type=int, default=0, help="探索的最大深度，0 表示不限制")
+    parser.add_argument("--max-pages", type=int, default=0, help="最多探索的页面数，0 表示不限制")
+    parser.add_argument("--output", help="把每组结果写入该 JSON 文件")
+    args = parser.parse_args()
+
+    results = []
+    for depth in args.depth:
+        for branching in args.branching:
+            for frontier in args.frontier:
+                result = run_simulation(depth, branching, args.switch_density, args.shared, args.popups,
+                                        args.long_pages, args.seed, args.analyzer, args.model_latency,
+                                        args.sleep_scale, max_depth=args.max_depth, max_pages=args.max_pages,
+                                        topic_skew=args.topic_skew, frontier=frontier,
+                                        hierarchy_extraction=not args.no_hierarchy_extraction,
+                                        analysis_mode=args.analysis_mode, switch_kb=not args.no_switch_kb,
+                                        progressive=args.progressive,
+                                        scroll_control=not args.no_scroll_control,
+                                        back_glitch=args.back_glitch, external_ratio=args.external,
+                                        app_guard=not args.no_app_guard)
+                results.append(result)
+                exploration = result["exploration"]
+                logger.info(f"depth={depth} branching={branching} frontier={frontier} 页面={result['tree']['pages']} "
+                            f"耗时={result['wall_time']}s 内存峰值={result['peak_memory_mb']}MB "
+                            f"分析调用={result['analyzer_calls']} 开关覆盖率={result['switch_coverage']} "
+                            f"首个开关前页面数={exploration['pages_to_first_switch']} "
+                            f"开关/分钟={exploration['switches_per_minute']} 本地分析页面={exploration['pages_local']}"
+                            f"（{exploration['pages_local_fraction']:.0%}） "
+                            f"文字摘要分析页面={result['analysis_mode']['text_pages']} "
+                            f"输出token={result['completion_tokens']}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+import json
+import logging
+import os
+import time
+from typing import Dict, List, Optional
+
+import uiautomator2 as u2
+from dotenv import load_dotenv
+
+from tracing import traced_sleep
+
+# 加载环境变量
+load_dotenv()
+
+JOURNAL_DIR = os.getenv("JOURNAL_DIR", "journals")
+
+logger = logging.getLogger(__name__)
+
+
+def page_record_key(path: List[str]) -> str:
+    """page 记录的唯一标识：从设置首页到该页面的路径，与进入该页面的 frontier 项的 item_key 相同"""
+    return json.dumps(path, ensure_ascii=False)
+
+
+def item_key(item: Dict) -> str:
+    """frontier 项的唯一标识：所在页面路径加列表项文字"""
+    return page_record_key(item["path"] + [item["text"]])
+
+
+class CrawlJournal:
+    """
+    只追加的爬取日志（JSONL），每条记录写入后立即 fsync，进程崩溃或设备断开时已完成的部分不会丢失
+    记录类型：
+    - start：应用包名与导航到设置页的前缀路径
+    - page：已分析页面的路径、分析结果与加入 frontier 的子项
+    - item_done：frontier 项处理完毕（visited / unreachable / failed / left_app）
+    - resume：从该日志恢复
+    - finish：探索结束时的概况
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+
+    @classmethod
+    def create(cls, app_package: str, journal_dir: str = JOURNAL_DIR) -> "CrawlJournal":
+        timestamp = time.strftime("%Y%m%d_%H%M%S")
+        return cls(os.path.join(journal_dir, f"{app_package.replace('.', '_')}_{timestamp}.jsonl"))
+
+    def _write(self, record: Dict):
+        record["ts"] = time.time()
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def start(self, app_package: str, prefix: List[Dict]):
+        self._write({"type": "start", "app_package": app_package, "prefix": prefix})
+
+    def page(self, path: List[str], result: Dict, children: List[Dict]):
+        self._write({"type": "page", "path": path, "result": result, "children": children})
+
+    def item_done(self, item: Dict, status: str):
+        self._write({"type": "item_done", "key": item_key(item), "status": status})
+
+    def resume(self):
+        self._write({"type": "resume"})
+
+    def finish(self, report: Dict):
+        self._write({"type": "finish", "report": report})
+
+    def close(self):
+        self._file.close()
+
+
+def load_journal(path: str) -> Dict:
+    """
+    读取日志，返回 app_package、prefix、按顺序的 page 记录、已处理完的 frontier 项与是否已结束
+    崩溃时最后一行可能只写了一半，解析失败的行直接跳过
+    """
+    state = {"path": path, "app_package": None, "prefix": [], "pages": [], "done": set(), "finished": False}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                logger.warning(f"跳过日志中不完整的记录: {line[:80]!r}")
+                continue
+            if record["type"] == "start":
+                state["app_package"] = record["app_package"]
+                state["prefix"] = record["prefix"]
+            elif record["type"] == "page":
+                state["pages"].append(record)
+            elif record["type"] == "item_done":
+                state["done"].add(record["key"])
+            elif record["type"] == "finish":
+                state["finished"] = True
+            elif record["type"] == "resume":
+                state["finished"] = False
+    return state
+
+
+def latest_journal(app_package: str, journal_dir: str = JOURNAL_DIR) -> Optional[str]:
+    """该应用最近一份日志的路径"""
+    if not os.path.isdir(journal_dir):
+        return None
+    prefix = app_package.replace(".", "_") + "_"
+    names = sorted(name for name in os.listdir(journal_dir)
+                   if name.startswith(prefix) and name.endswith(".jsonl"))
+    return os.path.join(journal_dir, names[-1]) if names else None
+
+
+def replay_prefix(device: u2.Device, app_package: str, prefix: List[Dict], wait: float = 2.0):
+    """重启应用，按记录的归一化坐标依次点击前缀路径（我的 -> 设置），回到设置首页而不再调用检测模型"""
+    device.app_start(app_package, stop=True)
+    traced_sleep(5)
+    w, h = device.window_size()
+    for node in prefix:
+        x1, y1, x2, y2 = [float(v) for v in node["bounds"].replace("][", ",").strip("[]").split(",")]
+        logger.info(f"重放前缀路径: {node['text']}")
+        device.click(int((x1 + x2) / 2 * w), int((y1 + y2) / 2 * h))
+        traced_sleep(wait)
@@ -0,0 +1,622 @@
+import argparse
+import copy
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import xml.etree.ElementTree as ET
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+import requests
+from PIL import Image
+from dotenv import load_dotenv
+
+from llm_request import set_base_rewriter
+from stub_llm_server import StubLLMServer
+
+# 加载环境变量
+load_dotenv()
+
+RECORDINGS_DIR = os.getenv("RECORDINGS_DIR", "recordings")
+
+# 会改变界面状态的设备操作；其余操作（截图、层级、窗口大小等）只是观察
+ACTION_OPS = ("click", "swipe", "press", "app_start")
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def request_key(request: Dict) -> str:
+    """请求指纹：模型 + 消息内容，图片数据以哈希代替，避免指纹受 base64 长度影响"""
+    def strip(value):
+        if isinstance(value, dict):
+            return {k: strip(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [strip(v) for v in value]
+        if isinstance(value, str) and value.startswith("data:image"):
+            return hashlib.sha1(value.encode("utf-8")).hexdigest()
+        return value
+
+    basis = {"model": request.get("model"), "messages": strip(request.get("messages", []))}
+    return hashlib.sha1(json.dumps(basis, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class CrawlRecording:
+    """
+    一次录制的目录结构：
+      device_ops.jsonl   每个设备操作一行（操作类型、参数、结果或结果文件、耗时）
+      llm_calls.jsonl    每次模型请求一行（请求指纹、模型、状态码、回答内容、usage、延迟、首token时间）
+      frames/ hierarchy/ 截图与界面层级
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._seq = 0
+
+    def open_for_write(self) -> "CrawlRecording":
+        os.makedirs(os.path.join(self.path, "frames"), exist_ok=True)
+        os.makedirs(os.path.join(self.path, "hierarchy"), exist_ok=True)
+        return self
+
+    def next_seq(self) -> int:
+        with self._lock:
+            self._seq += 1
+            return self._seq
+
+    def _append(self, filename: str, entry: Dict):
+        with self._lock:
+            with open(os.path.join(self.path, filename), "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def add_device_op(self, entry: Dict):
+        self._append("device_ops.jsonl", entry)
+
+    def add_llm_call(self, entry: Dict):
+        self._append("llm_calls.jsonl", entry)
+
+    def _load(self, filename: str) -> List[Dict]:
+        path = os.path.join(self.path, filename)
+        if not os.path.exists(path):
+            return []
+        with open(path, "r", encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def device_ops(self) -> List[Dict]:
+        return self._load("device_ops.jsonl")
+
+    def llm_calls(self) -> List[Dict]:
+        return self._load("llm_calls.jsonl")
+
+    def file(self, relative: str) -> str:
+        return os.path.join(self.path, relative)
+
+
+# ---------------------------------------------------------------------------
+# 录制
+# ---------------------------------------------------------------------------
+
+class RecordingSelector:
+    """包装 device(text=...) 返回的选择器，记录 exists / info 的结果"""
+
+    def __init__(self, owner: "RecordingDevice", selector, kwargs: Dict):
+        self._owner = owner
+        self._selector = selector
+        self._kwargs = kwargs
+
+    @property
+    def exists(self) -> bool:
+        return self._owner._observe("selector.exists", lambda: bool(self._selector.exists), kwargs=self._kwargs)
+
+    @property
+    def info(self) -> Dict:
+        return self._owner._observe("selector.info", lambda: self._selector.info, kwargs=self._kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._selector, name)
+
+
+class RecordingDevice:
+    """透明包装真实的 u2.Device，把每次截图、层级、点击、滑动、按键及其耗时写入录制目录"""
+
+    def __init__(self, device, recording: CrawlRecording):
+        self._device = device
+        self._recording = recording
+
+    def _log(self, op: str, started: float, **fields):
+        entry = {"seq": self._recording.next_seq(), "op": op,
+                 "duration": round(time.time() - started, 4), **fields}
+        self._recording.add_device_op(entry)
+
+    def _observe(self, op: str, fetch, **fields):
+        started = time.time()
+        result = fetch()
+        self._log(op, started, result=result, **fields)
+        return result
+
+    def _act(self, op: str, func, *args, **kwargs):
+        started = time.time()
+        result = func(*args, **kwargs)
+        self._log(op, started, args=list(args), kwargs=kwargs)
+        return result
+
+    def screenshot(self, filename: Optional[str] = None, format: str = "pillow"):
+        started = time.time()
+        image = self._device.screenshot(format="pillow")
+        seq = self._recording.next_seq()
+        frame = os.path.join("frames", f"{seq:06d}.png")
+        image.save(self._recording.file(frame))
+        self._recording.add_device_op({"seq": seq, "op": "screenshot", "frame": frame,
+                                       "duration": round(time.time() - started, 4)})
+        if filename:
+            image.save(filename)
+            return filename
+        return image
+
+    def dump_hierarchy(self, *args, **kwargs) -> str:
+        started = time.time()
+        xml = self._device.dump_hierarchy(*args, **kwargs)
+        seq = self._recording.next_seq()
+        file = os.path.join("hierarchy", f"{seq:06d}.xml")
+        with open(self._recording.file(file), "w", encoding="utf-8") as f:
+            f.write(xml)
+        self._recording.add_device_op({"seq": seq, "op": "dump_hierarchy", "file": file,
+                                       "duration": round(time.time() - started, 4)})
+        return xml
+
+    def window_size(self):
+        return tuple(self._observe("window_size", lambda: list(self._device.window_size())))
+
+    def app_current(self) -> Dict:
+        return self._observe("app_current", self._device.app_current)
+
+    @property
+    def info(self) -> Dict:
+        return self._observe("info", lambda: self._device.info)
+
+    def click(self, *args, **kwargs):
+        return self._act("click", self._device.click, *args, **kwargs)
+
+    def swipe(self, *args, **kwargs):
+        return self._act("swipe", self._device.swipe, *args, **kwargs)
+
+    def press(self, *args, **kwargs):
+        return self._act("press", self._device.press, *args, **kwargs)
+
+    def app_start(self, *args, **kwargs):
+        return self._act("app_start", self._device.app_start, *args, **kwargs)
+
+    def __call__(self, **kwargs):
+        return RecordingSelector(self, self._device(**kwargs), kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._device, name)
+
+
+class RecordingProxy:
+    """
+    本地录制代理：执行层把服务地址改写为 <代理>/<上游别名>，代理原样转发到真实服务（流式逐行转发，保留首token时间），
+    同时把回答内容、usage、状态码与延迟写入录制目录
+    """
+
+    def __init__(self, recording: CrawlRecording, host: str = "127.0.0.1", port: int = 0):
+        self.recording = recording
+        self.upstreams: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def rewrite(self, provider: str, base_url: str) -> str:
+        with self._lock:
+            for alias, upstream in self.upstreams.items():
+                if upstream == base_url:
+                    return f"{self.url}/{alias}"
+            alias = f"{provider}{len(self.upstreams)}"
+            self.upstreams[alias] = base_url.rstrip("/")
+            return f"{self.url}/{alias}"
+
+    def start(self) -> "RecordingProxy":
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler_class(self):
+        proxy = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                alias, _, rest = self.path.lstrip("/").partition("/")
+                upstream = proxy.upstreams.get(alias)
+                if upstream is None:
+                    self.send_error(404)
+                    return
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                try:
+                    request = json.loads(body or b"{}")
+                except json.JSONDecodeError:
+                    request = {}
+                headers = {k: v for k, v in self.headers.items()
+                           if k.lower() in ("authorization", "content-type", "accept")}
+                entry = {"seq": proxy.recording.next_seq(), "key": request_key(request),
+                         "alias": alias, "model": request.get("model"), "stream": bool(request.get("stream")),
+                         "content": "", "reasoning": "", "usage": None, "ttft": None}
+                started = time.time()
+                try:
+                    with requests.post(f"{upstream}/{rest}", data=body, headers=headers,
+                                       stream=True, timeout=600) as response:
+                        entry["status"] = response.status_code
+                        self.send_response(response.status_code)
+                        self.send_header("Content-Type", response.headers.get("Content-Type", "application/json"))
+                        if response.headers.get("Retry-After"):
+                            self.send_header("Retry-After", response.headers["Retry-After"])
+                        self.end_headers()
+                        if entry["stream"] and response.status_code == 200:
+                            self._relay_stream(response, entry, started)
+                        else:
+                            data = response.content
+                            self.wfile.write(data)
+                            self._parse_body(data, entry)
+                except requests.RequestException as e:
+                    entry["status"] = 502
+                    entry["error"] = str(e)
+                    self.send_error(502)
+                entry["latency"] = round(time.time() - started, 4)
+                proxy.recording.add_llm_call(entry)
+
+            def _relay_stream(self, response, entry: Dict, started: float):
+                for line in response.iter_lines():
+                    self.wfile.write(line + b"\n")
+                    self.wfile.flush()
+                    if not line.startswith(b"data:"):
+                        continue
+                    data = line[5:].strip()
+                    if data == b"[DONE]":
+                        continue
+                    try:
+                        chunk = json.loads(data)
+                    except json.JSONDecodeError:
+                        continue
+                    if chunk.get("usage"):
+                        entry["usage"] = chunk["usage"]
+                    for choice in chunk.get("choices") or []:
+                        delta = choice.get("delta") or {}
+                        if entry["ttft"] is None and (delta.get("content") or delta.get("reasoning_content")):
+                            entry["ttft"] = round(time.time() - started, 4)
+                        entry["content"] += delta.get("content") or ""
+                        entry["reasoning"] += delta.get("reasoning_content") or ""
+
+            @staticmethod
+            def _parse_body(data: bytes, entry: Dict):
+                try:
+                    body = json.loads(data)
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    entry["body"] = data.decode("utf-8", "replace")[:2000]
+                    return
+                entry["usage"] = body.get("usage")
+                choices = body.get("choices") or []
+                if choices:
+                    entry["content"] = (choices[0].get("message") or {}).get("content") or ""
+
+        return Handler
+
+
+# ---------------------------------------------------------------------------
+# 回放
+# ---------------------------------------------------------------------------
+
+def _parse_bounds(bounds: str) -> Optional[Dict]:
+    match = re.match(r"\[(-?\d+),(-?\d+)\]\[(-?\d+),(-?\d+)\]", bounds or "")
+    if not match:
+        return None
+    left, top, right, bottom = map(int, match.groups())
+    return {"left": left, "top": top, "right": right, "bottom": bottom}
+
+
+class ReplaySelector:
+    """回放时的选择器：优先用录制到的结果，没有录到时在当前界面层级中按 text / description 查找"""
+
+    def __init__(self, device: "ReplayDevice", kwargs: Dict):
+        self._device = device
+        self._kwargs = kwargs
+
+    def _find_in_hierarchy(self) -> Optional[Dict]:
+        xml = self._device.current_hierarchy()
+        if not xml:
+            return None
+        try:
+            root = ET.fromstring(xml)
+        except ET.ParseError:
+            return None
+        attr_map = {"text": "text", "description": "content-desc", "resourceId": "resource-id"}
+        for node in root.iter("node"):
+            if all(node.attrib.get(attr_map.get(k, k)) == v for k, v in self._kwargs.items()):
+                bounds = _parse_bounds(node.attrib.get("bounds"))
+                if bounds:
+                    return {"bounds": bounds, "text": node.attrib.get("text", ""),
+                            "contentDescription": node.attrib.get("content-desc", "")}
+        return None
+
+    @property
+    def exists(self) -> bool:
+        recorded = self._device.observe("selector.exists", self._kwargs)
+        if recorded is not None:
+            return recorded["result"]
+        return self._find_in_hierarchy() is not None
+
+    @property
+    def info(self) -> Dict:
+        recorded = self._device.observe("selector.info", self._kwargs)
+        if recorded is not None:
+            return recorded["result"]
+        return self._find_in_hierarchy() or {}
+
+
+class ReplayDevice:
+    """
+    回放设备：把录制的操作序列切分为"界面状态"——两次动作（点击/滑动/按键）之间的所有观察属于同一状态
+    观察操作返回当前状态下录到的结果（同类观察按调用次数依次返回），动作操作推进到下一个状态
+    爬虫增减了截图/层级等观察调用时仍能正确回放；动作序列与录制不一致时记警告并照常推进
+    speed 为设备耗时的回放倍率，0 表示不等待
+    """
+
+    def __init__(self, recording: CrawlRecording, speed: float = 1.0):
+        self.recording = recording
+        self.speed = speed
+        self.settings: Dict = {}
+        self.states: List[List[Dict]] = [[]]
+        self.actions: List[Dict] = []
+        for op in recording.device_ops():
+            if op["op"] in ACTION_OPS:
+                self.actions.append(op)
+                self.states.append([])
+            else:
+                self.states[-1].append(op)
+        self.state = 0
+        self._asked: Dict[Tuple, int] = {}
+        self.mismatches = 0
+
+    def _wait(self, entry: Optional[Dict]):
+        if entry and self.speed > 0:
+            time.sleep(entry.get("duration", 0.0) * self.speed)
+
+    def observe(self, op: str, kwargs: Optional[Dict] = None) -> Optional[Dict]:
+        """返回当前状态下第 n 次同类观察的录制结果；当前状态没有录到时沿用之前状态最近的一次"""
+        def matches(entry):
+            return entry["op"] == op and (kwargs is None or entry.get("kwargs") == kwargs)
+
+        key = (self.state, op, json.dumps(kwargs, sort_keys=True, ensure_ascii=False))
+        candidates = [e for e in self.states[self.state] if matches(e)]
+        if candidates:
+            index = min(self._asked.get(key, 0), len(candidates) - 1)
+            self._asked[key] = self._asked.get(key, 0) + 1
+            entry = candidates[index]
+        else:
+            entry = None
+            for state in range(self.state - 1, -1, -1):
+                previous = [e for e in self.states[state] if matches(e)]
+                if previous:
+                    entry = previous[-1]
+                    break
+        self._wait(entry)
+        return entry
+
+    def _act(self, op: str, args, kwargs):
+        expected = self.actions[self.state] if self.state < len(self.actions) else None
+        if expected is None:
+            logger.warning(f"回放动作超出录制范围: {op}{tuple(args)}")
+            self.mismatches += 1
+            return
+        if expected["op"] != op or expected.get("args") != list(args):
+            logger.warning(f"回放动作与录制不一致: 录制 {expected['op']}{tuple(expected.get('args', []))}，"
+                           f"实际 {op}{tuple(args)}")
+            self.mismatches += 1
+        self._wait(expected)
+        self.state += 1
+
+    def current_hierarchy(self) -> Optional[str]:
+        for state in range(self.state, -1, -1):
+            dumps = [e for e in self.states[state] if e["op"] == "dump_hierarchy"]
+            if dumps:
+                with open(self.recording.file(dumps[-1]["file"]), "r", encoding="utf-8") as f:
+                    return f.read()
+        return None
+
+    def screenshot(self, filename: Optional[str] = None, format: str = "pillow"):
+        entry = self.observe("screenshot")
+        if entry is None:
+            raise RuntimeError("录制中没有可回放的截图")
+        image = Image.open(self.recording.file(entry["frame"]))
+        image.load()
+        if filename:
+            image.save(filename)
+            return filename
+        return image
+
+    def dump_hierarchy(self, *args, **kwargs) -> str:
+        entry = self.observe("dump_hierarchy")
+        if entry is None:
+            return ""
+        with open(self.recording.file(entry["file"]), "r", encoding="utf-8") as f:
+            return f.read()
+
+    def window_size(self):
+        entry = self.observe("window_size")
+        return tuple(entry["result"]) if entry else (1080, 2400)
+
+    def app_current(self) -> Dict:
+        entry = self.observe("app_current")
+        return copy.deepcopy(entry["result"]) if entry else {}
+
+    @property
+    def info(self) -> Dict:
+        entry = self.observe("info")
+        return copy.deepcopy(entry["result"]) if entry else {}
+
+    def click(self, *args, **kwargs):
+        self._act("click", args, kwargs)
+
+    def swipe(self, *args, **kwargs):
+        self._act("swipe", args, kwargs)
+
+    def press(self, *args, **kwargs):
+        self._act("press", args, kwargs)
+
+    def app_start(self, *args, **kwargs):
+        self._act("app_start", args, kwargs)
+
+    def __call__(self, **kwargs):
+        return ReplaySelector(self, kwargs)
+
+
+class ReplayLLMServer(StubLLMServer):
+    """
+    按录制回应的替身服务：先按请求指纹精确匹配尚未使用的录制，匹配不到时按同模型的录制顺序依次返回
+    回应的延迟、状态码与 usage 都取自录制，speed 为延迟倍率
+    """
+
+    def __init__(self, recording: CrawlRecording, speed: float = 1.0, **kwargs):
+        super().__init__(**kwargs)
+        self.calls = recording.llm_calls()
+        self.speed = speed
+        self._used = set()
+        self.exact_hits = 0
+        self.fallback_hits = 0
+
+    def _pick(self, request: Dict) -> Optional[Dict]:
+        key = request_key(request)
+        model = request.get("model")
+        with self._lock:
+            for i, call in enumerate(self.calls):
+                if i not in self._used and call["key"] == key:
+                    self._used.add(i)
+                    self.exact_hits += 1
+                    return call
+            same_model = [i for i, call in enumerate(self.calls) if call.get("model") == model]
+            for i in same_model:
+                if i not in self._used:
+                    self._used.add(i)
+                    self.fallback_hits += 1
+                    return self.calls[i]
+            if same_model:
+                self.fallback_hits += 1
+                return self.calls[same_model[-1]]
+        return None
+
+    def reply(self, request: Dict) -> Dict:
+        call = self._pick(request)
+        if call is None:
+            logger.warning(f"录制中没有模型 {request.get('model')} 的回应")
+            return {"content": "{}", "delay": 0.0, "status": 200, "usage": None}
+        return {
+            "content": call.get("content", ""),
+            "delay": call.get("latency", 0.0) * self.speed,
+            "status": call.get("status", 200),
+            "usage": call.get("usage"),
+        }
+
+
+# ---------------------------------------------------------------------------
+# 入口
+# ---------------------------------------------------------------------------
+
+def record_crawl(output_dir: Optional[str] = None) -> str:
+    """连接真实设备与模型服务跑一次完整爬取，同时录制设备操作与模型回应"""
+    import uiautomator2 as u2
+    import privacy_detection_main as crawler
+    from tracing import tracer
+
+    device = u2.connect(os.getenv("DEVICE_SERIAL"))
+    device.settings["wait_timeout"] = 20.0
+    app_package = device.app_current()["package"]
+    if output_dir is None:
+        output_dir = os.path.join(RECORDINGS_DIR, f"{app_package.replace('.', '_')}_{time.strftime('%Y%m%d_%H%M%S')}")
+
+    recording = CrawlRecording(output_dir).open_for_write()
+    proxy = RecordingProxy(recording).start()
+    set_base_rewriter(proxy.rewrite)
+    try:
+        recorded_device = RecordingDevice(device, recording)
+        recorded_device.app_current()
+        success = crawler.run_crawl(recorded_device, app_package, os.getenv("GEMINI_API_KEY"))
+    finally:
+        set_base_rewriter(None)
+        proxy.stop()
+
+    with open(recording.file("meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"app_package": app_package, "success": success,
+                   "recorded_at": time.strftime("%Y-%m-%d %H:%M:%S")}, f, ensure_ascii=False, indent=2)
+    tracer.export(f"record_{app_package.replace('.', '_')}")
+    logger.info(f"录制完成: {output_dir}")
+    return output_dir
+
+
+def replay_crawl(recording_dir: str, speed: float = 1.0) -> Dict:
+    """在没有手机和真实模型服务的情况下回放一次录制，返回耗时、结果数量与匹配情况"""
+    import privacy_detection_main as crawler
+    from tracing import tracer
+
+    recording = CrawlRecording(recording_dir)
+    with open(recording.file("meta.json"), "r", encoding="utf-8") as f:
+        meta = json.load(f)
+
+    device = ReplayDevice(recording, speed=speed)
+    server = ReplayLLMServer(recording, speed=speed).start()
+    set_base_rewriter(lambda provider, base_url: server.url)
+    crawler.crawl_trie.clear()
+    started = time.time()
+    try:
+        success = crawler.run_crawl(device, meta["app_package"], "replay")
+    finally:
+        set_base_rewriter(None)
+        server.stop()
+
+    report = {
+        "recording": recording_dir,
+        "success": success,
+        "elapsed": round(time.time() - started, 3),
+        "speed": speed,
+        "privacy_switches": crawler.crawl_trie.count("privacy_switches"),
+        "personality_switches": crawler.crawl_trie.count("personality_switches"),
+        "personality_layouts": crawler.crawl_trie.count("personality_layouts"),
+        "action_mismatches": device.mismatches,
+        "llm_exact_hits": server.exact_hits,
+        "llm_fallback_hits": server.fallback_hits,
+        "trace": tracer.summary(),
+    }
+    logger.info(f"回放完成: {json.dumps(report, ensure_ascii=False)}")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="录制一次真实爬取，或离线回放录制结果做基准测试")
+    sub = parser.add_subparsers(dest="command", required=True)
+    record = sub.add_parser("record", help="连接设备与模型服务，边爬取边录制")
+    record.add_argument("--out", help="录制输出目录（默认 recordings/<包名>_<时间>）")
+    replay = sub.add_parser("replay", help="用录制结果离线回放")
+    replay.add_argument("recording", help="录制目录")
+    replay.add_argument("--speed", type=float, default=1.0, help="设备与模型延迟的回放倍率，0 表示不等待")
+    args = parser.parse_args()
+
+    if args.command == "record":
+        record_crawl(args.out)
+    else:
+        replay_crawl(args.recording, args.speed)
+
+
+if __name__ == "__main__":
+    main()
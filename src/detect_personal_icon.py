@@ -3,14 +3,15 @@ from PIL import Image, ImageDraw
 import io
 import json
 import os
-import time
 import base64
 from typing import List, Dict, Tuple, Optional
 from pydantic import BaseModel
 import logging
 import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+
+from llm_request import Endpoint, check_response, gemini_executor
+from metering import report_payload, report_usage
+from structured_output import DetectionList, gemini_reask, parse_dict
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -40,23 +41,11 @@ class DetectionResult(BaseModel):
 class PersonalIconDetector:
     def __init__(self, api_key: str):
         self.api_key = api_key
-        self.total_prompt_tokens = 0
-        self.total_candidates_tokens = 0
-        self.total_total_tokens = 0
         self.api_url = f"{GEMINI_API_BASE}/v1/chat/completions"
         self.model = "gemini-2.5-pro-exp-03-25"
         # self.model = "gemini-2.5-flash-preview-05-20"
-        # 配置会话和重试策略
+        # 重试与截止时间由 llm_request 执行层统一负责，会话只用于连接复用
         self.session = requests.Session()
-        retry_strategy = Retry(
-            total=MAX_RETRIES,
-            backoff_factor=BACKOFF_FACTOR,
-            status_forcelist=[429, 500, 502, 503, 504],
-            allowed_methods=["POST"]
-        )
-        adapter = HTTPAdapter(max_retries=retry_strategy)
-        self.session.mount("https://", adapter)
-        self.session.mount("http://", adapter)
 
     def detect_personal_icon(self, image_bytes: bytes) -> Optional[Tuple[List[int], str]]:
         """
@@ -109,103 +98,63 @@ class PersonalIconDetector:
                 "response_format": {"type": "json_object"}
             }
 
-            headers = {
-                'Content-Type': 'application/json',
-                'Authorization': f'Bearer {self.api_key}'
-            }
-
-            for attempt in range(MAX_RETRIES):
-                try:
-                    logger.info(f" 尝试 {attempt + 1}: 发送API请求到 {self.api_url}")
-                    response = self.session.post(
-                        self.api_url,
-                        headers=headers,
-                        json=payload,
-                        timeout=TIMEOUT
-                    )
-
-                    response.raise_for_status()
-
-                    try:
-                        response_data = response.json()
-                    except json.JSONDecodeError:
-                        if attempt < MAX_RETRIES - 1:
-                            time.sleep(BACKOFF_FACTOR * (attempt + 1))
-                            continue
-                        return None
-
-                    if "error" in response_data:
-                        if attempt < MAX_RETRIES - 1:
-                            time.sleep(BACKOFF_FACTOR * (attempt + 1))
-                            continue
-                        return None
-
-                    content = None
-                    if "choices" in response_data and len(response_data["choices"]) > 0:
-                        content = response_data["choices"][0].get("message", {}).get("content", "")
-                    elif "message" in response_data:
-                        content = response_data["message"]
-
-                    if not content:
-                        if attempt < MAX_RETRIES - 1:
-                            time.sleep(BACKOFF_FACTOR * (attempt + 1))
-                            continue
-                        return None
-
-                    if content.startswith('```json'):
-                        content = content[7:-3].strip()
-                    elif content.startswith('```'):
-                        content = content[3:-3].strip()
-
-                    try:
-                        parsed_content = json.loads(content)
-                        if isinstance(parsed_content, list):
-                            detections = parsed_content
-                        elif isinstance(parsed_content, dict):
-                            detections = parsed_content.get("detections", [])
-                            if not detections:
-                                detections = parsed_content.get("elements", [])
-                        else:
-                            detections = []
-
-                        personal_elements = [
-                            item for item in detections
-                            if isinstance(item, dict) and
-                               any(keyword in item.get("label", "").lower()
-                                   for keyword in ["personal", "my", "profile", "account", "我的", "个人"])
-                        ]
+            def send(endpoint: Endpoint, timeout: float) -> Optional[str]:
+                logger.info(f" 发送API请求到 {endpoint.chat_url}")
+                body = json.dumps(dict(payload, model=endpoint.model))
+                report_payload(len(body))
+                response = self.session.post(
+                    endpoint.chat_url,
+                    headers=endpoint.headers(),
+                    data=body,
+                    timeout=timeout
+                )
+                check_response(response)
+
+                response_data = response.json()
+                report_usage(response_data.get("usage"))
+                if "error" in response_data:
+                    return None
 
-                        if not personal_elements:
-                            return None
+                content = None
+                if "choices" in response_data and len(response_data["choices"]) > 0:
+                    content = response_data["choices"][0].get("message", {}).get("content", "")
+                elif "message" in response_data:
+                    content = response_data["message"]
 
-                        bbox = personal_elements[0]["box_2d"]
-                        pixel_bbox = [
-                            int(bbox[1] * width / 1000),
-                            int(bbox[0] * height / 1000),
-                            int(bbox[3] * width / 1000),
-                            int(bbox[2] * height / 1000)
-                        ]
-                        logger.info(f"Detected personal icon at {pixel_bbox}")
-                        return pixel_bbox, personal_elements[0]["label"]
-
-                    except json.JSONDecodeError:
-                        if attempt < MAX_RETRIES - 1:
-                            time.sleep(BACKOFF_FACTOR * (attempt + 1))
-                            continue
-                        return None
-
-                except requests.exceptions.RequestException:
-                    if attempt < MAX_RETRIES - 1:
-                        time.sleep(BACKOFF_FACTOR * (attempt + 1))
-                        continue
-                    return None
-                except Exception:
-                    if attempt < MAX_RETRIES - 1:
-                        time.sleep(BACKOFF_FACTOR * (attempt + 1))
-                        continue
+                if not content:
                     return None
 
-            return None
+                return content
+
+            # 空回答与服务端错误由执行层带抖动重试
+            executor = gemini_executor(self.api_key, self.model, GEMINI_API_BASE,
+                                       attempt_timeout=TIMEOUT, max_retries=MAX_RETRIES,
+                                       backoff_base=BACKOFF_FACTOR)
+            content = executor.execute(send)
+            # 回答不合法时先本地修复，仍失败再交给便宜的文字模型整理，不重新发送截图
+            detections = parse_dict(content, DetectionList, reask=gemini_reask(self.api_key, GEMINI_API_BASE))
+            if detections is None:
+                return None
+
+            personal_elements = [
+                item for item in detections
+                if isinstance(item, dict) and
+                   any(keyword in item.get("label", "").lower()
+                       for keyword in ["personal", "my", "profile", "account", "我的", "个人"])
+            ]
+
+            if not personal_elements:
+                return None
+
+            bbox = personal_elements[0]["box_2d"]
+            pixel_bbox = [
+                int(bbox[1] * width / 1000),
+                int(bbox[0] * height / 1000),
+                int(bbox[3] * width / 1000),
+                int(bbox[2] * height / 1000)
+            ]
+            logger.info(f"Detected personal icon at {pixel_bbox}")
+            return pixel_bbox, personal_elements[0]["label"]
 
         except Exception as e:
             logger.error(f"Personal icon detection failed: {str(e)}")
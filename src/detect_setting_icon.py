@@ -4,9 +4,13 @@ import json
 import logging
 import base64
 import requests
-from typing import List, Tuple, Optional
+from typing import Dict, List, Tuple, Optional
 from pydantic import BaseModel
 
+from llm_request import Endpoint, check_response, gemini_executor
+from metering import report_payload
+from structured_output import DetectionList, gemini_reask, parse_dict
+
 from dotenv import load_dotenv
 import os
 
@@ -32,9 +36,6 @@ class DetectionResult(BaseModel):
 class SettingIconDetector:
     def __init__(self, api_key: str):
         self.api_key = api_key
-        self.total_prompt_tokens = 0
-        self.total_candidates_tokens = 0
-        self.total_total_tokens = 0
 
     def detect_setting_icon(self, image_bytes: bytes) -> Optional[Tuple[List[int], str]]:
         prompt = """识别手机应用中的“设置”图标或按钮，要求：
@@ -57,7 +58,7 @@ class SettingIconDetector:
             # 图片编码为 base64
             image_base64 = base64.b64encode(image_bytes).decode('utf-8')
 
-            payload = json.dumps({
+            payload = {
                 "model": GEMINI_MODEL,
                 "stream": False,
                 "messages": [
@@ -74,27 +75,26 @@ class SettingIconDetector:
                 "temperature": 0.9,
                 "max_tokens": GEMINI_MAX_TOKENS,
                 "response_format": {"type": "json_object"}
-            })
-
-            headers = {
-                'Accept': 'application/json',
-                'Content-Type': 'application/json',
-                'Authorization': f'Bearer {self.api_key}'
             }
 
-            response = requests.post(
-                f"{GEMINI_API_BASE}/v1/chat/completions",
-                headers=headers,
-                data=payload
+            def send(endpoint: Endpoint, timeout: float) -> Dict:
+                body = json.dumps(dict(payload, model=endpoint.model))
+                report_payload(len(body))
+                response = requests.post(
+                    endpoint.chat_url,
+                    headers=endpoint.headers(),
+                    data=body,
+                    timeout=timeout
+                )
+                check_response(response)
+                return response.json()
+
+            response_data = gemini_executor(self.api_key, GEMINI_MODEL, GEMINI_API_BASE).execute(
+                send, lambda data: bool(data.get('choices'))
             )
-
-            response_data = response.json()
-            if 'usage' in response_data:
-                usage = response_data['usage']
-                self.total_prompt_tokens += usage.get('prompt_tokens', 0)
-                self.total_candidates_tokens += usage.get('completion_tokens', 0)
-                self.total_total_tokens += usage.get('total_tokens', 0)
-
+            if response_data is None:
+                logger.warning("Gemini request failed after retries or deadline")
+                return None
             if 'choices' not in response_data or not response_data['choices']:
                 logger.warning("No choices in response")
                 return None
@@ -104,38 +104,34 @@ class SettingIconDetector:
                 logger.warning("Empty content in Gemini response")
                 return None
 
-            try:
-                detections = json.loads(content)
-                if not isinstance(detections, list):
-                    logger.warning("Response is not a list")
-                    return None
-
-                setting_icons = [
-                    d for d in detections
-                    if "setting" in d.get("label", "").lower()
-                ]
-
-                if not setting_icons:
-                    logger.info("No setting icon detected")
-                    return None
-
-                image = Image.open(io.BytesIO(image_bytes))
-                width, height = image.size
-                box = setting_icons[0]["box_2d"]
-                pixel_box = [
-                    int(box[1] * width / 1000),
-                    int(box[0] * height / 1000),
-                    int(box[3] * width / 1000),
-                    int(box[2] * height / 1000),
-                ]
-                label = setting_icons[0]["label"]
-                logger.info(f"Detected setting icon at {pixel_box}")
-                return pixel_box, label
-
-            except json.JSONDecodeError as e:
-                logger.error(f"Failed to parse response JSON: {str(e)}")
+            # 回答不合法时先本地修复，仍失败再交给便宜的文字模型整理，不重新发送截图
+            detections = parse_dict(content, DetectionList, reask=gemini_reask(self.api_key, GEMINI_API_BASE))
+            if detections is None:
+                logger.warning("Failed to parse response JSON")
                 return None
 
+            setting_icons = [
+                d for d in detections
+                if "setting" in d.get("label", "").lower()
+            ]
+
+            if not setting_icons:
+                logger.info("No setting icon detected")
+                return None
+
+            image = Image.open(io.BytesIO(image_bytes))
+            width, height = image.size
+            box = setting_icons[0]["box_2d"]
+            pixel_box = [
+                int(box[1] * width / 1000),
+                int(box[0] * height / 1000),
+                int(box[3] * width / 1000),
+                int(box[2] * height / 1000),
+            ]
+            label = setting_icons[0]["label"]
+            logger.info(f"Detected setting icon at {pixel_box}")
+            return pixel_box, label
+
         except Exception as e:
             logger.error(f"API call failed: {str(e)}")
             return None
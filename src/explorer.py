@@ -0,0 +1,556 @@
+import copy
+import logging
+import os
+import time
+from typing import Dict, List, Optional
+
+import uiautomator2 as u2
+from dotenv import load_dotenv
+
+from app_guard import guard as app_guard
+from crawl_journal import item_key, page_record_key, replay_prefix
+from frontier import make_frontier
+from metering import meter, set_scope
+from page_fingerprint import page_labels, screen_matches
+from path_trie import PathTrie, PRIVACY_SWITCHES, PERSONALITY_SWITCHES, PERSONALITY_LAYOUTS
+from popup_detector import POPUP_DETECTION, detector as popup_detector
+from screenshot_inspector import run_inspection
+from scroll_controller import scroller
+from tracing import tracer, traced, traced_sleep
+
+# 加载环境变量
+load_dotenv()
+
+# 探索预算（0 表示不限制）
+EXPLORE_MAX_DEPTH = int(os.getenv("EXPLORE_MAX_DEPTH", 8))
+EXPLORE_MAX_PAGES = int(os.getenv("EXPLORE_MAX_PAGES", 300))
+EXPLORE_MAX_SECONDS = float(os.getenv("EXPLORE_MAX_SECONDS", 0))
+EXPLORE_MAX_TOKENS = int(os.getenv("EXPLORE_MAX_TOKENS", 0))
+# 每次返回后确认所在页面：屏幕上的文字至少有该比例出现在上一级页面中，否则按路径恢复
+EXPLORE_VERIFY_BACK = os.getenv("EXPLORE_VERIFY_BACK", "true").lower() == "true"
+EXPLORE_VERIFY_MIN_OVERLAP = float(os.getenv("EXPLORE_VERIFY_MIN_OVERLAP", 0.6))
+# 确认返回时轮询层级的最长时间与间隔（秒），代替返回后固定等待 1 秒
+EXPLORE_BACK_TIMEOUT = float(os.getenv("EXPLORE_BACK_TIMEOUT", 2.0))
+EXPLORE_BACK_POLL_INTERVAL = float(os.getenv("EXPLORE_BACK_POLL_INTERVAL", 0.2))
+
+logger = logging.getLogger(__name__)
+
+
+@traced("device")
+def find_node_with_scroll(device: u2.Device, text: str, max_swipes: int = 10, swipe_delay: float = 0.5):
+    if scroller.enabled:
+        return scroller.find(device, text)
+    for _ in range(max_swipes):
+        node = device(text=text)
+        if not node.exists:
+            node = device(description=text)
+        if node.exists:
+            return node
+
+        w, h = device.window_size()
+        start_x, start_y = w // 2, int(h * 0.9)
+        end_x,   end_y   = w // 2, int(h * 0.25)
+        device.swipe(start_x, start_y, end_x, end_y, duration=0.3)
+        traced_sleep(swipe_delay)
+    return None
+
+
+@traced("device")
+def safe_click_by_hierarchy(device: u2.Device, cx: int, cy: int,
+                            max_retries: int = 2, wait_time: float = 1.0, hierarchies: list = None) -> bool:
+    """点击并确认界面发生变化；传入 hierarchies 列表时追加点击后的层级"""
+    prev_xml = device.dump_hierarchy()
+    for attempt in range(1, max_retries + 1):
+        device.click(cx, cy)
+        traced_sleep(wait_time)
+        new_xml = device.dump_hierarchy()
+        if new_xml != prev_xml:
+            if hierarchies is not None:
+                hierarchies.append(new_xml)
+            return True
+    return False
+
+
+def press_back(device: u2.Device):
+    with tracer.span("back", "device"):
+        device.press("back")
+
+
+def scroll_to_top(device: u2.Device, swipes: int = 5):
+    if scroller.enabled:
+        scroller.scroll_to_top(device)
+        return
+    w, h = device.window_size()
+    for _ in range(swipes):
+        device.swipe(w // 2, int(h * 0.3), w // 2, int(h * 0.8), 0.5)
+        traced_sleep(0.8)
+
+
+def page_key(curr_path: List[Dict]) -> str:
+    """用路径上各节点的文字标识页面，供计量按页面汇总"""
+    return " > ".join(node.get("text", "") for node in curr_path) or "root"
+
+
+def path_key(path: List[str]) -> str:
+    """设置首页以下的页面路径，作为输出文件 pages 的键（不含导航前缀，不同版本之间可对应）"""
+    return " > ".join(path) or "root"
+
+
+class Explorer:
+    """
+    基于待探索列表（frontier）的设置页面探索器，替代逐页递归的 dfs_explore
+    - 待探索的列表项放在 frontier 中，每项记录从设置首页到其所在页面的路径（列表项文字序列）
+    - 取出顺序由 frontier 决定（默认按预期隐私收益优先，见 frontier.py）
+    - 取出一项后先导航到其所在页面（返回到公共祖先，再沿路径逐级点击），点击进入后分析页面并把子项加入 frontier
+    - 最大深度、最大页面数、时间与 token 预算任一耗尽即停止；anytime 模式下异常也只结束探索，已得到的结果保留
+    - 每次返回后用上一级页面的文字集合确认所在页面；不一致时先在路径上的祖先页面中定位，
+      再尝试返回键，仍无法定位则重启应用并重放导航前缀，之后沿路径重新进入
+    - 每次点击进入后确认仍在目标应用中（见 app_guard.py），离开应用的列表项不截图也不调用模型
+    """
+
+    def __init__(self, device: u2.Device, prefix: Optional[List[Dict]] = None,
+                 max_depth: int = EXPLORE_MAX_DEPTH, max_pages: int = EXPLORE_MAX_PAGES,
+                 max_seconds: float = EXPLORE_MAX_SECONDS, max_tokens: int = EXPLORE_MAX_TOKENS,
+                 explore_personalization: bool = True, anytime: bool = True,
+                 frontier=None, journal=None, baseline_pages: Optional[Dict[str, Dict]] = None,
+                 trie: Optional[PathTrie] = None, app_package: Optional[str] = None):
+        self.device = device
+        self.app_package = app_package
+        self.prefix = list(prefix or [])
+        self.max_depth = max_depth
+        self.max_pages = max_pages
+        self.max_seconds = max_seconds
+        self.max_tokens = max_tokens
+        self.explore_personalization = explore_personalization
+        self.anytime = anytime
+        self.frontier = frontier if frontier is not None else make_frontier()
+        self.journal = journal
+        # 上一次爬取的页面指纹与分析结果（增量模式），以及本次得到的
+        self.baseline_pages = baseline_pages or {}
+        self.pages: Dict[str, Dict] = {}
+        self.pages_reused = 0
+        self.pages_local = 0
+        # 结果记录在路径树上：导航前缀只插入一次，各页面节点按路径缓存
+        self.trie = trie if trie is not None else PathTrie()
+        self._prefix_id = self.trie.add_path(self.prefix)
+        self._page_ids: Dict[tuple, int] = {(): self._prefix_id}
+
+        # 当前所在页面：从设置首页开始逐级进入的列表项，以及每一级是否为弹窗（与本地检测到的弹窗范围）
+        self.current: List[Dict] = []
+        # 弹窗页面的路径 -> 本地检测到的弹窗范围（模型判断为弹窗、本地未检测到时为 None），返回时关闭弹窗
+        self.popup_pages: Dict[tuple, Optional[List[int]]] = {}
+        # 已分析页面的路径 -> 页面文字集合，返回后据此确认所在页面；无法定位当前页面时 lost 为 True
+        self.page_labels: Dict[tuple, frozenset] = {}
+        self.lost = False
+        self.navigation = {"verified": 0, "unverified": 0, "mismatches": 0, "recovered_by_ancestor": 0,
+                           "recovered_by_back": 0, "recovered_by_relaunch": 0, "recovery_failed": 0,
+                           "recovery_seconds": 0.0}
+        self.pages_explored = 0
+        self.max_depth_reached = 0
+        self.skipped_by_depth = 0
+        self.unreachable = 0
+        self.left_app = 0
+        self.stopped_reason: Optional[str] = None
+        # 本次进入过的页面路径、每个开关所在页面的路径；首个开关出现时的耗时与已探索页面数
+        self.visited: List[List[str]] = []
+        self.switch_paths: List[List[str]] = []
+        self.switches_found = 0
+        self.first_switch_seconds: Optional[float] = None
+        self.first_switch_pages: Optional[int] = None
+        self._started = 0.0
+        self._tokens_at_start = 0
+
+    # ---- 导航 ----
+
+    def _go_back(self):
+        """
+        返回上一级；弹窗页按层级选择关闭方式（关闭按钮、点击遮罩、返回键），界面变化即确认关闭，不做固定等待
+        关闭 POPUP_DETECTION 时沿用点击弹窗外区域、界面无变化再按返回键的方式
+        开启 EXPLORE_VERIFY_BACK 且上一级页面分析过时，轮询层级直到确认回到上一级，超时则恢复
+        """
+        page = self.current.pop()
+        scroller.leave()
+        if page["popup"] and POPUP_DETECTION:
+            popup_detector.dismiss(self.device, page.get("popup_bounds"))
+        elif page["popup"]:
+            old_hierarchy = self.device.dump_hierarchy()
+            w, h = self.device.window_size()
+            self.device.click(w / 2, h / 9)
+            traced_sleep(2)
+            if self.device.dump_hierarchy() == old_hierarchy:
+                press_back(self.device)
+        else:
+            press_back(self.device)
+
+        labels = self.page_labels.get(tuple(p["text"] for p in self.current)) if EXPLORE_VERIFY_BACK else None
+        if labels is not None:
+            self._verify_return(labels)
+            return
+        if EXPLORE_VERIFY_BACK:
+            self.navigation["unverified"] += 1
+        if not (page["popup"] and POPUP_DETECTION):
+            traced_sleep(1)
+
+    def _locate(self, hierarchy_xml: str) -> Optional[int]:
+        """当前屏幕是路径上的第几级页面（0 为设置首页），从最深的一级开始比对；都不是返回 None"""
+        for level in range(len(self.current), -1, -1):
+            labels = self.page_labels.get(tuple(page["text"] for page in self.current[:level]))
+            if labels is not None and screen_matches(hierarchy_xml, labels, EXPLORE_VERIFY_MIN_OVERLAP):
+                return level
+        return None
+
+    def _verify_return(self, labels: frozenset):
+        """轮询层级直到屏幕与上一级页面的文字集合一致；超时仍不一致时恢复"""
+        waited = 0.0
+        while True:
+            hierarchy_xml = self.device.dump_hierarchy()
+            if screen_matches(hierarchy_xml, labels, EXPLORE_VERIFY_MIN_OVERLAP):
+                self.navigation["verified"] += 1
+                return
+            if waited >= EXPLORE_BACK_TIMEOUT:
+                break
+            traced_sleep(EXPLORE_BACK_POLL_INTERVAL, "back_poll")
+            waited += EXPLORE_BACK_POLL_INTERVAL
+        self.navigation["mismatches"] += 1
+        logger.warning(f"返回后不在预期页面: {path_key([page['text'] for page in self.current])}")
+        self._recover(hierarchy_xml)
+
+    @traced("navigation")
+    def _recover(self, hierarchy_xml: Optional[str] = None) -> bool:
+        """
+        重新确定所在页面：先在路径上的祖先页面中定位，再逐次按返回键定位，
+        仍无法定位时重启应用并重放导航前缀回到设置首页；之后由 navigate_to 沿路径重新进入
+        """
+        started = time.time()
+        if hierarchy_xml is None:
+            hierarchy_xml = self.device.dump_hierarchy()
+        level, method = self._locate(hierarchy_xml), "recovered_by_ancestor"
+        if level is None:
+            method = "recovered_by_back"
+            for _ in range(len(self.current) + 1):
+                press_back(self.device)
+                traced_sleep(1)
+                level = self._locate(self.device.dump_hierarchy())
+                if level is not None:
+                    break
+        if level is None and self.app_package:
+            method = "recovered_by_relaunch"
+            replay_prefix(self.device, self.app_package, self.prefix)
+            root_labels = self.page_labels.get(())
+            if root_labels is None or screen_matches(self.device.dump_hierarchy(), root_labels,
+                                                     EXPLORE_VERIFY_MIN_OVERLAP):
+                level = 0
+
+        self.navigation["recovery_seconds"] += time.time() - started
+        if level is None:
+            self.navigation["recovery_failed"] += 1
+            self.lost = True
+            logger.error("无法回到设置页面")
+            return False
+        self.navigation[method] += 1
+        logger.info(f"已回到: {path_key([page['text'] for page in self.current[:level]])}")
+        del self.current[level:]
+        scroller.rewind(level)
+        self.lost = False
+        return True
+
+    def _enter(self, text: str) -> bool:
+        """在当前页面找到文字为 text 的列表项并点击进入；向下找不到时回到顶部再找一次"""
+        node = find_node_with_scroll(self.device, text)
+        if not node:
+            scroll_to_top(self.device)
+            node = find_node_with_scroll(self.device, text)
+        if not node:
+            w, h = self.device.window_size()
+            self.device.swipe(w // 2, int(h * 0.8), w // 2, int(h * 0.1), duration=0.3)
+            scroller.forget()
+            traced_sleep(0.5)
+            return False
+
+        info = node.info.get("bounds", {})
+        cx = (info["left"] + info["right"]) // 2
+        cy = (info["top"] + info["bottom"]) // 2
+        hierarchies = []
+        if not safe_click_by_hierarchy(self.device, cx, cy, hierarchies=hierarchies):
+            return False
+        scroller.enter()
+        if not self._guard(hierarchies[0]):
+            return False
+        traced_sleep(1)
+        return True
+
+    def _guard(self, hierarchy_xml: str) -> bool:
+        """
+        点击后确认前台仍为目标应用、没有系统对话框；离开应用时立即返回并返回 False
+        系统对话框关闭后若已进入新页面（打开页面时申请权限）则照常分析，仍停在上一级页面则视为离开
+        """
+        if not app_guard.enabled or not self.app_package:
+            return True
+        incident = app_guard.check(self.device, self.app_package, hierarchy_xml)
+        if incident is None:
+            return True
+        logger.warning(f"点击后离开目标应用（{incident['kind']}: {incident['package']}），立即返回")
+        if not app_guard.recover(self.device, self.app_package, incident):
+            self.left_app += 1
+            self.lost = True
+            return False
+        labels = self.page_labels.get(tuple(page["text"] for page in self.current))
+        if incident["kind"] == "system_dialog" and labels is not None and not screen_matches(
+                self.device.dump_hierarchy(), labels, EXPLORE_VERIFY_MIN_OVERLAP):
+            return True
+        self.left_app += 1
+        scroller.leave()
+        if labels is not None and EXPLORE_VERIFY_BACK:
+            self._verify_return(labels)
+        return False
+
+    @traced("navigation")
+    def navigate_to(self, path: List[str]) -> bool:
+        """
+        从当前页面导航到 path 对应的页面：先返回到公共祖先，再沿 path 逐级点击
+        深度优先顺序下只需要返回；跳到其他分支或恢复时才需要重放路径
+        """
+        if self.lost and not self._recover():
+            return False
+        common = 0
+        while (common < len(self.current) and common < len(path)
+               and self.current[common]["text"] == path[common]):
+            common += 1
+        while len(self.current) > common:
+            self._go_back()
+            if self.lost:
+                return False
+        # 返回时发现位置不对、恢复到更浅的页面后，从该页面开始重放
+        common = min(common, len(self.current))
+        for i in range(common, len(path)):
+            if not self._enter(path[i]):
+                logger.warning(f"无法沿路径重新进入: {' > '.join(path[:i + 1])}")
+                return False
+            key = tuple(path[:i + 1])
+            self.current.append({"text": path[i], "popup": key in self.popup_pages,
+                                 "popup_bounds": self.popup_pages.get(key)})
+        return True
+
+    # ---- 页面处理 ----
+
+    def _node_path(self, path: List[str]) -> List[Dict]:
+        return self.prefix + [{"text": text} for text in path]
+
+    def _page_id(self, path: List[str]) -> int:
+        key = tuple(path)
+        node_id = self._page_ids.get(key)
+        if node_id is None:
+            node_id = self.trie.child(self._page_id(path[:-1]), path[-1])
+            self._page_ids[key] = node_id
+        return node_id
+
+    @property
+    def privacy_switches(self) -> List[List[Dict]]:
+        return list(self.trie.paths(PRIVACY_SWITCHES))
+
+    @property
+    def personality_switches(self) -> List[List[Dict]]:
+        return list(self.trie.paths(PERSONALITY_SWITCHES))
+
+    @property
+    def personality_layouts(self) -> List[List[Dict]]:
+        return list(self.trie.paths(PERSONALITY_LAYOUTS))
+
+    def _inspect(self, path: List[str]) -> Optional[Dict]:
+        set_scope(page=page_key(self._node_path(path)))
+        reuse = (lambda fingerprint: self._reuse(path, fingerprint)) if self.baseline_pages else None
+        hierarchies = []
+        result = run_inspection(self.device, reuse=reuse, hierarchies=hierarchies)
+        if hierarchies:
+            self.page_labels[tuple(path)] = page_labels(hierarchies)
+        traced_sleep(0.5)
+        if result and not result.get("isPopup"):
+            scroll_to_top(self.device)
+        return result
+
+    def _reuse(self, path: List[str], fingerprint: str) -> Optional[Dict]:
+        """页面结构与上一次爬取相同时直接复用其分析结果"""
+        stored = self.baseline_pages.get(path_key(path))
+        if not stored or stored.get("fingerprint") != fingerprint:
+            return None
+        self.pages_reused += 1
+        return copy.deepcopy(stored["result"])
+
+    def _record(self, path: List[str], result: Dict):
+        node_id = self._page_id(path)
+        for kind, switches in ((PRIVACY_SWITCHES, result.get("switches", [])),
+                               (PERSONALITY_SWITCHES, result.get("personalization", {}).get("switches", []))):
+            for sw in switches:
+                entry = {
+                    "text": sw["text"],
+                    "current_state": sw["current_state"],
+                    "recommended_state": sw.get("recommended_state"),
+                    "analysis": sw.get("analysis", "")
+                }
+                if "recommendation_source" in sw:
+                    entry["recommendation_source"] = sw["recommendation_source"]
+                self.trie.add(node_id, kind, entry)
+        personalization = result.get("personalization", {})
+        for playout in personalization.get("layouts", []):
+            self.trie.add(node_id, PERSONALITY_LAYOUTS, {"text": playout["text"]})
+
+    def _children(self, path: List[str], result: Dict) -> List[Dict]:
+        """当前页面可进入的列表项；路径上已出现过的文字视为环，不再进入"""
+        entries = [(layout["text"], "privacy") for layout in result.get("layouts", [])]
+        if self.explore_personalization:
+            entries += [(layout["text"], "personalization")
+                        for layout in result.get("personalization", {}).get("layouts", [])]
+        children = []
+        for text, kind in entries:
+            if not text or text in path:
+                continue
+            children.append({"path": list(path), "text": text, "kind": kind, "depth": len(path) + 1})
+        return children
+
+    def _apply(self, path: List[str], result: Dict) -> List[Dict]:
+        """记录页面的分析结果并更新统计，返回其子项"""
+        self.pages_explored += 1
+        self.visited.append(list(path))
+        self.max_depth_reached = max(self.max_depth_reached, len(path))
+        self._record(path, result)
+        switches = len(result.get("switches", [])) + len(result.get("personalization", {}).get("switches", []))
+        if switches:
+            self.switches_found += switches
+            self.switch_paths.extend([list(path)] * switches)
+            if self.first_switch_seconds is None and self._started:
+                self.first_switch_seconds = time.time() - self._started
+                self.first_switch_pages = self.pages_explored
+        if result.get("isPopup"):
+            self.popup_pages[tuple(path)] = result.get("popup_bounds")
+        if result.get("source") == "hierarchy":
+            self.pages_local += 1
+        if result.get("fingerprint"):
+            self.pages[path_key(path)] = {
+                "fingerprint": result["fingerprint"],
+                "result": {k: v for k, v in result.items() if k != "fingerprint"},
+            }
+        self.frontier.observe(path, switches)
+        return self._children(path, result)
+
+    def _expand(self, path: List[str], result: Dict):
+        children = self._apply(path, result)
+        if self.max_depth and len(path) >= self.max_depth:
+            self.skipped_by_depth += len(children)
+            children = []
+        self.frontier.push_children(children)
+        if self.journal is not None:
+            self.journal.page(path, result, children)
+
+    def restore(self, state: Dict):
+        """
+        从爬取日志恢复：重新记录已分析页面的结果，并把尚未处理完的子项按原顺序放回 frontier
+        恢复后 run() 不再分析首页，直接从 frontier 继续
+        page 记录先于 item_done 写入，崩溃在两者之间时该项没有 item_done：已有 page 记录的项同样视为处理完毕，
+        重复的 page 记录只恢复一次
+        """
+        done = set(state["done"]) | {page_record_key(page["path"]) for page in state["pages"]}
+        restored = set()
+        for page in state["pages"]:
+            key = page_record_key(page["path"])
+            if key in restored:
+                continue
+            restored.add(key)
+            self._apply(page["path"], page["result"])
+            self.frontier.push_children([c for c in page["children"] if item_key(c) not in done])
+        logger.info(f"已从日志恢复 {self.pages_explored} 个页面，剩余 {len(self.frontier)} 个待探索项")
+
+    # ---- 预算 ----
+
+    def _budget_exhausted(self) -> Optional[str]:
+        if self.max_pages and self.pages_explored >= self.max_pages:
+            return "max_pages"
+        if self.max_seconds and time.time() - self._started >= self.max_seconds:
+            return "time_budget"
+        if self.max_tokens and meter.total_tokens() - self._tokens_at_start >= self.max_tokens:
+            return "token_budget"
+        return None
+
+    # ---- 主循环 ----
+
+    @traced("explore")
+    def run(self) -> bool:
+        """从当前所在的设置首页开始探索；首页分析失败返回 False"""
+        self._started = time.time()
+        self._tokens_at_start = meter.total_tokens()
+        try:
+            if not self.pages_explored:
+                root = self._inspect([])
+                if not root:
+                    self.stopped_reason = "root_failed"
+                    return False
+                self._expand([], root)
+
+            while len(self.frontier):
+                reason = self._budget_exhausted()
+                if reason:
+                    self.stopped_reason = reason
+                    logger.info(f"探索预算耗尽（{reason}），剩余 {len(self.frontier)} 个待探索项")
+                    return True
+                self._explore_item(self.frontier.pop([page["text"] for page in self.current]))
+            self.stopped_reason = "completed"
+            return True
+        except Exception as e:
+            if not self.anytime:
+                raise
+            self.stopped_reason = "error"
+            logger.error(f"探索异常终止，保留已得到的结果: {str(e)}")
+            return True
+
+    def _explore_item(self, item: Dict):
+        status = self._visit(item)
+        if status == "unreachable":
+            self.unreachable += 1
+        if self.journal is not None:
+            self.journal.item_done(item, status)
+
+    def _visit(self, item: Dict) -> str:
+        if not self.navigate_to(item["path"]):
+            return "unreachable"
+        left_app = self.left_app
+        if not self._enter(item["text"]):
+            return "left_app" if self.left_app > left_app else "unreachable"
+
+        path = item["path"] + [item["text"]]
+        result = self._inspect(path)
+        self.current.append({"text": item["text"], "popup": bool(result and result.get("isPopup")),
+                             "popup_bounds": result.get("popup_bounds") if result else None})
+        if not result:
+            logger.warning(f"页面分析失败: {' > '.join(path)}")
+            return "failed"
+        self._expand(path, result)
+        return "visited"
+
+    def report(self) -> Dict:
+        """探索概况：停止原因、已探索页面、首个开关的出现时间与开关产出速率、未展开的 frontier（按深度）"""
+        remaining_by_depth: Dict[int, int] = {}
+        for item in self.frontier.items():
+            remaining_by_depth[item["depth"]] = remaining_by_depth.get(item["depth"], 0) + 1
+        elapsed = time.time() - self._started if self._started else 0.0
+        return {
+            "stopped_reason": self.stopped_reason,
+            "frontier": type(self.frontier).__name__,
+            "elapsed": round(elapsed, 3),
+            "pages_explored": self.pages_explored,
+            "pages_reused": self.pages_reused,
+            "pages_local": self.pages_local,
+            "pages_local_fraction": round(self.pages_local / self.pages_explored, 3) if self.pages_explored else 0.0,
+            "switches_found": self.switches_found,
+            "time_to_first_switch": (round(self.first_switch_seconds, 3)
+                                     if self.first_switch_seconds is not None else None),
+            "pages_to_first_switch": self.first_switch_pages,
+            "switches_per_minute": round(self.switches_found / elapsed * 60, 2) if elapsed else 0.0,
+            "max_depth_reached": self.max_depth_reached,
+            "frontier_remaining": len(self.frontier),
+            "frontier_remaining_by_depth": dict(sorted(remaining_by_depth.items())),
+            "skipped_by_depth": self.skipped_by_depth,
+            "unreachable": self.unreachable,
+            "left_app": self.left_app,
+            "navigation": dict(self.navigation, recovery_seconds=round(self.navigation["recovery_seconds"], 3)),
+            "budget": {"max_depth": self.max_depth, "max_pages": self.max_pages,
+                       "max_seconds": self.max_seconds, "max_tokens": self.max_tokens},
+        }
@@ -0,0 +1,169 @@
+import json
+import logging
+import math
+import os
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+
+# 加载环境变量
+load_dotenv()
+
+# 探索顺序：priority 按预期隐私收益优先展开，stack 按模型列出的顺序深度优先
+FRONTIER_STRATEGY = os.getenv("FRONTIER_STRATEGY", "priority")
+YIELD_HISTORY_DIR = os.getenv("YIELD_HISTORY_DIR", "yield_history")
+
+logger = logging.getLogger(__name__)
+
+# 列表项文字的关键词先验（参考 baseline2.KEYWORDS，按与隐私开关的相关程度加权；负值表示通常没有隐私开关）
+KEYWORD_PRIORS: Dict[str, float] = {
+    "隐私": 3.0, "个性化": 3.0, "推荐": 2.5, "广告": 2.5, "权限": 2.0, "私密": 2.0,
+    "找到我的方式": 2.0, "仅我自己": 1.5, "数据": 1.5, "信息": 1.0, "授权": 1.5,
+    "位置": 1.5, "通讯录": 1.5, "可见": 1.0, "黑名单": 0.5, "内容": 0.5, "消息": 0.5,
+    "设置": 0.5, "管理": 0.5, "服务": 0.3, "更多": 0.3, "直播": 0.3, "电商": 0.3,
+    "关于": -1.5, "帮助": -1.5, "反馈": -1.5, "版本": -1.5, "缓存": -1.0, "字体": -1.0,
+    "主题": -1.0, "语言": -1.0, "退出登录": -2.0, "切换账号": -1.5, "账号与安全": -0.5,
+}
+
+# 打分权重
+PRIOR_WEIGHT = 1.0
+ANCESTOR_PRIOR_WEIGHT = 0.4
+HISTORY_WEIGHT = 2.0
+SIBLING_YIELD_WEIGHT = 1.0
+DEPTH_PENALTY = 0.3
+NAVIGATION_COST = 0.15
+
+
+def keyword_prior(text: str) -> float:
+    """文字中出现的关键词先验：正向取最大值，负向取最小值，两者相加"""
+    weights = [w for kw, w in KEYWORD_PRIORS.items() if kw in text]
+    if not weights:
+        return 0.0
+    return max(max(weights), 0.0) + min(min(weights), 0.0)
+
+
+def navigation_distance(current: List[str], path: List[str]) -> int:
+    """从当前页面走到 path 所在页面需要的返回次数加点击次数"""
+    common = 0
+    while common < len(current) and common < len(path) and current[common] == path[common]:
+        common += 1
+    return (len(current) - common) + (len(path) - common)
+
+
+class YieldHistory:
+    """
+    同一应用历次爬取的收益记录：列表项文字 -> 进入次数与其子树中找到的开关数
+    保存在 YIELD_HISTORY_DIR/<包名>.json，下一次爬取时作为打分信号
+    """
+
+    def __init__(self, app_package: str, history_dir: str = YIELD_HISTORY_DIR):
+        self.path = os.path.join(history_dir, f"{app_package.replace('.', '_')}.json")
+        self.entries: Dict[str, Dict[str, int]] = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"读取历史收益失败，忽略: {str(e)}")
+
+    def score(self, text: str) -> float:
+        entry = self.entries.get(text)
+        if not entry or not entry.get("visits"):
+            return 0.0
+        return math.log1p(entry["switches"] / entry["visits"])
+
+    def update(self, visited: List[List[str]], switch_paths: List[List[str]]):
+        """visited 为本次进入过的页面路径，switch_paths 为每个开关所在页面的路径"""
+        for path in visited:
+            if path:
+                entry = self.entries.setdefault(path[-1], {"visits": 0, "switches": 0})
+                entry["visits"] += 1
+        for path in switch_paths:
+            for text in set(path):
+                entry = self.entries.setdefault(text, {"visits": 1, "switches": 0})
+                entry["switches"] += 1
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, ensure_ascii=False, indent=2)
+
+
+class StackFrontier:
+    """后进先出的待探索列表：同一页面的列表项按模型给出的顺序展开，整体为深度优先"""
+
+    def __init__(self):
+        self._items: List[Dict] = []
+
+    def push_children(self, items: List[Dict]):
+        self._items.extend(reversed(items))
+
+    def observe(self, path: List[str], switches: int):
+        pass
+
+    def pop(self, current: Optional[List[str]] = None) -> Dict:
+        return self._items.pop()
+
+    def items(self) -> List[Dict]:
+        return list(self._items)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+class PriorityFrontier(StackFrontier):
+    """
+    按预期隐私收益优先展开的待探索列表，每次取出时重新打分：
+    - 列表项文字与其所在路径的关键词先验
+    - 历次爬取中该列表项子树的开关产出
+    - 本次爬取中同一父页面及已探索的兄弟子树的开关产出
+    - 深度惩罚，以及从当前页面导航过去的步数（避免在分支之间来回跳）
+    """
+
+    def __init__(self, history: Optional[YieldHistory] = None):
+        super().__init__()
+        self.history = history
+        # 路径前缀 -> 该页面及其已探索子树中找到的开关数
+        self.subtree_yield: Dict[tuple, int] = {}
+        self._order = 0
+
+    def push_children(self, items: List[Dict]):
+        for item in items:
+            self._order += 1
+            self._items.append(dict(item, order=self._order))
+
+    def observe(self, path: List[str], switches: int):
+        if not switches:
+            return
+        for i in range(len(path) + 1):
+            key = tuple(path[:i])
+            self.subtree_yield[key] = self.subtree_yield.get(key, 0) + switches
+
+    def score(self, item: Dict, current: Optional[List[str]] = None) -> float:
+        text = item["text"]
+        score = PRIOR_WEIGHT * keyword_prior(text)
+        if item["path"]:
+            score += ANCESTOR_PRIOR_WEIGHT * max(keyword_prior(t) for t in item["path"])
+        if self.history is not None:
+            score += HISTORY_WEIGHT * self.history.score(text)
+        score += SIBLING_YIELD_WEIGHT * math.log1p(self.subtree_yield.get(tuple(item["path"]), 0))
+        score -= DEPTH_PENALTY * item["depth"]
+        if current is not None:
+            score -= NAVIGATION_COST * navigation_distance(current, item["path"])
+        return score
+
+    def pop(self, current: Optional[List[str]] = None) -> Dict:
+        # 分数相同时按入队顺序，保持模型列出的顺序
+        best = max(range(len(self._items)),
+                   key=lambda i: (self.score(self._items[i], current), -self._items[i]["order"]))
+        item = self._items.pop(best)
+        item.pop("order", None)
+        return item
+
+
+def make_frontier(strategy: str = FRONTIER_STRATEGY, history: Optional[YieldHistory] = None) -> StackFrontier:
+    if strategy == "stack":
+        return StackFrontier()
+    if strategy != "priority":
+        logger.warning(f"未知的探索顺序 {strategy}，使用 priority")
+    return PriorityFrontier(history)
@@ -0,0 +1,387 @@
+import logging
+import os
+import re
+import threading
+import xml.etree.ElementTree as ET
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from page_fingerprint import IGNORED_PACKAGES
+from switch_knowledge import NEGATIONS, SOURCE_KB, SOURCE_RULE, knowledge_base
+
+# 加载环境变量
+load_dotenv()
+
+# 是否先尝试由界面层级在本地得出分析结果（失败时仍走截图 + 视觉模型）
+# 本地结果的推荐状态完全由 SWITCH_RULES 的关键词决定、不经模型确认，默认关闭
+HIERARCHY_EXTRACTION = os.getenv("HIERARCHY_EXTRACTION", "false").lower() == "true"
+# 文字摘要中开关与列表项少于该数量时视为过于稀疏，改用截图
+DIGEST_MIN_ROWS = int(os.getenv("DIGEST_MIN_ROWS", 3))
+
+logger = logging.getLogger(__name__)
+
+_BOUNDS_PATTERN = re.compile(r'\[(-?\d+),(-?\d+)\]\[(-?\d+),(-?\d+)\]')
+_CHECKABLE_CLASSES = ("Switch", "CheckBox", "ToggleButton")
+
+# 开关文字 -> 类别、推荐状态与理由；按顺序匹配，第一条命中的规则生效（更具体的规则放在前面）
+# 类别：privacy 归入 switches，personalization 归入 personalization.switches，ignore 为与隐私无关的开关
+SWITCH_RULES: List[Tuple[Tuple[str, ...], str, Optional[str], str]] = [
+    (("隐私保护", "隐身", "私密账号", "隐藏", "仅自己可见", "仅我自己", "匿名", "防止"), "privacy", "on",
+     "开启后可限制他人获取你的个人信息与动态，有助于保护隐私。"),
+    (("通过手机号", "通过手机号码", "通讯录", "可能认识", "找到我", "搜索到我", "附近的人", "推荐给好友", "把我推荐"),
+     "privacy", "off", "关闭后他人无法通过手机号、通讯录等方式找到你，降低个人信息暴露风险。"),
+    (("个性化广告", "程序化广告", "广告个性化", "个性化推荐", "个性化内容", "个性化推送", "兴趣推荐", "推荐算法"),
+     "personalization", "off", "关闭后平台不再基于你的行为数据推送定制化的广告或内容，减少个人数据的使用。"),
+    (("允许查看", "展示我的", "显示我的", "公开", "在线状态", "访客记录", "浏览记录", "允许他人"),
+     "privacy", "off", "关闭后其他用户无法查看相关信息，减少个人信息的公开范围。"),
+    (("位置", "定位", "剪切板", "剪贴板", "读取", "收集", "上传", "共享", "数据分析", "体验改进", "改进计划", "诊断"),
+     "privacy", "off", "关闭后应用不再收集或共享相关数据，有助于减少个人数据的采集。"),
+    (("广告", "推荐"), "personalization", "off",
+     "关闭后平台减少基于个人数据的广告与推荐，降低数据被用于画像的程度。"),
+    (("通知", "提醒", "声音", "振动", "震动", "夜间", "深色", "护眼", "字体", "自动播放", "播放", "流量", "省电",
+      "缓存", "清理", "更新", "下载", "横屏", "音效", "弹幕", "免打扰"), "ignore", None, ""),
+]
+
+# 列表项文字 -> 类别；privacy 归入 layouts，personalization 归入 personalization.layouts，
+# settings 为仅在页面上没有任何隐私内容时才记录的“设置”入口，ignore 为 prompt.txt 中要求排除的入口
+ENTRY_RULES: List[Tuple[Tuple[str, ...], str]] = [
+    (("更多隐私设置", "隐私政策", "政策", "协议", "清单", "未成年", "帮助", "客服", "反馈", "关于", "账号与安全",
+      "账户安全", "账号安全", "黑名单", "权限", "退出", "切换账号", "缓存", "存储空间", "版本", "检查更新",
+      "字体", "语言", "深色模式", "夜间模式", "通用", "通知", "主题", "皮肤", "收货地址", "支付", "钱包",
+      "实名认证", "注销"), "ignore"),
+    (("个性化", "广告", "推荐设置", "推荐管理", "内容推荐", "兴趣"), "personalization"),
+    (("隐私", "找到我的方式", "可见范围", "谁可以", "谁能", "个人信息", "授权管理", "第三方", "互动", "通讯录"),
+     "privacy"),
+    (("设置",), "settings"),
+]
+
+
+def _negated(label: str, keywords: Tuple[str, ...]) -> bool:
+    """
+    开关文字是否为否定表述（“禁止通过手机号搜索到我”、“不公开我的动态”）：
+    命中的关键词之外出现奇数个否定词；关键词本身含否定词（“隐藏”）时不计
+    """
+    covered = set()
+    for kw in keywords:
+        start = label.find(kw)
+        while start != -1:
+            covered.update(range(start, start + len(kw)))
+            start = label.find(kw, start + 1)
+    count = 0
+    for neg in NEGATIONS:
+        start = label.find(neg)
+        while start != -1:
+            if not covered.intersection(range(start, start + len(neg))):
+                count += 1
+            start = label.find(neg, start + 1)
+    return count % 2 == 1
+
+
+def classify_switch(label: str) -> Optional[Dict]:
+    """
+    按 SWITCH_RULES 归类开关；否定表述的开关推荐状态取反，理由中的“开启后 / 关闭后”随之互换，
+    理由无法互换时返回 None，交给知识库或模型
+    """
+    for keywords, category, recommended, analysis in SWITCH_RULES:
+        if not any(kw in label for kw in keywords):
+            continue
+        if recommended is not None and _negated(label, keywords):
+            flipped = {"开启后": "关闭后", "关闭后": "开启后"}.get(analysis[:3])
+            if flipped is None:
+                return None
+            recommended = "on" if recommended == "off" else "off"
+            analysis = flipped + analysis[3:]
+        return {"category": category, "recommended_state": recommended, "analysis": analysis}
+    return None
+
+
+def classify_entry(label: str) -> Optional[str]:
+    for keywords, category in ENTRY_RULES:
+        if any(kw in label for kw in keywords):
+            return category
+    return None
+
+
+def _bounds(elem) -> Optional[List[int]]:
+    match = _BOUNDS_PATTERN.match(elem.get("bounds") or "")
+    return list(map(int, match.groups())) if match else None
+
+
+def _is_checkable(elem) -> bool:
+    cls = elem.get("class") or ""
+    return elem.get("checkable") == "true" or any(cls.endswith(c) for c in _CHECKABLE_CLASSES)
+
+
+def _label_of(nodes: List) -> Optional[str]:
+    """一组节点中最靠上、最靠左的非空文字（列表项的标题，而不是下方的说明文字）"""
+    best = None
+    for elem in nodes:
+        text = (elem.get("text") or elem.get("content-desc") or "").strip()
+        box = _bounds(elem)
+        if not text or box is None:
+            continue
+        key = (box[1], box[0])
+        if best is None or key < best[0]:
+            best = (key, text)
+    return best[1] if best else None
+
+
+def _switch_label(elem, parents: Dict) -> Tuple[Optional[str], List]:
+    """
+    开关的标题：控件自身的文字，否则逐级向上（最多三级）在祖先中找与开关处于同一行、位于其左侧的最靠上的文字
+    返回标题与属于这一行的节点（行较矮时整行，否则只有开关与标题节点）
+    """
+    own = (elem.get("text") or "").strip()
+    if own:
+        return own, [elem]
+    box = _bounds(elem)
+    if box is None:
+        return None, [elem]
+    margin = max(box[3] - box[1], 80)
+    container = elem
+    for _ in range(3):
+        container = parents.get(container)
+        if container is None:
+            break
+        candidates = []
+        for e in container.iter("node"):
+            text = (e.get("text") or e.get("content-desc") or "").strip()
+            tb = _bounds(e)
+            if e is elem or not text or tb is None:
+                continue
+            if tb[3] > box[1] - margin and tb[1] < box[3] + margin and tb[0] < box[0]:
+                candidates.append(((tb[1], tb[0]), text, e))
+        if candidates:
+            _, label, label_node = min(candidates, key=lambda c: c[0])
+            cb = _bounds(container) or box
+            if cb[3] - cb[1] <= 3 * margin:
+                return label, list(container.iter("node"))
+            return label, [elem, label_node]
+    return None, [elem]
+
+
+def page_rows(hierarchy_xmls: List[str]) -> Dict:
+    """
+    把长页面各屏的界面层级合并为按出现顺序排列的行：
+    - switch：可勾选控件（Switch / CheckBox / ToggleButton 或 checkable），配对同一行的标题文字，checked 为精确状态
+    - entry：不含可勾选控件的可点击行，has_chevron 表示右侧有箭头图标
+    - text：不属于任何行的文字（标题、说明）
+    相邻两屏重叠部分按 (类型, 文字) 去重；同时返回页面是否包含 WebView
+    """
+    rows: List[Dict] = []
+    seen = set()
+    has_webview = False
+    for xml in hierarchy_xmls:
+        try:
+            root = ET.fromstring(xml)
+        except ET.ParseError:
+            continue
+        parents = {child: parent for parent in root.iter() for child in parent}
+        nodes = [e for e in root.iter("node") if not (e.get("package") or "").startswith(IGNORED_PACKAGES)]
+        consumed = set()
+        screen_rows = []
+
+        if any("WebView" in (e.get("class") or "") for e in nodes):
+            has_webview = True
+
+        for elem in nodes:
+            if not _is_checkable(elem):
+                continue
+            label, row_nodes = _switch_label(elem, parents)
+            consumed.update(row_nodes)
+            box = _bounds(elem) or [0, 0, 0, 0]
+            screen_rows.append((box[1], {
+                "kind": "switch", "label": label, "checked": elem.get("checked") == "true",
+                "widget": (elem.get("class") or "").split(".")[-1], "clickable": True,
+            }))
+
+        for elem in nodes:
+            if elem.get("clickable") != "true" or elem in consumed:
+                continue
+            inner = list(elem.iter("node"))
+            if any(_is_checkable(e) for e in inner):
+                continue
+            # 只取最内层带文字的可点击节点
+            if any(e is not elem and e.get("clickable") == "true" and _label_of(list(e.iter("node")))
+                   for e in inner):
+                continue
+            label = _label_of(inner)
+            if not label:
+                continue
+            box = _bounds(elem) or [0, 0, 0, 0]
+            width = max(1, box[2] - box[0])
+            chevron = any(
+                "Image" in (e.get("class") or "") and not _label_of([e])
+                and (_bounds(e) or [0] * 4)[0] - box[0] > width * 0.7
+                for e in inner if e is not elem
+            )
+            consumed.update(inner)
+            screen_rows.append((box[1], {
+                "kind": "entry", "label": label, "checked": None,
+                "widget": (elem.get("class") or "").split(".")[-1], "clickable": True, "has_chevron": chevron,
+            }))
+
+        for elem in nodes:
+            if elem in consumed or list(elem):
+                continue
+            label = _label_of([elem])
+            if label:
+                box = _bounds(elem) or [0, 0, 0, 0]
+                screen_rows.append((box[1], {"kind": "text", "label": label, "checked": None,
+                                             "widget": (elem.get("class") or "").split(".")[-1],
+                                             "clickable": elem.get("clickable") == "true"}))
+
+        for _, row in sorted(screen_rows, key=lambda r: r[0]):
+            key = (row["kind"], row["label"])
+            if key in seen:
+                continue
+            seen.add(key)
+            rows.append(row)
+    return {"rows": rows, "has_webview": has_webview}
+
+
+def _content_span(hierarchy_xml: str) -> Optional[Tuple[float, float]]:
+    """首屏中应用内带文字的叶子节点所占的纵向范围（占屏幕高度的比例），供文字模型判断是否为底部弹窗"""
+    try:
+        root = ET.fromstring(hierarchy_xml)
+    except ET.ParseError:
+        return None
+    screen_bottom, top, bottom = 0, None, None
+    for elem in root.iter("node"):
+        box = _bounds(elem)
+        if box is None:
+            continue
+        screen_bottom = max(screen_bottom, box[3])
+        if list(elem) or (elem.get("package") or "").startswith(IGNORED_PACKAGES) or not _label_of([elem]):
+            continue
+        top = box[1] if top is None else min(top, box[1])
+        bottom = box[3] if bottom is None else max(bottom, box[3])
+    if top is None or not screen_bottom:
+        return None
+    return top / screen_bottom, bottom / screen_bottom
+
+
+def hierarchy_digest(hierarchy_xmls: List[str], min_rows: int = DIGEST_MIN_ROWS) -> Tuple[Optional[str], str]:
+    """
+    把长页面合并后的行序列化为紧凑的文字摘要（类型、文字、控件类、开关状态、可点击、右侧箭头），代替截图发给文字模型
+    含 WebView、存在没有标题的开关、或开关与列表项少于 min_rows 时返回 (None, 原因)，由调用方改用截图
+    """
+    page = page_rows(hierarchy_xmls)
+    if page["has_webview"]:
+        return None, "webview"
+    rows = page["rows"]
+    if any(row["kind"] == "switch" and not row["label"] for row in rows):
+        return None, "unlabeled_switch"
+    if sum(1 for row in rows if row["kind"] != "text") < min_rows:
+        return None, "sparse"
+
+    lines = []
+    span = _content_span(hierarchy_xmls[0]) if hierarchy_xmls else None
+    if span is not None:
+        lines.append(f"首屏内容纵向范围: {span[0]:.0%} - {span[1]:.0%}")
+    for i, row in enumerate(rows, 1):
+        if row["kind"] == "switch":
+            fields = ["开关", row["label"], row["widget"], "on" if row["checked"] else "off"]
+        elif row["kind"] == "entry":
+            fields = ["列表项", row["label"], row["widget"]]
+            if row.get("has_chevron"):
+                fields.append("箭头")
+        else:
+            fields = ["文字", row["label"], row["widget"]]
+            if row["clickable"]:
+                fields.append("可点击")
+        lines.append(f"{i}|" + "|".join(fields))
+    return "\n".join(lines), "ok"
+
+
+class HierarchyExtractor:
+    """
+    由界面层级在本地得出与 prompt.txt 约定格式相同的分析结果：
+    开关状态直接读 checked，推荐状态与理由来自 SWITCH_RULES（未覆盖时查开关知识库），列表项按 ENTRY_RULES 归类
+    含 WebView、出现规则表中没有的文字、或疑似自绘开关（文字像开关却不是可勾选控件且没有箭头）时放弃，交给视觉模型
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.pages = 0
+        self.local = 0
+        self.fallback_reasons: Dict[str, int] = {}
+
+    def _fallback(self, reason: str, detail: str = "") -> Tuple[None, str]:
+        with self._lock:
+            self.fallback_reasons[reason] = self.fallback_reasons.get(reason, 0) + 1
+        logger.info(f"层级提取放弃（{reason}）{detail}，改用视觉模型")
+        return None, reason
+
+    def extract(self, hierarchy_xmls: List[str]) -> Tuple[Optional[Dict], str]:
+        with self._lock:
+            self.pages += 1
+        page = page_rows(hierarchy_xmls)
+        if page["has_webview"]:
+            return self._fallback("webview")
+        rows = [row for row in page["rows"] if row["kind"] != "text"]
+        if not rows:
+            return self._fallback("no_rows")
+
+        result = {"switches": [], "layouts": [],
+                  "personalization": {"switches": [], "layouts": []}, "isPopup": False}
+        settings_entries = []
+        for row in rows:
+            label = row["label"]
+            if not label:
+                return self._fallback("unlabeled_switch")
+            if row["kind"] == "switch":
+                # 规则表没有覆盖的开关再查跨应用知识库
+                rule, source = classify_switch(label), SOURCE_RULE
+                if rule is None:
+                    rule, source = knowledge_base.lookup(label), SOURCE_KB
+                if rule is None:
+                    return self._fallback("unknown_label", label)
+                if rule["category"] == "ignore":
+                    continue
+                entry = {"text": label, "current_state": "on" if row["checked"] else "off",
+                         "recommended_state": rule["recommended_state"], "analysis": rule["analysis"],
+                         "recommendation_source": source}
+                target = result["switches"] if rule["category"] == "privacy" else result["personalization"]["switches"]
+                target.append(entry)
+                continue
+
+            category = classify_entry(label)
+            switch_rule = classify_switch(label)
+            if (not row.get("has_chevron") and switch_rule is not None
+                    and switch_rule["category"] != "ignore" and category != "ignore"):
+                return self._fallback("custom_toggle", label)
+            if category is None:
+                return self._fallback("unknown_label", label)
+            if category == "privacy":
+                result["layouts"].append({"text": label})
+            elif category == "personalization":
+                result["personalization"]["layouts"].append({"text": label})
+            elif category == "settings":
+                settings_entries.append({"text": label})
+
+        # 页面上没有任何隐私内容时，“设置”类入口是唯一的 layout
+        if not (result["switches"] or result["layouts"] or result["personalization"]["switches"]
+                or result["personalization"]["layouts"]):
+            result["layouts"] = settings_entries
+        with self._lock:
+            self.local += 1
+        result["source"] = "hierarchy"
+        return result, "local"
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "pages": self.pages,
+                "answered_locally": self.local,
+                "local_fraction": round(self.local / self.pages, 3) if self.pages else 0.0,
+                "fallback_reasons": dict(self.fallback_reasons),
+            }
+
+
+extractor = HierarchyExtractor()
+
+
+def extraction_stats() -> Dict:
+    return extractor.stats()
@@ -0,0 +1,150 @@
+from PIL import Image
+import io
+import json
+import base64
+import requests
+from typing import Dict, Optional
+from io import BytesIO
+
+from llm_request import GEMINI_API_BASE, Endpoint, check_response, gemini_executor
+from metering import report_payload, report_usage
+from tracing import mark_first_token
+from model_cascade import get_cascade, cascade_tiers, validate_detection_box
+from structured_output import JointDetection, gemini_reask, parse_response
+
+
+class JointIconDetector:
+    """联合检测：一次请求同时定位个人中心图标与设置图标，并判断设置入口是否已可见"""
+
+    def __init__(self, api_key: str):
+        self.api_key = api_key
+        self.model = "gemini-2.5-flash-preview-05-20"
+        # 与 llm_request 的默认端点一致，可用 GEMINI_API_BASE 覆盖
+        self.api_base = GEMINI_API_BASE
+        self.cascade = get_cascade(
+            "joint_icon", cascade_tiers("GEMINI_CASCADE_MODELS", [self.model, "gemini-2.5-pro"])
+        )
+
+    def detect_ui_elements(self, image_bytes: bytes, hierarchy_xml: Optional[str] = None) -> Optional[Dict]:
+        """
+        级联联合检测
+        设置入口可见时校验设置框，否则校验个人中心框；未通过校验时升级到更强的模型
+        """
+        def validate(result):
+            if not result:
+                return False
+            if result["setting_visible"]:
+                return validate_detection_box(result["setting"], hierarchy_xml)
+            return validate_detection_box(result["personal"], hierarchy_xml)
+
+        return self.cascade.run(
+            lambda model: self._request_ui_elements(image_bytes, model),
+            validate
+        )
+
+    def _request_ui_elements(self, image_bytes: bytes, model: str) -> Optional[Dict]:
+        """
+        返回: {"personal": {...} 或 None, "setting": {...} 或 None, "setting_visible": bool} 或 None
+        其中 personal/setting 的格式与单独检测器一致：{"box_2d": [y1,x1,y2,x2], "label": "..."}
+        """
+        prompt = """请你严格按照以下指示步骤工作：
+        你需要完成的工作是：
+        （1）在同一张手机应用截图中，同时检测指向个人中心或"我的"页面的图标/文字，以及"设置"图标/按钮
+        （2）判断当前界面上是否已经可以直接看到设置入口
+        ### 你的思考过程（此部分仅用于解释，不要放入JSON） ###
+        1. 个人中心元素：
+           - 人形图标、用户头像
+           - "我"、"我的"、"个人中心"、"账号"等文字（绝大多数情况下都是有文字的）
+           - 一般位于底部导航栏，右下角的概率遥遥领先
+        2. 设置元素：
+           - 齿轮/六边形图标，或写有"设置"字样的按钮
+           - 一般位于右上角，但不限于此
+           - 注意：菜单图标（三条横线）、"更多"等不算设置入口，不要放入setting字段
+        3. 只有当截图中确实存在可以直接点击的设置入口时，setting_visible 才为 true
+        4. 你获取坐标的时候尽可能缩小你的获取范围（但要包含足够的要素），避免框选到太多空白区域造成点击错误
+        5. 某一类元素没找到时，对应字段输出 null
+        ### 你必须输出的JSON数据 ###
+        {
+            "personal": {"box_2d": [y1,x1,y2,x2], "label": "personal icon/text", "confidence": 0.9},
+            "setting": {"box_2d": [y1,x1,y2,x2], "label": "setting icon", "confidence": 0.9},
+            "setting_visible": true
+        }
+        confidence 为你对每个检测结果的置信度（0-1）。
+        请先严格按照思考过程进行思考（你的思考过程也要输出！），然后输出正确的JSON数据。"""
+
+        def encode_compressed_image(image_bytes: bytes, quality=20) -> str:
+            with Image.open(io.BytesIO(image_bytes)) as img:
+                buffered = BytesIO()
+                img.save(buffered, format="PNG", quality=quality)
+                return base64.b64encode(buffered.getvalue()).decode("utf-8")
+
+        try:
+            image_base64 = encode_compressed_image(image_bytes)
+
+            payload = {
+                "model": model,
+                "stream": True,
+                "stream_options": {"include_usage": True},
+                "messages": [
+                    {
+                        "role": "user",
+                        "content": [
+                            {"type": "text", "text": prompt},
+                            {"type": "image_url", "image_url": {
+                                "url": f"data:image/png;base64,{image_base64}"}
+                             }
+                        ]
+                    }
+                ],
+                "temperature": 0.2,
+                "max_tokens": 8000
+            }
+
+            def send(endpoint: Endpoint, timeout: float) -> str:
+                full_content = ""
+                body = json.dumps(dict(payload, model=endpoint.model))
+                report_payload(len(body))
+                with requests.post(
+                        endpoint.chat_url,
+                        headers=endpoint.headers(),
+                        data=body,
+                        timeout=timeout,
+                        stream=True
+                ) as response:
+                    check_response(response)
+
+                    for line in response.iter_lines():
+                        if line:
+                            line_str = line.decode('utf-8')
+                            if line_str.startswith('data:'):
+                                json_str = line_str[5:].strip()
+                                if json_str == "[DONE]":
+                                    continue
+                                try:
+                                    chunk_data = json.loads(json_str)
+                                    report_usage(chunk_data.get('usage'))
+                                    if 'choices' in chunk_data and chunk_data['choices']:
+                                        delta = chunk_data['choices'][0].get('delta', {})
+                                        content = delta.get('content') or ''
+                                        if content:
+                                            mark_first_token()
+                                        full_content += content
+                                except json.JSONDecodeError:
+                                    pass
+                return full_content
+
+            full_content = gemini_executor(self.api_key, model, self.api_base).execute(
+                send, lambda content: bool(content)
+            )
+            # 回答不合法时先本地修复，仍失败再交给便宜的文字模型整理，不重新发送截图
+            detections = parse_response(full_content, JointDetection, reask=gemini_reask(self.api_key, self.api_base))
+            if detections is None:
+                return None
+            return {
+                "personal": detections.personal.model_dump(exclude_none=True) if detections.personal else None,
+                "setting": detections.setting.model_dump(exclude_none=True) if detections.setting else None,
+                "setting_visible": detections.setting_visible
+            }
+
+        except Exception:
+            return None
@@ -0,0 +1,331 @@
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Callable, Dict, List, Optional
+
+import requests
+from dotenv import load_dotenv
+
+from metering import meter
+from tracing import tracer
+from rate_limiter import RateLimiter, get_limiter, PRIORITY_NAVIGATION, PRIORITY_ANALYSIS
+
+# 加载环境变量
+load_dotenv()
+
+# 单次模型调用（含重试与对冲）的总截止时间，以及单次尝试的超时
+LLM_REQUEST_DEADLINE = float(os.getenv("LLM_REQUEST_DEADLINE", 180))
+LLM_ATTEMPT_TIMEOUT = float(os.getenv("LLM_ATTEMPT_TIMEOUT", 100))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 2))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", 1.0))
+# 对冲：首个请求超过其历史 p95 延迟仍未返回时，向备用端点再发一次
+LLM_HEDGE = os.getenv("LLM_HEDGE", "true").lower() == "true"
+LLM_HEDGE_QUANTILE = float(os.getenv("LLM_HEDGE_QUANTILE", 0.95))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", 5))
+LLM_MAX_WORKERS = int(os.getenv("LLM_MAX_WORKERS", 16))
+# 无法预估时按该token数占用限流额度
+LLM_DEFAULT_TOKEN_ESTIMATE = int(os.getenv("LLM_DEFAULT_TOKEN_ESTIMATE", 3000))
+# 推理模型的页面分析耗时长得多，单独配置
+ANALYSIS_REQUEST_DEADLINE = float(os.getenv("ANALYSIS_REQUEST_DEADLINE", 600))
+ANALYSIS_ATTEMPT_TIMEOUT = float(os.getenv("ANALYSIS_ATTEMPT_TIMEOUT", 300))
+
+GEMINI_API_BASE = os.getenv("GEMINI_API_BASE", "http://jeniya.cn")
+GEMINI_FALLBACK_API_BASE = os.getenv("GEMINI_FALLBACK_API_BASE")
+GEMINI_FALLBACK_API_KEY = os.getenv("GEMINI_FALLBACK_API_KEY")
+QWEN_API_BASE = os.getenv("QWEN_API_BASE", "https://dashscope.aliyuncs.com/compatible-mode/v1")
+QWEN_FALLBACK_API_BASE = os.getenv("QWEN_FALLBACK_API_BASE")
+QWEN_FALLBACK_API_KEY = os.getenv("QWEN_FALLBACK_API_KEY")
+
+# 这些状态码说明请求本身有问题，重试没有意义
+NON_RETRYABLE_STATUS = (400, 401, 403, 404, 413, 422)
+
+# 每个端点保留的延迟样本数
+MAX_LATENCY_SAMPLES = 200
+
+logger = logging.getLogger(__name__)
+
+_pool = ThreadPoolExecutor(max_workers=LLM_MAX_WORKERS, thread_name_prefix="llm-request")
+
+
+class Endpoint:
+    """一个可调用的模型端点：服务地址 + 密钥 + 模型名（可选挂一个按 key 的限流器）"""
+
+    def __init__(self, base_url: str, api_key: str, model: str, name: Optional[str] = None,
+                 limiter: Optional[RateLimiter] = None):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.model = model
+        self.name = name or f"{self.base_url}#{model}"
+        self.limiter = limiter
+
+    @property
+    def chat_url(self) -> str:
+        return f"{self.base_url}/v1/chat/completions"
+
+    def headers(self) -> Dict[str, str]:
+        return {
+            'Accept': 'application/json',
+            'Content-Type': 'application/json',
+            'Authorization': f'Bearer {self.api_key}'
+        }
+
+    def __repr__(self):
+        return f"Endpoint({self.name})"
+
+
+class HTTPStatusError(Exception):
+    """模型服务返回了非200状态码"""
+
+    def __init__(self, status_code: int, body: str = "", retry_after: Optional[float] = None):
+        super().__init__(f"HTTP {status_code}: {body[:200]}")
+        self.status_code = status_code
+        self.body = body
+        self.retry_after = retry_after
+
+
+def check_response(response: requests.Response):
+    """非200时抛出 HTTPStatusError，交给执行器决定是否重试"""
+    if response.status_code != 200:
+        try:
+            body = response.text
+        except Exception:
+            body = ""
+        try:
+            retry_after = float(response.headers.get("Retry-After"))
+        except (TypeError, ValueError):
+            retry_after = None
+        raise HTTPStatusError(response.status_code, body, retry_after)
+
+
+class _LatencyTracker:
+    """按端点记录成功请求的延迟，用于计算对冲阈值"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples: Dict[str, deque] = {}
+        self._counters: Dict[str, Dict[str, int]] = {}
+
+    def record(self, endpoint: Endpoint, latency: float):
+        with self._lock:
+            self._samples.setdefault(endpoint.name, deque(maxlen=MAX_LATENCY_SAMPLES)).append(latency)
+
+    def count(self, endpoint: Endpoint, key: str):
+        with self._lock:
+            counters = self._counters.setdefault(endpoint.name, {})
+            counters[key] = counters.get(key, 0) + 1
+
+    def quantile(self, endpoint: Endpoint, q: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples.get(endpoint.name, ()))
+        if len(samples) < LLM_HEDGE_MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            names = set(self._samples) | set(self._counters)
+            result = {}
+            for name in names:
+                samples = sorted(self._samples.get(name, ()))
+                result[name] = dict(self._counters.get(name, {}))
+                if samples:
+                    result[name]["p50_latency"] = round(samples[len(samples) // 2], 3)
+                    result[name]["p95_latency"] = round(samples[min(len(samples) - 1, int(0.95 * len(samples)))], 3)
+            return result
+
+
+latency_tracker = _LatencyTracker()
+
+
+class RequestExecutor:
+    """
+    模型请求执行层：整体截止时间 + 带抖动的重试 + 对冲请求
+    call(endpoint, timeout) 负责发出一次请求并返回解析后的结果，失败时返回 None 或抛异常
+    端点挂有限流器时，每次尝试先按 priority 排队拿名额；收到 429 会让同一 key 的所有调用一起暂停
+    """
+
+    def __init__(self, endpoints: List[Endpoint], deadline: float = LLM_REQUEST_DEADLINE,
+                 attempt_timeout: float = LLM_ATTEMPT_TIMEOUT, max_retries: int = LLM_MAX_RETRIES,
+                 hedge: bool = LLM_HEDGE, hedge_quantile: float = LLM_HEDGE_QUANTILE,
+                 backoff_base: float = LLM_BACKOFF_BASE, priority: int = PRIORITY_ANALYSIS,
+                 estimated_tokens: int = LLM_DEFAULT_TOKEN_ESTIMATE):
+        if not endpoints:
+            raise ValueError("至少需要一个端点")
+        self.endpoints = endpoints
+        self.deadline = deadline
+        self.attempt_timeout = attempt_timeout
+        self.max_retries = max_retries
+        self.hedge = hedge and len(endpoints) > 1
+        self.hedge_quantile = hedge_quantile
+        self.backoff_base = backoff_base
+        self.priority = priority
+        self.estimated_tokens = estimated_tokens
+
+    def _backoff(self, failures: int) -> float:
+        # full jitter：在 [0, base * 2^n] 内均匀随机，避免多个爬虫同步重试
+        return random.uniform(0, self.backoff_base * (2 ** (failures - 1)))
+
+    def _attempt(self, call: Callable[[Endpoint, float], Any], endpoint: Endpoint,
+                 timeout: float, deadline_at: float, timing: Dict[str, float]) -> Any:
+        lease = None
+        limiter = endpoint.limiter
+        if limiter is not None:
+            with tracer.span("rate_limit_wait", "rate_limit"):
+                lease = limiter.acquire(self.estimated_tokens, self.priority,
+                                        timeout=max(0.0, deadline_at - time.time()))
+            if lease is None:
+                raise TimeoutError(f"{endpoint.name} 等待限流名额超时")
+            timeout = max(0.1, min(timeout, deadline_at - time.time()))
+        timing["sent"] = time.time()
+        meter.begin_call()
+        result, ok = None, False
+        try:
+            with tracer.span(f"attempt:{endpoint.model}", "model", endpoint=endpoint.name) as span_args:
+                result = call(endpoint, timeout)
+                ok = True
+                span_args["ok"] = True
+            return result
+        except HTTPStatusError as e:
+            if e.status_code == 429 and limiter is not None:
+                limiter.report_throttled(e.retry_after)
+            raise
+        finally:
+            record = meter.end_call(endpoint.model, endpoint.name, time.time() - timing["sent"], ok, result)
+            if limiter is not None:
+                used = record["prompt_tokens"] + record["completion_tokens"]
+                limiter.release(lease, used or None)
+
+    def execute(self, call: Callable[[Endpoint, float], Any],
+                validate: Callable[[Any], bool] = lambda result: result is not None) -> Any:
+        """在截止时间内返回第一个通过校验的结果；全部失败或超时返回 None"""
+        with tracer.span(f"llm:{self.endpoints[0].model}", "model_wait"):
+            return self._execute(call, validate)
+
+    def _execute(self, call: Callable[[Endpoint, float], Any], validate: Callable[[Any], bool]) -> Any:
+        deadline_at = time.time() + self.deadline
+        pending: Dict[Any, tuple] = {}
+        failures = 0
+        next_index = 0
+        hedged = False
+
+        def launch(endpoint: Endpoint, tag: str):
+            timeout = max(0.1, min(self.attempt_timeout, deadline_at - time.time()))
+            latency_tracker.count(endpoint, tag)
+            timing = {"sent": None}
+            future = _pool.submit(self._attempt, call, endpoint, timeout, deadline_at, timing)
+            pending[future] = (endpoint, timing, tag)
+            return timing
+
+        primary = launch(self.endpoints[0], "requests")
+
+        while pending and time.time() < deadline_at:
+            now = time.time()
+            wake_at = deadline_at
+            hedge_delay = None
+            if self.hedge and not hedged:
+                hedge_delay = latency_tracker.quantile(self.endpoints[next_index], self.hedge_quantile)
+                if hedge_delay is not None:
+                    # 还在排队等限流名额的请求不计入对冲等待
+                    sent = primary["sent"]
+                    wake_at = min(wake_at, (sent + hedge_delay) if sent else now + 0.2)
+
+            done, _ = wait(list(pending), timeout=max(0.0, wake_at - now), return_when=FIRST_COMPLETED)
+
+            for future in done:
+                endpoint, timing, tag = pending.pop(future)
+                retryable = True
+                try:
+                    result = future.result()
+                    valid = bool(validate(result))
+                except HTTPStatusError as e:
+                    logger.warning(f"{endpoint.name} 请求失败: HTTP {e.status_code}")
+                    result, valid = None, False
+                    retryable = e.status_code not in NON_RETRYABLE_STATUS
+                except Exception as e:
+                    logger.warning(f"{endpoint.name} 请求异常: {str(e)}")
+                    result, valid = None, False
+
+                if valid:
+                    latency_tracker.record(endpoint, time.time() - (timing["sent"] or time.time()))
+                    if tag == "hedges":
+                        latency_tracker.count(endpoint, "hedge_wins")
+                    return result
+
+                latency_tracker.count(endpoint, "failures")
+                failures += 1
+                if not retryable or failures > self.max_retries or pending:
+                    continue
+                sleep = min(self._backoff(failures), max(0.0, deadline_at - time.time()))
+                time.sleep(sleep)
+                if time.time() >= deadline_at:
+                    break
+                next_index = (next_index + 1) % len(self.endpoints)
+                primary = launch(self.endpoints[next_index], "retries")
+
+            # 首个请求超过 p95 仍未返回：向备用端点发起对冲请求，取先返回的有效结果
+            if not done and hedge_delay is not None and not hedged and primary["sent"] \
+                    and time.time() >= primary["sent"] + hedge_delay:
+                hedged = True
+                logger.info(f"{self.endpoints[next_index].name} 超过 p95 ({hedge_delay:.1f}s) 未返回，发起对冲请求")
+                launch(self.endpoints[(next_index + 1) % len(self.endpoints)], "hedges")
+
+        if pending:
+            for endpoint, _, _ in pending.values():
+                latency_tracker.count(endpoint, "deadline_exceeded")
+            logger.warning(f"模型请求超过截止时间 {self.deadline:.0f}s")
+        return None
+
+
+_base_rewriter: Optional[Callable[[str, str], str]] = None
+
+
+def set_base_rewriter(rewriter: Optional[Callable[[str, str], str]]):
+    """设置服务地址改写函数 rewriter(provider, base_url) -> base_url，录制/回放时把请求转到本地代理"""
+    global _base_rewriter
+    _base_rewriter = rewriter
+
+
+def _endpoints(provider: str, primary_base: str, api_key: str, model: str,
+               fallback_base: Optional[str], fallback_key: Optional[str],
+               fallback_model: Optional[str]) -> List[Endpoint]:
+    if _base_rewriter is not None:
+        primary_base = _base_rewriter(provider, primary_base)
+        fallback_base = _base_rewriter(provider, fallback_base) if fallback_base else fallback_base
+    endpoints = [Endpoint(primary_base, api_key, model, limiter=get_limiter(provider, api_key))]
+    if fallback_base:
+        fallback_key = fallback_key or api_key
+        endpoints.append(Endpoint(fallback_base, fallback_key, fallback_model or model,
+                                  limiter=get_limiter(provider, fallback_key)))
+    elif fallback_model and fallback_model != model:
+        endpoints.append(Endpoint(primary_base, api_key, fallback_model, limiter=get_limiter(provider, api_key)))
+    return endpoints
+
+
+def gemini_executor(api_key: str, model: str, api_base: Optional[str] = None,
+                    **kwargs) -> RequestExecutor:
+    """Gemini（OpenAI兼容网关）请求执行器；配置了 GEMINI_FALLBACK_API_BASE 时启用对冲。默认按导航优先级限流"""
+    kwargs.setdefault("priority", PRIORITY_NAVIGATION)
+    return RequestExecutor(
+        _endpoints("gemini", api_base or GEMINI_API_BASE, api_key, model,
+                   GEMINI_FALLBACK_API_BASE, GEMINI_FALLBACK_API_KEY, os.getenv("GEMINI_HEDGE_MODEL")),
+        **kwargs
+    )
+
+
+def qwen_executor(api_key: str, model: str, **kwargs) -> RequestExecutor:
+    """通义（DashScope兼容模式）请求执行器；配置了 QWEN_FALLBACK_API_BASE 时启用对冲。默认按页面分析优先级限流"""
+    kwargs.setdefault("priority", PRIORITY_ANALYSIS)
+    return RequestExecutor(
+        _endpoints("qwen", QWEN_API_BASE, api_key, model,
+                   QWEN_FALLBACK_API_BASE, QWEN_FALLBACK_API_KEY, os.getenv("QWEN_HEDGE_MODEL")),
+        **kwargs
+    )
+
+
+def request_stats() -> Dict[str, Any]:
+    """各端点的请求数、失败数、对冲次数与延迟分位数"""
+    return latency_tracker.stats()
@@ -0,0 +1,239 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+
+# 加载环境变量
+load_dotenv()
+
+# 各模型单价（美元 / 百万token，输入与输出分开计价；推理token按输出计价）
+# 可用 MODEL_PRICES='{"model": [input, output]}' 覆盖或补充
+DEFAULT_MODEL_PRICES = {
+    "gemini-2.5-flash": (0.30, 2.50),
+    "gemini-2.5-flash-preview-05-20": (0.15, 3.50),
+    "gemini-2.5-pro": (1.25, 10.0),
+    "qwen-vl-max-latest": (0.23, 0.57),
+    "qvq-max-latest": (1.15, 4.60),
+}
+
+logger = logging.getLogger(__name__)
+
+
+def _load_prices() -> Dict[str, tuple]:
+    prices = dict(DEFAULT_MODEL_PRICES)
+    raw = os.getenv("MODEL_PRICES")
+    if raw:
+        try:
+            prices.update({k: tuple(v) for k, v in json.loads(raw).items()})
+        except (json.JSONDecodeError, TypeError, ValueError):
+            logger.warning("MODEL_PRICES 格式错误，使用默认单价")
+    return prices
+
+
+MODEL_PRICES = _load_prices()
+
+
+def call_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """按单价估算一次调用的费用（美元）；未知模型计 0"""
+    price = MODEL_PRICES.get(model)
+    if price is None:
+        return 0.0
+    return (prompt_tokens * price[0] + completion_tokens * price[1]) / 1_000_000
+
+
+def parse_usage(usage: Optional[Dict]) -> Dict[str, int]:
+    """兼容 OpenAI / Gemini 网关 / DashScope 的 usage 字段，统一为 prompt/completion/reasoning"""
+    usage = usage or {}
+    details = usage.get("completion_tokens_details") or {}
+    return {
+        "prompt_tokens": int(usage.get("prompt_tokens") or 0),
+        "completion_tokens": int(usage.get("completion_tokens") or 0),
+        "reasoning_tokens": int(details.get("reasoning_tokens") or usage.get("reasoning_tokens") or 0),
+    }
+
+
+def _empty_totals() -> Dict:
+    return {
+        "calls": 0,
+        "failed_calls": 0,
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+        "reasoning_tokens": 0,
+        "total_tokens": 0,
+        "payload_bytes": 0,
+        "latency": 0.0,
+        "cost": 0.0,
+        "answered_calls": 0,
+        "first_answer_latency": 0.0,
+    }
+
+
+def _add(totals: Dict, record: Dict):
+    totals["calls"] += 1
+    if not record["ok"]:
+        totals["failed_calls"] += 1
+    for key in ("prompt_tokens", "completion_tokens", "reasoning_tokens", "payload_bytes"):
+        totals[key] += record[key]
+    totals["total_tokens"] += record["prompt_tokens"] + record["completion_tokens"]
+    totals["latency"] += record["latency"]
+    totals["cost"] += record["cost"]
+    if record.get("first_answer_latency") is not None:
+        totals["answered_calls"] += 1
+        totals["first_answer_latency"] += record["first_answer_latency"]
+
+
+def _rounded(totals: Dict) -> Dict:
+    answered = totals["answered_calls"]
+    return dict(totals, latency=round(totals["latency"], 3), cost=round(totals["cost"], 6),
+                first_answer_latency=round(totals["first_answer_latency"], 3),
+                avg_first_answer_latency=round(totals["first_answer_latency"] / answered, 3) if answered else None)
+
+
+class Meter:
+    """
+    统一计量：每次模型调用（含失败的尝试）记录一条 prompt/completion/reasoning token、延迟、请求体大小与模型
+    记录时带上当前作用域（app/page/phase/page_class），可按应用、页面、页面类别与整次爬取汇总
+    流式调用另记录首个回答token的时间（不含推理过程），即用户可见的首字延迟
+    """
+
+    def __init__(self):
+        self.records: List[Dict] = []
+        self._scope: Dict[str, Optional[str]] = {"app": None, "page": None, "phase": None, "page_class": None}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    # ---- 作用域 ----
+
+    def set_scope(self, **scope):
+        """设置当前作用域（如 app=包名, page=页面路径）；执行层线程池中的调用同样归属该作用域"""
+        with self._lock:
+            self._scope.update(scope)
+
+    def current_scope(self) -> Dict[str, Optional[str]]:
+        with self._lock:
+            return dict(self._scope)
+
+    @contextmanager
+    def scope(self, **scope):
+        with self._lock:
+            previous = {k: self._scope.get(k) for k in scope}
+            self._scope.update(scope)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._scope.update(previous)
+
+    # ---- 单次调用 ----
+
+    def begin_call(self):
+        """执行层在发出请求前调用，之后 send 内通过 report_usage / report_payload 补充信息"""
+        self._local.usage = None
+        self._local.payload_bytes = 0
+        self._local.started = time.time()
+        self._local.first_answer = None
+
+    def report_usage(self, usage: Optional[Dict]):
+        """流式响应在最后一个 chunk 中拿到 usage 时调用"""
+        if usage:
+            self._local.usage = usage
+
+    def report_payload(self, payload_bytes: int):
+        self._local.payload_bytes = getattr(self._local, "payload_bytes", 0) + payload_bytes
+
+    def report_first_answer(self):
+        """流式响应收到第一个回答片段（推理片段之后）时调用，只记录第一次"""
+        started = getattr(self._local, "started", None)
+        if started is not None and getattr(self._local, "first_answer", None) is None:
+            self._local.first_answer = round(time.time() - started, 4)
+
+    def end_call(self, model: str, endpoint: str, latency: float, ok: bool,
+                 result=None) -> Dict:
+        """记录一次调用；非流式响应直接从结果的 usage 字段取 token 数"""
+        usage = getattr(self._local, "usage", None)
+        if usage is None and isinstance(result, dict) and isinstance(result.get("usage"), dict):
+            usage = result["usage"]
+        tokens = parse_usage(usage)
+        with self._lock:
+            record = dict(
+                self._scope,
+                model=model,
+                endpoint=endpoint,
+                latency=latency,
+                ok=ok,
+                payload_bytes=getattr(self._local, "payload_bytes", 0),
+                first_answer_latency=getattr(self._local, "first_answer", None),
+                cost=call_cost(model, tokens["prompt_tokens"], tokens["completion_tokens"]),
+                timestamp=time.time(),
+                **tokens,
+            )
+            self.records.append(record)
+        self._local.usage = None
+        self._local.payload_bytes = 0
+        self._local.first_answer = None
+        return record
+
+    # ---- 汇总 ----
+
+    def total_tokens(self, **filters) -> int:
+        with self._lock:
+            return sum(r["prompt_tokens"] + r["completion_tokens"] for r in self.records
+                       if all(r.get(k) == v for k, v in filters.items()))
+
+    def summary(self, app: Optional[str] = None) -> Dict:
+        """整次爬取（或只看某个 app）的汇总：总计 + 按模型 / 按页面 / 按阶段 / 按页面类别"""
+        with self._lock:
+            records = [r for r in self.records if app is None or r["app"] == app]
+
+        totals = _empty_totals()
+        groups = {"by_model": {}, "by_app": {}, "by_page": {}, "by_phase": {}, "by_page_class": {}}
+        for record in records:
+            _add(totals, record)
+            for group, key in (("by_model", "model"), ("by_app", "app"),
+                               ("by_page", "page"), ("by_phase", "phase"),
+                               ("by_page_class", "page_class")):
+                name = record.get(key)
+                if name is None:
+                    continue
+                _add(groups[group].setdefault(name, _empty_totals()), record)
+
+        summary = {"totals": _rounded(totals)}
+        for group, items in groups.items():
+            summary[group] = {name: _rounded(t) for name, t in items.items()}
+        return summary
+
+    def reset(self):
+        with self._lock:
+            self.records.clear()
+
+
+meter = Meter()
+
+
+def set_scope(**scope):
+    meter.set_scope(**scope)
+
+
+def metering_scope(**scope):
+    return meter.scope(**scope)
+
+
+def report_usage(usage: Optional[Dict]):
+    meter.report_usage(usage)
+
+
+def report_payload(payload_bytes: int):
+    meter.report_payload(payload_bytes)
+
+
+def report_first_answer():
+    meter.report_first_answer()
+
+
+def metering_summary(app: Optional[str] = None) -> Dict:
+    return meter.summary(app)
@@ -0,0 +1,307 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+import xml.etree.ElementTree as ET
+from typing import Any, Callable, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+# 加载环境变量
+load_dotenv()
+
+# 级联配置：低于该置信度的结果升级到更贵的模型
+CASCADE_MIN_CONFIDENCE = float(os.getenv("CASCADE_MIN_CONFIDENCE", 0.7))
+# 层级校验：模型返回的文字中至少有该比例能在界面层级里找到
+CASCADE_MIN_TEXT_MATCH = float(os.getenv("CASCADE_MIN_TEXT_MATCH", 0.6))
+CASCADE_STATS_PATH = os.getenv("CASCADE_STATS_PATH", "cascade_stats.json")
+
+# 每个层级最多保留的延迟样本数
+MAX_LATENCY_SAMPLES = 1000
+
+logger = logging.getLogger(__name__)
+
+_BOUNDS_PATTERN = re.compile(r'\[(\d+),(\d+)\]\[(\d+),(\d+)\]')
+_CHECKABLE_CLASSES = ("Switch", "CheckBox", "ToggleButton")
+
+
+def cascade_tiers(env_name: str, default: List[str]) -> List[str]:
+    """从环境变量读取逗号分隔的模型列表（便宜的在前），未配置时使用默认值"""
+    value = os.getenv(env_name)
+    if not value:
+        return list(default)
+    return [m.strip() for m in value.split(",") if m.strip()]
+
+
+class ModelCascade:
+    """模型级联：依次尝试各层级模型，结果通过校验即返回，否则升级到下一层级"""
+
+    def __init__(self, name: str, tiers: List[str]):
+        self.name = name
+        self.tiers = tiers
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, Any]] = {}
+
+    def _tier_stats(self, model: str) -> Dict[str, Any]:
+        if model not in self._stats:
+            self._stats[model] = {"calls": 0, "accepted": 0, "latencies": []}
+        return self._stats[model]
+
+    def _record(self, model: str, accepted: bool, latency: float):
+        with self._lock:
+            stats = self._tier_stats(model)
+            stats["calls"] += 1
+            stats["accepted"] += int(accepted)
+            stats["latencies"].append(round(latency, 3))
+            del stats["latencies"][:-MAX_LATENCY_SAMPLES]
+
+    def run(self, call: Callable[[str], Any], validate: Callable[[Any], bool]) -> Any:
+        """
+        call(model) 发起一次模型调用并返回解析后的结果
+        validate(result) 判断结果是否可信；最后一层的结果无论是否通过校验都会返回
+        """
+        result = None
+        for i, model in enumerate(self.tiers):
+            start = time.time()
+            try:
+                candidate = call(model)
+            except Exception as e:
+                logger.error(f"[{self.name}] 模型 {model} 调用异常: {str(e)}")
+                candidate = None
+            try:
+                accepted = bool(validate(candidate))
+            except Exception:
+                accepted = False
+            self._record(model, accepted, time.time() - start)
+
+            if candidate is not None:
+                result = candidate
+            if accepted:
+                return candidate
+            if i < len(self.tiers) - 1:
+                logger.info(f"[{self.name}] 模型 {model} 结果未通过校验，升级到 {self.tiers[i + 1]}")
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        """各层级的调用次数、命中率与延迟统计"""
+        with self._lock:
+            snapshot = {m: dict(s, latencies=list(s["latencies"])) for m, s in self._stats.items()}
+        return {model: _summarize(s) for model, s in snapshot.items()}
+
+
+def _percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(p * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _summarize(stats: Dict[str, Any]) -> Dict[str, Any]:
+    latencies = stats["latencies"]
+    return {
+        "calls": stats["calls"],
+        "accepted": stats["accepted"],
+        "hit_rate": round(stats["accepted"] / stats["calls"], 3) if stats["calls"] else 0.0,
+        "avg_latency": round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+        "p50_latency": _percentile(latencies, 0.5),
+        "p95_latency": _percentile(latencies, 0.95),
+        "latencies": latencies,
+    }
+
+
+_cascades: Dict[str, ModelCascade] = {}
+_registry_lock = threading.Lock()
+
+
+def get_cascade(name: str, tiers: List[str]) -> ModelCascade:
+    """按名称获取共享的级联实例，同名检测器的多个实例共用一份统计"""
+    with _registry_lock:
+        if name not in _cascades:
+            _cascades[name] = ModelCascade(name, tiers)
+        return _cascades[name]
+
+
+def cascade_stats() -> Dict[str, Any]:
+    """所有级联的统计（不含原始延迟样本）"""
+    result = {}
+    for name, cascade in list(_cascades.items()):
+        result[name] = {
+            model: {k: v for k, v in s.items() if k != "latencies"}
+            for model, s in cascade.stats().items()
+        }
+    return result
+
+
+def export_cascade_stats(path: str = CASCADE_STATS_PATH):
+    """将本次运行的统计累加进 path 指向的JSON文件，便于在整个应用语料上调整阈值"""
+    merged: Dict[str, Dict[str, Dict[str, Any]]] = {}
+    if os.path.exists(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                merged = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            merged = {}
+
+    for name, cascade in list(_cascades.items()):
+        for model, s in cascade.stats().items():
+            old = merged.setdefault(name, {}).get(model, {"calls": 0, "accepted": 0, "latencies": []})
+            combined = {
+                "calls": old.get("calls", 0) + s["calls"],
+                "accepted": old.get("accepted", 0) + s["accepted"],
+                "latencies": (old.get("latencies", []) + s["latencies"])[-MAX_LATENCY_SAMPLES:],
+            }
+            merged[name][model] = _summarize(combined)
+
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(merged, f, ensure_ascii=False, indent=2)
+    logger.info(f"级联统计已写入: {path}")
+
+
+def _parse_bounds(bounds: str) -> Optional[List[int]]:
+    match = _BOUNDS_PATTERN.match(bounds or "")
+    return list(map(int, match.groups())) if match else None
+
+
+def hierarchy_texts(hierarchy_xml: str) -> List[str]:
+    """提取界面层级中所有非空的 text / content-desc"""
+    texts = []
+    try:
+        root = ET.fromstring(hierarchy_xml)
+    except ET.ParseError:
+        return texts
+    for elem in root.iter():
+        for attr in ("text", "content-desc"):
+            value = (elem.get(attr) or "").strip()
+            if value:
+                texts.append(value)
+    return texts
+
+
+def _normalize_text(text: str) -> str:
+    return re.sub(r'\s+', '', text or "")
+
+
+def text_in_hierarchy(text: str, texts: List[str]) -> bool:
+    """模型返回的文字是否出现在层级中（双向包含，忽略空白）"""
+    target = _normalize_text(text)
+    if not target:
+        return False
+    for t in texts:
+        candidate = _normalize_text(t)
+        if target in candidate or (len(candidate) >= 2 and candidate in target):
+            return True
+    return False
+
+
+def validate_confidence(result: Optional[Dict], key: str = "confidence",
+                        min_confidence: float = CASCADE_MIN_CONFIDENCE) -> bool:
+    """结果存在且置信度字段不低于阈值"""
+    if not isinstance(result, dict):
+        return False
+    try:
+        return float(result.get(key, 0)) >= min_confidence
+    except (TypeError, ValueError):
+        return False
+
+
+def validate_detection_box(result: Optional[Dict], hierarchy_xml: Optional[str] = None,
+                           min_confidence: float = CASCADE_MIN_CONFIDENCE) -> bool:
+    """
+    校验 {"box_2d": [y1,x1,y2,x2], "label": ..., "confidence": ...} 格式的检测结果：
+    坐标合法、置信度达标（若返回了置信度），并且框中心落在层级中的某个可点击组件内
+    """
+    if not isinstance(result, dict):
+        return False
+    box = result.get("box_2d")
+    if not isinstance(box, list) or len(box) != 4:
+        return False
+    try:
+        y1, x1, y2, x2 = [float(v) for v in box]
+    except (TypeError, ValueError):
+        return False
+    if not (0 <= y1 < y2 <= 1000 and 0 <= x1 < x2 <= 1000):
+        return False
+    if "confidence" in result and not validate_confidence(result, min_confidence=min_confidence):
+        return False
+    if not hierarchy_xml:
+        return True
+
+    try:
+        root = ET.fromstring(hierarchy_xml)
+    except ET.ParseError:
+        return True
+    nodes = [(_parse_bounds(e.get("bounds")), e.get("clickable") == "true") for e in root.iter()]
+    nodes = [(b, c) for b, c in nodes if b]
+    if not nodes:
+        return True
+    screen_w = max(b[2] for b, _ in nodes)
+    screen_h = max(b[3] for b, _ in nodes)
+    cx = (x1 + x2) / 2 / 1000 * screen_w
+    cy = (y1 + y2) / 2 / 1000 * screen_h
+    for (left, top, right, bottom), clickable in nodes:
+        area = (right - left) * (bottom - top)
+        if clickable and left <= cx <= right and top <= cy <= bottom \
+                and area < 0.25 * screen_w * screen_h:
+            return True
+    return False
+
+
+def _analysis_items(result: Dict) -> Optional[tuple]:
+    personalization = result.get("personalization", {})
+    if not isinstance(personalization, dict):
+        return None
+    switches = result.get("switches", []) + personalization.get("switches", [])
+    layouts = result.get("layouts", []) + personalization.get("layouts", [])
+    return switches, layouts
+
+
+def validate_analysis_result(result: Optional[Dict], hierarchy_xmls: Optional[List[str]] = None,
+                             min_text_match: float = CASCADE_MIN_TEXT_MATCH,
+                             require_recommendation: bool = True) -> bool:
+    """
+    校验隐私分析结果：字段结构合法；返回的开关/布局文字大部分能在层级中找到；
+    层级中存在开关控件时输出却为空视为可疑
+    require_recommendation 为 False 时（结构模式，推荐状态在校验通过后才补全）开关可以没有 recommended_state
+    """
+    if not isinstance(result, dict) or not result:
+        return False
+    try:
+        items = _analysis_items(result)
+    except TypeError:
+        return False
+    if items is None:
+        return False
+    switches, layouts = items
+    for sw in switches:
+        if not isinstance(sw, dict) or not sw.get("text"):
+            return False
+        if sw.get("current_state") not in ("on", "off"):
+            return False
+        if require_recommendation and sw.get("recommended_state") not in ("on", "off"):
+            return False
+    for layout in layouts:
+        if not isinstance(layout, dict) or not layout.get("text"):
+            return False
+    if not hierarchy_xmls:
+        return True
+
+    texts = [t for xml in hierarchy_xmls for t in hierarchy_texts(xml)]
+    returned = [item["text"] for item in switches + layouts]
+    if not returned:
+        has_toggle = any(
+            any(c in (elem.get("class") or "") for c in _CHECKABLE_CLASSES)
+            for xml in hierarchy_xmls for elem in _iter_nodes(xml)
+        )
+        return not has_toggle
+    matched = sum(1 for text in returned if text_in_hierarchy(text, texts))
+    return matched / len(returned) >= min_text_match
+
+
+def _iter_nodes(hierarchy_xml: str):
+    try:
+        return list(ET.fromstring(hierarchy_xml).iter())
+    except ET.ParseError:
+        return []
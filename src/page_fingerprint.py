@@ -0,0 +1,97 @@
+import glob
+import hashlib
+import json
+import logging
+import os
+import re
+import xml.etree.ElementTree as ET
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 不属于应用本身的界面（状态栏、输入法等）
+IGNORED_PACKAGES = ("com.android.systemui", "com.google.android.inputmethod", "com.sohu.inputmethod")
+
+
+def _normalize_text(text: str) -> str:
+    """数字（缓存大小、时间、计数等）每次打开都可能不同，统一替换后再参与指纹"""
+    return re.sub(r"\d+(\.\d+)?", "#", text.strip())
+
+
+def structural_fingerprint(hierarchy_xmls: List[str]) -> Optional[str]:
+    """
+    页面的结构指纹：各屏界面层级中节点的 class、resource-id、文字、content-desc，以及可勾选控件的 checked 状态
+    不含坐标，滚动位置不同不影响指纹；相邻两屏重叠部分的节点按首次出现去重
+    开关状态计入指纹，复用的分析结果中 current_state 才不会过时
+    """
+    signature = []
+    seen = set()
+    for xml in hierarchy_xmls:
+        try:
+            root = ET.fromstring(xml)
+        except ET.ParseError:
+            continue
+        for elem in root.iter("node"):
+            if (elem.get("package") or "").startswith(IGNORED_PACKAGES):
+                continue
+            entry = (
+                elem.get("class", ""),
+                elem.get("resource-id", ""),
+                _normalize_text(elem.get("text", "")),
+                _normalize_text(elem.get("content-desc", "")),
+                elem.get("checked", "") if elem.get("checkable") == "true" else "",
+            )
+            if entry == ("", "", "", "", "") or entry in seen:
+                continue
+            seen.add(entry)
+            signature.append("|".join(entry))
+    if not signature:
+        return None
+    return hashlib.sha1("\n".join(signature).encode("utf-8")).hexdigest()[:16]
+
+
+def _labels(hierarchy_xml: str) -> List[str]:
+    try:
+        root = ET.fromstring(hierarchy_xml)
+    except ET.ParseError:
+        return []
+    labels = []
+    for elem in root.iter("node"):
+        if (elem.get("package") or "").startswith(IGNORED_PACKAGES):
+            continue
+        for text in (elem.get("text", ""), elem.get("content-desc", "")):
+            if text.strip():
+                labels.append(text.strip())
+    return labels
+
+
+def page_labels(hierarchy_xmls: List[str]) -> frozenset:
+    """
+    页面各屏出现过的全部文字，作为与滚动位置无关的页面标识，用于确认返回后所在的页面
+    数字不做归一化：各级页面常以编号区分（“通知 1” / “通知 2”），少量会变化的数字由比对时的重叠比例容忍
+    """
+    return frozenset(label for xml in hierarchy_xmls for label in _labels(xml))
+
+
+def screen_matches(hierarchy_xml: str, labels: frozenset, min_overlap: float = 0.6) -> bool:
+    """当前屏幕上的文字至少有 min_overlap 的比例出现在页面的文字集合中（屏幕可能停在页面的任意滚动位置）"""
+    visible = set(_labels(hierarchy_xml))
+    if not visible:
+        return not labels
+    return len(visible & labels) / len(visible) >= min_overlap
+
+
+def latest_output(app_package: str, output_dir: str = "all_paths_results") -> Optional[str]:
+    """该应用最近一次爬取的输出文件（不含同名的 .tree.json 树形输出，其中没有 pages）"""
+    files = sorted(f for f in glob.glob(os.path.join(output_dir, f"{app_package.replace('.', '_')}_*.json"))
+                   if not f.endswith(".tree.json"))
+    return files[-1] if files else None
+
+
+def load_baseline_pages(output_path: str) -> Dict[str, Dict]:
+    """读取上一次输出文件中的 pages（页面路径 -> 指纹与分析结果）；旧版本的输出没有该字段，返回空"""
+    with open(output_path, "r", encoding="utf-8") as f:
+        pages = json.load(f).get("pages", {})
+    if not pages:
+        logger.warning(f"{output_path} 中没有页面指纹，无法增量爬取")
+    return pages
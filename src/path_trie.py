@@ -0,0 +1,86 @@
+import json
+import sys
+from typing import IO, Dict, Iterator, List, Optional
+
+# 每个页面节点上挂载的三类结果
+PRIVACY_SWITCHES = "privacy_switches"
+PERSONALITY_SWITCHES = "personality_switches"
+PERSONALITY_LAYOUTS = "personality_layouts"
+KINDS = (PRIVACY_SWITCHES, PERSONALITY_SWITCHES, PERSONALITY_LAYOUTS)
+
+
+class PathTrie:
+    """
+    探索结果的路径树：每个页面（导航前缀节点或列表项）只存一个节点，记录父节点 ID、文字与该页面上找到的开关
+    相同前缀只存一份，内存与输出大小随不同页面数增长，而不是随 深度 × 开关数 增长
+    需要旧版展平格式时，由 paths() 按需还原出每个开关的完整路径
+    """
+
+    def __init__(self):
+        # 节点 0 为虚拟根节点
+        self.nodes: List[Dict] = [{"id": 0, "parent": None, "text": ""}]
+        self._children: Dict[tuple, int] = {}
+
+    def clear(self):
+        self.__init__()
+
+    def child(self, parent: int, text: str, bounds: Optional[str] = None) -> int:
+        """parent 下文字为 text 的子节点，不存在时创建；文字做字符串驻留，重复的标签只占一份内存"""
+        key = (parent, text)
+        node_id = self._children.get(key)
+        if node_id is None:
+            node_id = len(self.nodes)
+            node = {"id": node_id, "parent": parent, "text": sys.intern(text)}
+            if bounds is not None:
+                node["bounds"] = bounds
+            self.nodes.append(node)
+            self._children[key] = node_id
+        return node_id
+
+    def add_path(self, nodes: List[Dict], parent: int = 0) -> int:
+        """按顺序插入 [{"text", "bounds"?}, ...]，返回最后一个节点的 ID"""
+        for node in nodes:
+            parent = self.child(parent, node["text"], node.get("bounds"))
+        return parent
+
+    def add(self, node_id: int, kind: str, entry: Dict):
+        """在页面节点上记录一个开关（kind 为 KINDS 之一；个性化布局只有 text）"""
+        self.nodes[node_id].setdefault(kind, []).append(entry)
+
+    def count(self, kind: str) -> int:
+        return sum(len(node.get(kind, ())) for node in self.nodes)
+
+    def path_nodes(self, node_id: int) -> List[Dict]:
+        """从根到该节点的路径（旧版格式的节点字典：text 与可选的 bounds）"""
+        path = []
+        while node_id:
+            node = self.nodes[node_id]
+            path.append({"text": node["text"], **({"bounds": node["bounds"]} if "bounds" in node else {})})
+            node_id = node["parent"]
+        path.reverse()
+        return path
+
+    def paths(self, kind: str) -> Iterator[List[Dict]]:
+        """按记录顺序还原旧版的展平路径：页面路径 + 开关节点"""
+        for node in self.nodes:
+            entries = node.get(kind)
+            if not entries:
+                continue
+            prefix = self.path_nodes(node["id"])
+            for entry in entries:
+                yield prefix + [dict(entry)]
+
+    def to_dict(self) -> Dict:
+        return {"nodes": [node for node in self.nodes[1:]]}
+
+    def write(self, f: IO[str], extra: Optional[Dict] = None):
+        """流式写出树形 JSON：逐个节点序列化，不在内存中拼出整份文档"""
+        f.write("{")
+        for key, value in (extra or {}).items():
+            f.write(f"{json.dumps(key)}: {json.dumps(value, ensure_ascii=False)},\n")
+        f.write('"nodes": [\n')
+        for i, node in enumerate(self.nodes[1:]):
+            if i:
+                f.write(",\n")
+            f.write(json.dumps(node, ensure_ascii=False))
+        f.write("\n]}\n")
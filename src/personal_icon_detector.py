@@ -3,7 +3,6 @@ from PIL import Image, ImageDraw
 import io
 import json
 import os
-import re
 import time
 import base64
 import requests
@@ -11,17 +10,30 @@ from typing import List, Dict, Optional
 from pydantic import BaseModel
 from io import BytesIO
 
+from llm_request import Endpoint, check_response, gemini_executor
+from metering import report_payload, report_usage
+from tracing import mark_first_token
+from model_cascade import get_cascade, cascade_tiers, validate_detection_box
+from structured_output import DetectionList, gemini_reask, parse_response
+
 
 class PersonalIconDetector:
     def __init__(self, api_key: str):
         self.api_key = api_key
-        self.total_prompt_tokens = 0
-        self.total_candidates_tokens = 0
-        self.total_total_tokens = 0
         self.model = "gemini-2.5-flash-preview-05-20"
         self.api_base = "http://jeniya.cn"
+        self.cascade = get_cascade(
+            "personal_icon", cascade_tiers("GEMINI_CASCADE_MODELS", [self.model, "gemini-2.5-pro"])
+        )
+
+    def detect_ui_elements(self, image_bytes: bytes, hierarchy_xml: Optional[str] = None) -> Optional[Dict]:
+        """级联检测：先用便宜模型，结果未通过校验（坐标/置信度/层级比对）时升级到更强的模型"""
+        return self.cascade.run(
+            lambda model: self._request_ui_elements(image_bytes, model),
+            lambda result: validate_detection_box(result, hierarchy_xml)
+        )
 
-    def detect_ui_elements(self, image_bytes: bytes) -> Optional[Dict]:
+    def _request_ui_elements(self, image_bytes: bytes, model: str) -> Optional[Dict]:
         prompt = """请你严格按照以下指示步骤工作：
         你需要完成的工作是：
         （1）严格检测手机应用中指向个人中心或"我的"页面的图标或文字元素
@@ -39,8 +51,10 @@ class PersonalIconDetector:
         ### 你必须输出的JSON数据 ###
         [{
             "box_2d": [y1,x1,y2,x2],
-            "label": "personal icon/text"
+            "label": "personal icon/text",
+            "confidence": 0.9
         }]
+        confidence 为你对检测结果的置信度（0-1）。
         请先严格按照思考过程进行思考（你的思考过程也要输出！），然后输出正确的JSON数据。"""
 
         def encode_compressed_image(image_bytes: bytes, quality=20) -> str:
@@ -52,9 +66,10 @@ class PersonalIconDetector:
         try:
             image_base64 = encode_compressed_image(image_bytes)
 
-            payload = json.dumps({
-                "model": self.model,
+            payload = {
+                "model": model,
                 "stream": True,
+                "stream_options": {"include_usage": True},
                 "messages": [
                     {
                         "role": "user",
@@ -68,55 +83,49 @@ class PersonalIconDetector:
                 ],
                 "temperature": 0.2,
                 "max_tokens": 8000
-            })
-
-            headers = {
-                'Accept': 'application/json',
-                'Content-Type': 'application/json',
-                'Authorization': f'Bearer {self.api_key}'
             }
 
-            full_content = ""
-            with requests.post(
-                    f"{self.api_base}/v1/chat/completions",
-                    headers=headers,
-                    data=payload,
-                    timeout=100,
-                    stream=True
-            ) as response:
-                if response.status_code != 200:
-                    return None
-
-                for line in response.iter_lines():
-                    if line:
-                        line_str = line.decode('utf-8')
-                        if line_str.startswith('data:'):
-                            json_str = line_str[5:].strip()
-                            if json_str == "[DONE]":
-                                continue
-                            try:
-                                chunk_data = json.loads(json_str)
-                                if 'choices' in chunk_data and chunk_data['choices']:
-                                    delta = chunk_data['choices'][0].get('delta', {})
-                                    content = delta.get('content', '')
-                                    full_content += content
-                            except json.JSONDecodeError:
-                                pass
+            def send(endpoint: Endpoint, timeout: float) -> str:
+                full_content = ""
+                body = json.dumps(dict(payload, model=endpoint.model))
+                report_payload(len(body))
+                with requests.post(
+                        endpoint.chat_url,
+                        headers=endpoint.headers(),
+                        data=body,
+                        timeout=timeout,
+                        stream=True
+                ) as response:
+                    check_response(response)
 
-            json_match = re.search(r"```json\s*([\s\S]+?)\s*```", full_content)
+                    for line in response.iter_lines():
+                        if line:
+                            line_str = line.decode('utf-8')
+                            if line_str.startswith('data:'):
+                                json_str = line_str[5:].strip()
+                                if json_str == "[DONE]":
+                                    continue
+                                try:
+                                    chunk_data = json.loads(json_str)
+                                    report_usage(chunk_data.get('usage'))
+                                    if 'choices' in chunk_data and chunk_data['choices']:
+                                        delta = chunk_data['choices'][0].get('delta', {})
+                                        content = delta.get('content') or ''
+                                        if content:
+                                            mark_first_token()
+                                        full_content += content
+                                except json.JSONDecodeError:
+                                    pass
+                return full_content
 
-            if not json_match:
-                return None
-
-            json_str = json_match.group(1).strip()
-
-            try:
-                detections = json.loads(json_str)
-                if detections and isinstance(detections, list) and len(detections) > 0:
-                    return detections[0]
-                return None
-            except Exception:
+            full_content = gemini_executor(self.api_key, model, self.api_base).execute(
+                send, lambda content: bool(content)
+            )
+            # 回答不合法时先本地修复，仍失败再交给便宜的文字模型整理，不重新发送截图
+            detections = parse_response(full_content, DetectionList, reask=gemini_reask(self.api_key, self.api_base))
+            if not detections or not detections.root:
                 return None
+            return detections.root[0].model_dump(exclude_none=True)
 
         except Exception:
             return None
\ No newline at end of file
@@ -0,0 +1,359 @@
+import logging
+import os
+import re
+import threading
+import xml.etree.ElementTree as ET
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+from PIL import Image
+
+from page_fingerprint import IGNORED_PACKAGES
+from tracing import tracer, traced_sleep
+
+# 加载环境变量
+load_dotenv()
+
+# 在本地由截图亮度与界面层级判断弹窗（底部弹窗 / 对话框），不再只依赖模型的 isPopup
+POPUP_DETECTION = os.getenv("POPUP_DETECTION", "true").lower() == "true"
+# 遮罩行的平均亮度低于页面亮部（行亮度的 90 分位）的该比例时视为变暗
+POPUP_DIM_RATIO = float(os.getenv("POPUP_DIM_RATIO", 0.6))
+# 亮部亮度低于该值（0-255）时（深色主题）不用截图判断，只看层级
+POPUP_MIN_BRIGHTNESS = float(os.getenv("POPUP_MIN_BRIGHTNESS", 120))
+# 关闭弹窗后等待界面变化的最长时间与轮询间隔（秒）
+POPUP_DISMISS_TIMEOUT = float(os.getenv("POPUP_DISMISS_TIMEOUT", 2.0))
+POPUP_POLL_INTERVAL = float(os.getenv("POPUP_POLL_INTERVAL", 0.2))
+
+logger = logging.getLogger(__name__)
+
+# 截图已裁剪为本地检测到的弹窗区域时附加在提示词末尾的说明
+POPUP_REGION_NOTE = "\n\n截图只包含已在本地确认的弹窗区域，isPopup 输出 true，只需提取弹窗内的开关与列表项。"
+
+_BOUNDS_PATTERN = re.compile(r'\[(-?\d+),(-?\d+)\]\[(-?\d+),(-?\d+)\]')
+# 截图按该步长抽样计算亮度，足以判断遮罩又不必处理整张图
+_SAMPLE_STEP = 4
+# 遮罩可以从状态栏下方开始；对话框下方可能露出导航栏
+_TOP_ALLOWANCE = 0.08
+_BOTTOM_ALLOWANCE = 0.06
+# 弹窗区域至少占屏幕高度的比例，遮罩至少占的比例
+_MIN_POPUP_HEIGHT = 0.1
+_MIN_SCRIM_HEIGHT = 0.12
+# 带文字的节点至少有该比例落在弹窗区域内，截图判断才成立（排除深色头图等普通页面）
+_MIN_LABELS_INSIDE = 0.9
+# 系统与常见组件库中弹窗容器、遮罩与对话框面板的 resource-id
+_SHEET_IDS = ("design_bottom_sheet", "bottom_sheet")
+_SCRIM_IDS = ("touch_outside",)
+_DIALOG_IDS = ("parentPanel", "dialog_root", "dialog_container")
+_CLOSE_LABELS = ("关闭", "取消", "知道了", "我知道了", "暂不", "以后再说", "close", "cancel", "×", "✕", "x")
+
+
+def _bounds(elem) -> Optional[List[int]]:
+    match = _BOUNDS_PATTERN.match(elem.get("bounds") or "")
+    return list(map(int, match.groups())) if match else None
+
+
+def _resource_name(elem) -> str:
+    return (elem.get("resource-id") or "").rsplit("/", 1)[-1]
+
+
+def _app_nodes(hierarchy_xml: str, top_level: bool = False) -> List:
+    """层级中属于应用（不含状态栏、输入法等系统窗口）的节点；top_level 时只取各窗口的根节点"""
+    try:
+        root = ET.fromstring(hierarchy_xml)
+    except ET.ParseError:
+        return []
+    nodes = list(root) if top_level else root.iter("node")
+    return [elem for elem in nodes
+            if not (elem.get("package") or "").startswith(IGNORED_PACKAGES) and _bounds(elem) is not None]
+
+
+def _kind(bounds: List[int], height: int) -> str:
+    return "bottom_sheet" if bounds[3] >= height * (1 - _BOTTOM_ALLOWANCE) and bounds[1] > height * 0.1 \
+        else "dialog"
+
+
+# ---- 截图 ----
+
+def _luminance(image: Image.Image) -> np.ndarray:
+    pixels = np.asarray(image.convert("RGB"), dtype=np.float32)[::_SAMPLE_STEP, ::_SAMPLE_STEP]
+    return pixels @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+def _longest_run(mask: np.ndarray) -> Tuple[int, int]:
+    """布尔数组中最长的连续 True 区间 [start, end)；没有时返回 (0, 0)"""
+    best, start = (0, 0), None
+    for i, value in enumerate(np.append(mask, False)):
+        if value and start is None:
+            start = i
+        elif not value and start is not None:
+            if i - start > best[1] - best[0]:
+                best = (start, i)
+            start = None
+    return best
+
+
+def image_popup_region(image: Image.Image) -> Optional[List[int]]:
+    """
+    由截图判断弹窗：弹窗以外的区域被半透明遮罩整体压暗，弹窗本身保持原有亮度
+    按行（再在弹窗行内按列）比较平均亮度与页面亮部的比值，返回弹窗的像素坐标 [left, top, right, bottom]
+    深色主题（亮部本身很暗）无法判断，返回 None
+    """
+    lum = _luminance(image)
+    rows, cols = lum.shape
+    if rows < 10 or cols < 10:
+        return None
+    row_mean = lum.mean(axis=1)
+    bright = float(np.percentile(row_mean, 90))
+    if bright < POPUP_MIN_BRIGHTNESS:
+        return None
+    dim = row_mean < bright * POPUP_DIM_RATIO
+
+    start, end = _longest_run(~dim)
+    if end - start < rows * _MIN_POPUP_HEIGHT:
+        return None
+    # 弹窗之外的行（忽略状态栏与导航栏）必须几乎全部被压暗
+    outside = np.concatenate([dim[int(rows * _TOP_ALLOWANCE):start], dim[end:int(rows * (1 - _BOTTOM_ALLOWANCE))]])
+    if outside.size < rows * _MIN_SCRIM_HEIGHT or outside.mean() < 0.95:
+        return None
+    # 遮罩下的内容与弹窗要有明显对比，排除整体偏暗但亮度均匀的页面
+    if float(np.median(row_mean[~dim])) < float(np.median(row_mean[dim])) / POPUP_DIM_RATIO:
+        return None
+
+    # 弹窗行内按列找亮的区间：对话框两侧同样是遮罩
+    col_mean = lum[start:end].mean(axis=0)
+    left, right = _longest_run(col_mean >= float(np.percentile(col_mean, 90)) * POPUP_DIM_RATIO)
+    if right - left < cols * 0.3:
+        return None
+    scale_x, scale_y = image.width / cols, image.height / rows
+    return [round(left * scale_x), round(start * scale_y), min(image.width, round(right * scale_x)),
+            min(image.height, round(end * scale_y))]
+
+
+# ---- 层级 ----
+
+def hierarchy_popup_region(hierarchy_xml: str, width: int, height: int) -> Optional[List[int]]:
+    """
+    由层级判断弹窗：存在底部弹窗 / 对话框面板的容器节点，或应用的顶层窗口明显小于屏幕
+    返回弹窗的像素坐标；只有普通全屏页面时返回 None
+    """
+    nodes = _app_nodes(hierarchy_xml)
+    if not nodes:
+        return None
+    for elem in nodes:
+        name = _resource_name(elem)
+        if name in _SHEET_IDS or name in _DIALOG_IDS:
+            return _bounds(elem)
+    # 对话框窗口的根节点只有窗口本身大小；太小的窗口（悬浮按钮、Toast）不算
+    for elem in _app_nodes(hierarchy_xml, top_level=True):
+        box = _bounds(elem)
+        area = max(0, box[2] - box[0]) * max(0, box[3] - box[1])
+        if width * height * 0.15 <= area < width * height * 0.85 and box[3] - box[1] < height * 0.9:
+            return box
+    return None
+
+
+def _labels_inside(hierarchy_xml: str, region: List[int]) -> bool:
+    """带文字的叶子节点是否几乎都在 region 内（弹窗出现时遮罩下的页面不会出现在层级中或不可交互）"""
+    labeled = [_bounds(elem) for elem in _app_nodes(hierarchy_xml)
+               if not list(elem) and (elem.get("text") or elem.get("content-desc") or "").strip()]
+    if not labeled:
+        return True
+    inside = sum(1 for b in labeled
+                 if b[1] >= region[1] - 5 and b[3] <= region[3] + 5 and b[0] >= region[0] - 5 and b[2] <= region[2] + 5)
+    return inside / len(labeled) >= _MIN_LABELS_INSIDE
+
+
+def _labels_in(hierarchy_xml: str, region: List[int]) -> set:
+    """region 内带文字的叶子节点的文字"""
+    labels = set()
+    for elem in _app_nodes(hierarchy_xml):
+        text = (elem.get("text") or elem.get("content-desc") or "").strip()
+        b = _bounds(elem)
+        if list(elem) or not text or b is None:
+            continue
+        if b[1] >= region[1] - 5 and b[3] <= region[3] + 5 and b[0] >= region[0] - 5 and b[2] <= region[2] + 5:
+            labels.add(text)
+    return labels
+
+
+def _overlaps(a: List[int], b: List[int]) -> bool:
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+def popup_gone(hierarchy_xml: str, bounds: Optional[List[int]], labels: set, width: int, height: int) -> bool:
+    """
+    弹窗是否已关闭：层级中不再有与原弹窗重叠的弹窗容器 / 小窗口，且原弹窗内的文字大多已不在层级中
+    （界面变化可能只是弹窗内的动画、切换了选项卡或弹出了另一个弹窗）
+    """
+    region = hierarchy_popup_region(hierarchy_xml, width, height)
+    if region is not None and (bounds is None or _overlaps(region, bounds)):
+        return False
+    if not labels:
+        return True
+    remaining = labels & {(elem.get("text") or elem.get("content-desc") or "").strip()
+                          for elem in _app_nodes(hierarchy_xml)}
+    return len(remaining) / len(labels) < 0.5
+
+
+class PopupDetector:
+    """
+    本地弹窗检测与关闭
+    检测：层级中的弹窗容器 / 小窗口直接认定；截图中的遮罩需要层级佐证（带文字的节点都在弹窗内）
+    关闭：依次尝试弹窗内的关闭 / 取消按钮、点击遮罩区域、返回键，每一步都轮询层级直到确认弹窗已消失，
+    并优先使用本次爬取中最近成功过的方式
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.detected = {"image": 0, "hierarchy": 0, "both": 0}
+        self.pages = 0
+        # 本地未检测到、模型仍判断为弹窗的页面数（检测漏报的参考）
+        self.model_only = 0
+        self.dismissals: Dict[str, Dict[str, int]] = {}
+        self.preferred: Optional[str] = None
+
+    def detect(self, image: Optional[Image.Image], hierarchy_xml: Optional[str],
+               width: int, height: int) -> Optional[Dict]:
+        """返回 {"kind": bottom_sheet / dialog, "bounds": [l, t, r, b], "source": image / hierarchy / both}，不是弹窗返回 None"""
+        with tracer.span("popup_detect", "analysis"):
+            from_hierarchy = hierarchy_popup_region(hierarchy_xml, width, height) if hierarchy_xml else None
+            from_image = image_popup_region(image) if image is not None else None
+        if from_image is not None and hierarchy_xml and not _labels_inside(hierarchy_xml, from_image):
+            from_image = None
+        with self._lock:
+            self.pages += 1
+            if from_hierarchy is None and from_image is None:
+                return None
+            source = "both" if from_hierarchy and from_image else ("hierarchy" if from_hierarchy else "image")
+            self.detected[source] += 1
+        bounds = from_hierarchy or from_image
+        return {"kind": _kind(bounds, height), "bounds": bounds, "source": source}
+
+    def reset(self):
+        with self._lock:
+            self.detected = {"image": 0, "hierarchy": 0, "both": 0}
+            self.pages = 0
+            self.model_only = 0
+            self.dismissals = {}
+            self.preferred = None
+
+    def record_model_only(self):
+        with self._lock:
+            self.model_only += 1
+
+    # ---- 关闭 ----
+
+    def _close_button(self, nodes: List, bounds: Optional[List[int]]) -> Optional[Tuple[int, int]]:
+        for elem in nodes:
+            label = (elem.get("text") or elem.get("content-desc") or "").strip().lower()
+            if label not in _CLOSE_LABELS:
+                continue
+            box = _bounds(elem)
+            if bounds and not (bounds[0] <= (box[0] + box[2]) // 2 <= bounds[2]
+                               and bounds[1] <= (box[1] + box[3]) // 2 <= bounds[3]):
+                continue
+            return (box[0] + box[2]) // 2, (box[1] + box[3]) // 2
+        return None
+
+    def _outside_point(self, nodes: List, bounds: Optional[List[int]], width: int,
+                       height: int) -> Optional[Tuple[int, int]]:
+        """遮罩上的点：优先用 touch_outside 节点，否则取弹窗上方（或下方）空白的中点；不知道弹窗范围时沿用屏幕上部"""
+        for elem in nodes:
+            if _resource_name(elem) in _SCRIM_IDS:
+                box = _bounds(elem)
+                # touch_outside 通常铺满整个屏幕，只取其中弹窗上方的部分
+                bottom = bounds[1] if bounds and bounds[1] > box[1] else box[3]
+                return (box[0] + box[2]) // 2, (box[1] + bottom) // 2
+        if not bounds:
+            return width // 2, height // 9
+        if bounds[1] > height * _MIN_SCRIM_HEIGHT:
+            return width // 2, bounds[1] // 2
+        if bounds[3] < height * (1 - _MIN_SCRIM_HEIGHT):
+            return width // 2, (bounds[3] + height) // 2
+        return None
+
+    def _strategies(self, hierarchy_xml: str, bounds: Optional[List[int]], width: int, height: int) -> List:
+        nodes = _app_nodes(hierarchy_xml)
+        strategies = []
+        button = self._close_button(nodes, bounds)
+        if button:
+            strategies.append(("close_button", button))
+        outside = self._outside_point(nodes, bounds, width, height)
+        if outside:
+            strategies.append(("tap_outside", outside))
+        strategies.append(("back", None))
+        if self.preferred:
+            strategies.sort(key=lambda s: s[0] != self.preferred)
+        return strategies
+
+    def _record(self, strategy: str, ok: bool):
+        with self._lock:
+            counts = self.dismissals.setdefault(strategy, {"success": 0, "failed": 0})
+            counts["success" if ok else "failed"] += 1
+            if ok:
+                self.preferred = strategy
+
+    def dismiss(self, device, bounds: Optional[List[int]] = None) -> bool:
+        """关闭当前弹窗；每种方式执行后轮询层级，直到确认弹窗已消失（popup_gone）或超时，全部失败返回 False"""
+        width, height = device.window_size()
+        old_hierarchy = device.dump_hierarchy()
+        region = bounds or hierarchy_popup_region(old_hierarchy, width, height)
+        labels = _labels_in(old_hierarchy, region) if region else set()
+
+        def gone(hierarchy_xml: str) -> bool:
+            return popup_gone(hierarchy_xml, region, labels, width, height)
+
+        for strategy, point in self._strategies(old_hierarchy, bounds, width, height):
+            with tracer.span(f"dismiss:{strategy}", "device"):
+                if point is None:
+                    device.press("back")
+                else:
+                    device.click(*point)
+                closed = wait_for_change(device, old_hierarchy, done=gone)
+            self._record(strategy, closed)
+            if closed:
+                return True
+            # 未关闭但界面已变化（例如点中了弹窗内的其他选项）时，下一种方式以当前界面为准
+            old_hierarchy = device.dump_hierarchy()
+        logger.warning("弹窗关闭失败：关闭按钮、点击遮罩与返回键执行后弹窗仍在")
+        return False
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"pages": self.pages, "detected": dict(self.detected), "model_only": self.model_only,
+                    "dismissals": {k: dict(v) for k, v in self.dismissals.items()}}
+
+
+def crop_popup(screenshot_path: str, bounds: List[int], screen_height: int) -> str:
+    """
+    把长截图裁剪为弹窗区域，保存在原图旁边（文件名加 _popup），返回裁剪后的路径
+    弹窗内部可以滚动时长截图比屏幕高，弹窗下边界按与屏幕底部的距离换算
+    """
+    root, ext = os.path.splitext(screenshot_path)
+    popup_path = f"{root}_popup{ext}"
+    with Image.open(screenshot_path) as img:
+        bottom = img.height - max(0, screen_height - bounds[3])
+        img.crop((bounds[0], bounds[1], bounds[2], max(bounds[1] + 1, bottom))).save(popup_path)
+    return popup_path
+
+
+def wait_for_change(device, old_hierarchy: str, timeout: float = POPUP_DISMISS_TIMEOUT,
+                    interval: float = POPUP_POLL_INTERVAL,
+                    done: Optional[Callable[[str], bool]] = None) -> bool:
+    """轮询层级直到与 old_hierarchy 不同（且满足 done）；代替固定时长的等待"""
+    waited = 0.0
+    while waited < timeout:
+        traced_sleep(interval, "popup_poll")
+        waited += interval
+        hierarchy_xml = device.dump_hierarchy()
+        if hierarchy_xml != old_hierarchy and (done is None or done(hierarchy_xml)):
+            return True
+    return False
+
+
+detector = PopupDetector()
+
+
+def popup_stats() -> Dict:
+    return detector.stats()
@@ -2,78 +2,196 @@ from openai import OpenAI
 import base64
 from PIL import Image
 from io import BytesIO
+import itertools
 import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
 
-def analyze_privacy_switches(image_path: str, api_key: str, prompt_path: str, system_path: str) -> dict:
-    def encode_compressed_image(image_path, quality=40, max_size=9 * 1024 * 1024):
-        with Image.open(image_path) as img:
-            img = img.convert("RGB")  # JPEG 不支持透明通道
+from dotenv import load_dotenv
+
+from metering import meter, report_first_answer, report_payload, report_usage
+from structured_output import (QWEN_REASK_MODEL, PrivacyAnalysis, SwitchRecommendations, parse_dict,
+                               response_format)
+from popup_detector import POPUP_REGION_NOTE
+from switch_knowledge import STRUCTURE_ONLY_NOTE
+from tracing import tracer, mark_first_token
+from llm_request import Endpoint, qwen_executor, ANALYSIS_REQUEST_DEADLINE, ANALYSIS_ATTEMPT_TIMEOUT
+
+# 加载环境变量
+load_dotenv()
+
+# 推理模型的思考过程默认丢弃；开启时在后台线程写入 REASONING_LOG_DIR 供审计，不阻塞分析
+REASONING_LOG = os.getenv("REASONING_LOG", "false").lower() == "true"
+REASONING_LOG_DIR = os.getenv("REASONING_LOG_DIR", "reasoning_logs")
+
+_reasoning_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="reasoning-log")
+_reasoning_seq = itertools.count(1)
+
+# 知识库中没有的开关单独询问推荐状态时使用的提示词，后接开关文字的 JSON 数组
+RECOMMEND_PROMPT = (
+    "以下是应用设置中的若干开关文字。请从隐私保护角度给出每个开关的推荐状态与简明的推荐理由，"
+    "输出 JSON 对象，键为开关文字（与输入完全一致），值为 "
+    '{"recommended_state": "on" 或 "off", "analysis": "推荐理由"}，不要输出其他内容。\n'
+)
+
+def encode_compressed_image(image_path, quality=40, max_size=9 * 1024 * 1024):
+    with Image.open(image_path) as img:
+        img = img.convert("RGB")  # JPEG 不支持透明通道
+        buffered = BytesIO()
+        img.save(buffered, format="JPEG", quality=quality)
+        img_data = buffered.getvalue()
+        while len(img_data) > max_size and quality > 10:
+            quality -= 5
             buffered = BytesIO()
             img.save(buffered, format="JPEG", quality=quality)
             img_data = buffered.getvalue()
-            while len(img_data) > max_size and quality > 10:
-                quality -= 5
-                buffered = BytesIO()
-                img.save(buffered, format="JPEG", quality=quality)
-                img_data = buffered.getvalue()
-            return base64.b64encode(img_data).decode("utf-8")
+        return base64.b64encode(img_data).decode("utf-8")
+
+def _write_reasoning(model: str, scope: dict, reasoning: str):
+    os.makedirs(REASONING_LOG_DIR, exist_ok=True)
+    timestamp = time.strftime("%Y%m%d_%H%M%S", time.localtime())
+    path = os.path.join(REASONING_LOG_DIR, f"{timestamp}_{next(_reasoning_seq):04d}_{model}.txt")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(f"# model={model} app={scope.get('app')} page={scope.get('page')} phase={scope.get('phase')}\n")
+        f.write(reasoning)
+
+def _thinking_options(thinking_budget: Optional[int]) -> dict:
+    """按页面类别配置的思考预算：None 不指定（模型默认），0 关闭思考，正数为思考token上限"""
+    if thinking_budget is None:
+        return {}
+    if thinking_budget <= 0:
+        return {"extra_body": {"enable_thinking": False}}
+    return {"extra_body": {"enable_thinking": True, "thinking_budget": thinking_budget}}
+
+def _stream_answer(api_key: str, model: str, content: list, payload_bytes: int, estimated_tokens: int,
+                   schema=None, thinking_budget: Optional[int] = None) -> str:
+    """
+    流式调用模型，返回回答正文；模型支持时按 schema 附加 response_format
+    回答片段先放入列表最后拼接；思考过程只在开启 REASONING_LOG 时保留，并交给后台线程写文件
+    """
+
+    def send(endpoint: Endpoint, timeout: float) -> str:
+        reasoning_parts = []
+        answer_parts = []
+
+        # 重试由执行层负责，SDK 自身不再重试
+        client = OpenAI(
+            api_key=endpoint.api_key,
+            base_url=endpoint.base_url,
+            timeout=timeout,
+            max_retries=0,
+        )
+
+        report_payload(payload_bytes)
+        completion = client.chat.completions.create(
+            **(response_format(endpoint.model, schema) if schema is not None else {}),
+            **_thinking_options(thinking_budget),
+            model=endpoint.model,
+            messages=[
+                {
+                    "role": "user",
+                    "content": content,
+                },
+            ],
+            stream=True,
+            stream_options={"include_usage": True},
+            seed=1234,
+            temperature=0,
+        )
+
+        for chunk in completion:
+            if getattr(chunk, "usage", None):
+                report_usage(chunk.usage.model_dump())
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+            mark_first_token()
+            reasoning = getattr(delta, "reasoning_content", None)
+            if reasoning is not None:
+                if REASONING_LOG:
+                    reasoning_parts.append(reasoning)
+                continue
+            if not delta.content:
+                continue
+            if not answer_parts:
+                report_first_answer()
+            answer_parts.append(delta.content)
+
+        if reasoning_parts:
+            _reasoning_writer.submit(_write_reasoning, endpoint.model, meter.current_scope(), "".join(reasoning_parts))
+        return "".join(answer_parts)
+
+    executor = qwen_executor(api_key, model, deadline=ANALYSIS_REQUEST_DEADLINE,
+                             attempt_timeout=ANALYSIS_ATTEMPT_TIMEOUT, estimated_tokens=estimated_tokens)
+    return executor.execute(send, lambda content: bool(content))
+
+def _analyze(api_key: str, model: str, content: list, payload_bytes: int, estimated_tokens: int,
+             schema=PrivacyAnalysis, thinking_budget: Optional[int] = None) -> dict:
+    """
+    调用分析模型并把回答校验为 schema；图片与文字摘要两种输入共用
+    回答无法解析时只把原回答交给便宜的文字模型整理一次，不重新发送图片；仍失败返回 {}
+    """
+    answer_content = _stream_answer(api_key, model, content, payload_bytes, estimated_tokens, schema,
+                                    thinking_budget)
 
+    def reask(prompt: str) -> str:
+        return _stream_answer(api_key, QWEN_REASK_MODEL, [{"type": "text", "text": prompt}],
+                              len(prompt.encode("utf-8")), len(prompt) + 2000)
+
+    return parse_dict(answer_content, schema, reask=reask) or {}
+
+def analyze_privacy_switches(image_path: str, api_key: str, prompt_path: str, system_path: str,
+                             model: str = "qvq-max-latest", structure_only: bool = False,
+                             thinking_budget: Optional[int] = None, popup_region: bool = False) -> dict:
     # 读取提示词文件
     with open(prompt_path, "r", encoding="utf-8") as f:
         prompt_text = f.read()
+    # 结构模式：开关只要求 text 与 current_state，推荐状态与理由由知识库补全
+    if structure_only:
+        prompt_text += STRUCTURE_ONLY_NOTE
+    # 截图已裁剪为本地检测到的弹窗区域
+    if popup_region:
+        prompt_text += POPUP_REGION_NOTE
 
     with open(system_path, "r", encoding="utf-8") as f:
         system_text = f.read()
 
-    base64_image = encode_compressed_image(image_path)
-
-    reasoning_content = ""
-    answer_content = ""
-    is_answering = False
-
-    client = OpenAI(
-        api_key=api_key,
-        base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
-    )
-
-    completion = client.chat.completions.create(
-        model="qvq-max-latest",
-        messages=[
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "image_url",
-                        "image_url": {"url": f"data:image/png;base64,{base64_image}"},
-                    },
-                    {"type": "text", "text": prompt_text},
-                ],
-            },
-        ],
-        stream=True,
-        seed=1234,
-        temperature=0,
-    )
-
-    for chunk in completion:
-        if not chunk.choices:
-            pass
-        else:
-            delta = chunk.choices[0].delta
-            if hasattr(delta, 'reasoning_content') and delta.reasoning_content != None:
-                reasoning_content += delta.reasoning_content
-            else:
-                if delta.content != "" and is_answering is False:
-                    is_answering = True
-                answer_content += delta.content
-
-    cleaned_text = answer_content.strip()
-    if cleaned_text.startswith("```json"):
-        cleaned_text = cleaned_text[len("```json"):].strip()
-    if cleaned_text.endswith("```"):
-        cleaned_text = cleaned_text[:-len("```")].strip()
-
-    try:
-        return json.loads(cleaned_text)
-    except json.JSONDecodeError:
-        return {}
+    with tracer.span("encode_image", "image"):
+        base64_image = encode_compressed_image(image_path)
+
+    content = [
+        {
+            "type": "image_url",
+            "image_url": {"url": f"data:image/png;base64,{base64_image}"},
+        },
+        {"type": "text", "text": prompt_text},
+    ]
+    # 按图片与提示词大小预估token，供限流器预占额度（base64 约 4 字符 ≈ 3 字节，图片按 ~750 字节/token 估算）
+    estimated_tokens = len(base64_image) * 3 // 4 // 750 + len(prompt_text) + 2000
+    return _analyze(api_key, model, content, len(base64_image) + len(prompt_text.encode("utf-8")),
+                    estimated_tokens, thinking_budget=thinking_budget)
+
+def analyze_privacy_digest(digest: str, api_key: str, prompt_path: str, system_path: str,
+                           model: str = "qwen-plus", structure_only: bool = False,
+                           thinking_budget: Optional[int] = None) -> dict:
+    """以界面层级的文字摘要代替截图调用文字模型，输出格式与 analyze_privacy_switches 相同"""
+    with open(prompt_path, "r", encoding="utf-8") as f:
+        prompt_text = f.read()
+    if structure_only:
+        prompt_text += STRUCTURE_ONLY_NOTE
+
+    text = f"{prompt_text}\n\n界面层级摘要：\n{digest}"
+    content = [{"type": "text", "text": text}]
+    # 中文约 1 字符 ≈ 1 token
+    estimated_tokens = len(text) + 2000
+    return _analyze(api_key, model, content, len(text.encode("utf-8")), estimated_tokens,
+                    thinking_budget=thinking_budget)
+
+def recommend_switch_states(labels: list, api_key: str, model: str = "qwen-plus") -> dict:
+    """知识库中没有的开关：只发送开关文字，询问推荐状态与理由，返回 {开关文字: {recommended_state, analysis}}"""
+    text = RECOMMEND_PROMPT + json.dumps(labels, ensure_ascii=False)
+    content = [{"type": "text", "text": text}]
+    estimated_tokens = len(text) + 100 * len(labels)
+    return _analyze(api_key, model, content, len(text.encode("utf-8")), estimated_tokens, SwitchRecommendations)
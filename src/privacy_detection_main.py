@@ -1,183 +1,109 @@
 import uiautomator2 as u2 
+import argparse
+import logging
 import time
-import copy
 import json
 import os
-from typing import List, Dict
+from typing import List, Dict, Optional
 from route import SimpleNavigator
 from dotenv import load_dotenv
-from screenshot_inspector import run_inspection
+from app_guard import guard_stats
+from crawl_journal import CrawlJournal, latest_journal, load_journal, replay_prefix
+from explorer import Explorer
+from hierarchy_extractor import extraction_stats
+from llm_request import request_stats
+from popup_detector import popup_stats
+from rate_limiter import limiter_stats
+from screenshot_inspector import analysis_mode_stats, progressive_stats
+from scroll_controller import scroll_stats
+from structured_output import structured_output_stats
+from switch_knowledge import SWITCH_KB, from_model, knowledge_base, knowledge_stats
+from page_fingerprint import latest_output, load_baseline_pages
+from path_trie import PathTrie, PRIVACY_SWITCHES, PERSONALITY_SWITCHES, PERSONALITY_LAYOUTS
+from frontier import YieldHistory, make_frontier
+from model_cascade import export_cascade_stats
+from metering import set_scope, metering_summary
+from tracing import tracer
 
 # 加载环境变量
 load_dotenv()
 
-privacy_switches: List[List[Dict]] = []
-personality_switches: List[List[Dict]] = []
-personality_layouts: List[List[Dict]] = []
-enable_personalization_layout_dfs = True
-def find_node_with_scroll(device: u2.Device, text: str, max_swipes: int = 10, swipe_delay: float = 0.5):
-    for _ in range(max_swipes):
-        node = device(text=text)
-        if not node.exists:
-            node = device(description=text)
-        if node.exists:
-            return node
-
-        w, h = device.window_size()
-        start_x, start_y = w // 2, int(h * 0.9)
-        end_x,   end_y   = w // 2, int(h * 0.25)
-        device.swipe(start_x, start_y, end_x, end_y, duration=0.3)
-        time.sleep(swipe_delay)
-    return None
-
-def safe_click_by_hierarchy(device: u2.Device, cx: int, cy: int,
-                            max_retries: int = 2, wait_time: float = 1.0) -> bool:
-    prev_xml = device.dump_hierarchy()
-    for attempt in range(1, max_retries + 1):
-        device.click(cx, cy)
-        time.sleep(wait_time)
-        new_xml = device.dump_hierarchy()
-        if new_xml != prev_xml:
-            return True
-    return False
-
-def dfs_explore(device: u2.Device, curr_path: List[Dict]):
-    result = run_inspection(device)
-    time.sleep(0.5)
-
-    if not result:
-        return False, False
-
-    is_current_page_popup = result.get("isPopup")
-
-    if not is_current_page_popup:
-        w, h = device.window_size()
-        for _ in range(5):
-            device.swipe(w//2, int(h*0.3), w//2, int(h*0.8), 0.5)
-            time.sleep(0.8)
-    for sw in result.get("switches", []):
-        curr_path.append({
-            "text": sw["text"],
-            "current_state": sw["current_state"],
-            "recommended_state": sw["recommended_state"],
-            "analysis": sw["analysis"]
-        })
-        privacy_switches.append(copy.deepcopy(curr_path))
-        curr_path.pop()
-
-    personalization = result.get("personalization", {})
-
-    for psw in personalization.get("switches", []):
-        curr_path.append({
-            "text": psw["text"],
-            "current_state": psw["current_state"],
-            "recommended_state": psw["recommended_state"],
-            "analysis": psw["analysis"]
-        })
-        personality_switches.append(copy.deepcopy(curr_path))
-        curr_path.pop()
-
-    for layout in result.get("layouts", []):
-        text = layout["text"]
-        node = find_node_with_scroll(device, text)
-        if not node:
-            w, h = device.window_size()
-            device.swipe(w // 2, int(h * 0.8), w // 2, int(h * 0.1), duration=0.3)
-            time.sleep(0.5)
-            continue
-
-        info = node.info.get("bounds", {})
-        left, top = info["left"], info["top"]
-        right, bottom = info["right"], info["bottom"]
-        cx = (left + right) // 2
-        cy = (top + bottom) // 2
-
-        curr_path.append({"text": text})
-        if not safe_click_by_hierarchy(device, cx, cy):
-            curr_path.pop()
-            continue
-
-        time.sleep(1)
-
-        sub_explore_success, is_popup_after_sub_explore = dfs_explore(device, curr_path)
-
-        if is_popup_after_sub_explore:
-            old_page_hierarchy = device.dump_hierarchy()
-            w, h = device.window_size()
-            device.click(w / 2, h / 9)
-            time.sleep(2)
-            new_page_hierarchy = device.dump_hierarchy()
-            if old_page_hierarchy == new_page_hierarchy:
-                device.press("back")
-            time.sleep(1)
-        else:
-            device.press("back")
-            time.sleep(1)
-
-        if not sub_explore_success:
-            curr_path.pop()
-            return False, False
-
-        curr_path.pop()
-
-
-    for playout in personalization.get("layouts", []):
-        text = playout["text"]
-        node = find_node_with_scroll(device, text)
-        if not node:
-            continue
+logger = logging.getLogger(__name__)
 
-        curr_path.append({"text": text})
-        personality_layouts.append(copy.deepcopy(curr_path))
-
-        if enable_personalization_layout_dfs:
-            info = node.info.get("bounds", {})
-            left, top = info["left"], info["top"]
-            right, bottom = info["right"], info["bottom"]
-            cx = (left + right) // 2
-            cy = (top + bottom) // 2
-
-            success = safe_click_by_hierarchy(device, cx, cy)
-            if success:
-                dfs_explore(device, curr_path)
-                device.press("back")
-                time.sleep(0.5)
-
-        curr_path.pop()
-    return True, is_current_page_popup
-
-def main():
-    device = u2.connect(os.getenv("DEVICE_SERIAL"))
-    device.settings["wait_timeout"] = 20.0
+# 输出格式：flat 为展平的开关列表（默认），tree 为路径树，both 两者都写
+OUTPUT_FORMAT = os.getenv("OUTPUT_FORMAT", "flat")
 
+# 探索结果的路径树（隐私开关 / 个性化开关 / 个性化布局都挂在各自所在的页面节点上）
+crawl_trie = PathTrie()
+enable_personalization_layout_dfs = True
+# 最近一次探索的概况（停止原因、剩余 frontier 等）与各页面的指纹和分析结果，随结果一起写入输出文件
+exploration_report: Dict = {}
+explored_pages: Dict[str, Dict] = {}
+
+def run_crawl(device: u2.Device, app_package: str, gemini_api_key: str,
+              resume_from: Optional[str] = None, baseline_from: Optional[str] = None) -> bool:
+    """
+    导航到设置页后按预算探索；结果累积在模块级的路径树中，过程写入爬取日志
+    resume_from 为日志路径时不再调用导航模型：重放记录的前缀路径，恢复已有结果与 frontier 后继续
+    baseline_from 为上一次的输出文件时增量爬取：结构指纹未变的页面复用其分析结果，只有新增或变化的页面调用模型
+    """
+    global exploration_report, explored_pages
     curr_path: List[Dict] = []
-    APP_PACKAGE = device.app_current()['package']
-    GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-
-    navigator = SimpleNavigator(
-        device_serial=os.getenv("DEVICE_SERIAL"),
-        app_package=APP_PACKAGE,
-        gemini_api_key=GEMINI_API_KEY
+    set_scope(app=app_package, page="navigation")
+
+    state = None
+    if resume_from:
+        state = load_journal(resume_from)
+        curr_path = state["prefix"]
+        journal = CrawlJournal(resume_from)
+        journal.resume()
+        with tracer.span("navigate", "navigation"):
+            replay_prefix(device, app_package, curr_path)
+    else:
+        navigator = SimpleNavigator(
+            device_serial=os.getenv("DEVICE_SERIAL"),
+            app_package=app_package,
+            gemini_api_key=gemini_api_key,
+            device=device
+        )
+        with tracer.span("navigate", "navigation"):
+            prefix = navigator.navigate()
+        for node in prefix:
+            curr_path.append({"text": node["text"], "bounds": node["bounds"]})
+        journal = CrawlJournal.create(app_package)
+        journal.start(app_package, curr_path)
+    logger.info(f"爬取日志: {journal.path}")
+
+    history = YieldHistory(app_package)
+    explorer = Explorer(
+        device,
+        prefix=curr_path,
+        frontier=make_frontier(history=history),
+        journal=journal,
+        baseline_pages=load_baseline_pages(baseline_from) if baseline_from else None,
+        explore_personalization=enable_personalization_layout_dfs,
+        trie=crawl_trie,
+        app_package=app_package
     )
-    prefix = navigator.navigate()
-    for node in prefix:
-        curr_path.append({"text": node["text"], "bounds": node["bounds"]})
-
-    success, _ = dfs_explore(device, curr_path)
-    if not success:
-        exit(1)
-
-    if not privacy_switches and not personality_switches and not personality_layouts:
-        return
-
-    output_dir = "all_paths_results"
-    os.makedirs(output_dir, exist_ok=True)
-
-    timestamp = time.strftime("%Y%m%d_%H%M%S")
-    safe_pkg = APP_PACKAGE.replace(".", "_")
-    output_file = os.path.join(output_dir, f"{safe_pkg}_{timestamp}.json")
-
-    final_output = {
+    if state is not None:
+        explorer.restore(state)
+    # 恢复出的页面在上一次运行中已计入历史收益
+    restored_pages, restored_switches = len(explorer.visited), len(explorer.switch_paths)
+    try:
+        success = explorer.run()
+    finally:
+        exploration_report = explorer.report()
+        explored_pages = explorer.pages
+        journal.finish(exploration_report)
+        journal.close()
+    history.update(explorer.visited[restored_pages:], explorer.switch_paths[restored_switches:])
+    history.save()
+    return success
+
+def build_final_output(privacy_switches: List[List[Dict]], personality_switches: List[List[Dict]],
+                       personality_layouts: List[List[Dict]]) -> Dict:
+    """把探索得到的各条路径展平为输出文件的结构"""
+    return {
         "privacy_switches": [
             {
                 **({"bounds": node.get("bounds")} if "bounds" in node else {}),
@@ -185,7 +111,9 @@ def main():
                 **({"current_state": node["current_state"],
                     "recommended_state": node["recommended_state"],
                     "analysis": node["analysis"]}
-                   if "recommended_state" in node else {})
+                   if "recommended_state" in node else {}),
+                **({"recommendation_source": node["recommendation_source"]}
+                   if "recommendation_source" in node else {})
             }
             for path in privacy_switches
             for node in path
@@ -198,7 +126,9 @@ def main():
                     **({"current_state": node["current_state"],
                         "recommended_state": node["recommended_state"],
                         "analysis": node["analysis"]}
-                       if "recommended_state" in node else {})
+                       if "recommended_state" in node else {}),
+                    **({"recommendation_source": node["recommendation_source"]}
+                       if "recommendation_source" in node else {})
                 }
                 for path in personality_switches
                 for node in path
@@ -211,8 +141,100 @@ def main():
         }
     }
 
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(final_output, f, ensure_ascii=False, indent=2)
+def main():
+    parser = argparse.ArgumentParser(description="探索当前前台应用的隐私设置")
+    parser.add_argument("--resume", nargs="?", const="", default=None, metavar="JOURNAL",
+                        help="从爬取日志继续（不指定路径时使用当前应用最近一份日志）")
+    parser.add_argument("--output-format", choices=["flat", "tree", "both"], default=OUTPUT_FORMAT,
+                        help="flat 为展平的开关列表，tree 为路径树（节点带父节点 ID 与各自的开关）")
+    parser.add_argument("--incremental", nargs="?", const="", default=None, metavar="PREVIOUS_OUTPUT",
+                        help="增量爬取：结构未变的页面复用上一次输出文件中的分析结果（不指定路径时使用该应用最近一次的输出）")
+    args = parser.parse_args()
+
+    device = u2.connect(os.getenv("DEVICE_SERIAL"))
+    device.settings["wait_timeout"] = 20.0
+
+    GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+    resume_from = None
+    if args.resume is not None:
+        resume_from = args.resume or latest_journal(device.app_current()['package'])
+        if not resume_from:
+            logger.error("没有找到可恢复的爬取日志")
+            exit(1)
+        state = load_journal(resume_from)
+        if state["finished"]:
+            logger.info(f"日志 {resume_from} 对应的爬取已经结束，继续探索剩余的 frontier")
+        APP_PACKAGE = state["app_package"]
+    else:
+        APP_PACKAGE = device.app_current()['package']
+
+    baseline_from = None
+    if args.incremental is not None:
+        baseline_from = args.incremental or latest_output(APP_PACKAGE)
+        if not baseline_from:
+            logger.warning("没有找到该应用之前的输出文件，进行完整爬取")
+        else:
+            logger.info(f"增量爬取，基准输出: {baseline_from}")
+
+    # 首次使用时由历次输出构建开关知识库
+    if SWITCH_KB and not knowledge_base.entries:
+        knowledge_base.build("all_paths_results")
+    if SWITCH_KB and not knowledge_base.ready():
+        logger.info(f"开关知识库只有 {len(knowledge_base.entries)} 条，页面分析仍让模型输出完整结果")
+
+    success = run_crawl(device, APP_PACKAGE, GEMINI_API_KEY, resume_from=resume_from,
+                        baseline_from=baseline_from)
+    export_cascade_stats()
+    tracer.export(APP_PACKAGE.replace(".", "_"))
+    if not success:
+        exit(1)
+
+    if not any(crawl_trie.count(kind) for kind in (PRIVACY_SWITCHES, PERSONALITY_SWITCHES, PERSONALITY_LAYOUTS)):
+        return
+
+    output_dir = "all_paths_results"
+    os.makedirs(output_dir, exist_ok=True)
+
+    timestamp = time.strftime("%Y%m%d_%H%M%S")
+    safe_pkg = APP_PACKAGE.replace(".", "_")
+    summary = {
+        "metering": metering_summary(APP_PACKAGE),
+        "requests": request_stats(),
+        "rate_limiter": limiter_stats(),
+        "hierarchy_extraction": extraction_stats(),
+        "analysis_mode": analysis_mode_stats(APP_PACKAGE),
+        "progressive": progressive_stats(APP_PACKAGE),
+        "popup": popup_stats(),
+        "scroll": scroll_stats(),
+        "app_guard": guard_stats(),
+        "switch_knowledge": knowledge_stats(),
+        "structured_output": structured_output_stats(),
+        "exploration": exploration_report,
+        "pages": explored_pages,
+    }
+
+    if args.output_format in ("tree", "both"):
+        with open(os.path.join(output_dir, f"{safe_pkg}_{timestamp}.tree.json"), "w", encoding="utf-8") as f:
+            crawl_trie.write(f, extra=dict(summary, app_package=APP_PACKAGE))
+
+    if args.output_format in ("flat", "both"):
+        final_output = build_final_output(list(crawl_trie.paths(PRIVACY_SWITCHES)),
+                                          list(crawl_trie.paths(PERSONALITY_SWITCHES)),
+                                          list(crawl_trie.paths(PERSONALITY_LAYOUTS)))
+        final_output.update(summary)
+        with open(os.path.join(output_dir, f"{safe_pkg}_{timestamp}.json"), "w", encoding="utf-8") as f:
+            json.dump(final_output, f, ensure_ascii=False, indent=2)
+
+    # 本次爬取中由模型给出推荐的开关写回知识库，供之后的应用复用（知识库与规则表补全的不回写）
+    if SWITCH_KB:
+        for kind, category in ((PRIVACY_SWITCHES, "privacy"), (PERSONALITY_SWITCHES, "personalization")):
+            for path in crawl_trie.paths(kind):
+                switch = path[-1]
+                if not from_model(switch):
+                    continue
+                knowledge_base.add(switch["text"], category, switch.get("recommended_state"),
+                                   switch.get("analysis", ""), APP_PACKAGE)
+        knowledge_base.save()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,231 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from dotenv import load_dotenv
+
+try:
+    import fcntl
+except ImportError:  # Windows 下没有 fcntl，只在进程内限流
+    fcntl = None
+
+# 加载环境变量
+load_dotenv()
+
+# 优先级：数值越小越优先，导航调用排在页面分析之前
+PRIORITY_NAVIGATION = 0
+PRIORITY_ANALYSIS = 1
+
+# 各服务商的默认限额（每分钟请求数 / 每分钟token数 / 最大并发）
+DEFAULT_LIMITS = {
+    "gemini": {"rpm": 60, "tpm": 1_000_000, "concurrency": 8},
+    "qwen": {"rpm": 30, "tpm": 500_000, "concurrency": 4},
+}
+RATE_LIMIT_STATE_DIR = os.getenv("RATE_LIMIT_STATE_DIR", os.path.join(tempfile.gettempdir(), "prisee_rate_limit"))
+# 等待者超过该时间未刷新视为已退出（秒）
+WAITER_TTL = 30.0
+# 收到 429 但没有 Retry-After 时的默认暂停时间（秒）
+DEFAULT_THROTTLE_PAUSE = float(os.getenv("RATE_LIMIT_THROTTLE_PAUSE", 10))
+
+logger = logging.getLogger(__name__)
+
+
+def _pid_alive(pid: int) -> bool:
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        return True
+    return True
+
+
+class RateLimiter:
+    """
+    按 API key 的令牌桶限流器（请求数/分钟 + token数/分钟）与并发闸门
+    状态保存在本机的共享文件中并用文件锁保护，同一台机器上的多个爬虫进程共用同一份额度
+    """
+
+    def __init__(self, name: str, rpm: float, tpm: float, max_concurrency: int,
+                 state_dir: str = RATE_LIMIT_STATE_DIR):
+        self.name = name
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_concurrency = max_concurrency
+        self._thread_lock = threading.Lock()
+        self._memory_state: Optional[Dict] = None
+        self._state_path = None
+        if fcntl is not None:
+            os.makedirs(state_dir, exist_ok=True)
+            self._state_path = os.path.join(state_dir, f"{name}.json")
+        else:
+            logger.warning(f"[{name}] 当前平台没有 fcntl，限流只在本进程内生效，多个爬虫进程会各自占用全部额度")
+        self.wait_time = 0.0
+        self.throttle_events = 0
+
+    # ---- 共享状态读写 ----
+
+    def _new_state(self) -> Dict:
+        return {
+            "requests": float(self.rpm),
+            "tokens": float(self.tpm),
+            "updated": time.time(),
+            "blocked_until": 0.0,
+            "waiting": {},
+            "inflight": {},
+        }
+
+    @contextmanager
+    def _locked_state(self):
+        with self._thread_lock:
+            if self._state_path is None:
+                if self._memory_state is None:
+                    self._memory_state = self._new_state()
+                yield self._memory_state
+                return
+
+            with open(self._state_path, "a+", encoding="utf-8") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.seek(0)
+                    raw = f.read()
+                    try:
+                        state = json.loads(raw) if raw else self._new_state()
+                    except json.JSONDecodeError:
+                        state = self._new_state()
+                    yield state
+                    f.seek(0)
+                    f.truncate()
+                    f.write(json.dumps(state))
+                    f.flush()
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _refill(self, state: Dict, now: float):
+        elapsed = max(0.0, now - state["updated"])
+        state["requests"] = min(float(self.rpm), state["requests"] + elapsed * self.rpm / 60.0)
+        state["tokens"] = min(float(self.tpm), state["tokens"] + elapsed * self.tpm / 60.0)
+        state["updated"] = now
+
+    @staticmethod
+    def _cleanup(state: Dict, now: float):
+        state["waiting"] = {
+            k: v for k, v in state["waiting"].items()
+            if now - v["ts"] < WAITER_TTL and _pid_alive(v["pid"])
+        }
+        state["inflight"] = {
+            k: v for k, v in state["inflight"].items() if _pid_alive(v["pid"])
+        }
+
+    # ---- 对外接口 ----
+
+    def acquire(self, tokens: int = 0, priority: int = PRIORITY_ANALYSIS,
+                timeout: Optional[float] = None) -> Optional[str]:
+        """
+        阻塞直到拿到一个请求名额；返回租约ID，超时返回 None
+        有更高优先级的等待者时让出额度，保证导航调用先于页面分析
+        """
+        lease = uuid.uuid4().hex
+        waiter = {"pid": os.getpid(), "priority": priority, "ts": 0.0}
+        # 单次请求超过桶容量时只要求桶满，避免永远拿不到
+        tokens = min(tokens, self.tpm)
+        start = time.time()
+
+        while True:
+            now = time.time()
+            with self._locked_state() as state:
+                self._refill(state, now)
+                self._cleanup(state, now)
+                higher_waiting = any(w["priority"] < priority for k, w in state["waiting"].items() if k != lease)
+                can_go = (
+                    now >= state["blocked_until"]
+                    and not higher_waiting
+                    and state["requests"] >= 1
+                    and state["tokens"] >= tokens
+                    and len(state["inflight"]) < self.max_concurrency
+                )
+                if can_go:
+                    state["requests"] -= 1
+                    state["tokens"] -= tokens
+                    state["waiting"].pop(lease, None)
+                    state["inflight"][lease] = {"pid": os.getpid(), "tokens": tokens, "ts": now}
+                    self.wait_time += now - start
+                    return lease
+
+                waiter["ts"] = now
+                state["waiting"][lease] = waiter
+                sleep = max(
+                    state["blocked_until"] - now,
+                    (1 - state["requests"]) * 60.0 / self.rpm,
+                    (tokens - state["tokens"]) * 60.0 / self.tpm,
+                    0.05,
+                )
+
+            if timeout is not None and now - start + sleep > timeout:
+                with self._locked_state() as state:
+                    state["waiting"].pop(lease, None)
+                return None
+            time.sleep(min(sleep, 1.0))
+
+    def release(self, lease: Optional[str], actual_tokens: Optional[int] = None):
+        """释放并发名额；给出实际token用量时按差额校正token桶"""
+        if not lease:
+            return
+        with self._locked_state() as state:
+            entry = state["inflight"].pop(lease, None)
+            if entry is not None and actual_tokens is not None:
+                state["tokens"] = min(float(self.tpm), state["tokens"] - (actual_tokens - entry["tokens"]))
+
+    def report_throttled(self, retry_after: Optional[float] = None):
+        """
+        收到 429 时调用：所有进程暂停到 retry_after 之后，并清空请求桶，
+        恢复后按速率逐步放行，避免重试风暴
+        """
+        pause = retry_after if retry_after and retry_after > 0 else DEFAULT_THROTTLE_PAUSE
+        now = time.time()
+        with self._locked_state() as state:
+            state["blocked_until"] = max(state["blocked_until"], now + pause)
+            state["requests"] = 0.0
+        self.throttle_events += 1
+        logger.warning(f"[{self.name}] 收到限流响应，暂停 {pause:.1f}s")
+
+
+_limiters: Dict[str, RateLimiter] = {}
+_registry_lock = threading.Lock()
+
+
+def get_limiter(provider: str, api_key: str) -> RateLimiter:
+    """
+    获取某服务商某个 key 的限流器；限额可用 <PROVIDER>_RPM / _TPM / _MAX_CONCURRENCY 覆盖
+    key 只以哈希形式出现在状态文件名中
+    """
+    key_hash = hashlib.sha1((api_key or "").encode("utf-8")).hexdigest()[:12]
+    name = f"{provider}_{key_hash}"
+    with _registry_lock:
+        if name not in _limiters:
+            defaults = DEFAULT_LIMITS.get(provider, DEFAULT_LIMITS["gemini"])
+            prefix = provider.upper()
+            _limiters[name] = RateLimiter(
+                name,
+                rpm=float(os.getenv(f"{prefix}_RPM", defaults["rpm"])),
+                tpm=float(os.getenv(f"{prefix}_TPM", defaults["tpm"])),
+                max_concurrency=int(os.getenv(f"{prefix}_MAX_CONCURRENCY", defaults["concurrency"])),
+            )
+        return _limiters[name]
+
+
+def limiter_stats() -> Dict[str, Dict]:
+    """本进程在各限流器上的累计等待时间与限流次数"""
+    return {
+        name: {"wait_time": round(l.wait_time, 3), "throttle_events": l.throttle_events}
+        for name, l in _limiters.items()
+    }
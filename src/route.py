@@ -7,13 +7,15 @@ from typing import Dict, List
 
 from personal_icon_detector import PersonalIconDetector
 from setting_icon_detector import GeminiSegmentationAPI
+from joint_icon_detector import JointIconDetector
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class SimpleNavigator:
-    def __init__(self, device_serial: str, app_package: str, gemini_api_key: str):
-        self.device = u2.connect(device_serial)
+    def __init__(self, device_serial: str, app_package: str, gemini_api_key: str, device=None):
+        # 传入 device 时直接复用（如录制/回放包装的设备），否则按序列号连接
+        self.device = device if device is not None else u2.connect(device_serial)
         self.app_package = app_package
         self.gemini_api_key = gemini_api_key
         self.screen_width, self.screen_height = self.device.window_size()
@@ -49,54 +51,58 @@ class SimpleNavigator:
         center_y = int((norm_y1 + norm_y2) / 2 * self.screen_height)
         return center_x, center_y
 
+    def _click_detection(self, detection: Dict, text: str, tag: str) -> Dict:
+        node = {
+            "bounds": self.normalize_bounds(detection["box_2d"]),
+            "text": text
+        }
+        center_x, center_y = self.get_click_coordinates(detection["box_2d"])
+        logger.info(f"Clicking {tag} icon: ({center_x}, {center_y})")
+        self.device.click(center_x, center_y)
+        time.sleep(2)
+
+        post_click_screenshot = self.capture_screenshot()
+        with open(f"results/{tag}_clicked_{int(time.time())}.png", "wb") as f:
+            f.write(post_click_screenshot)
+        return node
+
     def navigate(self) -> List[Dict]:
         result = []
         try:
             os.makedirs("results", exist_ok=True)
 
-            logger.info("Detecting personal icon...")
-            personal_detector = PersonalIconDetector(self.gemini_api_key)
+            logger.info("Detecting personal and setting icons jointly...")
+            joint_detector = JointIconDetector(self.gemini_api_key)
             screenshot = self.capture_screenshot()
-            personal_result = personal_detector.detect_ui_elements(screenshot)
+            joint_result = joint_detector.detect_ui_elements(screenshot, self.device.dump_hierarchy())
+            logger.info(f"Joint detection result: {joint_result}")
+
+            # 首页已可见设置入口时，跳过个人中心这一跳
+            if joint_result and joint_result["setting_visible"]:
+                logger.info("Setting icon already visible, skipping personal center")
+                result.append(self._click_detection(joint_result["setting"], "设置", "setting"))
+                return result
+
+            personal_result = joint_result["personal"] if joint_result else None
+            # 联合检测失败或没有给出个人中心图标时，改用单独的个人中心检测器（与原先的流程一致）
+            if not personal_result:
+                logger.info("Personal icon not found by joint detection, detecting personal icon...")
+                personal_detector = PersonalIconDetector(self.gemini_api_key)
+                personal_result = personal_detector.detect_ui_elements(screenshot, self.device.dump_hierarchy())
 
             if personal_result:
                 logger.info(f"Personal icon detected: {personal_result}")
-                result.append({
-                    "bounds": self.normalize_bounds(personal_result["box_2d"]),
-                    "text": "我的"
-                })
-
-                center_x, center_y = self.get_click_coordinates(personal_result["box_2d"])
-                logger.info(f"Clicking personal icon: ({center_x}, {center_y})")
-                self.device.click(center_x, center_y)
-                time.sleep(2)
-
-                post_click_screenshot = self.capture_screenshot()
-                with open(f"results/personal_clicked_{int(time.time())}.png", "wb") as f:
-                    f.write(post_click_screenshot)
-
+                result.append(self._click_detection(personal_result, "我的", "personal"))
                 time.sleep(2)
 
             logger.info("Detecting setting icon...")
             setting_detector = GeminiSegmentationAPI(self.gemini_api_key)
             screenshot = self.capture_screenshot()
-            setting_result = setting_detector.detect_ui_elements(screenshot)
+            setting_result = setting_detector.detect_ui_elements(screenshot, self.device.dump_hierarchy())
 
             if setting_result:
                 logger.info(f"Setting icon detected: {setting_result}")
-                result.append({
-                    "bounds": self.normalize_bounds(setting_result["box_2d"]),
-                    "text": "设置"
-                })
-
-                center_x, center_y = self.get_click_coordinates(setting_result["box_2d"])
-                logger.info(f"Clicking setting icon: ({center_x}, {center_y})")
-                self.device.click(center_x, center_y)
-                time.sleep(2)
-
-                post_click_screenshot = self.capture_screenshot()
-                with open(f"results/setting_clicked_{int(time.time())}.png", "wb") as f:
-                    f.write(post_click_screenshot)
+                result.append(self._click_detection(setting_result, "设置", "setting"))
 
             return result
 
@@ -1,12 +1,61 @@
+import logging
 import time
 import uiautomator2 as u2
 from PIL import Image
 import json
 import datetime
 import os
+import threading
+from typing import Callable, Dict, Optional
+from dotenv import load_dotenv
 import privacy_analyzer
+from model_cascade import get_cascade, cascade_tiers, validate_analysis_result
+from hierarchy_extractor import HIERARCHY_EXTRACTION, classify_switch, extractor, hierarchy_digest, page_rows
+from metering import meter, metering_scope
+from switch_knowledge import SWITCH_KB, SWITCH_KB_MODEL, knowledge_base
+from page_fingerprint import structural_fingerprint
+from popup_detector import POPUP_DETECTION, crop_popup, detector as popup_detector
+from scroll_controller import SCROLL_MAX_PAGES, scroller
+from tracing import tracer, traced, traced_sleep
 
+# 加载环境变量
+load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# 页面分析方式：image 发送长截图给视觉模型；text 先发送界面层级的文字摘要给文字模型，摘要过于稀疏或结果未通过校验时改用截图
+ANALYSIS_MODE = os.getenv("ANALYSIS_MODE", "image").lower()
+
+# 页面分析的模型级联：先用非推理的视觉模型，未通过校验再交给推理模型
+ANALYSIS_CASCADE = get_cascade(
+    "privacy_analysis", cascade_tiers("QWEN_CASCADE_MODELS", ["qwen-vl-max-latest", "qvq-max-latest"])
+)
+# 文字摘要分析的模型级联
+TEXT_ANALYSIS_CASCADE = get_cascade(
+    "privacy_text_analysis", cascade_tiers("QWEN_TEXT_CASCADE_MODELS", ["qwen-plus", "qwen-max"])
+)
+
+# 页面类别：webview（含 WebView，内容只在截图中）、long（超过 LONG_PAGE_SCREENS 屏）、simple（其余原生页面）
+LONG_PAGE_SCREENS = int(os.getenv("LONG_PAGE_SCREENS", 3))
+# 按页面类别覆盖截图分析的级联与思考预算，例如
+# {"simple": {"models": "qwen-vl-max-latest", "thinking_budget": 0}, "webview": {"thinking_budget": 8192}}
+# models 为逗号分隔的级联（便宜的在前）；thinking_budget 为 0 时关闭思考，未配置的类别沿用默认级联与模型默认行为
+PAGE_CLASS_POLICY = {}
+try:
+    PAGE_CLASS_POLICY = json.loads(os.getenv("PAGE_CLASS_POLICY") or "{}")
+except json.JSONDecodeError:
+    logger.warning("PAGE_CLASS_POLICY 格式错误，所有页面使用默认级联")
+
+# 渐进式分析：先把缩小 PROGRESSIVE_SCALE 倍的长截图交给级联第一层模型，
+# 结果未通过层级校验（文字在层级中找不到、层级有开关却输出为空）时再用原图走完整级联
+PROGRESSIVE_ANALYSIS = os.getenv("PROGRESSIVE_ANALYSIS", "false").lower() == "true"
+PROGRESSIVE_SCALE = float(os.getenv("PROGRESSIVE_SCALE", 0.5))
+
+# text 模式下各页面的去向：文字模型给出结果 / 摘要稀疏 / 结果未通过校验；image_pages 为走截图分析的页面数
+_mode_lock = threading.Lock()
+_mode_counts = {"text_pages": 0, "image_pages": 0, "fallback_reasons": {}, "page_classes": {}}
+# 渐进式分析按应用统计：缩图尝试 / 命中次数与耗时，原图分析的页面数与耗时
+_progressive_counts: Dict[str, Dict] = {}
 
 # 创建保存截图文件的文件夹
 save_dir = "screenshot"
@@ -30,7 +79,39 @@ def find_overlap(img1: Image.Image, img2: Image.Image, check_height: int = 100)
             return i  # 找到重叠高度
     return 0  # 没有重叠
 
-def take_long_screenshot(d: u2.Device, save_path: str = None, wait_time: float = 0.5):
+def stitch_screenshots(screenshots: list, width: int, last_overlap: Optional[int] = None) -> Image.Image:
+    """
+    纵向拼接各屏截图；最后一屏与上一屏的重叠部分裁掉
+    已知最后一屏的重叠高度（由实际滚动距离算出）时直接使用，否则比较像素查找
+    """
+    screenshots = list(screenshots)
+    if len(screenshots) >= 2 and last_overlap:
+        img = screenshots[-1]
+        screenshots[-1] = img.crop((0, min(last_overlap, img.height - 1), img.width, img.height))
+    elif len(screenshots) >= 2:
+        img1 = screenshots[-2]
+        img2 = screenshots[-1]
+        overlap = find_overlap(img1, img2)
+        if overlap > 0:
+            screenshots[-1] = img2.crop((0, overlap, img2.width, img2.height))
+
+    total_height = sum(img.height for img in screenshots)
+    long_img = Image.new("RGB", (width, total_height))
+    y = 0
+    for img in screenshots:
+        long_img.paste(img, (0, y))
+        y += img.height
+    return long_img
+
+@traced("device")
+def take_long_screenshot(d: u2.Device, save_path: str = None, wait_time: float = 0.5,
+                         hierarchies: list = None, frames: list = None):
+    """
+    滚动截取长图；传入 hierarchies 列表时，每一屏的界面层级也会追加进去，传入 frames 时追加每一屏的截图
+    开启 SCROLL_CONTROL 时按可滚动容器每次滚动一屏，由实际滚动距离判断到底（见 scroll_controller.py）
+    """
+    if scroller.enabled:
+        return _take_long_screenshot_by_container(d, save_path, hierarchies, frames)
     width, height = d.window_size()
     scroll_height = height - 150
 
@@ -40,32 +121,73 @@ def take_long_screenshot(d: u2.Device, save_path: str = None, wait_time: float =
     reached_bottom = False
 
     for i in range(max_scrolls):
-        img = d.screenshot(format='pillow').convert("RGB")
+        with tracer.span("screenshot", "device"):
+            img = d.screenshot(format='pillow').convert("RGB")
         if last_screenshot and img.tobytes() == last_screenshot.tobytes():
             reached_bottom = True
             break
         screenshots.append(img)
         last_screenshot = img
+        if frames is not None:
+            frames.append(img)
+        if hierarchies is not None:
+            with tracer.span("dump_hierarchy", "device"):
+                hierarchies.append(d.dump_hierarchy())
 
         start_y = int(height * 0.75)
         end_y = int(height * 0.25)
-        d.swipe(width // 2, start_y, width // 2, end_y, 0.1)
-        time.sleep(wait_time)
+        with tracer.span("swipe", "device"):
+            d.swipe(width // 2, start_y, width // 2, end_y, 0.1)
+        traced_sleep(wait_time)
 
-    if len(screenshots) >= 2:
-        img1 = screenshots[-2]
-        img2 = screenshots[-1]
-        overlap = find_overlap(img1, img2)
-        if overlap > 0:
-            screenshots[-1] = img2.crop((0, overlap, img2.width, img2.height))
+    with tracer.span("stitch", "image", frames=len(screenshots)):
+        long_img = stitch_screenshots(screenshots, width)
+    return _save_long_screenshot(d, long_img, save_path), reached_bottom
 
-    total_height = sum(img.height for img in screenshots)
-    long_img = Image.new("RGB", (width, total_height))
-    y = 0
-    for img in screenshots:
-        long_img.paste(img, (0, y))
-        y += img.height
 
+def _take_long_screenshot_by_container(d: u2.Device, save_path: str = None, hierarchies: list = None,
+                                       frames: list = None):
+    """
+    每次在可滚动容器内滚动一屏：滚动后的层级即下一屏的层级，实际滚动距离明显少于一屏即已到底，
+    最后一屏只保留新露出的部分；滚动距离为 0 时不再截图
+    """
+    width, _ = d.window_size()
+    with tracer.span("screenshot", "device"):
+        img = d.screenshot(format='pillow').convert("RGB")
+    with tracer.span("dump_hierarchy", "device"):
+        hierarchy_xml = d.dump_hierarchy()
+    screenshots = [img]
+    screens = [hierarchy_xml]
+    reached_bottom = False
+    last_overlap = None
+
+    for _ in range(SCROLL_MAX_PAGES - 1):
+        result = scroller.scroll(d, "down", hierarchy_xml, frame=img)
+        if result["moved"] == 0:
+            reached_bottom = True
+            break
+        img = result["frame"]
+        if img is None:
+            with tracer.span("screenshot", "device"):
+                img = d.screenshot(format='pillow').convert("RGB")
+        hierarchy_xml = result["hierarchy"]
+        screenshots.append(img)
+        screens.append(hierarchy_xml)
+        if result["edge"]:
+            reached_bottom = True
+            last_overlap = result["container"][3] - result["moved"]
+            break
+
+    if frames is not None:
+        frames.extend(screenshots)
+    if hierarchies is not None:
+        hierarchies.extend(screens)
+    with tracer.span("stitch", "image", frames=len(screenshots)):
+        long_img = stitch_screenshots(screenshots, width, last_overlap)
+    return _save_long_screenshot(d, long_img, save_path), reached_bottom
+
+
+def _save_long_screenshot(d: u2.Device, long_img: Image.Image, save_path: str = None) -> str:
     if not save_path:
         info = d.info
         package = info.get("currentPackageName", "unknown")
@@ -74,22 +196,323 @@ def take_long_screenshot(d: u2.Device, save_path: str = None, wait_time: float =
         filename = f"{package}.{activity}_{timestamp}.png"
         save_path = os.path.join(save_dir, filename)
 
-    long_img.save(save_path)
-    return save_path, reached_bottom
+    with tracer.span("save_png", "image"):
+        long_img.save(save_path)
+    return save_path
 
 
 
 
-def run_inspection(d: u2.Device) -> list:
-    import os
-    screenshot_path, reached_bottom = take_long_screenshot(d)
+def run_inspection(d: u2.Device, reuse: Optional[Callable[[str], Optional[Dict]]] = None,
+                   hierarchies: list = None) -> list:
+    """
+    截取长图并分析页面；结果中附带页面的结构指纹
+    传入 reuse(fingerprint) 时先按指纹查找已有的分析结果，找到则不再调用模型
+    开启 HIERARCHY_EXTRACTION 时再尝试由界面层级在本地得出结果，仍无法确定才调用模型
+    ANALYSIS_MODE=text 时先把层级摘要交给文字模型，摘要稀疏或结果未通过校验再调用视觉模型
+    开启 POPUP_DETECTION 时先由首屏截图与层级在本地判断弹窗：弹窗页只把弹窗区域发给视觉模型，结果中记录弹窗范围
+    传入 hierarchies 列表时，各屏的界面层级会追加进去
+    """
+    if hierarchies is None:
+        hierarchies = []
+    frames = []
+    screenshot_path, reached_bottom = take_long_screenshot(d, hierarchies=hierarchies, frames=frames)
     if not reached_bottom:
         return None
 
-    result = privacy_analyzer.analyze_privacy_switches(
-        image_path=screenshot_path,
-        api_key=os.getenv("QWEN_API_KEY"),
-        prompt_path="prompt.txt",
-        system_path="system.txt",
-    )
+    popup = None
+    if POPUP_DETECTION and frames:
+        width, height = d.window_size()
+        popup = popup_detector.detect(frames[0], hierarchies[0] if hierarchies else None, width, height)
+
+    fingerprint = structural_fingerprint(hierarchies)
+    if reuse is not None and fingerprint is not None:
+        reused = reuse(fingerprint)
+        if reused is not None:
+            return dict(reused, fingerprint=fingerprint)
+
+    # 原生控件的页面先在本地由层级得出结果，无法确定时才调用视觉模型
+    if HIERARCHY_EXTRACTION:
+        with tracer.span("hierarchy_extract", "analysis"):
+            local, _ = extractor.extract(hierarchies)
+        if local is not None:
+            if fingerprint is not None:
+                local["fingerprint"] = fingerprint
+            return _mark_popup(local, popup)
+
+    category = page_class(hierarchies)
+    with _mode_lock:
+        _mode_counts["page_classes"][category] = _mode_counts["page_classes"].get(category, 0) + 1
+    result = None
+    with metering_scope(page_class=category):
+        if ANALYSIS_MODE == "text":
+            result = _analyze_digest(hierarchies, category)
+
+        if result is None:
+            if popup is not None:
+                with tracer.span("crop_popup", "image"):
+                    screenshot_path = crop_popup(screenshot_path, popup["bounds"], d.window_size()[1])
+            result = _analyze_image(screenshot_path, hierarchies, category, popup_region=popup is not None)
+    if isinstance(result, dict) and fingerprint is not None:
+        result["fingerprint"] = fingerprint
+    return _mark_popup(result, popup)
+
+
+def _mark_popup(result, popup: Optional[Dict]):
+    """本地检测到的弹窗以本地为准并记录弹窗范围；本地未检测到时保留模型的 isPopup"""
+    if not isinstance(result, dict):
+        return result
+    if popup is not None:
+        result["isPopup"] = True
+        result["popup_bounds"] = popup["bounds"]
+    elif POPUP_DETECTION and result.get("isPopup"):
+        popup_detector.record_model_only()
+    return result
+
+
+def page_class(hierarchies: list) -> str:
+    """按界面层级给页面分类，决定使用的级联与思考预算；没有层级时为 default"""
+    if not hierarchies:
+        return "default"
+    if page_rows(hierarchies)["has_webview"]:
+        return "webview"
+    if len(hierarchies) > LONG_PAGE_SCREENS:
+        return "long"
+    return "simple"
+
+
+def _policy(category: str) -> Dict:
+    policy = PAGE_CLASS_POLICY.get(category)
+    return policy if isinstance(policy, dict) else {}
+
+
+def _image_cascade(category: str):
+    models = _policy(category).get("models")
+    if not models:
+        return ANALYSIS_CASCADE
+    if isinstance(models, str):
+        models = [m.strip() for m in models.split(",") if m.strip()]
+    return get_cascade(f"privacy_analysis:{category}", list(models))
+
+
+def _complete_switches(result):
+    """
+    结构模式下模型只给出开关文字与当前状态，推荐状态与理由由知识库、规则表补全，仍缺的再单独询问文字模型
+    只对级联最终采用的结果调用：被校验拒绝的结果不应触发询问，也不应给知识库投票
+    """
+    if not SWITCH_KB or not isinstance(result, dict):
+        return result
+
+    def recommend(labels):
+        with metering_scope(phase="switch_recommend"):
+            return privacy_analyzer.recommend_switch_states(labels, os.getenv("QWEN_API_KEY"), SWITCH_KB_MODEL)
+
+    return knowledge_base.complete(result, recommend=recommend, rules=classify_switch,
+                                   app=meter.current_scope().get("app") or "")
+
+
+def _structure_only() -> bool:
+    """开启 SWITCH_KB 且知识库已有足够条目时，只让模型输出页面结构；知识库为空时仍输出完整结果"""
+    return SWITCH_KB and knowledge_base.ready()
+
+
+def _fallback(reason: str):
+    with _mode_lock:
+        _mode_counts["fallback_reasons"][reason] = _mode_counts["fallback_reasons"].get(reason, 0) + 1
+    logger.info(f"文字摘要分析放弃（{reason}），改用截图")
+
+
+def _analyze_digest(hierarchies: list, category: str = "default") -> Optional[Dict]:
+    """
+    由界面层级生成文字摘要交给文字模型分析；结果必须通过层级校验（文字模型看不到截图，只能信任与层级一致的结果）
+    摘要稀疏或校验失败时返回 None
+    """
+    with tracer.span("hierarchy_digest", "analysis"):
+        digest, reason = hierarchy_digest(hierarchies)
+    if digest is None:
+        _fallback(reason)
+        return None
+
+    accepted = {}
+    structure_only = _structure_only()
+
+    def validate(result):
+        accepted["ok"] = validate_analysis_result(result, hierarchies, require_recommendation=not structure_only)
+        return accepted["ok"]
+
+    with metering_scope(phase="text_analysis"):
+        result = TEXT_ANALYSIS_CASCADE.run(
+            lambda model: privacy_analyzer.analyze_privacy_digest(
+                digest=digest,
+                api_key=os.getenv("QWEN_API_KEY"),
+                prompt_path="prompt_text.txt",
+                system_path="system.txt",
+                model=model,
+                structure_only=structure_only,
+                thinking_budget=_policy(category).get("thinking_budget"),
+            ),
+            validate
+        )
+    if not accepted.get("ok"):
+        _fallback("rejected")
+        return None
+    result = _complete_switches(result)
+    with _mode_lock:
+        _mode_counts["text_pages"] += 1
+    result["source"] = "digest"
+    return result
+
+
+def downscale_screenshot(screenshot_path: str, scale: float = PROGRESSIVE_SCALE) -> str:
+    """按比例缩小长截图，保存在原图旁边（文件名加 _low），返回缩图路径"""
+    root, ext = os.path.splitext(screenshot_path)
+    low_path = f"{root}_low{ext}"
+    with Image.open(screenshot_path) as img:
+        size = (max(1, int(img.width * scale)), max(1, int(img.height * scale)))
+        img.resize(size, Image.Resampling.LANCZOS).save(low_path)
+    return low_path
+
+
+def _progressive_record(app: str, **values):
+    with _mode_lock:
+        counts = _progressive_counts.setdefault(app, {"attempts": 0, "hits": 0, "low_latency": 0.0,
+                                                      "full_pages": 0, "full_latency": 0.0})
+        for key, value in values.items():
+            counts[key] += value
+
+
+def _analyze_low_resolution(screenshot_path: str, hierarchies: list, model: str, category: str,
+                            popup_region: bool = False) -> Optional[Dict]:
+    """渐进式分析的第一步：缩图交给 model 分析，结果必须通过层级校验才采用，否则返回 None"""
+    app = meter.current_scope().get("app") or ""
+    started = time.time()
+    structure_only = _structure_only()
+    result = None
+    try:
+        with tracer.span("downscale", "image"):
+            low_path = downscale_screenshot(screenshot_path)
+        result = privacy_analyzer.analyze_privacy_switches(
+            image_path=low_path,
+            api_key=os.getenv("QWEN_API_KEY"),
+            prompt_path="prompt.txt",
+            system_path="system.txt",
+            model=model,
+            structure_only=structure_only,
+            thinking_budget=_policy(category).get("thinking_budget"),
+            popup_region=popup_region,
+        )
+    except Exception as e:
+        logger.error(f"缩图分析异常: {str(e)}")
+    hit = validate_analysis_result(result, hierarchies, require_recommendation=not structure_only)
+    _progressive_record(app, attempts=1, hits=int(hit), low_latency=time.time() - started)
+    if not hit:
+        logger.info("缩图分析结果未通过层级校验，改用原图分析")
+        return None
+    return _complete_switches(result)
+
+
+def _analyze_image(screenshot_path: str, hierarchies: list, category: str = "default",
+                   popup_region: bool = False) -> Optional[Dict]:
+    with _mode_lock:
+        _mode_counts["image_pages"] += 1
+    cascade = _image_cascade(category)
+    structure_only = _structure_only()
+    # 缩图结果只能靠层级校验判断，没有层级时直接用原图
+    progressive = PROGRESSIVE_ANALYSIS and bool(hierarchies)
+    if progressive:
+        with metering_scope(phase="image_analysis"):
+            result = _analyze_low_resolution(screenshot_path, hierarchies, cascade.tiers[0], category, popup_region)
+        if result is not None:
+            return result
+    # 只有多层级级联时才用层级数据做交叉校验
+    if len(cascade.tiers) == 1:
+        hierarchies = None
+    started = time.time()
+    with metering_scope(phase="image_analysis"):
+        result = cascade.run(
+            lambda model: privacy_analyzer.analyze_privacy_switches(
+                image_path=screenshot_path,
+                api_key=os.getenv("QWEN_API_KEY"),
+                prompt_path="prompt.txt",
+                system_path="system.txt",
+                model=model,
+                structure_only=structure_only,
+                thinking_budget=_policy(category).get("thinking_budget"),
+                popup_region=popup_region,
+            ),
+            lambda result: validate_analysis_result(result, hierarchies, require_recommendation=not structure_only)
+        )
+        result = _complete_switches(result)
+    if progressive:
+        _progressive_record(meter.current_scope().get("app") or "", full_pages=1, full_latency=time.time() - started)
     return result
+
+
+def _per_page(totals: Optional[Dict], pages: int) -> Optional[Dict]:
+    if not totals or not pages:
+        return None
+    return {"tokens": round(totals["total_tokens"] / pages, 1),
+            "latency": round(totals["latency"] / pages, 3),
+            "payload_bytes": round(totals["payload_bytes"] / pages)}
+
+
+def reset_analysis_mode_stats():
+    with _mode_lock:
+        _mode_counts.update(text_pages=0, image_pages=0, fallback_reasons={}, page_classes={})
+        _progressive_counts.clear()
+
+
+def analysis_mode_stats(app: Optional[str] = None) -> Dict:
+    """
+    两种分析方式的页面数与每页平均 token / 延迟 / 请求体大小（来自计量的 text_analysis 与 image_analysis 阶段）
+    以截图分析的每页平均值为基准，估算文字摘要分析节省的 token 与延迟（已扣除被放弃的摘要请求的开销）
+    """
+    with _mode_lock:
+        counts = {"text_pages": _mode_counts["text_pages"], "image_pages": _mode_counts["image_pages"],
+                  "fallback_reasons": dict(_mode_counts["fallback_reasons"]),
+                  "page_classes": dict(_mode_counts["page_classes"])}
+    summary = meter.summary(app)
+    by_phase = summary["by_phase"]
+    text_totals = by_phase.get("text_analysis")
+    image_totals = by_phase.get("image_analysis")
+    attempted = counts["text_pages"] + counts["fallback_reasons"].get("rejected", 0)
+    stats = dict(counts, mode=ANALYSIS_MODE,
+                 text_per_page=_per_page(text_totals, attempted),
+                 image_per_page=_per_page(image_totals, counts["image_pages"]),
+                 estimated_savings=None,
+                 first_answer_latency={
+                     category: totals["avg_first_answer_latency"]
+                     for category, totals in summary["by_page_class"].items()
+                 })
+    if text_totals and stats["image_per_page"]:
+        baseline = stats["image_per_page"]
+        stats["estimated_savings"] = {
+            "tokens": round(baseline["tokens"] * counts["text_pages"] - text_totals["total_tokens"]),
+            "latency": round(baseline["latency"] * counts["text_pages"] - text_totals["latency"], 3),
+        }
+    return stats
+
+
+def progressive_stats(app: Optional[str] = None) -> Dict:
+    """
+    渐进式分析按应用的命中率与估算节省的耗时：
+    不用渐进式时每个尝试页面都要一次原图分析（按未命中页面的原图平均耗时估算），减去缩图分析本身的耗时
+    """
+    with _mode_lock:
+        apps = {name: dict(counts) for name, counts in _progressive_counts.items()}
+    stats = {}
+    for name, counts in apps.items():
+        if app is not None and name != app:
+            continue
+        full_avg = counts["full_latency"] / counts["full_pages"] if counts["full_pages"] else None
+        stats[name] = {
+            "attempts": counts["attempts"],
+            "hits": counts["hits"],
+            "hit_rate": round(counts["hits"] / counts["attempts"], 3) if counts["attempts"] else None,
+            "low_latency": round(counts["low_latency"], 3),
+            "full_pages": counts["full_pages"],
+            "avg_full_latency": round(full_avg, 3) if full_avg is not None else None,
+            "estimated_saved_latency": round(counts["hits"] * full_avg - counts["low_latency"], 3)
+            if full_avg is not None else None,
+        }
+    return stats
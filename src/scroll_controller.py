@@ -0,0 +1,278 @@
+import hashlib
+import logging
+import os
+import re
+import threading
+import xml.etree.ElementTree as ET
+from collections import Counter
+from typing import Dict, List, Optional
+
+import uiautomator2 as u2
+from dotenv import load_dotenv
+from PIL import Image
+
+from page_fingerprint import IGNORED_PACKAGES
+from tracing import tracer, traced, traced_sleep
+
+# 加载环境变量
+load_dotenv()
+
+# 由界面层级中的可滚动容器计算滚动距离，按层级 / 截图判断到顶与到底，并记录当前滚动位置
+SCROLL_CONTROL = os.getenv("SCROLL_CONTROL", "true").lower() == "true"
+# 相邻两屏保留的重叠部分占容器高度的比例（保证前后两屏有共同的节点用于测量实际滚动距离）
+SCROLL_OVERLAP = float(os.getenv("SCROLL_OVERLAP", 0.15))
+# 每次滑动后等待界面稳定的时间（秒）
+SCROLL_SETTLE = float(os.getenv("SCROLL_SETTLE", 0.3))
+# 单个页面最多滚动的屏数
+SCROLL_MAX_PAGES = int(os.getenv("SCROLL_MAX_PAGES", 10))
+
+logger = logging.getLogger(__name__)
+
+_BOUNDS_PATTERN = re.compile(r'\[(-?\d+),(-?\d+)\]\[(-?\d+),(-?\d+)\]')
+# 手指开始拖动到内容开始跟随之间的距离；实际滚动比请求的少超过该值即认为到达边缘
+_TOUCH_SLOP = 48
+# 层级中没有可滚动容器时，在屏幕中部这一范围内滑动
+_FALLBACK_REGION = (0.15, 0.9)
+
+
+def _bounds(elem) -> Optional[List[int]]:
+    match = _BOUNDS_PATTERN.match(elem.get("bounds") or "")
+    return list(map(int, match.groups())) if match else None
+
+
+def _app_nodes(hierarchy_xml: Optional[str]) -> List:
+    if not hierarchy_xml:
+        return []
+    try:
+        root = ET.fromstring(hierarchy_xml)
+    except ET.ParseError:
+        return []
+    return [elem for elem in root.iter("node") if not (elem.get("package") or "").startswith(IGNORED_PACKAGES)]
+
+
+def scroll_container(hierarchy_xml: Optional[str], width: int, height: int) -> List[int]:
+    """页面中面积最大的可滚动容器的坐标 [left, top, right, bottom]；没有时取屏幕中部"""
+    best, best_area = None, 0
+    for elem in _app_nodes(hierarchy_xml):
+        if elem.get("scrollable") != "true":
+            continue
+        box = _bounds(elem)
+        if box is None:
+            continue
+        box = [max(0, box[0]), max(0, box[1]), min(width, box[2]), min(height, box[3])]
+        area = max(0, box[2] - box[0]) * max(0, box[3] - box[1])
+        if area > best_area:
+            best, best_area = box, area
+    # 太矮的容器（横向滚动的标签栏等）不适合纵向滚动
+    if best is None or best[3] - best[1] < height * 0.2:
+        return [0, int(height * _FALLBACK_REGION[0]), width, int(height * _FALLBACK_REGION[1])]
+    return best
+
+
+def _anchors(hierarchy_xml: Optional[str], box: List[int]) -> Dict[tuple, int]:
+    """容器内完整可见、带文字的叶子节点 (文字, 类名, 左边界) -> 上边界；同一页面出现多次的节点不能用于定位"""
+    tops: Dict[tuple, int] = {}
+    counts = Counter()
+    for elem in _app_nodes(hierarchy_xml):
+        text = (elem.get("text") or elem.get("content-desc") or "").strip()
+        b = _bounds(elem)
+        if list(elem) or not text or b is None or b[1] < box[1] or b[3] > box[3]:
+            continue
+        key = (text, elem.get("class") or "", b[0])
+        counts[key] += 1
+        tops[key] = b[1]
+    return {key: top for key, top in tops.items() if counts[key] == 1}
+
+
+def _frame_hash(image: Image.Image) -> str:
+    return hashlib.md5(image.tobytes()).hexdigest()
+
+
+def _label_match(hierarchy_xml: Optional[str], text: str) -> Optional[str]:
+    """层级中是否有文字（text）或描述（description）为 text 的节点"""
+    for elem in _app_nodes(hierarchy_xml):
+        if (elem.get("text") or "") == text:
+            return "text"
+        if (elem.get("content-desc") or "") == text:
+            return "description"
+    return None
+
+
+class ScrollController:
+    """
+    基于可滚动容器的页面滚动
+    - 滑动距离按容器高度计算（每次一屏，保留 SCROLL_OVERLAP 的重叠），而不是固定的屏幕比例
+    - 由前后两次层级中共同节点的位移测得实际滚动距离：比请求的明显少即到达边缘，不需要多滑一次再比较截图；
+      容器内没有文字节点（WebView 等）时改为比较前后截图的哈希
+    - 记录当前页面相对顶部的滚动距离：已在顶部时回到顶部不做任何操作，位置已知时按位置滑回，不需要多滑一次确认到顶
+    进入子页面时保存上一级的位置，返回时恢复；位置无法确定时按一屏一屏向上滚动直到测得到顶
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.enabled = SCROLL_CONTROL
+        # 当前页面相对顶部已滚动的像素，None 表示未知
+        self.offset: Optional[int] = None
+        self._stack: List[Optional[int]] = []
+        self.swipes = 0
+        self.edges = {"hierarchy": 0, "frame": 0}
+        self.to_top = {"skipped": 0, "known_offset": 0, "search": 0}
+        self.to_top_swipes = 0
+
+    def reset(self):
+        with self._lock:
+            self.offset = None
+            self._stack = []
+            self.swipes = 0
+            self.edges = {"hierarchy": 0, "frame": 0}
+            self.to_top = {"skipped": 0, "known_offset": 0, "search": 0}
+            self.to_top_swipes = 0
+
+    # ---- 页面位置 ----
+
+    def enter(self):
+        """点击进入新页面：保存当前页面的位置，新页面从顶部开始"""
+        self._stack.append(self.offset)
+        self.offset = 0
+
+    def leave(self):
+        """返回上一级：恢复其位置"""
+        self.offset = self._stack.pop() if self._stack else None
+
+    def forget(self):
+        """在控制器之外滑动过，当前位置未知"""
+        self.offset = None
+
+    def rewind(self, depth: int):
+        """导航恢复到第 depth 级页面后只保留其上各级的位置，当前位置未知"""
+        del self._stack[depth:]
+        self.offset = None
+
+    # ---- 滚动 ----
+
+    def _measure(self, before: Dict[tuple, int], after: Dict[tuple, int]) -> Optional[int]:
+        """前后两次层级中共同节点的位移（取众数），没有共同节点时返回 None"""
+        shifts = Counter(before[key] - after[key] for key in before.keys() & after.keys())
+        return shifts.most_common(1)[0][0] if shifts else None
+
+    @traced("device")
+    def scroll(self, device: u2.Device, direction: str = "down", hierarchy_xml: Optional[str] = None,
+               distance: Optional[int] = None, frame: Optional[Image.Image] = None) -> Dict:
+        """
+        在可滚动容器内滚动一屏（或 distance 像素）；down 为查看下方内容
+        返回 {"moved": 实际滚动的像素, "requested", "edge": 是否已到达该方向的边缘, "hierarchy": 滚动后的层级,
+              "frame": 比较截图时滚动后的截图（否则为 None）, "container": 容器坐标}
+        """
+        width, height = device.window_size()
+        if hierarchy_xml is None:
+            hierarchy_xml = device.dump_hierarchy()
+        box = scroll_container(hierarchy_xml, width, height)
+        margin = int((box[3] - box[1]) * SCROLL_OVERLAP / 2)
+        step = box[3] - box[1] - 2 * margin
+        requested = max(1, min(step, distance if distance is not None else step))
+        before = _anchors(hierarchy_xml, box)
+        # 没有可用于定位的文字节点时用截图判断是否滚动
+        if not before and frame is None:
+            with tracer.span("screenshot", "device"):
+                frame = device.screenshot(format='pillow').convert("RGB")
+
+        x = (box[0] + box[2]) // 2
+        if direction == "down":
+            start_y, end_y = box[3] - margin, box[3] - margin - requested
+        else:
+            start_y, end_y = box[1] + margin, box[1] + margin + requested
+        with tracer.span("swipe", "device"):
+            device.swipe(x, start_y, x, end_y, 0.3)
+        traced_sleep(SCROLL_SETTLE)
+        with tracer.span("dump_hierarchy", "device"):
+            after_xml = device.dump_hierarchy()
+
+        after_frame = None
+        measured = self._measure(before, _anchors(after_xml, box))
+        if measured is not None:
+            moved, source = abs(measured), "hierarchy"
+        elif before and after_xml == hierarchy_xml:
+            moved, source = 0, "hierarchy"
+        elif frame is not None:
+            with tracer.span("screenshot", "device"):
+                after_frame = device.screenshot(format='pillow').convert("RGB")
+            moved, source = (0 if _frame_hash(after_frame) == _frame_hash(frame) else requested), "frame"
+        else:
+            # 层级变化但没有共同节点：按请求的距离计，位置不再精确
+            moved, source = requested, None
+        edge = moved < requested - _TOUCH_SLOP
+
+        with self._lock:
+            self.swipes += 1
+            if edge and source:
+                self.edges[source] += 1
+            if source != "hierarchy":
+                self.offset = None
+            elif self.offset is not None:
+                self.offset = max(0, self.offset + (moved if direction == "down" else -moved))
+            if direction == "up" and edge:
+                self.offset = 0
+        return {"moved": moved, "requested": requested, "edge": edge, "hierarchy": after_xml,
+                "frame": after_frame, "container": box}
+
+    @traced("device")
+    def scroll_to_top(self, device: u2.Device):
+        """回到页面顶部：已在顶部时不操作；位置已知时按位置滑动，否则一屏一屏向上直到到顶"""
+        if self.offset == 0:
+            with self._lock:
+                self.to_top["skipped"] += 1
+            return
+        with self._lock:
+            self.to_top["known_offset" if self.offset is not None else "search"] += 1
+        hierarchy_xml = device.dump_hierarchy()
+        reached = False
+        for _ in range(SCROLL_MAX_PAGES):
+            distance = self.offset + _TOUCH_SLOP if self.offset is not None else None
+            result = self.scroll(device, "up", hierarchy_xml, distance)
+            with self._lock:
+                self.to_top_swipes += 1
+            reached = result["edge"] or self.offset == 0
+            if reached:
+                break
+            hierarchy_xml = result["hierarchy"]
+        # 滑满 SCROLL_MAX_PAGES 屏仍未测得到顶时位置未知，下次回到顶部时重新查找
+        self.offset = 0 if reached else None
+        if not reached:
+            logger.warning(f"滑动 {SCROLL_MAX_PAGES} 屏后仍未到达页面顶部")
+
+    @traced("device")
+    def find(self, device: u2.Device, text: str):
+        """从当前位置向下逐屏查找文字为 text 的节点，找到返回选择器；到底仍未找到返回 None"""
+        hierarchy_xml = device.dump_hierarchy()
+        for _ in range(SCROLL_MAX_PAGES):
+            match = _label_match(hierarchy_xml, text)
+            if match == "text":
+                return device(text=text)
+            if match == "description":
+                return device(description=text)
+            result = self.scroll(device, "down", hierarchy_xml)
+            if result["moved"] == 0:
+                return None
+            hierarchy_xml = result["hierarchy"]
+            # 已到底：只需再看一次滚动后的层级，不再滑动
+            if result["edge"] and _label_match(hierarchy_xml, text) is None:
+                return None
+        return None
+
+    def stats(self) -> Dict:
+        with self._lock:
+            calls = sum(self.to_top.values())
+            return {
+                "enabled": self.enabled,
+                "swipes": self.swipes,
+                "edges_detected": dict(self.edges),
+                "scroll_to_top": dict(self.to_top),
+                "avg_swipes_to_top": round(self.to_top_swipes / calls, 2) if calls else 0,
+            }
+
+
+scroller = ScrollController()
+
+
+def scroll_stats() -> Dict:
+    return scroller.stats()
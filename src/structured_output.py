@@ -0,0 +1,494 @@
+import json
+import logging
+import os
+import re
+import threading
+from typing import Any, Callable, Dict, List, Literal, Optional, Type
+
+import requests
+from dotenv import load_dotenv
+from pydantic import BaseModel, ConfigDict, Field, RootModel, ValidationError, field_validator, model_validator
+
+from llm_request import Endpoint, check_response, gemini_executor
+from metering import metering_scope, report_payload, report_usage
+
+# 加载环境变量
+load_dotenv()
+
+# 支持 response_format 的模型（按前缀匹配，逗号分隔）：json_schema 约束到具体结构，json_object 只保证输出合法 JSON
+JSON_SCHEMA_MODELS = [m.strip() for m in os.getenv("JSON_SCHEMA_MODELS", "").split(",") if m.strip()]
+JSON_OBJECT_MODELS = [m.strip() for m in os.getenv(
+    "JSON_OBJECT_MODELS", "qwen-plus,qwen-max,qwen-turbo,qwen-vl-max,qwen-vl-plus").split(",") if m.strip()]
+# 输出无法修复时，把原输出与校验错误交给便宜的文字模型重新整理（不重新发送图片）
+QWEN_REASK_MODEL = os.getenv("QWEN_REASK_MODEL", "qwen-plus")
+GEMINI_REASK_MODEL = os.getenv("GEMINI_REASK_MODEL", "gemini-2.5-flash")
+# 重新整理时附带的原输出最大长度（字符）
+REASK_MAX_CHARS = int(os.getenv("REASK_MAX_CHARS", 6000))
+
+logger = logging.getLogger(__name__)
+
+_ON = ("on", "开", "开启", "已开启", "打开", "true", "1", "enabled")
+_OFF = ("off", "关", "关闭", "已关闭", "false", "0", "disabled")
+
+
+def _state(value):
+    """开关状态的常见写法统一为 on / off"""
+    if isinstance(value, bool):
+        return "on" if value else "off"
+    text = str(value).strip().lower()
+    if text in _ON:
+        return "on"
+    if text in _OFF:
+        return "off"
+    return value
+
+
+def _require_any(*keys):
+    """顶层对象至少要有其中一个字段；否则回答中任意一个小对象（如单个列表项）都会被当成全默认值的结果"""
+    def check(cls, v):
+        if not isinstance(v, dict) or not any(key in v for key in keys):
+            raise ValueError(f"缺少字段: {' / '.join(keys)}")
+        return v
+    return model_validator(mode="before")(classmethod(check))
+
+
+# ---- 页面分析（prompt.txt / prompt_text.txt） ----
+
+class SwitchItem(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+    text: str = Field(min_length=1)
+    current_state: Literal["on", "off"]
+    # 结构模式下由开关知识库补全，模型可以不给
+    recommended_state: Optional[Literal["on", "off"]] = None
+    analysis: Optional[str] = None
+
+    _normalize_states = field_validator("current_state", "recommended_state", mode="before")(
+        lambda cls, v: None if v is None else _state(v))
+
+
+class LayoutItem(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+    text: str = Field(min_length=1)
+
+
+class PersonalizationResult(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+    switches: List[SwitchItem] = []
+    layouts: List[LayoutItem] = []
+
+
+class PrivacyAnalysis(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+    switches: List[SwitchItem] = []
+    layouts: List[LayoutItem] = []
+    personalization: PersonalizationResult = PersonalizationResult()
+    isPopup: bool = False
+
+    _required = _require_any("switches", "layouts")
+
+    @field_validator("personalization", mode="before")
+    @classmethod
+    def _empty_personalization(cls, v):
+        # 模型有时把空的 personalization 写成 [] 或 null
+        return v if isinstance(v, dict) else {}
+
+
+class SwitchRecommendation(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+    recommended_state: Literal["on", "off"]
+    analysis: str = ""
+
+    _normalize_state = field_validator("recommended_state", mode="before")(lambda cls, v: _state(v))
+
+
+class SwitchRecommendations(RootModel[Dict[str, SwitchRecommendation]]):
+    pass
+
+
+# ---- 图标检测 ----
+
+class DetectionBox(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+    box_2d: List[int] = Field(min_length=4, max_length=4)  # [y1, x1, y2, x2]，0-1000 归一化坐标
+    label: str = ""
+    confidence: Optional[float] = None
+
+    @field_validator("box_2d", mode="before")
+    @classmethod
+    def _round_box(cls, v):
+        if isinstance(v, list):
+            return [round(float(x)) if isinstance(x, (int, float, str)) and str(x).strip() else x for x in v]
+        return v
+
+
+class DetectionList(RootModel[List[DetectionBox]]):
+    @model_validator(mode="before")
+    @classmethod
+    def _unwrap(cls, v):
+        # 兼容 {"detections": [...]}、{"elements": [...]} 与单个检测框
+        if isinstance(v, dict):
+            if "box_2d" in v:
+                return [v]
+            return v.get("detections") or v.get("elements") or []
+        return v
+
+
+def _valid_or_none(model: Type[BaseModel]):
+    """单个子结果不合法时置为 None，而不是让整个回答校验失败（与原来逐项检查的行为一致）"""
+    def convert(v):
+        if v is None:
+            return None
+        try:
+            return model.model_validate(v)
+        except ValidationError:
+            return None
+    return convert
+
+
+class JointDetection(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+    personal: Optional[DetectionBox] = None
+    setting: Optional[DetectionBox] = None
+    setting_visible: bool = False
+
+    _required = _require_any("personal", "setting")
+    _boxes = field_validator("personal", "setting", mode="before")(
+        lambda cls, v: _valid_or_none(DetectionBox)(v))
+
+    @model_validator(mode="after")
+    def _visible_needs_box(self):
+        self.setting_visible = self.setting_visible and self.setting is not None
+        return self
+
+
+# ---- Stage1 粗定位 / 精定位 ----
+
+class RegionGuess(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    region: str = Field(min_length=1)
+    confidence: float = 0.0
+    reason: str = ""
+
+
+class CoarseRegions(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+    detected_regions: List[RegionGuess] = []
+
+    _required = _require_any("detected_regions")
+
+
+class JointRegions(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+    personal: Optional[RegionGuess] = None
+    setting: Optional[RegionGuess] = None
+    setting_visible: bool = False
+
+    _required = _require_any("personal", "setting")
+    _regions = field_validator("personal", "setting", mode="before")(
+        lambda cls, v: _valid_or_none(RegionGuess)(v))
+
+    @model_validator(mode="after")
+    def _visible_needs_region(self):
+        self.setting_visible = self.setting_visible and self.setting is not None
+        return self
+
+
+class SelectedElement(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    index: int
+    confidence: float = 0.0
+    reason: str = ""
+
+
+class ElementSelection(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+    selected_element: Optional[SelectedElement] = None
+
+    _required = _require_any("selected_element")
+    _selected = field_validator("selected_element", mode="before")(
+        lambda cls, v: _valid_or_none(SelectedElement)(v))
+
+
+# ---- 提取与修复 ----
+
+_FENCE = re.compile(r"```(?:json|JSON)?\s*\n?([\s\S]*?)(?:```|$)")
+_FULL_WIDTH = {"，": ",", "：": ":", "“": '"', "”": '"', "｛": "{", "｝": "}", "［": "[", "］": "]"}
+_LITERALS = {"true": "true", "false": "false", "null": "null", "True": "true", "False": "false", "None": "null"}
+_NUMBER = re.compile(r"-?\d+(\.\d+)?([eE][+-]?\d+)?$")
+# 未加引号的值：到空白、标点、括号或引号（含全角）为止
+_BARE_WORD = re.compile(r"[^\s,:{}\[\]\"'" + "".join(_FULL_WIDTH) + "]+")
+
+
+def json_candidates(text: str) -> List[str]:
+    """
+    从模型回答中取出可能的 JSON 部分，按优先级排列：
+    最后一个代码块（前面可能是思考过程）；能完整解析的最长 JSON 片段；从第一个 { 或 [ 到结尾（交给 repair_json 修复）
+    """
+    text = (text or "").strip()
+    candidates = []
+    blocks = [b.strip() for b in _FENCE.findall(text) if b.strip()]
+    if blocks:
+        candidates.append(blocks[-1])
+    starts = [i for i, c in enumerate(text) if c in "{["][:50]
+    decoder = json.JSONDecoder()
+    best = None
+    for start in starts:
+        try:
+            _, end = decoder.raw_decode(text, start)
+        except ValueError:
+            continue
+        if best is None or end - start > best[1] - best[0]:
+            best = (start, end)
+    if best is not None:
+        candidates.append(text[best[0]:best[1]])
+    candidates.append(text[starts[0]:] if starts else text)
+    return list(dict.fromkeys(candidates))
+
+
+def repair_json(text: str) -> str:
+    """
+    修复模型输出中常见的 JSON 错误（只在字符串之外处理）：
+    全角标点、// 注释、单引号字符串、Python 字面量、未加引号的 on/off、多余或缺失的逗号、
+    字符串内的换行，以及输出被截断时未闭合的字符串与括号
+    """
+    out: List[str] = []
+    stack: List[str] = []
+    quote = None          # 当前字符串的结束引号（"、' 或 ”），None 表示在字符串之外
+    after_value = False   # 上一个 token 是完整的值，下一个值之前缺逗号
+    i, n = 0, len(text)
+
+    def strip_trailing_comma():
+        while out and out[-1].isspace():
+            out.pop()
+        if out and out[-1] == ",":
+            out.pop()
+
+    while i < n:
+        c = text[i]
+        if quote is not None:
+            if c == "\\" and i + 1 < n:
+                out.append(c + text[i + 1])
+                i += 2
+                continue
+            if c == quote:
+                out.append('"')
+                quote = None
+                after_value = True
+            elif c == '"':
+                out.append('\\"')
+            elif c == "\n":
+                out.append("\\n")
+            else:
+                out.append(c)
+            i += 1
+            continue
+
+        c = _FULL_WIDTH.get(c, c)
+        if c == "/" and text[i:i + 2] == "//":
+            while i < n and text[i] != "\n":
+                i += 1
+            continue
+        if c.isspace():
+            out.append(c)
+            i += 1
+            continue
+        if c in "}]":
+            strip_trailing_comma()
+            if out and out[-1] == ":":
+                out.append("null")
+            if stack:
+                out.append(stack.pop())
+            after_value = True
+            i += 1
+            continue
+        if c in ",:":
+            if c == "," and (not out or out[-1] in ",[{"):
+                i += 1
+                continue
+            out.append(c)
+            after_value = False
+            i += 1
+            continue
+
+        if after_value:
+            out.append(",")
+        if c in "{[":
+            stack.append("}" if c == "{" else "]")
+            out.append(c)
+            after_value = False
+            i += 1
+        elif c in "\"'“":
+            quote = "”" if c == "“" else c
+            out.append('"')
+            i += 1
+        else:
+            match = _BARE_WORD.match(text, i)
+            word = match.group(0) if match else c
+            i += len(word)
+            if word in _LITERALS:
+                out.append(_LITERALS[word])
+            elif _NUMBER.match(word):
+                out.append(word)
+            else:
+                out.append(json.dumps(word, ensure_ascii=False))
+            after_value = True
+
+    if quote is not None:
+        out.append('"')
+    strip_trailing_comma()
+    if out and out[-1] == ":":
+        out.append("null")
+    while stack:
+        out.append(stack.pop())
+    return "".join(out)
+
+
+# ---- 解析统计 ----
+
+class _ParseStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts: Dict[str, Dict[str, int]] = {}
+
+    def count(self, schema: str, outcome: str):
+        with self._lock:
+            counts = self.counts.setdefault(schema, {"parsed": 0, "repaired": 0, "reasked": 0, "failed": 0})
+            counts[outcome] += 1
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {schema: dict(c) for schema, c in self.counts.items()}
+
+
+parse_stats = _ParseStats()
+
+
+def structured_output_stats() -> Dict[str, Dict[str, int]]:
+    """各响应类型直接解析成功 / 修复后成功 / 重新整理后成功 / 失败的次数"""
+    return parse_stats.stats()
+
+
+def _validate(candidate: str, schema: Type[BaseModel]):
+    """返回 (结果, 错误信息)"""
+    try:
+        return schema.model_validate_json(candidate), None
+    except ValidationError as e:
+        return None, str(e)
+
+
+def reask_prompt(raw: str, error: str, schema: Type[BaseModel]) -> str:
+    return (
+        "下面这段模型输出未能通过 JSON 校验，错误如下：\n"
+        f"{error[:1500]}\n"
+        "请在不改变其内容含义的前提下把它整理为合法的 JSON，只输出 JSON 本身（不要解释、不要代码块），"
+        "并符合以下 JSON Schema：\n"
+        f"{json.dumps(schema.model_json_schema(), ensure_ascii=False)}\n"
+        "需要整理的输出：\n"
+        f"{raw[-REASK_MAX_CHARS:]}"
+    )
+
+
+def parse_response(text: Optional[str], schema: Type[BaseModel],
+                   reask: Optional[Callable[[str], Optional[str]]] = None) -> Optional[BaseModel]:
+    """
+    把模型回答解析并校验为 schema：先直接解析代码块 / JSON 片段，失败时修复后再试；
+    仍失败且传入 reask(提示词) -> 文字 时，把原输出与校验错误交给便宜的文字模型整理一次（不重发图片）
+    全部失败返回 None
+    """
+    name = schema.__name__
+    if not text or not text.strip():
+        parse_stats.count(name, "failed")
+        return None
+    candidates = json_candidates(text)
+    error = None
+    for candidate in candidates:
+        result, candidate_error = _validate(candidate, schema)
+        if result is not None:
+            parse_stats.count(name, "parsed")
+            return result
+        error = error or candidate_error
+    for candidate in candidates:
+        result, candidate_error = _validate(repair_json(candidate), schema)
+        if result is not None:
+            parse_stats.count(name, "repaired")
+            return result
+        error = candidate_error if candidate is candidates[0] else error
+
+    if reask is not None:
+        logger.info(f"{name} 输出校验失败，交给文字模型重新整理: {error[:200]}")
+        try:
+            with metering_scope(phase="reask"):
+                answer = reask(reask_prompt(candidates[0], error, schema))
+        except Exception as e:
+            logger.warning(f"重新整理请求失败: {str(e)}")
+            answer = None
+        for candidate in json_candidates(answer) if answer else ():
+            result, _ = _validate(candidate, schema)
+            if result is None:
+                result, _ = _validate(repair_json(candidate), schema)
+            if result is not None:
+                parse_stats.count(name, "reasked")
+                return result
+
+    logger.warning(f"{name} 输出无法解析: {error[:200]}")
+    parse_stats.count(name, "failed")
+    return None
+
+
+def parse_dict(text: Optional[str], schema: Type[BaseModel],
+               reask: Optional[Callable[[str], Optional[str]]] = None) -> Optional[Any]:
+    """parse_response 的字典 / 列表形式（去掉值为 None 的字段），供沿用字典结果的调用方使用"""
+    result = parse_response(text, schema, reask)
+    return None if result is None else result.model_dump(exclude_none=True)
+
+
+# ---- 请求侧 ----
+
+def _supports(model: str, prefixes: List[str]) -> bool:
+    return any(model.startswith(prefix) for prefix in prefixes)
+
+
+def response_format(model: str, schema: Type[BaseModel]) -> Dict[str, Any]:
+    """
+    该模型支持时返回请求中要附加的 {"response_format": ...}，否则返回空字典
+    json_object 只能约束顶层为对象，顶层为数组的 schema 不使用
+    """
+    if _supports(model, JSON_SCHEMA_MODELS):
+        return {"response_format": {"type": "json_schema", "json_schema": {
+            "name": schema.__name__, "schema": schema.model_json_schema()}}}
+    if _supports(model, JSON_OBJECT_MODELS) and schema.model_json_schema().get("type") == "object":
+        return {"response_format": {"type": "json_object"}}
+    return {}
+
+
+def gemini_reask(api_key: str, api_base: Optional[str] = None,
+                 model: str = GEMINI_REASK_MODEL) -> Callable[[str], Optional[str]]:
+    """Gemini 网关上的重新整理请求：只发送文字，不带图片"""
+
+    def ask(prompt: str) -> Optional[str]:
+        def send(endpoint: Endpoint, timeout: float) -> Optional[str]:
+            body = json.dumps({"model": endpoint.model, "temperature": 0,
+                               "messages": [{"role": "user", "content": prompt}]})
+            report_payload(len(body))
+            response = requests.post(endpoint.chat_url, headers=endpoint.headers(), data=body, timeout=timeout)
+            check_response(response)
+            data = response.json()
+            report_usage(data.get("usage"))
+            choices = data.get("choices") or []
+            return choices[0].get("message", {}).get("content") if choices else None
+
+        return gemini_executor(api_key, model, api_base, max_retries=1).execute(send, lambda content: bool(content))
+
+    return ask
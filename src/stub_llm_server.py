@@ -0,0 +1,167 @@
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Optional, Union
+
+
+class StubLLMServer:
+    """
+    本地 OpenAI 兼容的替身服务，用于在没有真实模型服务时测试请求执行层
+    支持注入延迟、按概率返回错误状态码，以及流式/非流式两种响应
+    """
+
+    def __init__(self, content: Union[str, Callable[[Dict], str]] = "{}",
+                 latency: Union[float, Callable[[], float]] = 0.0,
+                 error_rate: float = 0.0, error_status: int = 503,
+                 host: str = "127.0.0.1", port: int = 0):
+        self.content = content
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.request_count = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "StubLLMServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def respond(self, request: Dict) -> str:
+        """根据请求生成回答内容，子类可覆盖"""
+        return self.content(request) if callable(self.content) else self.content
+
+    def _delay(self) -> float:
+        return self.latency() if callable(self.latency) else self.latency
+
+    def reply(self, request: Dict) -> Dict:
+        """
+        决定一次请求的完整回应：content / delay（秒）/ status（非200时返回错误）/ usage（None 时按长度估算）
+        默认按构造参数注入延迟与错误，子类（如录制回放）可整体覆盖
+        """
+        status = 200
+        if self.error_rate and random.random() < self.error_rate:
+            status = self.error_status
+        return {
+            "content": self.respond(request) if status == 200 else "",
+            "delay": self._delay(),
+            "status": status,
+            "usage": None,
+        }
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self.send_error(404)
+                    return
+                length = int(self.headers.get("Content-Length", 0))
+                try:
+                    request = json.loads(self.rfile.read(length) or b"{}")
+                except json.JSONDecodeError:
+                    self.send_error(400)
+                    return
+                with stub._lock:
+                    stub.request_count += 1
+
+                reply = stub.reply(request)
+                time.sleep(max(0.0, reply["delay"]))
+                if reply["status"] != 200:
+                    self.send_error(reply["status"])
+                    return
+
+                content = reply["content"]
+                model = request.get("model", "stub")
+                usage = reply.get("usage")
+                if not usage:
+                    usage = {
+                        "prompt_tokens": len(json.dumps(request.get("messages", []))) // 4,
+                        "completion_tokens": len(content) // 4,
+                    }
+                    usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+
+                if request.get("stream"):
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/event-stream")
+                    self.end_headers()
+                    step = 64
+                    for i in range(0, len(content), step) or [0]:
+                        chunk = {"id": "stub", "object": "chat.completion.chunk", "model": model,
+                                 "choices": [{"index": 0, "delta": {"content": content[i:i + step]}}]}
+                        self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                    final = {"id": "stub", "object": "chat.completion.chunk", "model": model,
+                             "choices": [], "usage": usage}
+                    self.wfile.write(f"data: {json.dumps(final)}\n\n".encode("utf-8"))
+                    self.wfile.write(b"data: [DONE]\n\n")
+                    return
+
+                body = json.dumps({
+                    "id": "stub",
+                    "object": "chat.completion",
+                    "model": model,
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": content}}],
+                    "usage": usage,
+                }, ensure_ascii=False).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 OpenAI 兼容替身服务（可注入延迟与错误）")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--content-file", help="作为回答内容返回的文件")
+    parser.add_argument("--latency", type=float, default=0.0, help="固定延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.0, help="在固定延迟之上叠加的随机延迟上限（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    content = "{}"
+    if args.content_file:
+        with open(args.content_file, "r", encoding="utf-8") as f:
+            content = f.read()
+
+    server = StubLLMServer(content=content,
+                           latency=lambda: args.latency + random.uniform(0, args.jitter),
+                           error_rate=args.error_rate, port=args.port)
+    print(f"stub server listening on {server.url}")
+    server.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
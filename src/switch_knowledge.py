@@ -0,0 +1,300 @@
+import argparse
+import difflib
+import glob
+import json
+import logging
+import os
+import re
+import threading
+import unicodedata
+from collections import Counter
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+# 加载环境变量
+load_dotenv()
+
+# 是否让模型只输出页面结构（开关文字与当前状态），推荐状态与理由由知识库补全
+SWITCH_KB = os.getenv("SWITCH_KB", "true").lower() == "true"
+SWITCH_KB_PATH = os.getenv("SWITCH_KB_PATH", "switch_knowledge.json")
+# 知识库条目少于该数量时（例如首次安装、还没有历史输出）仍让模型输出完整结果：
+# 否则几乎每个开关都查不到，每页都要在页面分析之外再询问一次推荐状态
+SWITCH_KB_MIN_ENTRIES = int(os.getenv("SWITCH_KB_MIN_ENTRIES", 50))
+# 模糊匹配的最低相似度（difflib ratio，基于归一化后的文字）
+SWITCH_KB_MIN_SIMILARITY = float(os.getenv("SWITCH_KB_MIN_SIMILARITY", 0.8))
+# 知识库与规则都无法补全时，向该文字模型单独询问推荐状态与理由
+SWITCH_KB_MODEL = os.getenv("SWITCH_KB_MODEL", "qwen-plus")
+
+logger = logging.getLogger(__name__)
+
+# 结构模式下附加在提示词末尾的要求
+STRUCTURE_ONLY_NOTE = (
+    "\n\n输出精简要求：switches 与 personalization.switches 中的每一项只输出 text 与 current_state 两个字段，"
+    "不要输出 recommended_state 与 analysis（由本地知识库补全），其余字段与规则不变。"
+)
+
+# 开关推荐状态的来源（输出中记在 recommendation_source 字段）：只有模型给出的推荐才计入知识库的投票，
+# 知识库与规则表补全的结果不回写，避免知识库为自己之前的回答投票、把错误的推荐越投越多；没有该字段的旧输出均来自模型
+SOURCE_MODEL = "model"
+SOURCE_KB = "kb"
+SOURCE_RULE = "rule"
+
+# 含义相反的标记：一方有、另一方没有时即使文字相近也不算同一个开关（“允许…找到我” 与 “不允许…找到我”）
+NEGATIONS = ("不", "禁止", "拒绝", "关闭", "隐藏")
+_PUNCTUATION = re.compile(r"[\s\W_]+", re.UNICODE)
+_TIMESTAMP_SUFFIX = re.compile(r"_\d{8}_\d{6}(\.tree)?\.json$")
+
+
+def normalize_label(text: str) -> str:
+    """全角转半角、转小写、去掉空白与标点，得到知识库的键"""
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    return _PUNCTUATION.sub("", text)
+
+
+def _bigrams(key: str) -> set:
+    return {key[i:i + 2] for i in range(len(key) - 1)} or {key}
+
+
+def _same_polarity(a: str, b: str) -> bool:
+    return all((neg in a) == (neg in b) for neg in NEGATIONS)
+
+
+def from_model(entry: Dict) -> bool:
+    """开关的推荐状态是否由模型给出（可以计入知识库）"""
+    return entry.get("recommendation_source", SOURCE_MODEL) == SOURCE_MODEL
+
+
+def _output_switches(path: str) -> Iterator[Tuple[str, str, Dict]]:
+    """从一份 all_paths_results 输出（展平或树形）中依次取出 (应用包名, 类别, 开关)"""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    # 展平输出没有包名字段，从文件名取（包名中的 . 已替换为 _）
+    app = data.get("app_package") or _TIMESTAMP_SUFFIX.sub("", os.path.basename(path))
+    if "nodes" in data:
+        for node in data["nodes"]:
+            for kind, category in (("privacy_switches", "privacy"), ("personality_switches", "personalization")):
+                for entry in node.get(kind, ()):
+                    yield app, category, entry
+        return
+    for entry in data.get("privacy_switches", ()):
+        yield app, "privacy", entry
+    for entry in data.get("personality", {}).get("personality_switches", ()):
+        yield app, "personalization", entry
+
+
+class SwitchKnowledgeBase:
+    """
+    跨应用的开关知识库：归一化的开关文字 -> 类别、推荐状态（按应用投票）与规范的推荐理由
+    由历次 all_paths_results 输出构建，爬取过程中模型新给出的推荐也会加入；
+    查找时先精确匹配，再在共享二元字组的候选中做模糊匹配（含义相反的文字不匹配）
+    """
+
+    def __init__(self, path: str = SWITCH_KB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self.entries: Dict[str, Dict] = {}
+        self._index: Dict[str, set] = {}
+        self.hits = 0
+        self.fuzzy_hits = 0
+        self.misses = 0
+        self.filled_by_rules = 0
+        self.filled_by_model = 0
+        if path and os.path.exists(path):
+            self.load(path)
+
+    # ---- 持久化 ----
+
+    def load(self, path: str):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        with self._lock:
+            for key, entry in data.get("entries", {}).items():
+                entry["votes"] = Counter(entry.get("votes", {}))
+                entry["analyses"] = Counter(entry.get("analyses", {}))
+                entry["apps"] = set(entry.get("apps", []))
+                self._put(key, entry)
+        logger.info(f"开关知识库已加载: {len(self.entries)} 条")
+
+    def save(self, path: Optional[str] = None):
+        path = path or self.path
+        with self._lock:
+            entries = {
+                key: dict(entry, votes=dict(entry["votes"]), analyses=dict(entry["analyses"].most_common(3)),
+                          apps=sorted(entry["apps"]))
+                for key, entry in self.entries.items()
+            }
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"entries": entries}, f, ensure_ascii=False, indent=1)
+
+    # ---- 构建 ----
+
+    def _put(self, key: str, entry: Dict):
+        self.entries[key] = entry
+        for gram in _bigrams(key):
+            self._index.setdefault(gram, set()).add(key)
+
+    def add(self, text: str, category: str, recommended_state: str, analysis: str, app: str = ""):
+        """记录一个开关的推荐；同一应用的同一开关只计一票（重复构建同一批输出不会重复计票）"""
+        key = normalize_label(text)
+        if not key or recommended_state not in ("on", "off"):
+            return
+        # 包名统一成输出文件名中的写法，展平与树形输出、爬取过程中记录的同一应用才能对上
+        app = app.replace(".", "_")
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                entry = {"text": text, "category": category, "votes": Counter(), "analyses": Counter(), "apps": set()}
+                self._put(key, entry)
+            elif app and app in entry["apps"]:
+                return
+            entry["votes"][recommended_state] += 1
+            if analysis:
+                entry["analyses"][analysis] += 1
+            if app:
+                entry["apps"].add(app)
+
+    def build(self, output_dir: str = "all_paths_results") -> int:
+        """读取目录下所有历史输出（展平与树形），返回加入的开关数；知识库或规则表补全的开关不计入"""
+        added = 0
+        for path in sorted(glob.glob(os.path.join(output_dir, "*.json"))):
+            try:
+                for app, category, entry in _output_switches(path):
+                    if entry.get("text") and entry.get("recommended_state") and from_model(entry):
+                        self.add(entry["text"], category, entry["recommended_state"], entry.get("analysis", ""), app)
+                        added += 1
+            except (OSError, ValueError, AttributeError) as e:
+                logger.warning(f"跳过无法解析的输出文件 {path}: {e}")
+        logger.info(f"由 {output_dir} 构建开关知识库: {added} 个开关，{len(self.entries)} 条不同的开关")
+        return added
+
+    def ready(self) -> bool:
+        """条目足够多，页面分析可以只让模型输出结构"""
+        with self._lock:
+            return len(self.entries) >= SWITCH_KB_MIN_ENTRIES
+
+    # ---- 查找 ----
+
+    def _match(self, key: str) -> Optional[str]:
+        if key in self.entries:
+            return key
+        candidates = set()
+        for gram in _bigrams(key):
+            candidates |= self._index.get(gram, set())
+        candidates = [c for c in candidates
+                      if abs(len(c) - len(key)) <= max(2, len(key) // 3) and _same_polarity(c, key)]
+        matches = difflib.get_close_matches(key, candidates, n=1, cutoff=SWITCH_KB_MIN_SIMILARITY)
+        return matches[0] if matches else None
+
+    def lookup(self, text: str) -> Optional[Dict]:
+        """返回 {category, recommended_state, analysis, matched}；推荐状态取票数多的一方，理由取最常见的一条"""
+        key = normalize_label(text)
+        if not key:
+            return None
+        with self._lock:
+            matched = self._match(key)
+            if matched is None:
+                self.misses += 1
+                return None
+            entry = self.entries[matched]
+            if matched == key:
+                self.hits += 1
+            else:
+                self.fuzzy_hits += 1
+            recommended = entry["votes"].most_common(1)[0][0]
+            analyses = entry["analyses"].most_common()
+            analysis = min((a for a, n in analyses if n == analyses[0][1]), key=len) if analyses else ""
+            return {"category": entry["category"], "recommended_state": recommended,
+                    "analysis": analysis, "matched": entry["text"]}
+
+    # ---- 补全分析结果 ----
+
+    def complete(self, result: Dict, recommend: Optional[Callable[[List[str]], Dict[str, Dict]]] = None,
+                 rules: Optional[Callable[[str], Optional[Dict]]] = None, app: str = "") -> Dict:
+        """
+        为模型只给出 text 与 current_state 的开关补全 recommended_state 与 analysis：
+        依次查知识库、本地规则（rules），仍缺的开关一次性交给 recommend(文字列表) 询问，其回答写回知识库
+        每个开关的 recommendation_source 记录推荐状态的来源（model / kb / rule）
+        """
+        if not isinstance(result, dict):
+            return result
+        personalization = result.get("personalization")
+        groups = [("privacy", result.get("switches")),
+                  ("personalization", personalization.get("switches") if isinstance(personalization, dict) else None)]
+        missing = []
+        for category, group in groups:
+            for switch in group if isinstance(group, list) else ():
+                if not isinstance(switch, dict) or not switch.get("text"):
+                    continue
+                if switch.get("recommended_state") in ("on", "off") and switch.get("analysis"):
+                    switch.setdefault("recommendation_source", SOURCE_MODEL)
+                    continue
+                known, source = self.lookup(switch["text"]), SOURCE_KB
+                if known is None and rules is not None:
+                    known, source = rules(switch["text"]), SOURCE_RULE
+                    if known is not None and known.get("recommended_state") in ("on", "off"):
+                        with self._lock:
+                            self.filled_by_rules += 1
+                if known is not None and known.get("recommended_state") in ("on", "off"):
+                    switch["recommended_state"] = known["recommended_state"]
+                    switch["analysis"] = known["analysis"]
+                    switch["recommendation_source"] = source
+                else:
+                    missing.append((category, switch))
+
+        if not missing or recommend is None:
+            return result
+        try:
+            answers = recommend([switch["text"] for _, switch in missing]) or {}
+        except Exception as e:
+            logger.error(f"询问开关推荐状态失败: {str(e)}")
+            answers = {}
+        for category, switch in missing:
+            answer = answers.get(switch["text"])
+            if not isinstance(answer, dict) or answer.get("recommended_state") not in ("on", "off"):
+                continue
+            switch["recommended_state"] = answer["recommended_state"]
+            switch["analysis"] = answer.get("analysis", "")
+            switch["recommendation_source"] = SOURCE_MODEL
+            with self._lock:
+                self.filled_by_model += 1
+            self.add(switch["text"], category, switch["recommended_state"], switch["analysis"], app)
+        return result
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "entries": len(self.entries),
+                "exact_hits": self.hits,
+                "fuzzy_hits": self.fuzzy_hits,
+                "misses": self.misses,
+                "filled_by_rules": self.filled_by_rules,
+                "filled_by_model": self.filled_by_model,
+            }
+
+
+knowledge_base = SwitchKnowledgeBase()
+
+
+def knowledge_stats() -> Dict:
+    return knowledge_base.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="由历次爬取输出构建跨应用的开关知识库")
+    parser.add_argument("--output-dir", default="all_paths_results")
+    parser.add_argument("--kb", default=SWITCH_KB_PATH, help="知识库文件（已存在时在其基础上累加）")
+    parser.add_argument("--lookup", nargs="*", default=[], help="构建后查询这些开关文字")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    kb = SwitchKnowledgeBase(args.kb)
+    kb.build(args.output_dir)
+    kb.save()
+    for text in args.lookup:
+        print(text, "->", json.dumps(kb.lookup(text), ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+
+# 加载环境变量
+load_dotenv()
+
+TRACE_ENABLED = os.getenv("TRACE_ENABLED", "true").lower() == "true"
+TRACE_DIR = os.getenv("TRACE_DIR", "traces")
+# 固定等待的缩放倍率（回放/模拟时可设为 0 以去掉等待）
+SLEEP_SCALE = float(os.getenv("SLEEP_SCALE", 1.0))
+
+logger = logging.getLogger(__name__)
+
+
+class Tracer:
+    """
+    轻量级 span 追踪：记录每段耗时并导出 Chrome trace / Perfetto 可读的 JSON
+    每个 span 同时累计"自身耗时"（扣除子 span），用于按类别统计设备、模型、等待与空闲时间
+    """
+
+    def __init__(self, enabled: bool = TRACE_ENABLED):
+        self.enabled = enabled
+        self.events: List[Dict] = []
+        self.span_stats: List[Dict] = []
+        self.thread_names: Dict[int, str] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._t0 = time.perf_counter()
+        self._wall_start = time.time()
+
+    def _stack(self) -> List[Dict]:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextmanager
+    def span(self, name: str, cat: str, **args):
+        """with tracer.span("screenshot", "device"): ...；yield 出的 args 字典可以在 span 内补充字段"""
+        if not self.enabled:
+            yield args
+            return
+        stack = self._stack()
+        entry = {"start": time.perf_counter(), "child": 0.0, "args": args}
+        stack.append(entry)
+        try:
+            yield args
+        finally:
+            stack.pop()
+            dur = time.perf_counter() - entry["start"]
+            if stack:
+                stack[-1]["child"] += dur
+            thread = threading.current_thread()
+            with self._lock:
+                self.thread_names.setdefault(thread.ident, thread.name)
+                self.events.append({
+                    "name": name,
+                    "cat": cat,
+                    "ph": "X",
+                    "ts": round((entry["start"] - self._t0) * 1e6, 1),
+                    "dur": round(dur * 1e6, 1),
+                    "pid": os.getpid(),
+                    "tid": thread.ident,
+                    "args": args,
+                })
+                self.span_stats.append({
+                    "cat": cat,
+                    "tid": thread.ident,
+                    "dur": dur,
+                    "self": max(0.0, dur - entry["child"]),
+                    "ttft": args.get("ttft_ms"),
+                })
+
+    def mark_first_token(self):
+        """流式响应收到第一个内容片段时调用，记录到当前线程最内层的 span 上"""
+        stack = self._stack() if self.enabled else None
+        if stack and "ttft_ms" not in stack[-1]["args"]:
+            stack[-1]["args"]["ttft_ms"] = round((time.perf_counter() - stack[-1]["start"]) * 1000, 1)
+
+    def summary(self) -> Dict:
+        """
+        按类别汇总：main 为主线程各类别的自身耗时与空闲时间（未被任何 span 覆盖的部分），
+        workers 为执行层线程池中的模型请求（次数、总耗时、平均首token时间）
+        """
+        main_tid = threading.main_thread().ident
+        wall = time.perf_counter() - self._t0
+        main: Dict[str, float] = {}
+        workers: Dict[str, Dict] = {}
+        with self._lock:
+            stats = list(self.span_stats)
+        for stat in stats:
+            if stat["tid"] == main_tid:
+                main[stat["cat"]] = main.get(stat["cat"], 0.0) + stat["self"]
+            else:
+                item = workers.setdefault(stat["cat"], {"count": 0, "total": 0.0, "ttft": []})
+                item["count"] += 1
+                item["total"] += stat["dur"]
+                if stat["ttft"] is not None:
+                    item["ttft"].append(stat["ttft"])
+        main["idle"] = max(0.0, wall - sum(main.values()))
+        return {
+            "wall_time": round(wall, 3),
+            "main": {cat: round(t, 3) for cat, t in sorted(main.items(), key=lambda x: -x[1])},
+            "workers": {
+                cat: {
+                    "count": item["count"],
+                    "total": round(item["total"], 3),
+                    "avg_ttft_ms": round(sum(item["ttft"]) / len(item["ttft"]), 1) if item["ttft"] else None,
+                }
+                for cat, item in workers.items()
+            },
+        }
+
+    def format_summary(self) -> str:
+        summary = self.summary()
+        wall = summary["wall_time"] or 1.0
+        lines = [f"总耗时 {summary['wall_time']:.1f}s", f"{'类别':<16}{'耗时(s)':>10}{'占比':>8}"]
+        for cat, seconds in summary["main"].items():
+            lines.append(f"{cat:<16}{seconds:>10.1f}{seconds / wall:>8.1%}")
+        for cat, item in summary["workers"].items():
+            ttft = f"，平均首token {item['avg_ttft_ms']:.0f}ms" if item["avg_ttft_ms"] is not None else ""
+            lines.append(f"[线程池] {cat}: {item['count']} 次，共 {item['total']:.1f}s{ttft}")
+        return "\n".join(lines)
+
+    def export(self, label: str = "crawl", path: Optional[str] = None) -> Optional[str]:
+        """写出 Chrome trace JSON（可直接拖进 chrome://tracing 或 ui.perfetto.dev），并打印分类汇总"""
+        if not self.enabled:
+            return None
+        if path is None:
+            os.makedirs(TRACE_DIR, exist_ok=True)
+            timestamp = time.strftime("%Y%m%d_%H%M%S", time.localtime(self._wall_start))
+            path = os.path.join(TRACE_DIR, f"trace_{label}_{timestamp}.json")
+        with self._lock:
+            metadata = [
+                {"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": name}}
+                for tid, name in self.thread_names.items()
+            ]
+            events = list(self.events)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({
+                "traceEvents": metadata + events,
+                "displayTimeUnit": "ms",
+                "otherData": {"label": label, "summary": self.summary()},
+            }, f, ensure_ascii=False)
+        logger.info(f"追踪文件已保存到: {path}\n{self.format_summary()}")
+        return path
+
+
+tracer = Tracer()
+
+
+def traced(cat: str, name: Optional[str] = None):
+    """函数装饰器：整个调用记为一个 span"""
+    def decorator(func):
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with tracer.span(span_name, cat):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def traced_sleep(seconds: float, name: str = "sleep"):
+    """带追踪的 time.sleep，让固定等待在时间线上可见；实际等待时间乘以 SLEEP_SCALE"""
+    with tracer.span(name, "sleep", seconds=seconds):
+        time.sleep(seconds * SLEEP_SCALE)
+
+
+def set_sleep_scale(scale: float):
+    global SLEEP_SCALE
+    SLEEP_SCALE = scale
+
+
+def mark_first_token():
+    tracer.mark_first_token()
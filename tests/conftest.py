@@ -0,0 +1,9 @@
+import os
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# src 下的模块以模块名互相导入（与直接运行脚本时相同）
+sys.path.insert(0, os.path.join(ROOT_DIR, "src"))
+# 测试不读写工作目录下的开关知识库
+os.environ.setdefault("SWITCH_KB_PATH", "")
@@ -0,0 +1,147 @@
+import pytest
+
+import app_guard
+import app_simulator
+from app_guard import AppGuard, _deny_button, _overlay_package
+
+APP = "com.demo"
+PERMISSION = "com.android.permissioncontroller"
+
+
+def _node(bounds, text="", package=APP, children=""):
+    return (f'<node text="{text}" class="android.widget.TextView" package="{package}" content-desc="" '
+            f'bounds="[{bounds[0]},{bounds[1]}][{bounds[2]},{bounds[3]}]">{children}</node>')
+
+
+def _hierarchy(*windows):
+    return "<hierarchy rotation=\"0\">" + "".join(windows) + "</hierarchy>"
+
+
+STATUS_BAR = _node([0, 0, 1080, 80], package="com.android.systemui")
+SETTINGS = _node([0, 0, 1080, 2400], children=_node([40, 300, 1040, 420], "隐私设置"))
+PERMISSION_DIALOG = _node([60, 900, 1020, 1500], package=PERMISSION,
+                          children=_node([100, 950, 980, 1100], "允许“演示应用”获取此设备的位置信息？", PERMISSION)
+                          + _node([100, 1200, 980, 1300], "仅在使用中允许", PERMISSION)
+                          + _node([100, 1350, 980, 1450], "拒绝", PERMISSION))
+BROWSER = _node([0, 0, 1080, 2400], package="com.android.browser", children=_node([40, 300, 1040, 420], "用户协议",
+                                                                                 "com.android.browser"))
+
+
+class FakeDevice:
+    """界面栈：每层为 (前台包名, 层级)；返回键弹出一层，点中 deny 坐标时关闭对话框"""
+
+    def __init__(self, *screens, deny=None, stuck=False):
+        self.screens = list(screens)
+        self.deny = deny
+        self.stuck = stuck
+        self.actions = []
+
+    def app_current(self):
+        return {"package": self.screens[-1][0], "activity": ".Main"}
+
+    def dump_hierarchy(self):
+        return self.screens[-1][1]
+
+    def click(self, x, y):
+        self.actions.append(("click", x, y))
+        if [x, y] == self.deny:
+            self.screens.pop()
+
+    def press(self, key):
+        self.actions.append(key)
+        if not self.stuck and len(self.screens) > 1:
+            self.screens.pop()
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(app_guard, "traced_sleep", lambda *args, **kwargs: None)
+
+
+# ---- 判断 ----
+
+def test_overlay_package_ignores_status_bar():
+    assert _overlay_package(_hierarchy(STATUS_BAR, SETTINGS)) is None
+    assert _overlay_package(_hierarchy(STATUS_BAR, SETTINGS, PERMISSION_DIALOG)) == PERMISSION
+    assert _overlay_package("<hierarchy") is None
+
+
+def test_deny_button_never_picks_allow():
+    assert _deny_button(_hierarchy(SETTINGS, PERMISSION_DIALOG), PERMISSION) == [540, 1400]
+    # 应用自己的“取消”按钮不属于系统对话框
+    assert _deny_button(_hierarchy(SETTINGS, _node([100, 1350, 980, 1450], "取消")), PERMISSION) is None
+
+
+def test_check_classifies_foreign_apps_and_system_dialogs():
+    guard = AppGuard()
+    settings = _hierarchy(STATUS_BAR, SETTINGS)
+    assert guard.check(FakeDevice((APP, settings)), APP, settings) is None
+
+    incident = guard.check(FakeDevice((APP, settings), ("com.android.browser", _hierarchy(BROWSER))), APP)
+    assert incident["kind"] == "foreign_app" and incident["package"] == "com.android.browser"
+
+    # 权限对话框以独立窗口出现在前台
+    dialog = _hierarchy(PERMISSION_DIALOG)
+    incident = guard.check(FakeDevice((APP, settings), (PERMISSION, dialog)), APP, dialog)
+    assert incident["kind"] == "system_dialog" and incident["package"] == PERMISSION
+
+    # 前台仍为目标应用，对话框只出现在点击后的层级中
+    overlay = _hierarchy(STATUS_BAR, SETTINGS, PERMISSION_DIALOG)
+    incident = guard.check(FakeDevice((APP, overlay)), APP, overlay)
+    assert incident["kind"] == "system_dialog" and incident["package"] == PERMISSION
+
+    stats = guard.stats()
+    assert stats["checks"] == 4
+    assert stats["incidents"] == {"system_dialog": 2, "foreign_app": 1}
+    assert stats["packages"] == {PERMISSION: 2, "com.android.browser": 1}
+
+
+# ---- 返回 ----
+
+def test_system_dialog_is_denied_not_backed_out():
+    guard = AppGuard()
+    settings = _hierarchy(STATUS_BAR, SETTINGS)
+    device = FakeDevice((APP, settings), (APP, _hierarchy(STATUS_BAR, SETTINGS, PERMISSION_DIALOG)), deny=[540, 1400])
+    incident = guard.check(device, APP, device.dump_hierarchy())
+
+    assert guard.recover(device, APP, incident)
+    assert device.actions == [("click", 540, 1400)]
+    assert device.dump_hierarchy() == settings
+    assert guard.stats()["recoveries"] == {"deny_button": 1, "back": 0, "failed": 0}
+
+
+def test_foreign_app_is_left_with_back_presses():
+    guard = AppGuard()
+    # 浏览器内打开了两层页面
+    device = FakeDevice((APP, _hierarchy(SETTINGS)), ("com.android.browser", _hierarchy(BROWSER)),
+                        ("com.android.browser", _hierarchy(BROWSER)))
+    incident = guard.check(device, APP)
+
+    assert guard.recover(device, APP, incident)
+    assert device.actions == ["back", "back"]
+    assert device.app_current()["package"] == APP
+    assert guard.stats()["recoveries"] == {"deny_button": 0, "back": 1, "failed": 0}
+
+
+def test_recovery_gives_up_after_max_backs():
+    guard = AppGuard()
+    device = FakeDevice((APP, _hierarchy(SETTINGS)), ("com.android.browser", _hierarchy(BROWSER)), stuck=True)
+    assert not guard.recover(device, APP, guard.check(device, APP))
+    assert device.actions == ["back"] * app_guard.APP_GUARD_MAX_BACKS
+    assert guard.stats()["recoveries"]["failed"] == 1
+
+
+def test_explorer_returns_after_guarded_click(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "screenshot").mkdir()
+    guarded = app_simulator.run_simulation(depth=3, branching=3, seed=1, external_ratio=0.5)
+    unguarded = app_simulator.run_simulation(depth=3, branching=3, seed=1, external_ratio=0.5, app_guard=False)
+
+    stats = guarded["app_guard"]
+    incidents = sum(stats["incidents"].values())
+    assert stats["incidents"]["system_dialog"] > 0 and stats["incidents"]["foreign_app"] > 0
+    assert stats["recoveries"]["failed"] == 0
+    assert guarded["exploration"]["left_app"] == incidents
+    # 离开应用的列表项不截图也不调用模型，其余页面照常探索
+    assert guarded["analyzer_calls"] == unguarded["analyzer_calls"] - incidents
+    assert guarded["switch_coverage"] == 1.0
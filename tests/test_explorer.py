@@ -0,0 +1,172 @@
+import json
+import time
+
+import pytest
+
+import privacy_analyzer
+import screenshot_inspector
+from app_guard import guard
+from app_simulator import SimulatedDevice, analysis_for_page, generate_settings_tree, simulated_recommendation
+from crawl_journal import CrawlJournal, load_journal
+from explorer import Explorer
+from metering import meter
+from popup_detector import detector as popup_detector
+from scroll_controller import scroller
+from tracing import set_sleep_scale
+
+
+@pytest.fixture
+def simulate(monkeypatch, tmp_path):
+    """在模拟应用上构造 Explorer：模型调用直接返回模拟页面的分析结果，不做固定等待"""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "screenshot").mkdir()
+    monkeypatch.setattr(screenshot_inspector, "SWITCH_KB", False)
+    monkeypatch.setattr(screenshot_inspector, "HIERARCHY_EXTRACTION", False)
+    monkeypatch.setattr(screenshot_inspector, "ANALYSIS_MODE", "image")
+    monkeypatch.setattr(screenshot_inspector, "PROGRESSIVE_ANALYSIS", False)
+    for singleton in (popup_detector, scroller, guard, meter):
+        singleton.reset()
+    set_sleep_scale(0.0)
+
+    def build(depth=3, branching=3, seed=1, topic_skew=0.0, back_glitch=0.0, **kwargs):
+        pages = generate_settings_tree(depth, branching, 0.5, 0.0, 0.0, 0.0, topic_skew=topic_skew, seed=seed)
+        device = SimulatedDevice(pages, back_glitch=back_glitch, seed=seed)
+
+        def analyze(**_):
+            return analysis_for_page(pages[device.current_page], structure_only=False)
+        monkeypatch.setattr(privacy_analyzer, "analyze_privacy_switches", analyze)
+        monkeypatch.setattr(privacy_analyzer, "analyze_privacy_digest", analyze)
+        monkeypatch.setattr(privacy_analyzer, "recommend_switch_states",
+                            lambda labels, *args, **kw: {label: simulated_recommendation(label) for label in labels})
+        for budget in ("max_depth", "max_pages", "max_seconds", "max_tokens"):
+            kwargs.setdefault(budget, 0)
+        return device, Explorer(device, app_package=device.package, **kwargs)
+
+    yield build
+    set_sleep_scale(1.0)
+
+
+def _switch_paths(explorer):
+    return sorted(json.dumps([node["text"] for node in path], ensure_ascii=False)
+                  for path in explorer.privacy_switches)
+
+
+def test_resume_after_crash_between_page_and_item_done(simulate, tmp_path):
+    _, complete = simulate()
+    assert complete.run()
+    assert complete.stopped_reason == "completed"
+
+    journal_path = str(tmp_path / "journal.jsonl")
+    _, crashed = simulate(journal=CrawlJournal(journal_path))
+    crashed.run()
+    crashed.journal.close()
+
+    # 截断到某个带开关的页面记录之后：它的 item_done 还没写入时进程崩溃
+    with open(journal_path, encoding="utf-8") as f:
+        lines = f.readlines()
+    cut = max(i for i, line in enumerate(lines)
+              if json.loads(line)["type"] == "page" and json.loads(line)["result"]["switches"])
+    assert json.loads(lines[cut + 1])["type"] == "item_done"
+    with open(journal_path, "w", encoding="utf-8") as f:
+        f.writelines(lines[:cut + 1])
+
+    state = load_journal(journal_path)
+    _, resumed = simulate(journal=CrawlJournal(journal_path))
+    resumed.restore(state)
+    assert resumed.run()
+
+    # 崩溃前已分析的页面不会再次进入，开关不重复
+    visited = [json.dumps(path, ensure_ascii=False) for path in resumed.visited]
+    assert len(visited) == len(set(visited))
+    assert sorted(visited) == sorted(json.dumps(path, ensure_ascii=False) for path in complete.visited)
+    assert _switch_paths(resumed) == _switch_paths(complete)
+
+
+def test_duplicate_page_records_are_restored_once(simulate, tmp_path):
+    journal_path = str(tmp_path / "journal.jsonl")
+    _, explorer = simulate(journal=CrawlJournal(journal_path))
+    explorer.run()
+    explorer.journal.close()
+
+    state = load_journal(journal_path)
+    state["pages"] = state["pages"] + state["pages"][1:2]
+    _, resumed = simulate()
+    resumed.restore(state)
+    assert resumed.pages_explored == explorer.pages_explored
+    assert _switch_paths(resumed) == _switch_paths(explorer)
+
+
+def test_report_includes_share_of_pages_analysed_locally(monkeypatch, simulate):
+    monkeypatch.setattr(screenshot_inspector, "HIERARCHY_EXTRACTION", True)
+    # 带主题的列表项与开关文字都在规则表中，页面可在本地得出结果
+    _, explorer = simulate(topic_skew=1.0)
+    assert explorer.run()
+    report = explorer.report()
+    assert report["pages_local"] > 0
+    assert report["pages_local_fraction"] == round(report["pages_local"] / report["pages_explored"], 3)
+
+
+def _wrap_analyzer(monkeypatch, before):
+    """每次分析页面前先执行 before()"""
+    analyze = privacy_analyzer.analyze_privacy_switches
+
+    def wrapped(**kwargs):
+        before()
+        return analyze(**kwargs)
+    monkeypatch.setattr(privacy_analyzer, "analyze_privacy_switches", wrapped)
+
+
+def test_page_budget(simulate):
+    _, explorer = simulate(max_pages=5)
+    assert explorer.run()
+    assert explorer.report()["stopped_reason"] == "max_pages"
+    assert explorer.pages_explored == len(explorer.visited) == 5
+
+
+def test_depth_budget(simulate):
+    _, explorer = simulate(max_depth=1)
+    assert explorer.run()
+    report = explorer.report()
+    # 只进入首页的子页面，更深的列表项不加入 frontier
+    assert report["stopped_reason"] == "completed"
+    assert report["max_depth_reached"] == 1
+    assert report["skipped_by_depth"] > 0
+    assert all(len(path) <= 1 for path in explorer.visited)
+    assert len(explorer.visited) == 1 + sum(1 for path in explorer.visited if len(path) == 1)
+
+
+def test_time_budget(monkeypatch, simulate):
+    _, explorer = simulate(max_seconds=0.5)
+    _wrap_analyzer(monkeypatch, lambda: time.sleep(0.2))
+    assert explorer.run()
+    assert explorer.report()["stopped_reason"] == "time_budget"
+    # 每个页面至少 0.2s：第三个页面之后必定超出预算
+    assert 2 <= explorer.pages_explored <= 3
+
+
+def test_token_budget(monkeypatch, simulate):
+    _, explorer = simulate(max_tokens=3500)
+
+    def use_tokens():
+        meter.begin_call()
+        meter.end_call("simulated", "simulated", 0.0, True, {"usage": {"prompt_tokens": 900, "completion_tokens": 100}})
+    _wrap_analyzer(monkeypatch, use_tokens)
+    assert explorer.run()
+    assert explorer.report()["stopped_reason"] == "token_budget"
+    assert explorer.pages_explored == 4
+
+
+def test_recovers_from_back_glitch_without_losing_switches(simulate):
+    _, complete = simulate()
+    assert complete.run()
+
+    # 按返回键时有 30% 的概率一次退回两级：返回确认发现不在预期页面，定位到祖先页面后沿路径重新进入
+    _, glitchy = simulate(back_glitch=0.3)
+    assert glitchy.run()
+    navigation = glitchy.report()["navigation"]
+    recovered = sum(navigation[key] for key in ("recovered_by_ancestor", "recovered_by_back", "recovered_by_relaunch"))
+    assert navigation["mismatches"] > 0
+    assert recovered == navigation["mismatches"]
+    assert navigation["recovery_failed"] == 0
+    assert glitchy.report()["stopped_reason"] == "completed"
+    assert _switch_paths(glitchy) == _switch_paths(complete)
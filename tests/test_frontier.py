@@ -0,0 +1,77 @@
+import math
+
+from frontier import PriorityFrontier, StackFrontier, YieldHistory, make_frontier
+
+
+def _item(text, path=()):
+    return {"text": text, "path": list(path), "depth": len(path) + 1}
+
+
+def _drain(frontier, current=None):
+    order = []
+    while len(frontier):
+        order.append(frontier.pop(current)["text"])
+    return order
+
+
+def test_items_with_higher_prior_are_expanded_first():
+    frontier = PriorityFrontier()
+    frontier.push_children([_item("关于我们"), _item("通用"), _item("隐私设置"), _item("个性化推荐")])
+    assert _drain(frontier) == ["隐私设置", "个性化推荐", "通用", "关于我们"]
+
+
+def test_ties_keep_the_listed_order():
+    frontier = PriorityFrontier()
+    frontier.push_children([_item("通用"), _item("存储空间"), _item("辅助功能")])
+    assert _drain(frontier) == ["通用", "存储空间", "辅助功能"]
+    # 栈式 frontier 同样按列出的顺序展开
+    stack = make_frontier("stack")
+    assert isinstance(stack, StackFrontier) and not isinstance(stack, PriorityFrontier)
+    stack.push_children([_item("通用"), _item("存储空间")])
+    assert _drain(stack) == ["通用", "存储空间"]
+
+
+def test_observed_switches_raise_siblings_of_productive_pages():
+    frontier = PriorityFrontier()
+    frontier.push_children([_item("甲", ["通用"]), _item("乙", ["其他"])])
+    frontier.observe(["其他", "丙"], 3)
+    assert frontier.score(_item("乙", ["其他"])) - frontier.score(_item("甲", ["通用"])) == math.log1p(3)
+    assert _drain(frontier) == ["乙", "甲"]
+
+
+def test_deeper_and_farther_items_score_lower():
+    frontier = PriorityFrontier()
+    frontier.push_children([_item("甲", ["通用", "高级"]), _item("乙", ["通用"]), _item("丙", ["其他"])])
+    # 从“其他”页面出发：同一页面的列表项不需要返回，更浅的列表项优先于更深的
+    assert _drain(frontier, current=["其他"]) == ["丙", "乙", "甲"]
+
+
+def test_yield_history_carries_over_between_runs(tmp_path):
+    first = YieldHistory("com.demo.app", str(tmp_path))
+    assert first.entries == {}
+    first.update(visited=[["通用"], ["通用", "高级"], ["关于"]],
+                 switch_paths=[["通用", "高级"], ["通用", "高级"]])
+    first.save()
+
+    second = YieldHistory("com.demo.app", str(tmp_path))
+    assert second.entries == first.entries
+    assert second.score("高级") == math.log1p(2)
+    assert second.score("关于") == 0.0
+    assert second.score("未见过") == 0.0
+
+    # 上一次有开关产出的列表项排在没有关键词先验的同级列表项之前
+    frontier = PriorityFrontier(second)
+    frontier.push_children([_item("关于"), _item("高级")])
+    assert _drain(frontier) == ["高级", "关于"]
+
+    # 再次爬取时在已有记录上累加
+    second.update(visited=[["通用", "高级"]], switch_paths=[])
+    second.save()
+    third = YieldHistory("com.demo.app", str(tmp_path))
+    assert third.entries["高级"] == {"visits": 2, "switches": 2}
+    assert third.score("高级") == math.log1p(1)
+
+
+def test_unreadable_history_is_ignored(tmp_path):
+    (tmp_path / "com_demo_app.json").write_text("{broken", encoding="utf-8")
+    assert YieldHistory("com.demo.app", str(tmp_path)).entries == {}
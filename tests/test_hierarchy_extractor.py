@@ -0,0 +1,146 @@
+import pytest
+
+from hierarchy_extractor import HierarchyExtractor, classify_entry, classify_switch, hierarchy_digest, page_rows
+
+
+def _switch_row(top: int, label: str, checked: bool) -> str:
+    return (
+        f'<node class="android.widget.LinearLayout" package="com.demo" clickable="false" '
+        f'bounds="[0,{top}][1080,{top + 160}]">'
+        f'<node class="android.widget.TextView" package="com.demo" text="{label}" '
+        f'bounds="[40,{top + 30}][700,{top + 90}]" />'
+        f'<node class="android.widget.Switch" package="com.demo" text="" checkable="true" '
+        f'checked="{str(checked).lower()}" clickable="true" bounds="[900,{top + 40}][1040,{top + 120}]" />'
+        f'</node>'
+    )
+
+
+def _entry_row(top: int, label: str) -> str:
+    return (
+        f'<node class="android.widget.LinearLayout" package="com.demo" clickable="true" '
+        f'bounds="[0,{top}][1080,{top + 120}]">'
+        f'<node class="android.widget.TextView" package="com.demo" text="{label}" '
+        f'bounds="[40,{top + 30}][500,{top + 90}]" />'
+        f'<node class="android.widget.ImageView" package="com.demo" text="" '
+        f'bounds="[1000,{top + 40}][1040,{top + 80}]" />'
+        f'</node>'
+    )
+
+
+def _screen(*rows: str) -> str:
+    return (
+        '<hierarchy rotation="0">'
+        '<node class="android.widget.FrameLayout" package="com.demo" bounds="[0,0][1080,2400]">'
+        '<node class="android.widget.TextView" package="com.demo" text="隐私" bounds="[40,80][400,140]" />'
+        + "".join(rows)
+        + '</node></hierarchy>'
+    )
+
+
+PRIVACY_PAGE = _screen(
+    _switch_row(200, "通过手机号搜索到我", True),
+    _switch_row(400, "不公开我的动态", False),
+    _entry_row(600, "隐私设置"),
+)
+
+
+@pytest.mark.parametrize("label, category, state", [
+    ("通过手机号搜索到我", "privacy", "off"),
+    ("个性化广告推荐", "personalization", "off"),
+    ("仅自己可见", "privacy", "on"),
+    ("隐藏我的位置", "privacy", "on"),
+    ("消息通知", "ignore", None),
+])
+def test_classify_switch(label, category, state):
+    rule = classify_switch(label)
+    assert rule["category"] == category
+    assert rule["recommended_state"] == state
+
+
+@pytest.mark.parametrize("label, category", [
+    ("禁止通过手机号搜索到我", "privacy"),
+    ("不公开我的动态", "privacy"),
+    ("不允许他人查看我的主页", "privacy"),
+    ("不推荐给好友", "privacy"),
+    ("关闭个性化推荐", "personalization"),
+])
+def test_classify_switch_negated_label_flips_recommendation(label, category):
+    rule = classify_switch(label)
+    assert rule["category"] == category
+    assert rule["recommended_state"] == "on"
+    assert rule["analysis"].startswith("开启后")
+
+
+def test_classify_switch_negation_inside_keyword_is_not_counted():
+    # “隐藏”本身就是规则关键词，不是否定；再加一个“不”才是否定
+    assert classify_switch("隐藏在线状态")["recommended_state"] == "on"
+    assert classify_switch("不隐藏在线状态")["recommended_state"] == "off"
+
+
+def test_classify_switch_unknown_label():
+    assert classify_switch("夜猫子模式测试") is None
+
+
+@pytest.mark.parametrize("label, category", [
+    ("隐私政策", "ignore"),
+    ("黑名单", "ignore"),
+    ("个性化广告管理", "personalization"),
+    ("谁可以看我的朋友圈", "privacy"),
+    ("隐私设置", "privacy"),
+    ("设置", "settings"),
+    ("我的收藏", None),
+])
+def test_classify_entry(label, category):
+    assert classify_entry(label) == category
+
+
+def test_page_rows_pairs_switches_with_row_labels():
+    rows = page_rows([PRIVACY_PAGE])["rows"]
+    assert [(row["kind"], row["label"]) for row in rows] == [
+        ("text", "隐私"),
+        ("switch", "通过手机号搜索到我"),
+        ("switch", "不公开我的动态"),
+        ("entry", "隐私设置"),
+    ]
+    assert rows[1]["checked"] is True and rows[1]["widget"] == "Switch"
+    assert rows[2]["checked"] is False
+    assert rows[3]["has_chevron"] is True
+
+
+def test_page_rows_deduplicates_overlapping_screens():
+    second = _screen(_switch_row(200, "不公开我的动态", False), _entry_row(400, "隐私设置"),
+                     _switch_row(600, "允许他人查看我的主页", True))
+    page = page_rows([PRIVACY_PAGE, second])
+    labels = [row["label"] for row in page["rows"]]
+    assert labels == ["隐私", "通过手机号搜索到我", "不公开我的动态", "隐私设置", "允许他人查看我的主页"]
+    assert page["has_webview"] is False
+
+
+def test_hierarchy_digest():
+    digest, reason = hierarchy_digest([PRIVACY_PAGE], min_rows=3)
+    assert reason == "ok"
+    lines = digest.splitlines()
+    assert lines[0].startswith("首屏内容纵向范围")
+    assert lines[1:] == [
+        "1|文字|隐私|TextView",
+        "2|开关|通过手机号搜索到我|Switch|on",
+        "3|开关|不公开我的动态|Switch|off",
+        "4|列表项|隐私设置|LinearLayout|箭头",
+    ]
+
+
+def test_hierarchy_digest_fallbacks():
+    assert hierarchy_digest([PRIVACY_PAGE], min_rows=4) == (None, "sparse")
+    webview = _screen('<node class="android.webkit.WebView" package="com.demo" bounds="[0,200][1080,2400]" />')
+    assert hierarchy_digest([webview], min_rows=0) == (None, "webview")
+    unlabeled = _screen('<node class="android.widget.Switch" package="com.demo" checkable="true" checked="false" '
+                        'bounds="[900,240][1040,320]" />')
+    assert hierarchy_digest([unlabeled], min_rows=0) == (None, "unlabeled_switch")
+
+
+def test_extract_uses_flipped_recommendation_for_negated_switch():
+    result, reason = HierarchyExtractor().extract([PRIVACY_PAGE])
+    assert reason == "local"
+    states = {s["text"]: (s["current_state"], s["recommended_state"]) for s in result["switches"]}
+    assert states == {"通过手机号搜索到我": ("on", "off"), "不公开我的动态": ("off", "on")}
+    assert result["layouts"] == [{"text": "隐私设置"}]
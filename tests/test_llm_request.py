@@ -0,0 +1,101 @@
+import time
+
+import pytest
+import requests
+
+import llm_request
+from llm_request import Endpoint, RequestExecutor, check_response, latency_tracker
+from stub_llm_server import StubLLMServer
+
+
+class ScriptedServer(StubLLMServer):
+    """按顺序返回给定的状态码，用完后一直返回 200"""
+
+    def __init__(self, statuses, **kwargs):
+        super().__init__(content="ok", **kwargs)
+        self.statuses = list(statuses)
+
+    def reply(self, request):
+        reply = super().reply(request)
+        with self._lock:
+            if self.statuses:
+                reply["status"] = self.statuses.pop(0)
+        return reply
+
+
+def send(endpoint, timeout):
+    response = requests.post(endpoint.chat_url, headers=endpoint.headers(),
+                             json={"model": endpoint.model, "messages": []}, timeout=timeout)
+    check_response(response)
+    return response.json()["choices"][0]["message"]["content"]
+
+
+@pytest.fixture
+def serve():
+    servers = []
+
+    def start(server):
+        servers.append(server.start())
+        return server
+    yield start
+    for server in servers:
+        server.stop()
+
+
+def test_deadline_expires_while_request_is_pending(serve):
+    server = serve(StubLLMServer(content="late", latency=1.5))
+    endpoint = Endpoint(server.url, "key", "slow-model")
+    executor = RequestExecutor([endpoint], deadline=0.3, attempt_timeout=5, hedge=False)
+
+    started = time.time()
+    assert executor.execute(send) is None
+    assert time.time() - started < 1.0
+    assert latency_tracker.stats()[endpoint.name]["deadline_exceeded"] == 1
+
+
+@pytest.mark.parametrize("statuses", [[429, 503], [503, 503]])
+def test_retries_throttling_and_unavailable_with_jittered_backoff(monkeypatch, serve, statuses):
+    server = serve(ScriptedServer(statuses))
+    backoffs = []
+
+    def uniform(low, high):
+        backoffs.append((low, high))
+        return high / 2
+    monkeypatch.setattr(llm_request.random, "uniform", uniform)
+    executor = RequestExecutor([Endpoint(server.url, "key", "flaky-model")], deadline=5,
+                               max_retries=2, hedge=False, backoff_base=0.05)
+
+    assert executor.execute(send) == "ok"
+    assert server.request_count == 3
+    # full jitter：每次在 [0, base * 2^n] 内取值，上限逐次翻倍
+    assert backoffs == [(0, 0.05), (0, 0.1)]
+
+
+def test_gives_up_after_max_retries_and_on_client_errors(serve):
+    flaky = serve(ScriptedServer([503, 503, 503]))
+    executor = RequestExecutor([Endpoint(flaky.url, "key", "down-model")], deadline=5,
+                               max_retries=2, hedge=False, backoff_base=0.01)
+    assert executor.execute(send) is None
+    assert flaky.request_count == 3
+
+    rejected = serve(ScriptedServer([400]))
+    executor = RequestExecutor([Endpoint(rejected.url, "key", "bad-request-model")], deadline=5,
+                               max_retries=2, hedge=False, backoff_base=0.01)
+    assert executor.execute(send) is None
+    assert rejected.request_count == 1
+
+
+def test_hedge_wins_against_slow_primary(serve):
+    slow = serve(StubLLMServer(content="primary", latency=1.5))
+    fast = serve(StubLLMServer(content="hedge"))
+    primary = Endpoint(slow.url, "key", "primary-model")
+    backup = Endpoint(fast.url, "key", "backup-model")
+    # 主端点以往的延迟都在 50ms 左右，超过 p95 仍未返回即发起对冲
+    for _ in range(llm_request.LLM_HEDGE_MIN_SAMPLES):
+        latency_tracker.record(primary, 0.05)
+    executor = RequestExecutor([primary, backup], deadline=5, hedge=True)
+
+    started = time.time()
+    assert executor.execute(send) == "hedge"
+    assert time.time() - started < 1.0
+    assert latency_tracker.stats()[backup.name]["hedge_wins"] == 1
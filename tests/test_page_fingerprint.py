@@ -0,0 +1,72 @@
+import json
+
+from page_fingerprint import latest_output, load_baseline_pages, page_labels, screen_matches, structural_fingerprint
+
+
+def _node(text: str, top: int, package: str = "com.demo", checked: str = None) -> str:
+    extra = f' checkable="true" checked="{checked}"' if checked is not None else ""
+    return (f'<node class="android.widget.TextView" package="{package}" resource-id="com.demo:id/title" '
+            f'text="{text}" bounds="[0,{top}][1080,{top + 100}]"{extra} />')
+
+
+def _screen(*nodes: str) -> str:
+    return '<hierarchy rotation="0">' + "".join(nodes) + '</hierarchy>'
+
+
+SCREEN_1 = _screen(_node("隐私", 0), _node("通讯录", 200), _node("附近的人", 400))
+SCREEN_2 = _screen(_node("附近的人", 100), _node("个性化推荐", 300))
+
+
+def test_fingerprint_ignores_positions_and_overlap():
+    moved = _screen(_node("隐私", 50), _node("通讯录", 250), _node("附近的人", 450))
+    assert structural_fingerprint([SCREEN_1]) == structural_fingerprint([moved])
+    # 相邻两屏重叠的节点只计一次
+    assert structural_fingerprint([SCREEN_1, SCREEN_2]) == structural_fingerprint(
+        [SCREEN_1, _screen(_node("个性化推荐", 300))])
+
+
+def test_fingerprint_normalizes_numbers_and_ignores_system_ui():
+    a = _screen(_node("缓存 12.5MB", 0), _node("12:30", 0, package="com.android.systemui"))
+    b = _screen(_node("缓存 3MB", 0), _node("12:31", 0, package="com.android.systemui"))
+    assert structural_fingerprint([a]) == structural_fingerprint([b])
+
+
+def test_fingerprint_changes_with_text_and_switch_state():
+    assert structural_fingerprint([SCREEN_1]) != structural_fingerprint([SCREEN_2])
+    on = _screen(_node("通讯录", 0, checked="true"))
+    off = _screen(_node("通讯录", 0, checked="false"))
+    assert structural_fingerprint([on]) != structural_fingerprint([off])
+
+
+def test_fingerprint_of_empty_or_invalid_hierarchy():
+    assert structural_fingerprint([]) is None
+    assert structural_fingerprint(["<hierarchy"]) is None
+
+
+def test_screen_matches_any_scroll_position():
+    labels = page_labels([SCREEN_1, SCREEN_2])
+    assert labels == frozenset({"隐私", "通讯录", "附近的人", "个性化推荐"})
+    assert screen_matches(SCREEN_2, labels)
+    assert not screen_matches(_screen(_node("我的", 0), _node("钱包", 200), _node("附近的人", 400)), labels)
+
+
+def test_screen_matches_keeps_numbered_pages_apart():
+    # 各级页面常以编号区分，数字不做归一化
+    labels = page_labels([_screen(_node("Entry p3", 0), _node("Switch 3", 200))])
+    assert not screen_matches(_screen(_node("Entry p13", 0), _node("Switch 13", 200)), labels)
+
+
+def test_latest_output_skips_tree_files(tmp_path):
+    for name in ("com_demo_20260101_000000.json", "com_demo_20260102_000000.json",
+                 "com_demo_20260102_000000.tree.json", "com_other_20260103_000000.json"):
+        (tmp_path / name).write_text("{}", encoding="utf-8")
+    assert latest_output("com.demo", str(tmp_path)).endswith("com_demo_20260102_000000.json")
+    assert latest_output("com.missing", str(tmp_path)) is None
+
+
+def test_load_baseline_pages(tmp_path):
+    path = tmp_path / "com_demo_20260101_000000.json"
+    path.write_text(json.dumps({"pages": {"我的 > 设置": {"fingerprint": "abc"}}}), encoding="utf-8")
+    assert load_baseline_pages(str(path)) == {"我的 > 设置": {"fingerprint": "abc"}}
+    path.write_text("{}", encoding="utf-8")
+    assert load_baseline_pages(str(path)) == {}
@@ -0,0 +1,64 @@
+import io
+import json
+
+from path_trie import PERSONALITY_LAYOUTS, PRIVACY_SWITCHES, PathTrie
+
+
+def _trie():
+    trie = PathTrie()
+    privacy = trie.add_path([{"text": "我的"}, {"text": "设置", "bounds": "[900,40][1040,120]"},
+                             {"text": "隐私"}])
+    trie.add(privacy, PRIVACY_SWITCHES, {"text": "通讯录", "current_state": "on"})
+    trie.add(privacy, PRIVACY_SWITCHES, {"text": "附近的人", "current_state": "off"})
+    ads = trie.add_path([{"text": "广告"}], parent=trie.add_path([{"text": "我的"}, {"text": "设置"}]))
+    trie.add(ads, PERSONALITY_LAYOUTS, {"text": "个性化广告"})
+    return trie, privacy, ads
+
+
+def test_shared_prefixes_are_stored_once():
+    trie, privacy, ads = _trie()
+    # 根节点 + 我的 / 设置 / 隐私 / 广告
+    assert len(trie.nodes) == 5
+    assert trie.nodes[privacy]["parent"] == trie.nodes[ads]["parent"]
+    assert trie.child(0, "我的") == 1
+
+
+def test_bounds_are_kept_from_first_insert():
+    trie, privacy, _ = _trie()
+    assert trie.path_nodes(privacy) == [
+        {"text": "我的"}, {"text": "设置", "bounds": "[900,40][1040,120]"}, {"text": "隐私"},
+    ]
+
+
+def test_count_and_flat_paths():
+    trie, _, _ = _trie()
+    assert trie.count(PRIVACY_SWITCHES) == 2
+    paths = list(trie.paths(PRIVACY_SWITCHES))
+    assert [path[-1]["text"] for path in paths] == ["通讯录", "附近的人"]
+    assert [node["text"] for node in paths[0][:-1]] == ["我的", "设置", "隐私"]
+    assert list(trie.paths(PERSONALITY_LAYOUTS)) == [
+        [{"text": "我的"}, {"text": "设置", "bounds": "[900,40][1040,120]"}, {"text": "广告"},
+         {"text": "个性化广告"}]
+    ]
+
+
+def test_flat_paths_are_copies():
+    trie, privacy, _ = _trie()
+    next(trie.paths(PRIVACY_SWITCHES))[-1]["text"] = "changed"
+    assert trie.nodes[privacy][PRIVACY_SWITCHES][0]["text"] == "通讯录"
+
+
+def test_write_matches_to_dict():
+    trie, _, _ = _trie()
+    f = io.StringIO()
+    trie.write(f, extra={"app_package": "com.demo"})
+    data = json.loads(f.getvalue())
+    assert data["app_package"] == "com.demo"
+    assert data["nodes"] == trie.to_dict()["nodes"]
+
+
+def test_clear():
+    trie, _, _ = _trie()
+    trie.clear()
+    assert trie.nodes == [{"id": 0, "parent": None, "text": ""}]
+    assert trie.count(PRIVACY_SWITCHES) == 0
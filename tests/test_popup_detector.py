@@ -0,0 +1,158 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+import popup_detector
+from popup_detector import PopupDetector, hierarchy_popup_region, image_popup_region
+
+WIDTH, HEIGHT = 1080, 2400
+
+
+def _image(bright=None, page=235, scrim=90):
+    """整屏为 page 亮度；给出 bright = [l, t, r, b] 时其余部分压暗为 scrim，只有该区域保持亮"""
+    pixels = np.full((HEIGHT, WIDTH, 3), page, dtype=np.uint8)
+    if bright is not None:
+        pixels[:] = scrim
+        left, top, right, bottom = bright
+        pixels[top:bottom, left:right] = 250
+    return Image.fromarray(pixels)
+
+
+def _node(bounds, text="", rid="", package="com.demo", children=""):
+    return (f'<node text="{text}" resource-id="{rid}" class="android.widget.TextView" package="{package}" '
+            f'content-desc="" clickable="true" bounds="[{bounds[0]},{bounds[1]}][{bounds[2]},{bounds[3]}]">'
+            f'{children}</node>')
+
+
+def _hierarchy(*windows):
+    return "<hierarchy rotation=\"0\">" + "".join(windows) + "</hierarchy>"
+
+
+PAGE = _node([0, 0, WIDTH, HEIGHT], children=_node([40, 300, 1040, 420], "隐私设置")
+             + _node([40, 460, 1040, 580], "通用"))
+SHEET_BOUNDS = [0, 1400, WIDTH, HEIGHT]
+CANCEL_BOUNDS = [40, 2200, 1040, 2350]
+
+
+def _sheet(*extra):
+    return _node(SHEET_BOUNDS, rid="com.demo:id/design_bottom_sheet",
+                 children=_node([40, 1500, 1040, 1600], "仅自己可见") + _node([40, 1650, 1040, 1750], "所有人可见")
+                 + "".join(extra) + _node(CANCEL_BOUNDS, "取消"))
+
+
+# ---- 截图 ----
+
+def test_image_detects_bottom_sheet_over_scrim():
+    region = image_popup_region(_image(SHEET_BOUNDS))
+    assert region is not None
+    assert region[1] == pytest.approx(1400, abs=8)
+    assert region[3] == HEIGHT
+    assert region[2] - region[0] >= WIDTH - 8
+
+
+def test_image_detects_centered_dialog():
+    region = image_popup_region(_image([140, 900, 940, 1500]))
+    assert region == pytest.approx([140, 900, 940, 1500], abs=8)
+
+
+@pytest.mark.parametrize("image", [
+    _image(),                    # 普通页面，没有遮罩
+    _image(page=40),             # 深色主题无法由亮度判断
+    _image([0, 0, WIDTH, 100]),  # 亮的区域太矮
+])
+def test_image_without_popup(image):
+    assert image_popup_region(image) is None
+
+
+# ---- 层级 ----
+
+def test_hierarchy_detects_bottom_sheet_container():
+    assert hierarchy_popup_region(_hierarchy(_node([0, 0, WIDTH, HEIGHT], children=PAGE + _sheet())),
+                                  WIDTH, HEIGHT) == SHEET_BOUNDS
+
+
+def test_hierarchy_detects_small_dialog_window():
+    dialog = _node([100, 800, 980, 1600], children=_node([160, 900, 920, 1000], "提示"))
+    assert hierarchy_popup_region(_hierarchy(PAGE, dialog), WIDTH, HEIGHT) == [100, 800, 980, 1600]
+
+
+@pytest.mark.parametrize("windows", [
+    (PAGE,),
+    # 系统窗口（状态栏）不算弹窗，太小的窗口（悬浮按钮）也不算
+    (PAGE, _node([100, 800, 980, 1600], package="com.android.systemui")),
+    (PAGE, _node([900, 2100, 1040, 2240])),
+])
+def test_hierarchy_without_popup(windows):
+    assert hierarchy_popup_region(_hierarchy(*windows), WIDTH, HEIGHT) is None
+
+
+# ---- 关闭 ----
+
+class FakeDevice:
+    """screens 为界面名 -> 层级，transitions 为 (界面名, 操作) -> 操作后的界面名，未列出的操作不改变界面"""
+
+    def __init__(self, screens, transitions):
+        self.screens = screens
+        self.transitions = transitions
+        self.screen = "popup"
+        self.actions = []
+
+    def window_size(self):
+        return WIDTH, HEIGHT
+
+    def dump_hierarchy(self):
+        return self.screens[self.screen]
+
+    def click(self, x, y):
+        inside = CANCEL_BOUNDS[0] <= x <= CANCEL_BOUNDS[2] and CANCEL_BOUNDS[1] <= y <= CANCEL_BOUNDS[3]
+        self._act("close_button" if inside else "tap_outside")
+
+    def press(self, key):
+        self._act(key)
+
+    def _act(self, action):
+        self.actions.append(action)
+        self.screen = self.transitions.get((self.screen, action), self.screen)
+
+
+SCREENS = {
+    "page": _hierarchy(PAGE),
+    "popup": _hierarchy(_node([0, 0, WIDTH, HEIGHT], children=PAGE + _sheet())),
+    # 点中了弹窗内的选项：层级变了，弹窗还在
+    "popup_selected": _hierarchy(_node([0, 0, WIDTH, HEIGHT],
+                                       children=PAGE + _sheet(_node([40, 1800, 1040, 1900], "已选择")))),
+}
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(popup_detector, "traced_sleep", lambda *args, **kwargs: None)
+
+
+def test_dismiss_stops_at_first_strategy_that_closes_popup():
+    detector = PopupDetector()
+    device = FakeDevice(SCREENS, {("popup", "close_button"): "page"})
+    assert detector.dismiss(device, SHEET_BOUNDS)
+    assert device.actions == ["close_button"]
+    assert detector.stats()["dismissals"] == {"close_button": {"success": 1, "failed": 0}}
+
+
+def test_dismiss_falls_back_when_popup_is_still_there():
+    detector = PopupDetector()
+    device = FakeDevice(SCREENS, {("popup", "close_button"): "popup_selected",
+                                  ("popup_selected", "back"): "page"})
+    assert detector.dismiss(device, SHEET_BOUNDS)
+    # 关闭按钮与点击遮罩之后界面虽有变化，弹窗仍在，直到返回键才确认关闭
+    assert device.actions == ["close_button", "tap_outside", "back"]
+    assert detector.stats()["dismissals"] == {"close_button": {"success": 0, "failed": 1},
+                                              "tap_outside": {"success": 0, "failed": 1},
+                                              "back": {"success": 1, "failed": 0}}
+    # 之后的弹窗优先使用成功过的方式
+    assert detector.preferred == "back"
+
+
+def test_dismiss_reports_failure_when_nothing_closes_popup():
+    detector = PopupDetector()
+    device = FakeDevice(SCREENS, {})
+    assert not detector.dismiss(device, SHEET_BOUNDS)
+    assert device.actions == ["close_button", "tap_outside", "back"]
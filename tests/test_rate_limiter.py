@@ -0,0 +1,115 @@
+import json
+import multiprocessing
+import threading
+import time
+
+import pytest
+
+import rate_limiter
+from rate_limiter import PRIORITY_ANALYSIS, PRIORITY_NAVIGATION, RateLimiter
+
+pytestmark = pytest.mark.skipif(rate_limiter.fcntl is None, reason="共享状态文件依赖 fcntl")
+
+
+class FakeClock:
+    """替换 rate_limiter 中的 time：sleep 只推进时钟"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(rate_limiter, "time", fake)
+    return fake
+
+
+def _drain(limiter, count):
+    for _ in range(count):
+        limiter.release(limiter.acquire(timeout=0))
+
+
+def _use_quota(state_dir, count):
+    _drain(RateLimiter("shared", rpm=3, tpm=1_000_000, max_concurrency=4, state_dir=state_dir), count)
+
+
+def test_bucket_is_shared_across_processes(tmp_path):
+    child = multiprocessing.get_context("fork").Process(target=_use_quota, args=(str(tmp_path), 3))
+    child.start()
+    child.join(10)
+    assert child.exitcode == 0
+
+    limiter = RateLimiter("shared", rpm=3, tpm=1_000_000, max_concurrency=4, state_dir=str(tmp_path))
+    assert limiter.acquire(timeout=0.2) is None
+    with open(tmp_path / "shared.json", encoding="utf-8") as f:
+        state = json.load(f)
+    assert state["requests"] < 1
+    assert state["inflight"] == {}
+
+
+def test_requests_refill_at_the_configured_rate(tmp_path, clock):
+    limiter = RateLimiter("refill", rpm=60, tpm=1_000_000, max_concurrency=4, state_dir=str(tmp_path))
+    _drain(limiter, 60)
+    assert limiter.acquire(timeout=0.5) is None
+
+    started = clock.now
+    assert limiter.acquire() is not None
+    # 每分钟 60 个请求：一秒补充一个
+    assert 1.0 <= clock.now - started < 1.1
+
+
+def test_token_bucket_waits_for_large_requests(tmp_path, clock):
+    limiter = RateLimiter("tokens", rpm=1000, tpm=6000, max_concurrency=4, state_dir=str(tmp_path))
+    limiter.release(limiter.acquire(tokens=6000), actual_tokens=6000)
+
+    started = clock.now
+    assert limiter.acquire(tokens=3000) is not None
+    assert 30.0 <= clock.now - started < 30.1
+
+
+def test_navigation_goes_before_waiting_analysis(tmp_path):
+    limiter = RateLimiter("priority", rpm=600, tpm=1_000_000, max_concurrency=4, state_dir=str(tmp_path))
+    # 暂停期间两类请求都在排队，恢复后导航调用先拿到名额
+    limiter.report_throttled(0.3)
+    granted = []
+
+    def request(priority):
+        limiter.release(limiter.acquire(priority=priority, timeout=5))
+        granted.append(priority)
+
+    analysis = threading.Thread(target=request, args=(PRIORITY_ANALYSIS,))
+    navigation = threading.Thread(target=request, args=(PRIORITY_NAVIGATION,))
+    analysis.start()
+    time.sleep(0.05)
+    navigation.start()
+    analysis.join(5)
+    navigation.join(5)
+    assert granted == [PRIORITY_NAVIGATION, PRIORITY_ANALYSIS]
+
+
+def test_throttled_pauses_every_limiter_on_the_key(tmp_path, clock):
+    limiter = RateLimiter("throttled", rpm=60, tpm=1_000_000, max_concurrency=4, state_dir=str(tmp_path))
+    other = RateLimiter("throttled", rpm=60, tpm=1_000_000, max_concurrency=4, state_dir=str(tmp_path))
+    limiter.report_throttled(retry_after=5.0)
+    assert limiter.throttle_events == 1
+
+    started = clock.now
+    assert other.acquire(timeout=2.0) is None
+    assert other.acquire() is not None
+    assert clock.now - started >= 5.0
+
+
+def test_throttled_without_retry_after_uses_default_pause(tmp_path, clock):
+    limiter = RateLimiter("default_pause", rpm=60, tpm=1_000_000, max_concurrency=4, state_dir=str(tmp_path))
+    limiter.report_throttled()
+    with open(tmp_path / "default_pause.json", encoding="utf-8") as f:
+        state = json.load(f)
+    assert state["blocked_until"] == clock.now + rate_limiter.DEFAULT_THROTTLE_PAUSE
+    assert state["requests"] == 0.0
@@ -0,0 +1,79 @@
+import pytest
+
+import route
+
+PERSONAL = {"box_2d": [900, 800, 1000, 1000], "label": "我的"}
+SETTING = {"box_2d": [0, 900, 50, 1000], "label": "设置"}
+
+
+class FakeDevice:
+    def __init__(self):
+        self.clicks = []
+
+    def window_size(self):
+        return 1000, 2000
+
+    def screenshot(self, path):
+        with open(path, "wb") as f:
+            f.write(b"png")
+
+    def dump_hierarchy(self):
+        return "<hierarchy />"
+
+    def click(self, x, y):
+        self.clicks.append((x, y))
+
+
+def _detector(result, calls, name):
+    class Detector:
+        def __init__(self, api_key):
+            pass
+
+        def detect_ui_elements(self, screenshot, hierarchy_xml=None):
+            calls.append(name)
+            return result
+    return Detector
+
+
+@pytest.fixture
+def navigator(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(route.time, "sleep", lambda seconds: None)
+    return route.SimpleNavigator("", "com.demo", "key", device=FakeDevice())
+
+
+@pytest.mark.parametrize("joint_result", [
+    None,
+    {"personal": None, "setting": None, "setting_visible": False},
+])
+def test_personal_detector_runs_when_joint_detection_has_no_personal_icon(monkeypatch, navigator, joint_result):
+    calls = []
+    monkeypatch.setattr(route, "JointIconDetector", _detector(joint_result, calls, "joint"))
+    monkeypatch.setattr(route, "PersonalIconDetector", _detector(PERSONAL, calls, "personal"))
+    monkeypatch.setattr(route, "GeminiSegmentationAPI", _detector(SETTING, calls, "setting"))
+
+    path = navigator.navigate()
+    assert calls == ["joint", "personal", "setting"]
+    assert [node["text"] for node in path] == ["我的", "设置"]
+    assert navigator.device.clicks == [(900, 1900), (950, 50)]
+
+
+def test_joint_personal_icon_skips_dedicated_detector(monkeypatch, navigator):
+    calls = []
+    joint = {"personal": PERSONAL, "setting": None, "setting_visible": False}
+    monkeypatch.setattr(route, "JointIconDetector", _detector(joint, calls, "joint"))
+    monkeypatch.setattr(route, "PersonalIconDetector", _detector(PERSONAL, calls, "personal"))
+    monkeypatch.setattr(route, "GeminiSegmentationAPI", _detector(SETTING, calls, "setting"))
+
+    assert [node["text"] for node in navigator.navigate()] == ["我的", "设置"]
+    assert calls == ["joint", "setting"]
+
+
+def test_visible_setting_skips_personal_center(monkeypatch, navigator):
+    calls = []
+    joint = {"personal": PERSONAL, "setting": SETTING, "setting_visible": True}
+    monkeypatch.setattr(route, "JointIconDetector", _detector(joint, calls, "joint"))
+    monkeypatch.setattr(route, "PersonalIconDetector", _detector(PERSONAL, calls, "personal"))
+
+    assert [node["text"] for node in navigator.navigate()] == ["设置"]
+    assert calls == ["joint"]
@@ -0,0 +1,79 @@
+import pytest
+
+import privacy_analyzer
+import screenshot_inspector
+import switch_knowledge
+from model_cascade import ModelCascade
+from switch_knowledge import SwitchKnowledgeBase
+
+HIERARCHY = (
+    '<hierarchy rotation="0">'
+    '<node class="android.widget.TextView" package="com.demo" text="陌生人私信" bounds="[40,200][700,260]" />'
+    '<node class="android.widget.Switch" package="com.demo" checkable="true" checked="true" '
+    'bounds="[900,200][1040,260]" />'
+    '</hierarchy>'
+)
+
+
+@pytest.fixture
+def structure_mode(monkeypatch):
+    """结构模式：模型只输出开关文字与当前状态，知识库中查不到，推荐状态需要单独询问"""
+    monkeypatch.setattr(screenshot_inspector, "SWITCH_KB", True)
+    monkeypatch.setattr(switch_knowledge, "SWITCH_KB_MIN_ENTRIES", 0)
+    monkeypatch.setattr(screenshot_inspector, "PROGRESSIVE_ANALYSIS", False)
+    monkeypatch.setattr(screenshot_inspector, "knowledge_base", SwitchKnowledgeBase(path=""))
+    monkeypatch.setattr(screenshot_inspector, "_image_cascade",
+                        lambda category: ModelCascade("test_analysis", ["flash", "max"]))
+    asked = []
+
+    def recommend(labels, api_key, model):
+        asked.append(list(labels))
+        return {label: {"recommended_state": "off", "analysis": "模型"} for label in labels}
+
+    monkeypatch.setattr(privacy_analyzer, "recommend_switch_states", recommend)
+    return asked
+
+
+def test_rejected_tier_is_not_completed(monkeypatch, structure_mode):
+    answers = {
+        # flash 给出的文字在层级中不存在，校验不通过
+        "flash": {"switches": [{"text": "悄悄话", "current_state": "on"}], "layouts": []},
+        "max": {"switches": [{"text": "陌生人私信", "current_state": "on"}], "layouts": []},
+    }
+    monkeypatch.setattr(privacy_analyzer, "analyze_privacy_switches", lambda **kwargs: answers[kwargs["model"]])
+
+    result = screenshot_inspector._analyze_image("page.png", [HIERARCHY])
+    assert structure_mode == [["陌生人私信"]]
+    assert result["switches"] == [{"text": "陌生人私信", "current_state": "on", "recommended_state": "off",
+                                   "analysis": "模型", "recommendation_source": "model"}]
+    assert set(screenshot_inspector.knowledge_base.entries) == {"陌生人私信"}
+
+
+def test_accepted_first_tier_is_completed_once(monkeypatch, structure_mode):
+    calls = []
+
+    def analyze(**kwargs):
+        calls.append(kwargs["model"])
+        return {"switches": [{"text": "陌生人私信", "current_state": "on"}], "layouts": []}
+
+    monkeypatch.setattr(privacy_analyzer, "analyze_privacy_switches", analyze)
+    result = screenshot_inspector._analyze_image("page.png", [HIERARCHY])
+    assert calls == ["flash"]
+    assert structure_mode == [["陌生人私信"]]
+    assert result["switches"][0]["recommended_state"] == "off"
+
+
+def test_empty_knowledge_base_asks_for_full_output(monkeypatch, structure_mode):
+    monkeypatch.setattr(switch_knowledge, "SWITCH_KB_MIN_ENTRIES", 1)
+    modes = []
+
+    def analyze(**kwargs):
+        modes.append(kwargs["structure_only"])
+        return {"switches": [{"text": "陌生人私信", "current_state": "on", "recommended_state": "off",
+                              "analysis": "整页"}], "layouts": []}
+
+    monkeypatch.setattr(privacy_analyzer, "analyze_privacy_switches", analyze)
+    result = screenshot_inspector._analyze_image("page.png", [HIERARCHY])
+    assert modes == [False]
+    assert structure_mode == []
+    assert result["switches"][0]["recommendation_source"] == "model"
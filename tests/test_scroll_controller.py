@@ -0,0 +1,137 @@
+import logging
+
+import pytest
+
+import scroll_controller
+from scroll_controller import ScrollController, _TOUCH_SLOP
+
+WIDTH, HEIGHT = 1080, 2400
+CONTAINER = [0, 200, WIDTH, HEIGHT]
+ROW_HEIGHT = 160
+
+
+class FakeDevice:
+    """rows 行的列表页面（rows 为 None 时无限长），offset 为内容相对顶部已滚动的像素"""
+
+    def __init__(self, rows=40, offset=0):
+        self.rows = rows
+        self.offset = offset
+        self.swipes = 0
+
+    @property
+    def max_offset(self):
+        if self.rows is None:
+            return float("inf")
+        return max(0, self.rows * ROW_HEIGHT - (CONTAINER[3] - CONTAINER[1]))
+
+    def window_size(self):
+        return WIDTH, HEIGHT
+
+    def dump_hierarchy(self):
+        first = self.offset // ROW_HEIGHT
+        last = (self.offset + CONTAINER[3] - CONTAINER[1]) // ROW_HEIGHT + 1
+        if self.rows is not None:
+            last = min(last, self.rows)
+        nodes = []
+        for i in range(first, last):
+            top = CONTAINER[1] + i * ROW_HEIGHT - self.offset
+            nodes.append(f'<node text="选项{i}" class="android.widget.TextView" package="com.demo" '
+                         f'bounds="[40,{top}][1040,{top + ROW_HEIGHT}]" />')
+        return (f'<hierarchy><node class="androidx.recyclerview.widget.RecyclerView" package="com.demo" '
+                f'scrollable="true" bounds="[{CONTAINER[0]},{CONTAINER[1]}][{CONTAINER[2]},{CONTAINER[3]}]">'
+                + "".join(nodes) + "</node></hierarchy>")
+
+    def swipe(self, x1, y1, x2, y2, duration):
+        self.swipes += 1
+        self.offset = int(max(0, min(self.max_offset, self.offset + (y1 - y2))))
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(scroll_controller, "traced_sleep", lambda *args, **kwargs: None)
+
+
+def test_measure_takes_the_most_common_shift():
+    scroller = ScrollController()
+    before = {("甲", "TextView", 40): 500, ("乙", "TextView", 40): 660, ("丙", "TextView", 40): 820}
+    # 乙 的位移与其他节点不同（例如展开了说明文字），取众数
+    after = {("甲", "TextView", 40): 300, ("乙", "TextView", 40): 300, ("丙", "TextView", 40): 620,
+             ("丁", "TextView", 40): 780}
+    assert scroller._measure(before, after) == 200
+    assert scroller._measure(before, {("丁", "TextView", 40): 780}) is None
+
+
+def test_scroll_tracks_offset_and_detects_bottom_edge():
+    scroller = ScrollController()
+    scroller.enter()
+    device = FakeDevice(rows=30)
+    results = []
+    while not results or not results[-1]["edge"]:
+        results.append(scroller.scroll(device, "down"))
+        assert scroller.offset == device.offset
+
+    # 最后一次滚动的距离比请求的少：不需要再多滑一次比较截图即可判断已到底
+    assert all(result["moved"] == result["requested"] for result in results[:-1])
+    assert results[-1]["moved"] < results[-1]["requested"] - _TOUCH_SLOP
+    assert device.offset == device.max_offset
+    assert scroller.stats()["edges_detected"] == {"hierarchy": 1, "frame": 0}
+
+
+def test_scroll_to_top_is_skipped_at_top():
+    scroller = ScrollController()
+    scroller.enter()
+    device = FakeDevice()
+    scroller.scroll_to_top(device)
+    assert device.swipes == 0
+    assert scroller.stats()["scroll_to_top"]["skipped"] == 1
+
+
+@pytest.mark.parametrize("screens", [1, 2])
+def test_known_offset_saves_the_confirming_swipe(screens):
+    scroller = ScrollController()
+    scroller.enter()
+    device = FakeDevice()
+    for _ in range(screens):
+        scroller.scroll(device, "down")
+    offset, swipes = device.offset, device.swipes
+
+    scroller.scroll_to_top(device)
+    assert device.offset == 0 and scroller.offset == 0
+    # 位置已知时滑回 offset 即确认到顶，每屏一次
+    assert device.swipes - swipes == screens
+    assert scroller.stats()["scroll_to_top"]["known_offset"] == 1
+
+    # 位置未知时还要多滑一次，由滚动距离变短确认到顶
+    searching, device = ScrollController(), FakeDevice(offset=offset)
+    searching.scroll_to_top(device)
+    assert device.offset == 0 and searching.offset == 0
+    assert device.swipes == screens + 1
+
+
+def test_scroll_to_top_searches_when_offset_is_unknown():
+    scroller = ScrollController()
+    device = FakeDevice(offset=5000)
+    assert scroller.offset is None
+
+    scroller.scroll_to_top(device)
+    assert device.offset == 0 and scroller.offset == 0
+    # 一屏一屏向上，直到测得滚动距离变短
+    assert device.swipes > 1
+    assert scroller.stats()["scroll_to_top"]["search"] == 1
+
+
+def test_offset_stays_unknown_when_top_is_never_reached(monkeypatch, caplog):
+    monkeypatch.setattr(scroll_controller, "SCROLL_MAX_PAGES", 3)
+    scroller = ScrollController()
+    device = FakeDevice(rows=None, offset=10 ** 6)
+
+    with caplog.at_level(logging.WARNING, logger="scroll_controller"):
+        scroller.scroll_to_top(device)
+    assert device.swipes == 3
+    assert device.offset > 0
+    # 没有到顶时位置仍未知，不能记为 0，否则下次回到顶部会被跳过
+    assert scroller.offset is None
+    assert "仍未到达页面顶部" in caplog.text
+
+    scroller.scroll_to_top(device)
+    assert scroller.stats()["scroll_to_top"] == {"skipped": 0, "known_offset": 0, "search": 2}
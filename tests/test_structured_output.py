@@ -0,0 +1,92 @@
+import json
+
+import pytest
+
+from structured_output import (
+    DetectionList, PrivacyAnalysis, SwitchRecommendations, parse_dict, parse_response, parse_stats, repair_json,
+)
+
+
+@pytest.mark.parametrize("raw, expected", [
+    # 全角标点与 // 注释
+    ('｛"index"： 0， // 第一个\n"ok"： true｝', {"index": 0, "ok": True}),
+    # 单引号、Python 字面量与未加引号的 on/off
+    ("{'state': on, 'visible': True, 'box': None}", {"state": "on", "visible": True, "box": None}),
+    # 多余与缺失的逗号
+    ('{"a": [1, 2, 3,], "b": 1 "c": 2,}', {"a": [1, 2, 3], "b": 1, "c": 2}),
+    # 字符串内的换行与未转义的引号
+    ('{"analysis": "第一行\n第二行", "text": "“个性化”推荐"}', {"analysis": "第一行\n第二行", "text": "“个性化”推荐"}),
+    # 被截断的输出
+    ('{"switches": [{"text": "通讯录', {"switches": [{"text": "通讯录"}]}),
+    ('{"layouts": [{"text": "隐私"}], "isPopup":', {"layouts": [{"text": "隐私"}], "isPopup": None}),
+])
+def test_repair_json(raw, expected):
+    assert json.loads(repair_json(raw)) == expected
+
+
+def test_repair_json_keeps_valid_json():
+    text = '{"a": "x, y: {z}", "b": [1, {"c": null}]}'
+    assert json.loads(repair_json(text)) == json.loads(text)
+
+
+def test_parse_response_takes_last_code_block():
+    text = '思考：先看 {"switches": []}\n```json\n{"switches": [{"text": "通讯录", "current_state": "开启"}]}\n```'
+    result = parse_response(text, PrivacyAnalysis)
+    assert result.switches[0].text == "通讯录"
+    assert result.switches[0].current_state == "on"
+
+
+def test_parse_response_counts_outcomes():
+    before = parse_stats.stats().get("SwitchRecommendations", {})
+    assert parse_response('{"通讯录": {"recommended_state": "off"}}', SwitchRecommendations) is not None
+    assert parse_response("{'通讯录': {'recommended_state': off,}}", SwitchRecommendations) is not None
+    assert parse_response("", SwitchRecommendations) is None
+    after = parse_stats.stats()["SwitchRecommendations"]
+    assert after["parsed"] - before.get("parsed", 0) == 1
+    assert after["repaired"] - before.get("repaired", 0) == 1
+    assert after["failed"] - before.get("failed", 0) == 1
+
+
+def test_parse_response_rejects_objects_without_required_fields():
+    # 只有单个列表项的小对象不能被当成全默认值的页面分析结果
+    assert parse_response('{"text": "隐私"}', PrivacyAnalysis) is None
+
+
+def test_parse_dict_repairs_and_drops_none():
+    text = "```json\n{'switches': [{'text': '个性化推荐', 'current_state': true}], 'personalization': [],}\n```"
+    assert parse_dict(text, PrivacyAnalysis) == {
+        "switches": [{"text": "个性化推荐", "current_state": "on"}],
+        "layouts": [],
+        "personalization": {"switches": [], "layouts": []},
+        "isPopup": False,
+    }
+
+
+def test_parse_dict_unwraps_detection_lists():
+    assert parse_dict('{"detections": [{"box_2d": [10.4, 20, 30, 40.6], "label": "设置"}]}', DetectionList) == [
+        {"box_2d": [10, 20, 30, 41], "label": "设置"}
+    ]
+
+
+def test_parse_dict_reasks_once_with_raw_output_and_error():
+    prompts = []
+
+    def reask(prompt):
+        prompts.append(prompt)
+        return '{"switches": [], "layouts": [{"text": "隐私设置"}]}'
+
+    assert parse_dict("抱歉，页面中没有开关。", PrivacyAnalysis, reask=reask) == {
+        "switches": [], "layouts": [{"text": "隐私设置"}],
+        "personalization": {"switches": [], "layouts": []}, "isPopup": False,
+    }
+    assert len(prompts) == 1
+    assert "抱歉，页面中没有开关。" in prompts[0]
+    assert "JSON Schema" in prompts[0]
+
+
+def test_parse_dict_returns_none_when_reask_fails():
+    def reask(prompt):
+        raise RuntimeError("timeout")
+
+    assert parse_dict("not json", PrivacyAnalysis, reask=reask) is None
+    assert parse_dict("not json", PrivacyAnalysis, reask=lambda prompt: "still not json") is None
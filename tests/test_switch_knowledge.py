@@ -0,0 +1,115 @@
+import json
+
+from switch_knowledge import SwitchKnowledgeBase, normalize_label
+
+
+def _kb():
+    kb = SwitchKnowledgeBase(path="")
+    kb.add("个性化广告推荐", "personalization", "off", "关闭后减少广告画像。", app="com.a")
+    kb.add("个性化广告推荐", "personalization", "off", "关闭后减少广告画像。", app="com.b")
+    kb.add("个性化广告推荐", "personalization", "on", "开启后广告更相关。", app="com.c")
+    kb.add("允许通过手机号找到我", "privacy", "off", "关闭后他人无法搜索到你。", app="com.a")
+    return kb
+
+
+def test_normalize_label():
+    assert normalize_label(" 个性化 广告，推荐！") == "个性化广告推荐"
+    assert normalize_label("ＡＢＣ Ads") == "abcads"
+
+
+def test_lookup_exact_takes_majority_vote():
+    kb = _kb()
+    known = kb.lookup("个性化广告推荐")
+    assert known == {"category": "personalization", "recommended_state": "off",
+                     "analysis": "关闭后减少广告画像。", "matched": "个性化广告推荐"}
+    assert kb.stats()["exact_hits"] == 1
+
+
+def test_lookup_ignores_punctuation_and_width():
+    assert _kb().lookup("个性化广告推荐。")["matched"] == "个性化广告推荐"
+
+
+def test_lookup_fuzzy_match():
+    kb = _kb()
+    assert kb.lookup("允许通过手机号码找到我")["matched"] == "允许通过手机号找到我"
+    assert kb.stats()["fuzzy_hits"] == 1
+
+
+def test_lookup_does_not_match_opposite_polarity():
+    kb = _kb()
+    assert kb.lookup("不允许通过手机号找到我") is None
+    assert kb.lookup("禁止个性化广告推荐") is None
+    assert kb.stats()["misses"] == 2
+
+
+def test_lookup_miss_and_empty():
+    kb = _kb()
+    assert kb.lookup("夜间模式") is None
+    assert kb.lookup("  ") is None
+
+
+def test_same_app_votes_once():
+    kb = _kb()
+    kb.add("个性化广告推荐", "personalization", "on", "", app="com.c")
+    kb.add("个性化广告推荐", "personalization", "on", "", app="com_c")
+    assert kb.entries["个性化广告推荐"]["votes"] == {"off": 2, "on": 1}
+
+
+def test_save_and_load_roundtrip(tmp_path):
+    path = str(tmp_path / "kb.json")
+    _kb().save(path)
+    loaded = SwitchKnowledgeBase(path=path)
+    assert loaded.lookup("个性化广告推荐")["recommended_state"] == "off"
+    assert loaded.entries["个性化广告推荐"]["apps"] == {"com_a", "com_b", "com_c"}
+
+
+def test_complete_fills_from_kb_rules_and_model():
+    kb = _kb()
+    result = {"switches": [{"text": "允许通过手机号找到我", "current_state": "on"},
+                           {"text": "上传通讯录", "current_state": "on"},
+                           {"text": "陌生人私信", "current_state": "on"}],
+              "personalization": {"switches": []}}
+    asked = []
+
+    def rules(label):
+        return {"category": "privacy", "recommended_state": "off", "analysis": "规则"} if "通讯录" in label else None
+
+    def recommend(labels):
+        asked.append(labels)
+        return {"陌生人私信": {"recommended_state": "off", "analysis": "模型"}}
+
+    kb.complete(result, recommend=recommend, rules=rules, app="com.d")
+    assert [(s["recommended_state"], s["analysis"]) for s in result["switches"]] == [
+        ("off", "关闭后他人无法搜索到你。"), ("off", "规则"), ("off", "模型")]
+    assert asked == [["陌生人私信"]]
+    # 模型的回答写回知识库
+    assert kb.lookup("陌生人私信")["recommended_state"] == "off"
+
+
+def test_complete_tags_recommendation_source():
+    kb = _kb()
+    result = {"switches": [{"text": "允许通过手机号找到我", "current_state": "on"},
+                           {"text": "上传通讯录", "current_state": "on"},
+                           {"text": "陌生人私信", "current_state": "on"},
+                           {"text": "附近的人", "current_state": "on", "recommended_state": "off", "analysis": "整页"}]}
+    kb.complete(result, recommend=lambda labels: {"陌生人私信": {"recommended_state": "off", "analysis": "模型"}},
+                rules=lambda label: {"category": "privacy", "recommended_state": "off", "analysis": "规则"}
+                if "通讯录" in label else None)
+    assert [s["recommendation_source"] for s in result["switches"]] == ["kb", "rule", "model", "model"]
+
+
+def test_build_skips_switches_filled_by_kb_or_rules(tmp_path):
+    output = {"privacy_switches": [
+        {"text": "通讯录", "current_state": "on", "recommended_state": "off", "analysis": "模型"},
+        {"text": "附近的人", "current_state": "on", "recommended_state": "off", "analysis": "知识库",
+         "recommendation_source": "kb"},
+        {"text": "读取剪贴板", "current_state": "on", "recommended_state": "off", "analysis": "规则",
+         "recommendation_source": "rule"},
+        {"text": "陌生人私信", "current_state": "on", "recommended_state": "off", "analysis": "模型",
+         "recommendation_source": "model"},
+    ]}
+    (tmp_path / "com_demo_20260101_000000.json").write_text(json.dumps(output, ensure_ascii=False),
+                                                           encoding="utf-8")
+    kb = SwitchKnowledgeBase(path="")
+    assert kb.build(str(tmp_path)) == 2
+    assert set(kb.entries) == {"通讯录", "陌生人私信"}